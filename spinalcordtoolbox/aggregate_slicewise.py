@@ -17,7 +17,7 @@ import datetime
 import logging
 import wquantiles
 
-from spinalcordtoolbox.template import get_slices_from_vertebral_levels, get_vertebral_level_from_slice
+from spinalcordtoolbox.template import VertLevelIndex
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.utils import __version__, parse_num_list_inv
 
@@ -235,40 +235,77 @@ def func_wa(data, mask=None, map_clusters=None):
     return np.average(data, weights=mask), None
 
 
-def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], distance_pmj=None, perslice=None,
-                                 perlevel=False, fname_vert_level=None, group_funcs=(('MEAN', func_wa),), map_clusters=None, length_pmj=None):
+# Functions which aggregate_per_slice_or_level() computes with a groupby for 1d metrics (one value per slice)
+GROUPBY_FUNCS = (func_wa, func_std, func_sum, func_max)
+
+
+def _aggregate_groupby(data, slicegroups, funcs):
+    """
+    Compute func_wa(), func_std(), func_sum() or func_max() of a 1d metric in all slice groups at once, with a groupby
+    on a table that has one row per slice. Equivalent to the loop of aggregate_per_slice_or_level() without mask:
+    nonfinite values are ignored, and groups without any finite value give None.
+
+    :param data: 1d-array: value of the metric in each slice
+    :param slicegroups: list of tuple: slices of each group
+    :param funcs: list of functions, among GROUPBY_FUNCS
+    :return: list of 1d-array: result of each function, for each slice group
+    """
+    import pandas as pd
+
+    n_groups = len(slicegroups)
+    index_slices = np.array([i for slicegroup in slicegroups for i in slicegroup], dtype=int)
+    value = data[index_slices].astype(float)
+    weight = np.isfinite(value).astype(float)
+    value[weight == 0] = 0.
+    table = pd.DataFrame({'group': np.repeat(np.arange(n_groups), [len(slicegroup) for slicegroup in slicegroups]),
+                          'value': value, 'weight': weight, 'weighted': value * weight})
+    sums = table.groupby('group')[['value', 'weight', 'weighted']].sum().reindex(range(n_groups))
+    average = sums['weighted'] / sums['weight']
+    results = {}
+    for func in funcs:
+        if func is func_wa:
+            result = average
+        elif func is func_std:
+            table['deviation'] = table['weight'] * (table['value'] - average.to_numpy()[table['group']]) ** 2
+            result = np.sqrt(table.groupby('group')['deviation'].sum().reindex(range(n_groups)) / sums['weight'])
+        elif func is func_sum:
+            result = sums['value']
+        else:
+            result = table.groupby('group')['value'].max().reindex(range(n_groups))
+        # Groups without any finite value give None, as well as NaN results
+        result = result.where(sums['weight'] > 0)
+        result = result.to_numpy()
+        results[func] = np.where(np.isnan(result), None, result)
+    return [results[func] for func in funcs]
+
+
+def get_vert_level_index(fname_vert_level):
     """
-    The aggregation will be performed along the last dimension of 'metric' ndarray.
+    :param fname_vert_level: Vertebral level. Could be either an Image, a file name, or a VertLevelIndex.
+    :return: VertLevelIndex of the vertebral level, in RPI orientation.
+    """
+    if isinstance(fname_vert_level, VertLevelIndex):
+        return fname_vert_level
+    # Assumption: fname_vert_level image will only ever be 3D or 4D
+    return VertLevelIndex(Image(fname_vert_level).change_orientation('RPI'))
 
-    :param metric: Class Metric(): data to aggregate.
-    :param mask: Class Metric(): mask to use for aggregating the data. Optional.
-    :param slices: List[int]: Slices to aggregate metric from. If empty, select all slices.
-    :param levels: List[int]: Vertebral levels to aggregate metric from. It respects the restriction to "slices".
-    :param distance_pmj: float: Distance from Ponto-Medullary Junction (PMJ) in mm.
-    :param Bool perslice: Aggregate per slice (True) or across slices (False)
-    :param Bool perlevel: Aggregate per level (True) or across levels (False). Has priority over "perslice".
-    :param fname_vert_level: Vertebral level. Could be either an Image or a file name.
-    :param tuple group_funcs: Name and function to apply on metric. Example: (('MEAN', func_wa),)). Note, the function
-      has special requirements in terms of i/o. See the definition to func_wa and use it as a template.
-    :param map_clusters: list of list of int: See func_map()
-    :param length_pmj: distance from the PMJ with corresponding slices.
-    :return: Aggregated metric
+
+def get_slicegroups(metric, slices=[], levels=[], perslice=None, perlevel=False, fname_vert_level=None):
+    """
+    Group the slices to aggregate a metric from. See aggregate_per_slice_or_level() for the parameters.
+
+    :return: slicegroups: list of tuple of slices, vertgroups: list of tuple of vertebral levels (or None)
     """
     if fname_vert_level is not None:
-        # Assumption: fname_vert_level image will only ever be 3D or 4D
-        vert_level_slices = Image(fname_vert_level).change_orientation('RPI').data.shape[2]
+        vert_level_index = get_vert_level_index(fname_vert_level)
+        vert_level_slices = vert_level_index.n_slices
         # Get slices ('z') from metrics regardless of whether they're 1D [z], 3D [x, y, z], and 4D [x, y, z, t]
         metric_slices = metric.data.shape[2] if len(metric.data.shape) >= 3 else metric.data.shape[0]
         if vert_level_slices != metric_slices:
             raise ValueError(f"Shape mismatch between vertfile [{vert_level_slices}] and metric [{metric_slices}]). "
                              f"Please verify that your vertfile has the same number of slices as your input image, "
                              f"and that your metric is RPI/LPI oriented.")
-        # Fetch fname_vert_level
-        im_vert_level = Image(fname_vert_level).change_orientation('RPI')
 
-    # If perslice is specified, put distance_pmj to None to prioritize perslice
-    if perslice:
-        distance_pmj = None
     # If user neither specified slices nor levels, set perslice=True, otherwise, the output will likely contain nan
     # because in many cases the segmentation does not span the whole I-S dimension.
     if perslice is None:
@@ -285,7 +322,7 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], distan
     vertgroups = None
     if levels:
         # slicegroups = [(0, 1, 2), (3, 4, 5), (6, 7, 8)]
-        slicegroups = [tuple(get_slices_from_vertebral_levels(im_vert_level, level)) for level in levels]
+        slicegroups = [tuple(vert_level_index.get_slices(level)) for level in levels]
         # Intersection between specified slices and each element of slicegroups
         slicegroups = [tuple(set(slicegroup) & set(slices)) for slicegroup in slicegroups]
         if perlevel:
@@ -295,7 +332,7 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], distan
             # slicegroups = [(0,), (1,), (2,), (3,), (4,), (5,), (6,), (7,), (8,)]
             slicegroups = [tuple([i]) for i in functools.reduce(operator.concat, slicegroups)]  # reduce to individual tuple
             # vertgroups = [(2,), (2,), (2,), (3,), (3,), (3,), (4,), (4,), (4,)]
-            vertgroups = [tuple([get_vertebral_level_from_slice(im_vert_level, i[0])]) for i in slicegroups]
+            vertgroups = [tuple([vert_level_index.get_level(i[0])]) for i in slicegroups]
         # output aggregate metric across levels
         else:
             # slicegroups = [(0, 1, 2, 3, 4, 5, 6, 7, 8)]
@@ -309,13 +346,47 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], distan
             slicegroups = [tuple([slice]) for slice in slices]
             # vertgroups = [(2,), (2,), (2,), (3,), (3,), (3,), (4,), (4,), (4,)]
             if fname_vert_level is not None:
-                vertgroups = [tuple([get_vertebral_level_from_slice(im_vert_level, i[0])]) for i in slicegroups]
+                vertgroups = [tuple([vert_level_index.get_level(i[0])]) for i in slicegroups]
         else:
             # slicegroups = [(0, 1, 2, 3, 4, 5, 6, 7, 8)]
             slicegroups = [tuple(slices)]
+    return slicegroups, vertgroups
+
+
+def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], distance_pmj=None, perslice=None,
+                                 perlevel=False, fname_vert_level=None, group_funcs=(('MEAN', func_wa),), map_clusters=None, length_pmj=None):
+    """
+    The aggregation will be performed along the last dimension of 'metric' ndarray.
+
+    :param metric: Class Metric(): data to aggregate.
+    :param mask: Class Metric(): mask to use for aggregating the data. Optional.
+    :param slices: List[int]: Slices to aggregate metric from. If empty, select all slices.
+    :param levels: List[int]: Vertebral levels to aggregate metric from. It respects the restriction to "slices".
+    :param distance_pmj: float: Distance from Ponto-Medullary Junction (PMJ) in mm.
+    :param Bool perslice: Aggregate per slice (True) or across slices (False)
+    :param Bool perlevel: Aggregate per level (True) or across levels (False). Has priority over "perslice".
+    :param fname_vert_level: Vertebral level. Could be either an Image, a file name, or a VertLevelIndex (to avoid
+      recomputing the level of each slice when aggregating several metrics with the same vertebral levels).
+    :param tuple group_funcs: Name and function to apply on metric. Example: (('MEAN', func_wa),)). Note, the function
+      has special requirements in terms of i/o. See the definition to func_wa and use it as a template.
+    :param map_clusters: list of list of int: See func_map()
+    :param length_pmj: distance from the PMJ with corresponding slices.
+    :return: Aggregated metric
+    """
+    # If perslice is specified, put distance_pmj to None to prioritize perslice
+    if perslice:
+        distance_pmj = None
+    slicegroups, vertgroups = get_slicegroups(metric, slices=slices, levels=levels, perslice=perslice,
+                                              perlevel=perlevel, fname_vert_level=fname_vert_level)
     agg_metric = dict((slicegroup, dict()) for slicegroup in slicegroups)
+    # 1d metrics (e.g. the shape metrics of sct_process_segmentation) are aggregated in all slice groups at once
+    groupby_results = None
+    if mask is None and metric.data.ndim == 1 and np.issubdtype(metric.data.dtype, np.floating) \
+            and all(func in GROUPBY_FUNCS for _, func in group_funcs) \
+            and all(0 <= i < metric.data.shape[0] for slicegroup in slicegroups for i in slicegroup):
+        groupby_results = _aggregate_groupby(metric.data, slicegroups, [func for _, func in group_funcs])
     # loop across slice group
-    for slicegroup in slicegroups:
+    for i_group, slicegroup in enumerate(slicegroups):
         # add distance from PMJ info
         if distance_pmj is not None:
             agg_metric[slicegroup]['DistancePMJ'] = distance_pmj
@@ -332,9 +403,13 @@ def aggregate_per_slice_or_level(metric, mask=None, slices=[], levels=[], distan
         if vertgroups is None:
             agg_metric[slicegroup]['VertLevel'] = None
         else:
-            agg_metric[slicegroup]['VertLevel'] = vertgroups[slicegroups.index(slicegroup)]
+            agg_metric[slicegroup]['VertLevel'] = vertgroups[i_group]
             if agg_metric[slicegroup]['VertLevel'][0] is None:
                 agg_metric[slicegroup]['VertLevel'] = None
+        if groupby_results is not None:
+            for (name, _), results in zip(group_funcs, groupby_results):
+                agg_metric[slicegroup]['{}({})'.format(name, metric.label)] = results[i_group]
+            continue
         # Loop across functions (e.g.: MEAN, STD)
         for (name, func) in group_funcs:
             try:
@@ -486,6 +561,115 @@ def extract_metric(data, labels=None, slices=None, levels=None, perslice=True, p
                                         map_clusters=map_clusters)
 
 
+def extract_metric_labels(data, labels=None, slices=None, levels=None, perslice=True, perlevel=False,
+                          fname_vert_level=None, method=None, label_struc=None, id_labels=None, indiv_labels_ids=None):
+    """
+    Extract metric for several labels. This gives the same results as calling extract_metric() for each label, but
+    with ML or MAP, all individual (i.e. not combined) labels are estimated at once: for each slice group, X^T.X and
+    X^T.y are computed a single time (X being the design matrix of all individual labels), and one least-squares
+    solve gives the metric in every label.
+
+    :param id_labels: list of int: IDs of labels to select
+    :return: dict: {id_label: aggregate_per_slice_or_level()}. See extract_metric() for the other parameters.
+    """
+    id_labels_batch = []
+    if method in ['ml', 'map']:
+        id_labels_batch = [id_label for id_label in id_labels if not isinstance(label_struc[id_label].id, list)]
+    agg_metrics = {}
+    if id_labels_batch:
+        agg_metrics.update(_estimate_labels(data, labels, slices=slices, levels=levels, perslice=perslice,
+                                            perlevel=perlevel, fname_vert_level=fname_vert_level, method=method,
+                                            label_struc=label_struc, id_labels=id_labels_batch,
+                                            indiv_labels_ids=indiv_labels_ids))
+    for id_label in id_labels:
+        if id_label not in agg_metrics:
+            agg_metrics[id_label] = extract_metric(data, labels=labels, slices=slices, levels=levels,
+                                                   perslice=perslice, perlevel=perlevel,
+                                                   fname_vert_level=fname_vert_level, method=method,
+                                                   label_struc=label_struc, id_label=id_label,
+                                                   indiv_labels_ids=indiv_labels_ids)
+    return {id_label: agg_metrics[id_label] for id_label in id_labels}
+
+
+def _estimate_labels(data, labels, slices=None, levels=None, perslice=True, perlevel=False, fname_vert_level=None,
+                     method=None, label_struc=None, id_labels=None, indiv_labels_ids=None):
+    """
+    ML or MAP estimation of individual labels, solving for all labels at once. Equivalent to
+    aggregate_per_slice_or_level() with func_ml()/func_map() and func_std(), as called by extract_metric().
+    """
+    name = {'ml': 'ML', 'map': 'MAP'}[method]
+    n_labels = len(indiv_labels_ids)
+    # Design matrix of all individual labels. ML/MAP estimates don't depend on the order of the labels, so the same
+    # solution is valid for every label.
+    x_labels = labels[..., indiv_labels_ids]
+    columns = [indiv_labels_ids.index(label_struc[id_label].id) for id_label in id_labels]
+    if method == 'map':
+        # Indicator matrix [nb_labels x nb_clusters] to sum the labels of each cluster (see func_map())
+        clusters = [label_struc[i].map_cluster for i in indiv_labels_ids]
+        cluster_values = list(dict.fromkeys(clusters))
+        indicator = np.array([[c == v for v in cluster_values] for c in clusters], dtype=float)
+
+    slicegroups, vertgroups = get_slicegroups(data, slices=slices, levels=levels, perslice=perslice,
+                                              perlevel=perlevel, fname_vert_level=fname_vert_level)
+    agg_metrics = {id_label: dict((slicegroup, dict()) for slicegroup in slicegroups) for id_label in id_labels}
+    for i_group, slicegroup in enumerate(slicegroups):
+        vert_level = None
+        if vertgroups is not None and vertgroups[i_group][0] is not None:
+            vert_level = vertgroups[i_group]
+        data_slicegroup = data.data[..., slicegroup]  # selection is done in the last dimension
+        mask_slicegroup = x_labels[..., slicegroup, :]
+        for id_label, column in zip(id_labels, columns):
+            agg_metrics[id_label][slicegroup].update({
+                'DistancePMJ': None,
+                'VertLevel': vert_level,
+                'Label': label_struc[id_label].name,
+                'Size [vox]': np.sum(mask_slicegroup[..., column]),
+            })
+        try:
+            # Ignore nonfinite values
+            i_nonfinite = ~np.isfinite(data_slicegroup)
+            data_slicegroup[i_nonfinite] = 0.
+            mask_slicegroup[i_nonfinite] = 0.
+            if mask_slicegroup.sum() == 0:
+                beta = None
+            else:
+                x = mask_slicegroup.reshape(-1, n_labels)
+                y = data_slicegroup.reshape(-1)
+                # Shared by all labels
+                xtx = np.dot(x.T, x)
+                xty = np.dot(x.T, y)
+                # ML estimation: beta = (Xt . X)^(-1) . Xt . y
+                beta = np.dot(np.linalg.pinv(xtx), xty)
+                if method == 'map':
+                    # ML estimation within each cluster provides the prior beta_0, then
+                    # beta = beta_0 + (Xt . X + 1)^(-1) . Xt . (y - X . beta_0)
+                    beta_cluster = np.dot(np.linalg.pinv(indicator.T @ xtx @ indicator), np.dot(indicator.T, xty))
+                    beta_0 = np.dot(indicator, beta_cluster)
+                    beta = beta_0 + np.dot(np.linalg.pinv(xtx + np.eye(n_labels)), xty - np.dot(xtx, beta_0))
+        except Exception as e:
+            logging.warning(e)
+            beta = str(e)
+        for id_label, column in zip(id_labels, columns):
+            agg_metric = agg_metrics[id_label][slicegroup]
+            if beta is None or isinstance(beta, str):
+                agg_metric['{}({})'.format(name, data.label)] = beta
+            else:
+                agg_metric['{}({})'.format(name, data.label)] = None if np.isnan(beta[column]) else beta[column]
+            try:
+                mask_label = mask_slicegroup[..., column]
+                if mask_slicegroup.sum() == 0:
+                    result = None
+                else:
+                    result, _ = func_std(data_slicegroup, mask_label)
+                    if np.isnan(result):
+                        result = None
+                agg_metric['STD({})'.format(data.label)] = result
+            except Exception as e:
+                logging.warning(e)
+                agg_metric['STD({})'.format(data.label)] = str(e)
+    return agg_metrics
+
+
 def make_a_string(item):
     """Convert tuple or list or None to a string. Important: elements in tuple or list are separated with ; (not ,)
     for compatibility with csv."""
@@ -530,61 +714,111 @@ def merge_dict(dict_in):
     return dict_merged
 
 
+# Columns of the output tables, in order
+TABLE_COLUMNS = ['Timestamp', 'SCT Version', 'Filename', 'Slice (I->S)', 'VertLevel', 'DistancePMJ']
+# Item sorted in order for display in the output tables
+TABLE_ITEMS = ['Label', 'Size [vox]', 'MEAN(area)', 'STD(area)', 'MEAN(angle_AP)', 'STD(angle_AP)', 'MEAN(angle_RL)',
+               'STD(angle_RL)', 'MEAN(diameter_AP)', 'STD(diameter_AP)', 'MEAN(diameter_RL)', 'STD(diameter_RL)',
+               'MEAN(eccentricity)', 'STD(eccentricity)', 'MEAN(orientation)', 'STD(orientation)',
+               'MEAN(solidity)', 'STD(solidity)', 'SUM(length)', 'WA()', 'BIN()', 'ML()', 'MAP()', 'MEDIAN()',
+               'STD()', 'MAX()']
+
+
+def agg_metric_to_dataframe(agg_metric, fname_in=None):
+    """
+    Convert the metric structure to a table, with one row per slice group (sorted) and one column per field. This is
+    the table written by save_as_csv() and save_as_parquet().
+
+    :param agg_metric: output of aggregate_per_slice_or_level()
+    :param fname_in: input file to be listed in the table (e.g., segmentation file which produced the results).
+    :return: pandas.DataFrame (of dtype object, so that the values are kept as is)
+    """
+    import pandas as pd
+
+    # Select the metric columns once, from the fields of the first slice group
+    fields = next(iter(agg_metric.values()))
+    keys = []
+    for item in TABLE_ITEMS:
+        for key in fields:
+            if item in key:
+                keys.append(key)
+                break
+    slicegroups = sorted(agg_metric.keys())
+    rows = [agg_metric[slicegroup] for slicegroup in slicegroups]
+    columns = {
+        'Timestamp': [datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")] * len(rows),
+        'SCT Version': [__version__] * len(rows),
+        'Filename': [fname_in] * len(rows),  # file name associated with the results
+        'Slice (I->S)': [parse_num_list_inv(slicegroup) for slicegroup in slicegroups],  # list all slices
+        'VertLevel': [parse_num_list_inv(row['VertLevel']) for row in rows],  # list vertebral levels
+        'DistancePMJ': ['' if row['DistancePMJ'] is None else str(row['DistancePMJ']) for row in rows],
+    }
+    for key in keys:
+        columns[key] = [row[key] for row in rows]
+    return pd.DataFrame(columns, columns=TABLE_COLUMNS + keys, dtype=object)
+
+
 def save_as_csv(agg_metric, fname_out, fname_in=None, append=False):
     """
     Write metric structure as csv. If field 'error' exists, it will add a specific column.
 
-    :param agg_metric: output of aggregate_per_slice_or_level()
+    :param agg_metric: output of aggregate_per_slice_or_level(), or table returned by agg_metric_to_dataframe()
     :param fname_out: output filename. Extention (.csv) will be added if it does not exist.
     :param fname_in: input file to be listed in the csv file (e.g., segmentation file which produced the results).
     :param append: Bool: Append results at the end of file (if exists) instead of overwrite.
     :return:
     """
-    # Item sorted in order for display in csv output
-    # list_item = ['VertLevel', 'Label', 'MEAN', 'WA', 'BIN', 'ML', 'MAP', 'STD', 'MAX']
-    # TODO: The thing below is ugly and needs to be fixed, but this is the only solution I found to order the columns
-    #  without refactoring the code with OrderedDict.
-    list_item = ['Label', 'Size [vox]', 'MEAN(area)', 'STD(area)', 'MEAN(angle_AP)', 'STD(angle_AP)', 'MEAN(angle_RL)',
-                 'STD(angle_RL)', 'MEAN(diameter_AP)', 'STD(diameter_AP)', 'MEAN(diameter_RL)', 'STD(diameter_RL)',
-                 'MEAN(eccentricity)', 'STD(eccentricity)', 'MEAN(orientation)', 'STD(orientation)',
-                 'MEAN(solidity)', 'STD(solidity)', 'SUM(length)', 'WA()', 'BIN()', 'ML()', 'MAP()', 'MEDIAN()',
-                 'STD()', 'MAX()']
+    table = agg_metric_to_dataframe(agg_metric, fname_in) if isinstance(agg_metric, dict) else agg_metric
     # TODO: if append=True but file does not exist yet, raise warning and set append=False
     # write header (only if append=False)
     if not append or not os.path.isfile(fname_out):
         with open(fname_out, 'w', newline='') as csvfile:
-            # spamwriter = csv.writer(csvfile, delimiter=',')
-            header = ['Timestamp', 'SCT Version', 'Filename', 'Slice (I->S)', 'VertLevel', 'DistancePMJ']
-            agg_metric_key = [v for i, (k, v) in enumerate(agg_metric.items())][0]
-            for item in list_item:
-                for key in agg_metric_key:
-                    if item in key:
-                        header.append(key)
-                        break
-            writer = csv.DictWriter(csvfile, fieldnames=header)
-            writer.writeheader()
+            csv.writer(csvfile).writerow(table.columns)
 
     # populate data
     with open(fname_out, 'a', newline='') as csvfile:
         spamwriter = csv.writer(csvfile, delimiter=',', quoting=csv.QUOTE_NONNUMERIC)
-        for slicegroup in sorted(agg_metric.keys()):
-            line = list()
-            line.append(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))  # Timestamp
-            line.append(__version__)  # SCT Version
-            line.append(fname_in)  # file name associated with the results
-            line.append(parse_num_list_inv(slicegroup))  # list all slices in slicegroup
-            line.append(parse_num_list_inv(agg_metric[slicegroup]['VertLevel']))  # list vertebral levels
-            if agg_metric[slicegroup]['DistancePMJ'] is not None:
-                line.append(str(agg_metric[slicegroup]['DistancePMJ']))  # distance from PMJ
-            else:
-                line.append('')
-            agg_metric_key = [v for i, (k, v) in enumerate(agg_metric.items())][0]
-            for item in list_item:
-                for key in agg_metric_key:
-                    if item in key:
-                        line.append(agg_metric[slicegroup][key])
-                        break
-            spamwriter.writerow(line)
+        spamwriter.writerows(table.itertuples(index=False, name=None))
+
+
+def save_as_parquet(agg_metric, fname_out, fname_in=None, append=False):
+    """
+    Write metric structure as a Parquet file (requires the optional 'pyarrow' package), with the same columns as the
+    csv file written by save_as_csv().
+
+    :param agg_metric: output of aggregate_per_slice_or_level(), or table returned by agg_metric_to_dataframe()
+    :param fname_out: output filename
+    :param fname_in: input file to be listed in the file (e.g., segmentation file which produced the results).
+    :param append: Bool: Append results at the end of file (if exists) instead of overwrite.
+    """
+    import pandas as pd
+
+    table = agg_metric_to_dataframe(agg_metric, fname_in) if isinstance(agg_metric, dict) else agg_metric
+    # Parquet columns are typed: the description columns are stored as strings, and the metric columns as numbers
+    # whenever possible (e.g. the 'Label' column of sct_extract_metric stays a string)
+    table = table.copy()
+    for column in table.columns:
+        if column not in TABLE_COLUMNS:
+            try:
+                table[column] = pd.to_numeric(table[column])
+                continue
+            except (ValueError, TypeError):
+                pass
+        table[column] = table[column].map(lambda value: None if value is None else str(value))
+    if append and os.path.isfile(fname_out):
+        table = pd.concat([pd.read_parquet(fname_out), table], ignore_index=True)
+    table.to_parquet(fname_out, index=False)
+
+
+def save_as_table(agg_metric, fname_out, fname_in=None, append=False):
+    """
+    Write metric structure as a Parquet file if `fname_out` has the '.parquet' extension, or as csv otherwise. See
+    save_as_csv() for the parameters.
+    """
+    if fname_out.endswith('.parquet'):
+        save_as_parquet(agg_metric, fname_out, fname_in=fname_in, append=append)
+    else:
+        save_as_csv(agg_metric, fname_out, fname_in=fname_in, append=append)
 
 
 def normalize_csa(csa_norm, data_predictors, data_subject):
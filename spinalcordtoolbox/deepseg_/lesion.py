@@ -13,7 +13,7 @@ from scipy.interpolate import interp1d
 import nibabel as nib
 
 from spinalcordtoolbox.image import Image, add_suffix, zeros_like, empty_like
-from spinalcordtoolbox.deepseg_.onnx import onnx_inference
+from spinalcordtoolbox.deepseg_.sliding_window import sliding_window_inference
 from spinalcordtoolbox.deepseg_.sc import find_centerline, crop_image_around_centerline, uncrop_image, _normalize_data
 from spinalcordtoolbox import resampling
 from spinalcordtoolbox.utils import sct_dir_local_path, TempFolder
@@ -80,35 +80,26 @@ def apply_intensity_normalization(img, contrast):
     return img_normalized
 
 
-def segment_3d(model_fname, contrast_type, im):
-    """Perform segmentation with 3D convolutions."""
+def segment_3d(model_fname, contrast_type, im, overlap=0.0, batch_size=BATCH_SIZE):
+    """
+    Perform segmentation with 3D convolutions.
+
+    :param overlap: Fraction of the z patch size shared by two consecutive windows. See `sliding_window_inference`.
+    :param batch_size: Number of windows fed to the model in a single forward pass.
+    """
     dct_patch_3d = {'t2': {'size': (48, 48, 48), 'mean': 871.309, 'std': 557.916},
                     't2_ax': {'size': (48, 48, 48), 'mean': 835.592, 'std': 528.386},
                     't2s': {'size': (48, 48, 48), 'mean': 1011.31, 'std': 678.985}}
 
-    out_data = np.zeros(im.data.shape)
-
     # segment the spinal cord
-    z_patch_size = dct_patch_3d[contrast_type]['size'][2]
-    z_step_keep = list(range(0, im.data.shape[2], z_patch_size))
-    for zz in z_step_keep:
-        if zz == z_step_keep[-1]:  # deal with instances where the im.data.shape[2] % patch_size_z != 0
-            patch_im = np.zeros(dct_patch_3d[contrast_type]['size'])
-            z_patch_extracted = im.data.shape[2] - zz
-            patch_im[:, :, :z_patch_extracted] = im.data[:, :, zz:]
-        else:
-            z_patch_extracted = z_patch_size
-            patch_im = im.data[:, :, zz:z_patch_size + zz]
-
-        if np.any(patch_im):  # Check if the patch is (not) empty, which could occur after a brain detection.
-            patch_norm = _normalize_data(patch_im, dct_patch_3d[contrast_type]['mean'], dct_patch_3d[contrast_type]['std'])
-            x = np.expand_dims(np.expand_dims(patch_norm, 0), 0).astype(np.float32)
-            onnx_pred = onnx_inference(model_fname, x)
-            pred_seg_th = (onnx_pred[0] > 0.1).astype(int)[0, 0, :, :, :]
-            if zz == z_step_keep[-1]:
-                out_data[:, :, zz:] = pred_seg_th[:, :, :z_patch_extracted]
-            else:
-                out_data[:, :, zz:z_patch_size + zz] = pred_seg_th
+    # NB: Empty patches are skipped, which could occur after a brain detection.
+    pred = sliding_window_inference(
+        model_fname, im.data,
+        patch_size_z=dct_patch_3d[contrast_type]['size'][2],
+        normalize=lambda patches: _normalize_data(patches, dct_patch_3d[contrast_type]['mean'],
+                                                  dct_patch_3d[contrast_type]['std']),
+        overlap=overlap, batch_size=batch_size, skip_empty=True)
+    out_data = (pred > 0.1).astype(np.float64)
 
     out = zeros_like(im, dtype=np.uint8)
     out.data = out_data
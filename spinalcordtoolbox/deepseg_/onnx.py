@@ -5,18 +5,69 @@ Copyright (c) 2022 Polytechnique Montreal <www.neuro.polymtl.ca>
 License: see the file LICENSE
 """
 
+import os
+import threading
+from collections import OrderedDict
+
 import onnxruntime as ort
 
+# Maximum number of InferenceSessions kept alive at the same time. sct_deepseg_sc uses at most 2 models per run
+# (centerline + segmentation), so this leaves some headroom for API users that switch between contrasts.
+MAX_CACHED_SESSIONS = 4
 
-def onnx_inference(model_path, input_data):
-    """Perform inference using an '.onnx' model."""
+# Sessions are keyed by (absolute model path, model mtime, intra_op_num_threads, inter_op_num_threads)
+_SESSION_CACHE = OrderedDict()
+_SESSION_CACHE_LOCK = threading.Lock()
+
+
+def _create_session(model_path, intra_op_num_threads=0, inter_op_num_threads=0):
+    """Create a new InferenceSession for an '.onnx' model."""
     # This option helps to combat an issue where the CPU memory arena would unnecessarily
     # consume ~6 gigabytes of memory, when our models only truly use ~5 megabytes. See also:
     # https://github.com/spinalcordtoolbox/spinalcordtoolbox/pull/3738#discussion_r881735426
     sess_options = ort.SessionOptions()
     sess_options.enable_cpu_mem_arena = False
+    # 0 means "let onnxruntime decide" (i.e. one thread per physical core)
+    sess_options.intra_op_num_threads = intra_op_num_threads
+    sess_options.inter_op_num_threads = inter_op_num_threads
+
+    return ort.InferenceSession(model_path, sess_options=sess_options)
+
+
+def get_session(model_path, intra_op_num_threads=0, inter_op_num_threads=0):
+    """
+    Return an InferenceSession for an '.onnx' model, loading it only if it isn't already cached.
 
-    ort_sess = ort.InferenceSession(model_path, sess_options=sess_options)
+    Sessions are cached per process, and the least recently used session is evicted once more than
+    `MAX_CACHED_SESSIONS` sessions are loaded. Changing the model file on disk invalidates its cache entry.
+
+    :param model_path: Path to the '.onnx' model.
+    :param intra_op_num_threads: Number of threads used to parallelize the execution within nodes (0 = default).
+    :param inter_op_num_threads: Number of threads used to parallelize the execution of the graph (0 = default).
+    :return: onnxruntime.InferenceSession
+    """
+    model_path = os.path.abspath(model_path)
+    key = (model_path, os.path.getmtime(model_path), intra_op_num_threads, inter_op_num_threads)
+    with _SESSION_CACHE_LOCK:
+        if key in _SESSION_CACHE:
+            _SESSION_CACHE.move_to_end(key)
+            return _SESSION_CACHE[key]
+        ort_sess = _create_session(model_path, intra_op_num_threads, inter_op_num_threads)
+        _SESSION_CACHE[key] = ort_sess
+        while len(_SESSION_CACHE) > MAX_CACHED_SESSIONS:
+            _SESSION_CACHE.popitem(last=False)
+    return ort_sess
+
+
+def clear_session_cache():
+    """Release all cached InferenceSessions."""
+    with _SESSION_CACHE_LOCK:
+        _SESSION_CACHE.clear()
+
+
+def onnx_inference(model_path, input_data, intra_op_num_threads=0, inter_op_num_threads=0):
+    """Perform inference using an '.onnx' model."""
+    ort_sess = get_session(model_path, intra_op_num_threads, inter_op_num_threads)
     preds = ort_sess.run(output_names=["predictions"], input_feed={"input_1": input_data})
 
     return preds
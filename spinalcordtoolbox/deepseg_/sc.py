@@ -15,6 +15,7 @@ from scipy.ndimage import distance_transform_edt, center_of_mass, label
 
 from spinalcordtoolbox import resampling
 from spinalcordtoolbox.deepseg_.onnx import onnx_inference
+from spinalcordtoolbox.deepseg_.sliding_window import sliding_window_inference
 from spinalcordtoolbox.deepseg_.postprocessing import post_processing_volume_wise, keep_largest_object, fill_holes_2d
 from spinalcordtoolbox.image import Image, empty_like, change_type, zeros_like, add_suffix, concat_data, split_img_data
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline, _call_viewer_centerline
@@ -26,6 +27,11 @@ from spinalcordtoolbox.types import EmptyArrayError
 # https://github.com/sct-pipeline/deepseg-threshold
 THR_DEEPSEG = {'t1': 0.15, 't2': 0.7, 't2s': 0.89, 'dwi': 0.01}
 
+# Number of axial slices whose centerline block is predicted in a single call once the SC is detected (see `heatmap()`).
+# The predictions of a batch are discarded as soon as the block moves with the center of mass of the SC, so larger
+# values only pay off if the block rarely moves from one slice to the next.
+N_SLICES_BATCH_CTR = 1
+
 logger = logging.getLogger(__name__)
 
 
@@ -78,7 +84,8 @@ def find_centerline(algo, image_fname, contrast_type, brain_bool, folder_output,
                                     patch_shape=dct_patch_ctr[contrast_type]['size'],
                                     mean_train=dct_patch_ctr[contrast_type]['mean'],
                                     std_train=dct_patch_ctr[contrast_type]['std'],
-                                    brain_bool=brain_bool)
+                                    brain_bool=brain_bool,
+                                    n_slices_batch=N_SLICES_BATCH_CTR)
         im_ctl, _, _, _ = get_centerline(im_heatmap,
                                          ParamCenterline(algo_fitting='optic', contrast=contrast_type),
                                          remove_temp_files=remove_temp_files)
@@ -170,17 +177,27 @@ def crop_image_around_centerline(im_in, ctr_in, crop_size):
     return x_lst, y_lst, z_lst, im_new
 
 
+def _predict_blocks(model, blocks, mean_train, std_train):
+    """
+    Run the centerline CNN on a stack of 2D blocks in a single ONNX call.
+
+    :param blocks: ndarray of shape (n_blocks, x, y)
+    :return: ndarray of shape (n_blocks, x, y) containing the predictions
+    """
+    # NB: A copy is made here so that normalization doesn't modify the (possibly viewed) input data in place
+    blocks_nn = np.expand_dims(np.array(blocks, dtype=np.float32), -1)
+    blocks_nn_norm = _normalize_data(blocks_nn, mean_train, std_train)
+    return onnx_inference(model, blocks_nn_norm)[0][..., 0]
+
+
 def scan_slice(z_slice, model, mean_train, std_train, coord_lst, patch_shape, z_out_dim):
     """Scan the entire axial slice to detect the centerline."""
     z_slice_out = np.zeros(z_out_dim)
     sum_lst = []
-    # loop across all the non-overlapping blocks of a cross-sectional slice
-    for idx, coord in enumerate(coord_lst):
-        block = z_slice[coord[0]:coord[2], coord[1]:coord[3]]
-        block_nn = np.expand_dims(np.expand_dims(block, 0), -1)
-        block_nn_norm = _normalize_data(block_nn, mean_train, std_train)
-        block_pred = onnx_inference(model, block_nn_norm)[0]
-
+    # predict all the non-overlapping blocks of a cross-sectional slice at once
+    blocks = np.stack([z_slice[coord[0]:coord[2], coord[1]:coord[3]] for coord in coord_lst])
+    block_preds = _predict_blocks(model, blocks, mean_train, std_train)
+    for coord, block_pred in zip(coord_lst, block_preds):
         if coord[2] > z_out_dim[0]:
             x_end = patch_shape[0] - (coord[2] - z_out_dim[0])
         else:
@@ -190,8 +207,8 @@ def scan_slice(z_slice, model, mean_train, std_train, coord_lst, patch_shape, z_
         else:
             y_end = patch_shape[1]
 
-        z_slice_out[coord[0]:coord[2], coord[1]:coord[3]] = block_pred[0, :x_end, :y_end, 0]
-        sum_lst.append(np.sum(block_pred[0, :x_end, :y_end, 0]))
+        z_slice_out[coord[0]:coord[2], coord[1]:coord[3]] = block_pred[:x_end, :y_end]
+        sum_lst.append(np.sum(block_pred[:x_end, :y_end]))
 
     # Put first the coord of the patch were the centerline is likely located so that the search could be faster for the
     # next axial slices
@@ -210,8 +227,16 @@ def scan_slice(z_slice, model, mean_train, std_train, coord_lst, patch_shape, z_
     return z_slice_out, x_CoM, y_CoM, coord_lst
 
 
-def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True):
-    """Compute the heatmap with CNN_1 representing the SC localization."""
+def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True, n_slices_batch=1):
+    """
+    Compute the heatmap with CNN_1 representing the SC localization.
+
+    :param n_slices_batch: Once the SC is detected, number of subsequent axial slices whose blocks are predicted
+        together in a single ONNX call, all of them being cropped around the last computed center of mass. The block is
+        still re-centered on every slice: once the center of mass of a slice moves the block, the remaining predictions
+        of the batch are discarded and the next slices are predicted again. The heatmap is therefore the same for any
+        value; larger values give fewer inference calls, but waste the discarded predictions.
+    """
     data_im = im.data.astype(np.float32)
     im_out = change_type(im, "uint8")
     del im
@@ -240,17 +265,18 @@ def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True):
 
     x_CoM, y_CoM = None, None
     z_sc_notDetected_cmpt = 0
-    for zz in range(data_im.shape[2]):
+    zz = 0
+    while zz < data_im.shape[2]:
         # if SC was detected at zz-1, we will start doing the detection on the block centered around the previously
-        # computed center of mass (CoM)
+        # computed center of mass (CoM), for the next `n_slices_batch` slices at once
         if x_CoM is not None:
             z_sc_notDetected_cmpt = 0  # SC detected, cmpt set to zero
             x_0, x_1 = _find_crop_start_end(x_CoM, patch_shape[0], data_im.shape[0])
             y_0, y_1 = _find_crop_start_end(y_CoM, patch_shape[1], data_im.shape[1])
-            block = data_im[x_0:x_1, y_0:y_1, zz]
-            block_nn = np.expand_dims(np.expand_dims(block, 0), -1)
-            block_nn_norm = _normalize_data(block_nn, mean_train, std_train)
-            block_pred = onnx_inference(model, block_nn_norm)[0]
+            crop_batch = (x_0, x_1, y_0, y_1)
+            z_end = min(zz + n_slices_batch, data_im.shape[2])
+            blocks = np.moveaxis(data_im[x_0:x_1, y_0:y_1, zz:z_end], -1, 0)
+            block_preds = _predict_blocks(model, blocks, mean_train, std_train)
 
             # coordinates manipulation due to the above padding and cropping
             if x_1 > data.shape[0]:
@@ -266,33 +292,45 @@ def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True):
             else:
                 y_end = patch_shape[1]
 
-            data[x_0:x_1, y_0:y_1, zz] = block_pred[0, :x_end, :y_end, 0]
+            for block_pred in block_preds:
+                data[x_0:x_1, y_0:y_1, zz] = block_pred[:x_end, :y_end]
 
-            # computation of the new center of mass
-            if np.max(data[:, :, zz]) > 0.5:
-                z_slice_out_bin = data[:, :, zz] > 0.5  # if the SC was detection
-                x_CoM, y_CoM = center_of_mass(z_slice_out_bin)
-                x_CoM, y_CoM = int(x_CoM), int(y_CoM)
-            else:
-                x_CoM, y_CoM = None, None
+                # computation of the new center of mass
+                if np.max(data[:, :, zz]) > 0.5:
+                    z_slice_out_bin = data[:, :, zz] > 0.5  # if the SC was detection
+                    x_CoM, y_CoM = center_of_mass(z_slice_out_bin)
+                    x_CoM, y_CoM = int(x_CoM), int(y_CoM)
+                else:
+                    # the remaining predictions of the batch are discarded, and slice zz is scanned below
+                    x_CoM, y_CoM = None, None
+                    break
+
+                _postprocess_heatmap_slice(data, zz)
+                zz += 1
+
+                # the next block of the batch is only valid if the block centered around the new CoM is the same
+                if (_find_crop_start_end(x_CoM, patch_shape[0], data_im.shape[0]) +
+                        _find_crop_start_end(y_CoM, patch_shape[1], data_im.shape[1])) != crop_batch:
+                    break
+
+            if x_CoM is not None:
+                continue
 
         # if the SC was not detected at zz-1 or on the patch centered around CoM in slice zz, the entire cross-sectional
         # slice is scanned
-        if x_CoM is None:
-            z_slice, x_CoM, y_CoM, coord_lst = scan_slice(data_im[:, :, zz], model,
-                                                          mean_train, std_train,
-                                                          coord_lst, patch_shape, data.shape[:2])
-            data[:, :, zz] = z_slice
-
-            z_sc_notDetected_cmpt += 1
-            # if the SC has not been detected on 10 consecutive z_slices, we stop the SC investigation
-            if z_sc_notDetected_cmpt > 10 and brain_bool:
-                logger.info('Brain section detected.')
-                break
-
-        # distance transform to deal with the harsh edges of the prediction boundaries (Dice)
-        data[:, :, zz][np.where(data[:, :, zz] < 0.5)] = 0
-        data[:, :, zz] = distance_transform_edt(data[:, :, zz])
+        z_slice, x_CoM, y_CoM, coord_lst = scan_slice(data_im[:, :, zz], model,
+                                                      mean_train, std_train,
+                                                      coord_lst, patch_shape, data.shape[:2])
+        data[:, :, zz] = z_slice
+
+        z_sc_notDetected_cmpt += 1
+        # if the SC has not been detected on 10 consecutive z_slices, we stop the SC investigation
+        if z_sc_notDetected_cmpt > 10 and brain_bool:
+            logger.info('Brain section detected.')
+            break
+
+        _postprocess_heatmap_slice(data, zz)
+        zz += 1
 
     if not np.any(data):
         logger.error(
@@ -309,6 +347,12 @@ def heatmap(im, model, patch_shape, mean_train, std_train, brain_bool=True):
         return im_out, z_max
 
 
+def _postprocess_heatmap_slice(data, zz):
+    """Distance transform to deal with the harsh edges of the prediction boundaries (Dice)."""
+    data[:, :, zz][np.where(data[:, :, zz] < 0.5)] = 0
+    data[:, :, zz] = distance_transform_edt(data[:, :, zz])
+
+
 def _normalize_data(data, mean, std):
     """Util function to normalized data based on learned mean and std."""
     data -= mean
@@ -316,30 +360,36 @@ def _normalize_data(data, mean, std):
     return data
 
 
-def segment_2d(model_fname, im_in):
+def segment_2d(model_fname, im_in, batch_size=64):
     """
     Segment data using 2D convolutions.
 
+    :param batch_size: Number of axial slices fed to the model in a single forward pass. This bounds the memory used
+        by the model's activations, so that very long acquisitions (e.g. whole-spine) are processed in chunks.
     :return: seg_crop.data: ndarray float32: Output prediction
     """
     seg_crop = zeros_like(im_in, dtype=np.float32)
 
     data_norm = im_in.data
     # TODO: use sct_progress_bar
-    for zz in range(im_in.dim[2]):
-        # 2D CNN prediction
-        x = np.expand_dims(np.expand_dims(data_norm[:, :, zz], -1), 0)
-        pred_seg = onnx_inference(model_fname, x)[0][0, :, :, 0]
-        seg_crop.data[:, :, zz] = pred_seg
+    for z_start in range(0, im_in.dim[2], batch_size):
+        z_end = min(z_start + batch_size, im_in.dim[2])
+        # 2D CNN prediction: [x, y, z] -> [z, x, y, 1]
+        x = np.expand_dims(np.moveaxis(data_norm[:, :, z_start:z_end], -1, 0), -1)
+        pred_seg = onnx_inference(model_fname, x)[0][..., 0]
+        seg_crop.data[:, :, z_start:z_end] = np.moveaxis(pred_seg, 0, -1)
 
     return seg_crop.data
 
 
-def segment_3d(model_fname, contrast_type, im_in):
+def segment_3d(model_fname, contrast_type, im_in, overlap=0.0, batch_size=4):
     """
     Perform segmentation with 3D convolutions.
 
-    :return: seg_crop.data: ndarray float32: Output prediction
+    :param overlap: Fraction of the z patch size shared by two consecutive windows. See `sliding_window_inference`.
+    :param batch_size: Number of windows fed to the model in a single forward pass.
+    :return: ndarray float32: Output prediction, which is not thresholded yet (see `threshold_seg` in
+        `deep_segmentation_spinalcord`)
     """
     dct_patch_sc_3d = {'t2': {'size': (64, 64, 48), 'mean': 65.8562, 'std': 59.7999},
                        't2s': {'size': (96, 96, 48), 'mean': 87.0212, 'std': 64.425},
@@ -348,31 +398,13 @@ def segment_3d(model_fname, contrast_type, im_in):
     out = zeros_like(im_in, dtype=np.float32)
 
     # segment the spinal cord
-    z_patch_size = dct_patch_sc_3d[contrast_type]['size'][2]
-    z_step_keep = list(range(0, im_in.data.shape[2], z_patch_size))
-    # TODO: use sct_progress_bar
-    for zz in z_step_keep:
-        if zz == z_step_keep[-1]:  # deal with instances where the im.data.shape[2] % patch_size_z != 0
-            patch_im = np.zeros(dct_patch_sc_3d[contrast_type]['size'])
-            z_patch_extracted = im_in.data.shape[2] - zz
-            patch_im[:, :, :z_patch_extracted] = im_in.data[:, :, zz:]
-        else:
-            z_patch_extracted = z_patch_size
-            patch_im = im_in.data[:, :, zz:z_patch_size + zz]
-
-        if np.any(patch_im):  # Check if the patch is (not) empty, which could occur after a brain detection.
-            patch_norm = \
-                _normalize_data(patch_im, dct_patch_sc_3d[contrast_type]['mean'], dct_patch_sc_3d[contrast_type]['std'])
-            x = np.expand_dims(np.expand_dims(patch_norm, 0), 0).astype(np.float32)
-            onnx_pred = onnx_inference(model_fname, x)
-            # pred_seg_th = (patch_pred_proba > 0.5).astype(int)[0, 0, :, :, :]
-            pred_seg_th = onnx_pred[0][0, 0, :, :, :]  # TODO: clarified variable (this is not thresholded!)
-
-            # TODO: add comment about what the code is doing below
-            if zz == z_step_keep[-1]:
-                out.data[:, :, zz:] = pred_seg_th[:, :, :z_patch_extracted]
-            else:
-                out.data[:, :, zz:z_patch_size + zz] = pred_seg_th
+    # NB: Empty patches are skipped, which could occur after a brain detection.
+    out.data = sliding_window_inference(
+        model_fname, im_in.data,
+        patch_size_z=dct_patch_sc_3d[contrast_type]['size'][2],
+        normalize=lambda patches: _normalize_data(patches, dct_patch_sc_3d[contrast_type]['mean'],
+                                                  dct_patch_sc_3d[contrast_type]['std']),
+        overlap=overlap, batch_size=batch_size, skip_empty=True)
 
     return out.data
 
@@ -0,0 +1,94 @@
+"""
+Sliding-window inference along the S-I axis (used by the 3D models of sct_deepseg_sc and sct_deepseg_lesion)
+
+Copyright (c) 2022 Polytechnique Montreal <www.neuro.polymtl.ca>
+License: see the file LICENSE
+"""
+
+import numpy as np
+
+from spinalcordtoolbox.deepseg_.onnx import onnx_inference
+
+
+def get_window_starts(n_z, patch_size_z, overlap=0.0):
+    """
+    Compute the first slice of each window tiling the z axis.
+
+    Windows are spaced by `patch_size_z * (1 - overlap)` slices, and the last window may extend past the end of the
+    volume (it is then zero-padded). With `overlap=0`, this gives non-overlapping chunks of `patch_size_z` slices.
+
+    :param n_z: Number of slices of the volume.
+    :param patch_size_z: Number of slices of a window.
+    :param overlap: Fraction of `patch_size_z` shared by two consecutive windows, in [0, 1).
+    :return: list of int
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError(f"Overlap should be in [0, 1), got: {overlap}")
+    step = max(1, int(round(patch_size_z * (1 - overlap))))
+    starts = [0]
+    while starts[-1] + patch_size_z < n_z:
+        starts.append(starts[-1] + step)
+    return starts
+
+
+def gaussian_weights(patch_size_z, sigma_scale=0.125):
+    """
+    1D Gaussian importance map along z, centered on the middle of the window.
+
+    Voxels near the borders of a window, where predictions are less reliable, get a lower weight when blending
+    overlapping windows. The weights are bounded away from zero to avoid divisions by zero.
+    """
+    z = np.arange(patch_size_z) - (patch_size_z - 1) / 2
+    weights = np.exp(-0.5 * (z / (sigma_scale * patch_size_z)) ** 2)
+    weights /= weights.max()
+    return np.maximum(weights, 1e-3).astype(np.float32)
+
+
+def sliding_window_inference(model_fname, data, patch_size_z, normalize=None, overlap=0.0, batch_size=1,
+                             skip_empty=True, sigma_scale=0.125):
+    """
+    Run a 3D model over a volume using windows sliding along z, and blend the predictions of the windows.
+
+    :param model_fname: Path to the '.onnx' model, which takes inputs of shape [n, 1, x, y, patch_size_z].
+    :param data: ndarray of shape (x, y, z). Not modified.
+    :param patch_size_z: Number of slices of a window.
+    :param normalize: Optional function applied to a stack of windows before inference (e.g. intensity normalization).
+        Windows that extend past the end of the volume are zero-padded before being normalized.
+    :param overlap: Fraction of `patch_size_z` shared by two consecutive windows, in [0, 1). With overlap, predictions
+        are blended using Gaussian weights along z; without overlap, each voxel is predicted by exactly one window.
+    :param batch_size: Number of windows fed to the model in a single forward pass.
+    :param skip_empty: If True, windows that only contain zeros (e.g. after a brain detection) are not predicted, and
+        their contribution is zero.
+    :param sigma_scale: Standard deviation of the Gaussian weights, as a fraction of `patch_size_z`.
+    :return: ndarray float32 of shape (x, y, z): blended predictions
+    """
+    n_x, n_y, n_z = data.shape
+    starts = get_window_starts(n_z, patch_size_z, overlap)
+    if skip_empty:
+        starts = [zz for zz in starts if np.any(data[:, :, zz:zz + patch_size_z])]
+    # Without overlap, constant weights keep the predictions untouched by the blending
+    weights = gaussian_weights(patch_size_z, sigma_scale) if overlap > 0 else np.ones(patch_size_z, dtype=np.float32)
+
+    pred_sum = np.zeros((n_x, n_y, n_z), dtype=np.float32)
+    weight_sum = np.zeros(n_z, dtype=np.float32)
+    for i_batch in range(0, len(starts), batch_size):
+        starts_batch = starts[i_batch:i_batch + batch_size]
+        # Extract the windows, zero-padding the ones that extend past the end of the volume
+        patches = np.zeros((len(starts_batch), n_x, n_y, patch_size_z), dtype=np.result_type(data, np.float32))
+        for patch, zz in zip(patches, starts_batch):
+            z_extracted = min(patch_size_z, n_z - zz)
+            patch[:, :, :z_extracted] = data[:, :, zz:zz + z_extracted]
+        if normalize is not None:
+            patches = normalize(patches)
+        x = np.expand_dims(patches, 1).astype(np.float32)
+        preds = onnx_inference(model_fname, x)[0][:, 0]
+
+        for pred, zz in zip(preds, starts_batch):
+            z_extracted = min(patch_size_z, n_z - zz)
+            pred_sum[:, :, zz:zz + z_extracted] += pred[:, :, :z_extracted] * weights[:z_extracted]
+            weight_sum[zz:zz + z_extracted] += weights[:z_extracted]
+
+    # Slices that weren't covered by any window (skipped because empty) stay at zero
+    covered = weight_sum > 0
+    pred_sum[:, :, covered] /= weight_sum[covered]
+    return pred_sum
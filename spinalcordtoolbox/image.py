@@ -222,7 +222,10 @@ class SlicerMany(object):
 
 
 def check_affines_match(im):
-    hdr = im.hdr
+    return _header_affines_match(im.hdr, im.absolutepath)
+
+
+def _header_affines_match(hdr, path):
     hdr2 = hdr.copy()
 
     try:
@@ -230,9 +233,9 @@ def check_affines_match(im):
     except np.linalg.LinAlgError:
         # See https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues/3097
         logger.warning("The sform for {} is uninitialized and may cause unexpected behaviour."
-                       ''.format(im.absolutepath))
+                       ''.format(path))
 
-        if im.absolutepath is None:
+        if path is None:
             logger.error("Internal code has produced an image with an uninitialized sform. "
                          "please report this on github at https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues "
                          "or on the SCT forums https://forum.spinalcordmri.org/.")
@@ -242,6 +245,32 @@ def check_affines_match(im):
     return np.allclose(hdr.get_qform(), hdr2.get_qform(), atol=1e-3)
 
 
+def _raise_sform_mismatch(path):
+    if path is None:
+        logger.error("Internal code has produced an image with inconsistent qform and sform "
+                     "please report this on github at https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues "
+                     " or on the SCT forum https://forum.spinalcordmri.org/.")
+    else:
+        logger.error(f"Image {path} has different qform and sform matrices. This can produce incorrect "
+                     f"results. Please use 'sct_image -i {path} -header' to check that both affine "
+                     f"matrices are valid. Then, consider running either 'sct_image -set-sform-to-qform' or "
+                     f"'sct_image -set-qform-to-sform' to fix any discrepancies you may find.")
+    raise ValueError("Image sform does not match qform")
+
+
+def check_sform(fname):
+    """
+    Check that the sform of an image file matches its qform, as `Image(fname, check_sform=True)` does, but only reading
+    the header of the file.
+
+    :param fname: path of the image
+    :raises ValueError: if the sform does not match the qform
+    """
+    path = os.path.abspath(fname)
+    if not _header_affines_match(nib.load(path).header, path):
+        _raise_sform_mismatch(path)
+
+
 class Image(object):
     """
     Create an object that behaves similarly to nibabel's image object. Useful additions include: dim, check_sform and
@@ -310,16 +339,7 @@ class Image(object):
         # Make sure sform and qform are the same.
         # Context: https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues/2429
         if check_sform and not check_affines_match(self):
-            if self.absolutepath is None:
-                logger.error("Internal code has produced an image with inconsistent qform and sform "
-                             "please report this on github at https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues "
-                             " or on the SCT forum https://forum.spinalcordmri.org/.")
-            else:
-                logger.error(f"Image {self._path} has different qform and sform matrices. This can produce incorrect "
-                             f"results. Please use 'sct_image -i {self._path} -header' to check that both affine "
-                             f"matrices are valid. Then, consider running either 'sct_image -set-sform-to-qform' or "
-                             f"'sct_image -set-qform-to-sform' to fix any discrepancies you may find.")
-            raise ValueError("Image sform does not match qform")
+            _raise_sform_mismatch(self.absolutepath)
 
     @property
     def dim(self):
@@ -645,11 +665,8 @@ class Image(object):
 
         m_p2f = self.hdr.get_best_affine()
         aug = np.hstack((np.asarray(coordi), np.ones((len(coordi), 1))))
-        ret = np.empty_like(coordi, dtype=np.float64)
-        for idx_coord, coord in enumerate(aug):
-            phys = np.matmul(m_p2f, coord)
-            ret[idx_coord] = phys[:3]
-        return ret
+        # Same as `np.matmul(m_p2f, coord)` for each point, but for all the points at once
+        return np.einsum('ij,nj->ni', m_p2f, aug)[:, :3].astype(np.float64)
 
     def transfo_phys2pix(self, coordi, real=True):
         """
@@ -1529,7 +1546,8 @@ def pad_image(im: Image, pad_x_i: int = 0, pad_x_f: int = 0, pad_y_i: int = 0, p
     # TODO: Do not copy the Image(), because the dim field and hdr.get_data_shape() will not be updated properly.
     #   better to just create a new Image() from scratch.
     im_out.data = padded_data  # done after the call of the function
-    im_out.absolutepath = add_suffix(im_out.absolutepath, "_pad")
+    if im_out.absolutepath is not None:
+        im_out.absolutepath = add_suffix(im_out.absolutepath, "_pad")
 
     # adapt the origin in the sform and qform matrix
     new_origin = np.dot(im_out.hdr.get_qform(), [-pad_x_i, -pad_y_i, -pad_z_i, 1])
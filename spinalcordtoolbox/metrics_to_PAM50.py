@@ -8,7 +8,7 @@ License: see the file LICENSE
 import numpy as np
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.aggregate_slicewise import Metric
-from spinalcordtoolbox.template import get_slices_from_vertebral_levels
+from spinalcordtoolbox.template import VertLevelIndex
 
 
 def interpolate_metrics(metrics, fname_vert_levels_PAM50, fname_vert_levels):
@@ -30,8 +30,10 @@ def interpolate_metrics(metrics, fname_vert_levels_PAM50, fname_vert_levels):
     levels = sorted(int(level) for level in np.unique(im_seg_labeled.data) if 0 < int(level) < 49)
 
     # Get slices corresponding to each level
-    level_slices_PAM50 = [get_slices_from_vertebral_levels(im_seg_labeled_PAM50, level) for level in levels]
-    level_slices_im = [get_slices_from_vertebral_levels(im_seg_labeled, level) for level in levels]
+    vert_level_index_PAM50 = VertLevelIndex(im_seg_labeled_PAM50)
+    vert_level_index_im = VertLevelIndex(im_seg_labeled)
+    level_slices_PAM50 = [vert_level_index_PAM50.get_slices(level) for level in levels]
+    level_slices_im = [vert_level_index_im.get_slices(level) for level in levels]
 
     # Find the mean scaling between the image and PAM50 (excluding first and last levels)
     scales = [len(slices_PAM50)/len(slices_im) for slices_PAM50, slices_im
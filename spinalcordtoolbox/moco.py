@@ -13,6 +13,7 @@ License: see the file LICENSE
 # TODO: ants: explore optin  --float  for faster computation
 
 from copy import deepcopy
+import contextlib
 import sys
 import os
 from shutil import copyfile
@@ -22,20 +23,24 @@ import time
 import functools
 import operator
 import csv
+import multiprocessing
 
 import numpy as np
 import scipy.interpolate
 
 from spinalcordtoolbox.image import Image, add_suffix, generate_output_file, convert, apply_mask_if_soft
 from spinalcordtoolbox.utils.shell import get_interpolation
-from spinalcordtoolbox.utils.sys import sct_progress_bar, run_proc, printv
+from spinalcordtoolbox.utils.sys import sct_progress_bar, run_proc, printv, get_n_jobs
 from spinalcordtoolbox.utils.fs import tmp_create, extract_fname, rmtree, copy
 
 # FIXME don't import from scripts in API
 from spinalcordtoolbox.scripts import sct_dmri_separate_b0_and_dwi
-from spinalcordtoolbox.scripts.sct_image import split_data, concat_data, multicomponent_split
+from spinalcordtoolbox.scripts.sct_image import split_data, concat_data
 from spinalcordtoolbox.scripts import sct_apply_transfo
 
+# Input data of the worker processes of moco(), loaded once per process (see `_init_moco_worker()`)
+_moco_worker_data = None
+
 
 class ParamMoco:
     """
@@ -82,6 +87,7 @@ class ParamMoco:
         self.iterAvg = 1  # iteratively average target image for more robust moco
         self.is_sagittal = False  # if True, then split along Z (right-left) and register each 2D slice (vs. 3D volume)
         self.output_motion_param = True  # if True, the motion parameters are outputted
+        self.n_jobs = 1  # number of volumes registered in parallel (see utils.sys.get_n_jobs)
 
     # update constructor with user's parameters
     def update(self, param_user):
@@ -229,21 +235,11 @@ def moco_wrapper(param):
     # Prepare data (mean/groups...)
     # ==================================================================================================================
 
-    # Split into T dimension
-    printv('\nSplit along T dimension...', param.verbose)
-    im_data_split_list = split_data(im_data, 3)
-    for im in im_data_split_list:
-        x_dirname, x_basename, x_ext = extract_fname(im.absolutepath)
-        im.absolutepath = os.path.join(x_dirname, x_basename + ".nii.gz")
-        im.save()
-
+    # Volumes are selected directly from the 4D data (the data is not split along T)
     if param.is_diffusion:
         # Merge and average b=0 images
         printv('\nMerge and average b=0 data...', param.verbose)
-        im_b0_list = []
-        for it in range(nb_b0):
-            im_b0_list.append(im_data_split_list[index_b0[it]])
-        im_b0 = concat_data(im_b0_list, 3).save(file_b0, verbose=0)
+        im_b0 = Image(im_data.data[:, :, :, index_b0], hdr=im_data.hdr).save(file_b0, mutable=True, verbose=0)
         # Average across time
         im_b0.mean(dim=3).save(add_suffix(file_b0, '_mean'))
 
@@ -275,15 +271,9 @@ def moco_wrapper(param):
                                    ncols=80):
         # get index
         index_moco_i = group_indexes[iGroup]
-        n_moco_i = len(index_moco_i)
-        # concatenate images across time, within this group
-        file_dwi_merge_i = os.path.join(file_dwi_basename + '_' + str(iGroup) + ext_data)
-        im_dwi_list = []
-        for it in range(n_moco_i):
-            im_dwi_list.append(im_data_split_list[index_moco_i[it]])
-        im_dwi_out = concat_data(im_dwi_list, 3).save(file_dwi_merge_i, verbose=0)
-        # Average across time
+        # Average across time, within this group
         list_file_group.append(os.path.join(file_dwi_basename + '_' + str(iGroup) + '_mean' + ext_data))
+        im_dwi_out = Image(im_data.data[:, :, :, index_moco_i], hdr=im_data.hdr)
         im_dwi_out.mean(dim=3).save(list_file_group[-1])
 
     # Merge across groups
@@ -295,9 +285,6 @@ def moco_wrapper(param):
     im_dw_list = [Image(fname) for fname in fname_dw_list]
     concat_data(im_dw_list, 3).save(file_datasubgroup, verbose=0)
 
-    # Cleanup
-    del im, im_data_split_list
-
     # ==================================================================================================================
     # Estimate moco
     # ==================================================================================================================
@@ -315,13 +302,14 @@ def moco_wrapper(param):
         if index_moco[0] != 0:
             # If first DWI is not the first volume (most common), then there is a least one b=0 image before. In that
             # case select it as the target image for registration of all b=0
-            param_moco.file_target = os.path.join(file_data_dirname,
-                                                  file_data_basename + '_T' + str(index_b0[index_moco[0] - 1]).zfill(
-                                                      4) + ext_data)
+            index_target = index_b0[index_moco[0] - 1]
         else:
             # If first DWI is the first volume, then the target b=0 is the first b=0 from the index_b0.
-            param_moco.file_target = os.path.join(file_data_dirname,
-                                                  file_data_basename + '_T' + str(index_b0[0]).zfill(4) + ext_data)
+            index_target = index_b0[0]
+        param_moco.file_target = os.path.join(file_data_dirname,
+                                              file_data_basename + '_T' + str(index_target).zfill(4) + ext_data)
+        im_target = Image(im_data.data[:, :, :, index_target], hdr=im_data.hdr)
+        im_target.save(param_moco.file_target, mutable=True, verbose=0)
         # Run moco
         param_moco.path_out = ''
         param_moco.todo = 'estimate_and_apply'
@@ -399,52 +387,9 @@ def moco_wrapper(param):
         if param.is_sagittal:
             printv('Motion parameters cannot be generated for sagittal images.', 1, 'warning')
         else:
-            files_warp_X, files_warp_Y = [], []
-            moco_param = []
-            for fname_warp in file_mat_data[0]:
-                # Cropping the image to keep only one voxel in the XY plane
-                im_warp = Image(fname_warp + param.suffix_mat)
-                im_warp.data = np.expand_dims(np.expand_dims(im_warp.data[0, 0, :, :, :], axis=0), axis=0)
-
-                # These three lines allow to generate one file instead of two, containing X, Y and Z moco parameters
-                # fname_warp_crop = fname_warp + '_crop_' + ext_mat
-                # files_warp.append(fname_warp_crop)
-                # im_warp.save(fname_warp_crop)
-
-                # Separating the three components and saving X and Y only (Z is equal to 0 by default).
-                im_warp_XYZ = multicomponent_split(im_warp)
-
-                fname_warp_crop_X = fname_warp + '_crop_X_' + param.suffix_mat
-                im_warp_XYZ[0].save(fname_warp_crop_X)
-                files_warp_X.append(fname_warp_crop_X)
-
-                fname_warp_crop_Y = fname_warp + '_crop_Y_' + param.suffix_mat
-                im_warp_XYZ[1].save(fname_warp_crop_Y)
-                files_warp_Y.append(fname_warp_crop_Y)
-
-                # Calculating the slice-wise average moco estimate to provide a QC file
-                moco_param.append([np.mean(np.ravel(im_warp_XYZ[0].data)), np.mean(np.ravel(im_warp_XYZ[1].data))])
-
-            # These two lines allow to generate one file instead of two, containing X, Y and Z moco parameters
-            # im_warp = [Image(fname) for fname in files_warp]
-            # im_warp_concat = concat_data(im_warp, dim=3)
-            # im_warp_concat.save('fmri_moco_params.nii')
-
-            # Concatenating the moco parameters into a time series for X and Y components.
-            im_warp_X = [Image(fname) for fname in files_warp_X]
-            im_warp_concat = concat_data(im_warp_X, dim=3)
-            im_warp_concat.save(file_moco_params_x)
-
-            im_warp_Y = [Image(fname) for fname in files_warp_Y]
-            im_warp_concat = concat_data(im_warp_Y, dim=3)
-            im_warp_concat.save(file_moco_params_y)
-
-            # Writing a TSV file with the slicewise average estimate of the moco parameters. Useful for QC
-            with open(file_moco_params_csv, 'wt', newline='') as out_file:
-                tsv_writer = csv.writer(out_file, delimiter='\t')
-                tsv_writer.writerow(['X', 'Y'])
-                for mocop in moco_param:
-                    tsv_writer.writerow([mocop[0], mocop[1]])
+            translations, im_warp = load_moco_translations([fname_warp + param.suffix_mat
+                                                            for fname_warp in file_mat_data[0]])
+            save_moco_params(translations, im_warp, file_moco_params_x, file_moco_params_y, file_moco_params_csv)
 
     # Generate output files
     printv('\nGenerate output files...', param.verbose)
@@ -479,6 +424,48 @@ def moco_wrapper(param):
     return fname_moco
 
 
+def load_moco_translations(fnames_warp):
+    """
+    Load the X and Y translations of each slice from the warping fields estimated by moco for an axial volume (which
+    are a stack of 2D Tx-Ty transformations).
+
+    :param fnames_warp: Warping fields of the nt volumes.
+    :return: (nz, nt, 2) array of X and Y translations, and the Image of the first warping field (used for headers).
+    """
+    translations, im_warp0 = None, None
+    for it, fname_warp in enumerate(fnames_warp):
+        im_warp = Image(fname_warp)
+        if translations is None:
+            im_warp0 = im_warp
+            translations = np.empty((im_warp.data.shape[2], len(fnames_warp), 2), dtype=im_warp.data.dtype)
+        # The translation is the same for all voxels of a slice, so the first voxel of each slice is enough
+        translations[:, it, :] = im_warp.data[0, 0, :, 0, :2]
+    return translations, im_warp0
+
+
+def save_moco_params(translations, im_warp, fname_x, fname_y, fname_tsv):
+    """
+    Save the motion parameters: the X and Y translations of each slice as time series (1 x 1 x nz x nt images), and the
+    slice-wise average of the translations of each volume as a TSV file (useful for QC).
+
+    :param translations: (nz, nt, 2) array, see load_moco_translations()
+    :param im_warp: Image of a warping field, whose header is used for the time series
+    :param fname_x: Output time series of X translations
+    :param fname_y: Output time series of Y translations
+    :param fname_tsv: Output TSV file
+    """
+    for i, fname in enumerate([fname_x, fname_y]):
+        im_param = im_warp.copy()
+        im_param.data = translations[np.newaxis, np.newaxis, :, :, i]
+        im_param.hdr.set_intent('vector', (), '')
+        im_param.save(fname, verbose=0)
+
+    with open(fname_tsv, 'wt', newline='') as out_file:
+        tsv_writer = csv.writer(out_file, delimiter='\t')
+        tsv_writer.writerow(['X', 'Y'])
+        tsv_writer.writerows(translations.mean(axis=0))
+
+
 def moco(param):
     """
     Main function that performs motion correction.
@@ -528,15 +515,11 @@ def moco(param):
     if not param.fname_mask == '':
         file_target, _ = apply_mask_if_soft(file_target, param.fname_mask)
 
-    # If scan is sagittal, split src and target along Z (slice)
+    # If scan is sagittal, split target along Z (slice). The data itself is not split: each volume is extracted from
+    # the input data (memory-mapped if uncompressed) right before its registration.
     if param.is_sagittal:
         dim_sag = 2  # TODO: find it
-        # z-split data (time series)
-        im_z_list = split_data(im_data, dim=dim_sag, squeeze_data=False)
-        file_data_splitZ = []
-        for im_z in im_z_list:
-            im_z.save(verbose=0)
-            file_data_splitZ.append(im_z.absolutepath)
+        nz_moco = nz
         # z-split target
         im_targetz_list = split_data(Image(file_target), dim=dim_sag, squeeze_data=False)
         file_target_splitZ = []
@@ -546,19 +529,13 @@ def moco(param):
         # z-split mask (if exists)
         if not param.fname_mask == '':
             im_maskz_list = split_data(Image(file_mask), dim=dim_sag, squeeze_data=False)
-            file_mask_splitZ = []
             for im_maskz in im_maskz_list:
                 im_maskz.save(verbose=0)
-                file_mask_splitZ.append(im_maskz.absolutepath)
-        # initialize file list for output matrices
-        file_mat = np.empty((nz, nt), dtype=object)
 
     # axial orientation
     else:
-        file_data_splitZ = [file_data]  # TODO: make it absolute like above
+        nz_moco = 1
         file_target_splitZ = [file_target]  # TODO: make it absolute like above
-        # initialize file list for output matrices
-        file_mat = np.empty((1, nt), dtype=object)
 
         # deal with mask
         if not param.fname_mask == '':
@@ -566,99 +543,176 @@ def moco(param):
             im_mask.save(file_mask, mutable=True, verbose=0)
             im_maskz_list = [Image(file_mask)]  # use a list with single element
 
-    # Loop across file list, where each file is either a 2D volume (if sagittal) or a 3D volume (otherwise)
-    # file_mat = tuple([[[] for i in range(nt)] for i in range(nz)])
-
-    file_data_splitZ_moco = []
-    printv('\nRegister. Loop across Z (note: there is only one Z if orientation is axial)')
-    for file in file_data_splitZ:
-        iz = file_data_splitZ.index(file)
-        # Split data along T dimension
-        # printv('\nSplit data along T dimension.', verbose)
-        im_z = Image(file)
-        list_im_zt = split_data(im_z, dim=3)
-        file_data_splitZ_splitT = []
-        for im_zt in list_im_zt:
-            im_zt.save(verbose=0)
-            file_data_splitZ_splitT.append(im_zt.absolutepath)
-        # file_data_splitT = file_data + '_T'
-
-        # Motion correction: initialization
-        index = np.arange(nt)
-        file_data_splitZ_splitT_moco = []
-        failed_transfo = [0 for i in range(nt)]
-
-        # Motion correction: Loop across T
-        for indice_index in sct_progress_bar(range(nt), unit='iter', unit_scale=False,
-                                             desc="Z=" + str(iz) + "/" + str(len(file_data_splitZ) - 1), ncols=80):
-
-            # create indices and display stuff
-            it = index[indice_index]
-            file_mat[iz][it] = os.path.join(folder_mat, "mat.Z") + str(iz).zfill(4) + 'T' + str(it).zfill(4)
-            file_data_splitZ_splitT_moco.append(add_suffix(file_data_splitZ_splitT[it], '_moco'))
+    # initialize file list for output matrices
+    file_mat = np.empty((nz_moco, nt), dtype=object)
+    # Motion-corrected data, filled in place as volumes get registered
+    data_moco = None
+
+    # Registrations of different volumes are independent, so they can be distributed across processes. Each process
+    # only writes the volume it is working on to the disk, so the size of temporary files doesn't depend on nt.
+    n_jobs = get_n_jobs(param.n_jobs)
+    # the pool is terminated when leaving the block, even if the registration of a volume fails
+    with (multiprocessing.Pool(n_jobs, initializer=_init_moco_worker, initargs=(n_jobs, file_data)) if n_jobs > 1
+          else contextlib.nullcontext()) as pool:
+        printv('\nRegister. Loop across Z (note: there is only one Z if orientation is axial)')
+        for iz in range(nz_moco):
+            # Motion correction: initialization
+            failed_transfo = [0 for i in range(nt)]
+            file_data_splitZ_splitT = []
+            for it in range(nt):
+                file_mat[iz][it] = os.path.join(folder_mat, "mat.Z") + str(iz).zfill(4) + 'T' + str(it).zfill(4)
+                suffix_zt = '_Z' + str(iz).zfill(4) + '_T' + str(it).zfill(4) if param.is_sagittal else '_T' + str(it).zfill(4)
+                file_data_splitZ_splitT.append(add_suffix(file_data, suffix_zt))
             # deal with masking (except in the 'apply' case, where masking is irrelevant)
-            input_mask = None
+            im_maskz = None
             if not param.fname_mask == '' and not param.todo == 'apply':
-                file_data_splitZ_splitT[it], input_mask = apply_mask_if_soft(file_data_splitZ_splitT[it],
-                                                                             im_maskz_list[iz])
-
-            # run 3D registration
-            failed_transfo[it] = register(param, file_data_splitZ_splitT[it], file_target_splitZ[iz], file_mat[iz][it],
-                                          file_data_splitZ_splitT_moco[it], im_mask=input_mask)
-
-            # average registered volume with target image
-            # N.B. use weighted averaging: (target * nb_it + moco) / (nb_it + 1)
-            if param.iterAvg and indice_index < 10 and failed_transfo[it] == 0 and not param.todo == 'apply':
-                im_targetz = Image(file_target_splitZ[iz])
-                data_targetz = im_targetz.data
-                data_mocoz = Image(file_data_splitZ_splitT_moco[it]).data
-                data_targetz = (data_targetz * (indice_index + 1) + data_mocoz) / (indice_index + 2)
-                im_targetz.data = data_targetz
-                im_targetz.save(verbose=0)
-
-        # Replace failed transformation with the closest good one
-        fT = [i for i, j in enumerate(failed_transfo) if j == 1]
-        gT = [i for i, j in enumerate(failed_transfo) if j == 0]
-        for it in range(len(fT)):
-            abs_dist = [np.abs(gT[i] - fT[it]) for i in range(len(gT))]
-            if not abs_dist == []:
-                index_good = abs_dist.index(min(abs_dist))
-                printv('  transfo #' + str(fT[it]) + ' --> use transfo #' + str(gT[index_good]), verbose)
-                # copy transformation
-                copy(file_mat[iz][gT[index_good]] + 'Warp.nii.gz', file_mat[iz][fT[it]] + 'Warp.nii.gz')
-                # apply transformation
-                sct_apply_transfo.main(argv=['-i', file_data_splitZ_splitT[fT[it]],
-                                             '-d', file_target,
-                                             '-w', file_mat[iz][fT[it]] + 'Warp.nii.gz',
-                                             '-o', file_data_splitZ_splitT_moco[fT[it]],
-                                             '-x', param.interp,
-                                             '-v', '0'])
-            else:
-                # exit program if no transformation exists.
-                printv('\nERROR in ' + os.path.basename(__file__) + ': No good transformation exist. Exit program.\n', verbose, 'error')
-                sys.exit(2)
-
-        # Merge data along T
-        file_data_splitZ_moco.append(add_suffix(file, suffix))
-        if todo != 'estimate':
-            im_data_splitZ_splitT_moco = [Image(fname, mmap=False) for fname in file_data_splitZ_splitT_moco]
-            im_out = concat_data(im_data_splitZ_splitT_moco, 3)
-            im_out.absolutepath = file_data_splitZ_moco[iz]
-            im_out.save(verbose=0)
-
-    # If sagittal, merge along Z
-    if param.is_sagittal:
-        # TODO: im_out.dim is incorrect: Z value is one
-        im_data_splitZ_moco = [Image(fname) for fname in file_data_splitZ_moco]
-        im_out = concat_data(im_data_splitZ_moco, 2)
-        dirname, basename, ext = extract_fname(file_data)
-        path_out = os.path.join(dirname, basename + suffix + ext)
-        im_out.absolutepath = path_out
+                im_maskz = im_maskz_list[iz]
+
+            def store(it, data_moco_zt):
+                """Copy a motion-corrected volume to the output data."""
+                nonlocal data_moco
+                if todo == 'estimate':
+                    return
+                if data_moco is None:
+                    data_moco = np.empty((nx, ny, nz, nt), dtype=data_moco_zt.dtype)
+                if param.is_sagittal:
+                    data_moco[:, :, iz, it] = data_moco_zt.reshape(nx, ny)
+                else:
+                    data_moco[:, :, :, it] = data_moco_zt.reshape(nx, ny, nz)
+
+            # The first volumes are averaged with the target image once registered, so they have to be registered one after
+            # the other. The target doesn't change afterwards, so the remaining volumes can be registered in parallel (and
+            # the result doesn't depend on the number of processes).
+            n_avg = min(nt, 10) if param.iterAvg and not param.todo == 'apply' else 0
+
+            # Motion correction: Loop across T
+            with sct_progress_bar(total=nt, unit='iter', unit_scale=False,
+                                  desc="Z=" + str(iz) + "/" + str(nz_moco - 1), ncols=80) as pbar:
+                if n_avg:
+                    im_targetz = Image(file_target_splitZ[iz])
+                for it in range(n_avg):
+                    # run 3D registration
+                    failed_transfo[it], data_moco_zt = register_volume(param, im_data.data, im_data.hdr, iz, it,
+                                                                       file_data_splitZ_splitT[it],
+                                                                       file_target_splitZ[iz], file_mat[iz][it],
+                                                                       im_mask=im_maskz)
+
+                    # average registered volume with target image
+                    # N.B. use weighted averaging: (target * nb_it + moco) / (nb_it + 1)
+                    if failed_transfo[it] == 0:
+                        store(it, data_moco_zt)
+                        im_targetz.data = (im_targetz.data * (it + 1) + data_moco_zt) / (it + 2)
+                        im_targetz.save(verbose=0)
+                    pbar.update(1)
+
+                tasks = [(iz, it, file_data_splitZ_splitT[it], file_target_splitZ[iz], file_mat[iz][it], im_maskz)
+                         for it in range(n_avg, nt)]
+                if pool is None:
+                    results = (register_volume(param, im_data.data, im_data.hdr, *task) for task in tasks)
+                else:
+                    results = pool.imap(functools.partial(_register_task, param, im_data.hdr), tasks)
+                for it, (failed, data_moco_zt) in zip(range(n_avg, nt), results):
+                    failed_transfo[it] = failed
+                    if failed == 0:
+                        store(it, data_moco_zt)
+                    pbar.update(1)
+
+            # Replace failed transformation with the closest good one
+            fT = [i for i, j in enumerate(failed_transfo) if j == 1]
+            gT = [i for i, j in enumerate(failed_transfo) if j == 0]
+            for it in range(len(fT)):
+                abs_dist = [np.abs(gT[i] - fT[it]) for i in range(len(gT))]
+                if not abs_dist == []:
+                    index_good = abs_dist.index(min(abs_dist))
+                    printv('  transfo #' + str(fT[it]) + ' --> use transfo #' + str(gT[index_good]), verbose)
+                    # copy transformation
+                    copy(file_mat[iz][gT[index_good]] + 'Warp.nii.gz', file_mat[iz][fT[it]] + 'Warp.nii.gz')
+                    # apply transformation
+                    file_src = _save_volume(im_data.data, im_data.hdr, iz, fT[it], file_data_splitZ_splitT[fT[it]],
+                                            param.is_sagittal)
+                    file_src_moco = add_suffix(file_src, '_moco')
+                    sct_apply_transfo.main(argv=['-i', file_src,
+                                                 '-d', file_target,
+                                                 '-w', file_mat[iz][fT[it]] + 'Warp.nii.gz',
+                                                 '-o', file_src_moco,
+                                                 '-x', param.interp,
+                                                 '-v', '0'])
+                    store(fT[it], Image(file_src_moco, mmap=False).data)
+                    _remove_files([file_src, file_src_moco])
+                else:
+                    # exit program if no transformation exists.
+                    printv('\nERROR in ' + os.path.basename(__file__) + ': No good transformation exist. Exit program.\n', verbose, 'error')
+                    sys.exit(2)
+
+    # Save motion-corrected data
+    im_out = None
+    if todo != 'estimate':
+        im_out = Image(data_moco, hdr=im_data.hdr)
+        im_out.absolutepath = add_suffix(file_data, suffix)
         im_out.save(verbose=0)
 
     return file_mat, im_out
 
 
+def _init_moco_worker(n_jobs, file_data):
+    """
+    Initializer of the processes of the pool: load the input data (memory-mapped if it is an uncompressed .nii file,
+    otherwise each process holds a copy in memory), and share the cores between the processes for ITK programs. A
+    number of ITK threads already set by the user (or by `sct_run_batch -itk-threads`) is only ever lowered.
+    """
+    global _moco_worker_data
+    _moco_worker_data = Image(file_data).data
+    n_threads = max(1, multiprocessing.cpu_count() // n_jobs)
+    if os.environ.get("ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"):
+        n_threads = min(int(os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"]), n_threads)
+    os.environ["ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"] = str(n_threads)
+
+
+def _register_task(param, hdr, task):
+    """Worker function: call register_volume() on the data of the pool with the arguments of a task."""
+    return register_volume(param, _moco_worker_data, hdr, *task)
+
+
+def _save_volume(data, hdr, iz, it, file_out, is_sagittal):
+    """Save the volume `it` (of the sagittal slice `iz` if `is_sagittal`) of 4D data, and return its file name."""
+    data_zt = data[:, :, iz:iz + 1, it] if is_sagittal else data[:, :, :, it]
+    Image(np.asarray(data_zt), hdr=hdr).save(file_out, mutable=True, verbose=0)
+    return file_out
+
+
+def _remove_files(fnames):
+    for fname in fnames:
+        if os.path.isfile(fname):
+            os.remove(fname)
+
+
+def register_volume(param, data, hdr, iz, it, file_src, file_dest, file_mat, im_mask=None):
+    """
+    Register one volume of 4D data held in memory. The volume only goes through the disk (as `file_src`) for the
+    duration of the registration; only the transformation `file_mat` is kept.
+
+    :param param: ParamMoco class
+    :param data: 4D ndarray (may be a memory map)
+    :param hdr: Header of the volumes
+    :param iz: Index of the sagittal slice (ignored for axial data)
+    :param it: Index of the volume
+    :param file_src: Temporary file name for the volume
+    :param file_dest: Target image
+    :param file_mat: Output transformation (without suffix)
+    :param im_mask: Image of mask, could be 2D or 3D
+    :return: failed_transfo, motion-corrected volume (None if the registration failed)
+    """
+    file_src = _save_volume(data, hdr, iz, it, file_src, param.is_sagittal)
+    file_src_moco = add_suffix(file_src, '_moco')
+    file_reg = file_src
+    if im_mask is not None:
+        file_reg, im_mask = apply_mask_if_soft(file_src, im_mask)
+    failed_transfo = register(param, file_reg, file_dest, file_mat, file_src_moco, im_mask=im_mask)
+    data_moco = None if failed_transfo else Image(file_src_moco, mmap=False).data
+    _remove_files({file_src, file_reg, file_src_moco})
+    return failed_transfo, data_moco
+
+
 def register(param, file_src, file_dest, file_mat, file_out, im_mask=None):
     """
     Register two images by estimating slice-wise Tx and Ty transformations, which are regularized along Z. This function
@@ -7,6 +7,8 @@ License: see the file LICENSE
 
 import math
 import platform
+import multiprocessing
+from multiprocessing import shared_memory
 import numpy as np
 from skimage import measure, transform
 import logging
@@ -15,14 +17,15 @@ from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.aggregate_slicewise import Metric
 from spinalcordtoolbox.centerline.core import get_centerline
 from spinalcordtoolbox.resampling import resample_nib
-from spinalcordtoolbox.utils import sct_progress_bar
+from spinalcordtoolbox.utils import sct_progress_bar, get_n_jobs
 
 # NB: We use a threshold to check if an array is empty, instead of checking if it's exactly 0. This is because
 # resampling can change 0 -> ~0 (e.g. 1e-16). See: https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues/3402
 NEAR_ZERO_THRESHOLD = 1e-6
 
 
-def compute_shape(segmentation, angle_correction=True, param_centerline=None, verbose=1, remove_temp_files=1):
+def compute_shape(segmentation, angle_correction=True, param_centerline=None, verbose=1, remove_temp_files=1,
+                  method='regionprops', jobs=1):
     """
     Compute morphometric measures of the spinal cord in the transverse (axial) plane from the segmentation.
     The segmentation could be binary or weighted for partial volume [0,1].
@@ -32,6 +35,15 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
     :param param_centerline: see centerline.core.ParamCenterline()
     :param verbose:
     :param remove_temp_files: int: Whether to remove temporary files. 0 = no, 1 = yes.
+    :param method: {'regionprops', 'moments'}: How to compute the shape properties.
+        - 'regionprops': Each slice is warped to correct for the centerline angle, upsampled, then analyzed using
+          skimage.measure.regionprops.
+        - 'moments': Area, diameters, eccentricity and orientation are computed for all slices at once from the
+          moments of the weighted mask, and the angle correction is applied analytically to the moments. Only the
+          solidity is computed slice by slice. Much faster on long segmentations, with results that agree with
+          'regionprops' within a few percent.
+    :param jobs: int: Number of processes used to compute the shape properties, slices being distributed across
+        processes. 0 or a negative integer means the number of available cores minus that number.
     :return metrics: Dict of class Metric(). If a metric cannot be calculated, its value will be nan.
     :return fit_results: class centerline.core.FitResults()
     """
@@ -73,64 +85,33 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
         _, arr_ctl, arr_ctl_der, fit_results = get_centerline(im_segr, param=param_centerline, verbose=verbose,
                                                               remove_temp_files=remove_temp_files)
 
-    # Loop across z and compute shape analysis
-    for iz in sct_progress_bar(range(min_z_index, max_z_index + 1), unit='iter', unit_scale=False, desc="Compute shape analysis",
-                               ncols=80):
-        # Extract 2D patch
-        current_patch = im_segr.data[:, :, iz]
-        if angle_correction:
-            # Extract tangent vector to the centerline (i.e. its derivative)
-            tangent_vect = np.array([arr_ctl_der[0][iz - min_z_index] * px,
-                                     arr_ctl_der[1][iz - min_z_index] * py,
-                                     pz])
-            # Normalize vector by its L2 norm
-            tangent_vect = tangent_vect / np.linalg.norm(tangent_vect)
-            # Compute the angle about AP axis between the centerline and the normal vector to the slice
-            v0 = [tangent_vect[0], tangent_vect[2]]
-            v1 = [0, 1]
-            angle_AP_rad = np.math.atan2(np.linalg.det([v0, v1]), np.dot(v0, v1))
-            # Compute the angle about RL axis between the centerline and the normal vector to the slice
-            v0 = [tangent_vect[1], tangent_vect[2]]
-            v1 = [0, 1]
-            angle_RL_rad = np.math.atan2(np.linalg.det([v0, v1]), np.dot(v0, v1))
-            # Apply affine transformation to account for the angle between the centerline and the normal to the patch
-            tform = transform.AffineTransform(scale=(np.cos(angle_RL_rad), np.cos(angle_AP_rad)))
-            # Convert to float64, to avoid problems in image indexation causing issues when applying transform.warp
-            current_patch = current_patch.astype(np.float64)
-            # TODO: make sure pattern does not go extend outside of image border
-            current_patch_scaled = transform.warp(current_patch,
-                                                  tform.inverse,
-                                                  output_shape=current_patch.shape,
-                                                  order=1,
-                                                  )
-        else:
-            current_patch_scaled = current_patch
-            angle_AP_rad, angle_RL_rad = 0.0, 0.0
-        # compute shape properties on 2D patch
-        shape_property = _properties2d(current_patch_scaled, [px, py])
-        if shape_property is not None:
-            # Add custom fields
-            shape_property['angle_AP'] = angle_AP_rad * 180.0 / math.pi
-            shape_property['angle_RL'] = angle_RL_rad * 180.0 / math.pi
-            shape_property['length'] = pz / (np.cos(angle_AP_rad) * np.cos(angle_RL_rad))
-            # Loop across properties and assign values for function output
-            for property_name in property_list:
-                shape_properties[property_name][iz] = shape_property[property_name]
-        else:
-            logging.warning('\nNo properties for slice: {}'.format(iz))
-
-        """ DEBUG
-        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-        from matplotlib.figure import Figure
-        fig = Figure()
-        FigureCanvas(fig)
-        ax = fig.add_subplot(111)
-        ax.imshow(current_patch_scaled)
-        ax.grid()
-        ax.set_xlabel('y')
-        ax.set_ylabel('x')
-        fig.savefig('tmp_fig.png')
-        """
+    if method not in ['regionprops', 'moments']:
+        raise ValueError(f"Invalid method: '{method}'. Valid methods are: 'regionprops', 'moments'")
+
+    z_range = np.arange(min_z_index, max_z_index + 1)
+    if angle_correction:
+        # Extract tangent vector to the centerline (i.e. its derivative), and compute the angles about the AP and RL
+        # axes between the centerline and the normal vector to the slice
+        angle_AP_rad = np.arctan2(arr_ctl_der[0][z_range - min_z_index] * px, pz)
+        angle_RL_rad = np.arctan2(arr_ctl_der[1][z_range - min_z_index] * py, pz)
+    else:
+        angle_AP_rad, angle_RL_rad = np.zeros(len(z_range)), np.zeros(len(z_range))
+
+    n_jobs = get_n_jobs(jobs)
+    if n_jobs == 1:
+        shape_property = _compute_shape_slab(im_segr.data[:, :, min_z_index:max_z_index + 1], [px, py, pz],
+                                             angle_AP_rad, angle_RL_rad, angle_correction, method, progress=True)
+    else:
+        shape_property = _compute_shape_parallel(im_segr.data[:, :, min_z_index:max_z_index + 1], [px, py, pz],
+                                                 angle_AP_rad, angle_RL_rad, angle_correction, method, n_jobs)
+
+    # Assign values for function output
+    is_empty = np.isnan(shape_property['area'])
+    for iz in z_range[is_empty]:
+        logging.warning('\nNo properties for slice: {}'.format(iz))
+    for property_name in property_list:
+        shape_properties[property_name][z_range[~is_empty]] = shape_property[property_name][~is_empty]
+
     metrics = {}
     for key, value in shape_properties.items():
         # Making sure all entries added to metrics have results
@@ -141,6 +122,112 @@ def compute_shape(segmentation, angle_correction=True, param_centerline=None, ve
     return metrics, fit_results
 
 
+def _compute_shape_slab(data, dim, angle_AP_rad, angle_RL_rad, angle_correction, method, progress=False):
+    """
+    Compute the shape properties of a slab of consecutive axial slices.
+
+    :param data: 3D array (x, y, z) of the resampled segmentation.
+    :param dim: [px, py, pz]: Physical dimension of the image (in mm).
+    :param angle_AP_rad: 1D array: angle about the AP axis between the centerline and the normal to each slice.
+    :param angle_RL_rad: 1D array: angle about the RL axis between the centerline and the normal to each slice.
+    :param angle_correction: bool: whether to correct the slices for the centerline angle.
+    :param method: {'regionprops', 'moments'}: see `compute_shape`.
+    :param progress: bool: whether to display a progress bar.
+    :return: Dict of 1D arrays, with one value per slice. Empty slices are set to nan.
+    """
+    px, py, pz = dim
+    nz = data.shape[2]
+    if method == 'moments':
+        shape_properties = _properties2d_moments(data, [px, py], scale=(np.cos(angle_AP_rad), np.cos(angle_RL_rad)))
+    else:
+        shape_properties = {key: np.full(nz, np.nan) for key in ['area', 'diameter_AP', 'diameter_RL',
+                                                                 'eccentricity', 'orientation', 'solidity']}
+        # Loop across z and compute shape analysis
+        for iz in sct_progress_bar(range(nz), unit='iter', unit_scale=False, desc="Compute shape analysis",
+                                   ncols=80, disable=not progress):
+            # Extract 2D patch
+            current_patch = data[:, :, iz]
+            if angle_correction:
+                # Apply affine transformation to account for the angle between the centerline and the normal to the patch
+                tform = transform.AffineTransform(scale=(np.cos(angle_RL_rad[iz]), np.cos(angle_AP_rad[iz])))
+                # Convert to float64, to avoid problems in image indexation causing issues when applying transform.warp
+                current_patch = current_patch.astype(np.float64)
+                # TODO: make sure pattern does not go extend outside of image border
+                current_patch_scaled = transform.warp(current_patch,
+                                                      tform.inverse,
+                                                      output_shape=current_patch.shape,
+                                                      order=1,
+                                                      )
+            else:
+                current_patch_scaled = current_patch
+            # compute shape properties on 2D patch
+            shape_property = _properties2d(current_patch_scaled, [px, py])
+            if shape_property is not None:
+                for property_name in shape_properties:
+                    shape_properties[property_name][iz] = shape_property[property_name]
+
+            """ DEBUG
+            from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+            from matplotlib.figure import Figure
+            fig = Figure()
+            FigureCanvas(fig)
+            ax = fig.add_subplot(111)
+            ax.imshow(current_patch_scaled)
+            ax.grid()
+            ax.set_xlabel('y')
+            ax.set_ylabel('x')
+            fig.savefig('tmp_fig.png')
+            """
+    # Add custom fields
+    shape_properties['angle_AP'] = angle_AP_rad * 180.0 / math.pi
+    shape_properties['angle_RL'] = angle_RL_rad * 180.0 / math.pi
+    shape_properties['length'] = pz / (np.cos(angle_AP_rad) * np.cos(angle_RL_rad))
+    return shape_properties
+
+
+# Resampled segmentation shared with the worker processes of `_compute_shape_parallel`
+_shared_data = None
+
+
+def _init_shared_data(shm_name, shape, dtype):
+    """Attach a worker process to the shared memory block containing the resampled segmentation."""
+    global _shared_data
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # Keep a reference to `shm`, otherwise the buffer is released when it is garbage collected
+    _shared_data = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _compute_shape_shared_slab(task):
+    """Worker function: compute the shape properties of slices [z_start, z_end) of the shared segmentation."""
+    z_start, z_end, dim, angle_AP_rad, angle_RL_rad, angle_correction, method = task
+    return _compute_shape_slab(_shared_data[1][:, :, z_start:z_end], dim, angle_AP_rad, angle_RL_rad,
+                               angle_correction, method)
+
+
+def _compute_shape_parallel(data, dim, angle_AP_rad, angle_RL_rad, angle_correction, method, n_jobs):
+    """
+    Same as `_compute_shape_slab`, but distributes ranges of slices across a pool of `n_jobs` processes. The
+    segmentation is copied once into shared memory, instead of being pickled for each worker.
+    """
+    nz = data.shape[2]
+    # Use several ranges per process, to balance the load between processes
+    bounds = np.linspace(0, nz, min(nz, 4 * n_jobs) + 1).astype(int)
+    ranges = [(z_start, z_end) for z_start, z_end in zip(bounds[:-1], bounds[1:])]
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+        with multiprocessing.Pool(n_jobs, initializer=_init_shared_data,
+                                  initargs=(shm.name, data.shape, data.dtype)) as pool:
+            tasks = [(z_start, z_end, dim, angle_AP_rad[z_start:z_end], angle_RL_rad[z_start:z_end],
+                      angle_correction, method) for z_start, z_end in ranges]
+            results = list(sct_progress_bar(pool.imap(_compute_shape_shared_slab, tasks), total=len(tasks),
+                                            unit='chunk', desc="Compute shape analysis", ncols=80))
+    finally:
+        shm.close()
+        shm.unlink()
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+
 def _properties2d(image, dim):
     """
     Compute shape property of the input 2D image. Accounts for partial volume information.
@@ -207,6 +294,95 @@ def _properties2d(image, dim):
     return properties
 
 
+def _properties2d_moments(data, dim, scale=None):
+    """
+    Compute the shape properties of a stack of 2D slices at once, using the (partial volume) weighted moments of each
+    slice instead of skimage.measure.regionprops. Accounts for partial volume information.
+
+    The angle correction is applied analytically: scaling the slice coordinates by (sx, sy) scales the area by sx*sy,
+    and the second-order central moments by sx^2, sy^2 and sx*sy. Because solidity is invariant to such scalings, it is
+    computed slice by slice on the (unscaled) input, using the same upsampling as `_properties2d`.
+
+    Slices with several objects are measured as a single object, as in `_properties2d`: measure.regionprops is given the
+    binary mask, in which all objects share the same label, so its "more than one object" check never rejects a slice.
+
+    :param data: 3D array (x, y, z) of 2D slices in uint8 or float (weighted for partial volume).
+    :param dim: [px, py]: Physical dimension of the image (in mm). X,Y respectively correspond to AP,RL.
+    :param scale: (sx, sy): Scaling factors along x and y (scalars, or 1D arrays with one value per slice).
+    :return: Dict of 1D arrays, with one value per slice. Empty slices are set to nan.
+    """
+    nx, ny, nz = data.shape
+    sx, sy = (np.ones(nz), np.ones(nz)) if scale is None else (np.broadcast_to(s, nz) for s in scale)
+    data = data.astype(np.float64)
+    property_list = ['area', 'diameter_AP', 'diameter_RL', 'eccentricity', 'orientation', 'solidity']
+    properties = {key: np.full(nz, np.nan) for key in property_list}
+    # Check which slices are empty
+    is_slice = ~np.all(data < NEAR_ZERO_THRESHOLD, axis=(0, 1))
+    if not np.any(is_slice):
+        return properties
+    data, sx, sy = data[:, :, is_slice], sx[is_slice], sy[is_slice]
+    # Normalize each slice between 0 and 1
+    data_min, data_max = data.min(axis=(0, 1)), data.max(axis=(0, 1))
+    data_norm = (data - data_min) / (data_max - data_min)
+    # Raw and central moments of each slice (in pixel units)
+    x, y = np.arange(nx, dtype=np.float64), np.arange(ny, dtype=np.float64)
+    m00 = data_norm.sum(axis=(0, 1))
+    cx = np.einsum('xyz,x->z', data_norm, x) / m00
+    cy = np.einsum('xyz,y->z', data_norm, y) / m00
+    # Each pixel spreads its weight uniformly over its area, which adds a variance of 1/12 along each axis
+    var_x = np.einsum('xyz,x->z', data_norm, x ** 2) / m00 - cx ** 2 + 1 / 12
+    var_y = np.einsum('xyz,y->z', data_norm, y ** 2) / m00 - cy ** 2 + 1 / 12
+    cov_xy = np.einsum('xyz,x,y->z', data_norm, x, y) / m00 - cx * cy
+    # Apply the angle correction
+    var_x, var_y, cov_xy = var_x * sx ** 2, var_y * sy ** 2, cov_xy * sx * sy
+    # Inertia tensor [[a, b], [b, c]], with the same conventions as skimage.measure.regionprops
+    a, b, c = var_y, -cov_xy, var_x
+    delta = np.sqrt(((a - c) / 2) ** 2 + b ** 2)
+    eigval_major, eigval_minor = (a + c) / 2 + delta, np.maximum((a + c) / 2 - delta, 0)
+    major_axis_length, minor_axis_length = 4 * np.sqrt(eigval_major), 4 * np.sqrt(eigval_minor)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eccentricity = np.where(eigval_major == 0, 0, np.sqrt(1 - eigval_minor / eigval_major))
+    orientation_rad = np.where(a - c == 0, np.where(b < 0, -math.pi / 4, math.pi / 4),
+                               0.5 * np.arctan2(-2 * b, c - a))
+    # Compute ellipse orientation, modulo pi, in deg, and between [0, 90]
+    orientation = np.array([fix_orientation(o) for o in orientation_rad])
+    # Find RL and AP diameter based on major/minor axes and cord orientation
+    diameter_AP = np.where(orientation < 45.0, minor_axis_length, major_axis_length) * dim[0]
+    diameter_RL = np.where(orientation < 45.0, major_axis_length, minor_axis_length) * dim[1]
+    # Deal with https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues/2307
+    if any(x in platform.platform() for x in ['Darwin-15', 'Darwin-16']):
+        solidity = np.full(len(m00), np.nan)
+    else:
+        solidity = np.array([_solidity2d(data_norm[:, :, iz]) for iz in range(data_norm.shape[2])])
+
+    properties['area'][is_slice] = m00 * sx * sy * dim[0] * dim[1]
+    properties['diameter_AP'][is_slice] = diameter_AP
+    properties['diameter_RL'][is_slice] = diameter_RL
+    properties['eccentricity'][is_slice] = eccentricity
+    properties['orientation'][is_slice] = orientation
+    properties['solidity'][is_slice] = solidity
+    return properties
+
+
+def _solidity2d(image_norm):
+    """
+    Compute the solidity of a normalized 2D image, after the same cropping and upsampling as in `_properties2d`.
+    :param image_norm: 2D input image, normalized between 0 and 1.
+    """
+    upscale = 5  # upscale factor for resampling the input image (for better precision)
+    pad = 3  # padding used for cropping
+    x_nonzero, y_nonzero = np.nonzero(image_norm > 0.5)
+    if not len(x_nonzero):
+        return np.nan
+    image_crop = image_norm[max(x_nonzero.min() - pad, 0): x_nonzero.max() + 1 + pad,
+                            max(y_nonzero.min() - pad, 0): y_nonzero.max() + 1 + pad]
+    # Oversample image to reach sufficient precision when computing shape metrics on the binary mask
+    image_crop_r = transform.pyramid_expand(image_crop, upscale=upscale, sigma=None, order=1)
+    image_crop_r_bin = np.array(image_crop_r > 0.5, dtype='uint8')
+    regions = measure.regionprops(image_crop_r_bin)
+    return regions[0].solidity if regions else np.nan
+
+
 def fix_orientation(orientation):
     """Re-map orientation from skimage.regionprops from [-pi/2,pi/2] to [0,90] and rotate by 90deg because image axis
     are inverted"""
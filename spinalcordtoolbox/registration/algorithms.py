@@ -8,6 +8,8 @@ License: see the file LICENSE
 import logging
 import os  # FIXME
 import shutil
+import functools
+import multiprocessing
 import psutil
 from math import asin, cos, sin, acos
 
@@ -25,7 +27,7 @@ from spinalcordtoolbox.math import laplacian
 from spinalcordtoolbox.registration.landmarks import register_landmarks
 from spinalcordtoolbox.registration import core
 from spinalcordtoolbox.scripts import sct_resample
-from spinalcordtoolbox.utils import sct_progress_bar, copy_helper, run_proc, tmp_create, sct_dir_local_path
+from spinalcordtoolbox.utils import sct_progress_bar, copy_helper, run_proc, tmp_create, sct_dir_local_path, get_n_jobs
 
 from spinalcordtoolbox.scripts import sct_image
 
@@ -45,7 +47,7 @@ class Paramreg(object):
     def __init__(self, step=None, type=None, algo='syn', metric='MeanSquares', samplingStrategy='None',
                  samplingPercentage='0.2', iter='10', shrink='1', smooth='0', gradStep='0.5', deformation='1x1x0',
                  init='', filter_size=5, poly='5', slicewise='0', laplacian='0', dof='Tx_Ty_Tz_Rx_Ry_Rz',
-                 smoothWarpXY='2', pca_eigenratio_th='1.6', rot_method='pca'):
+                 smoothWarpXY='2', pca_eigenratio_th='1.6', rot_method='pca', jobs='1'):
         """
         Class to define registration method.
 
@@ -72,6 +74,8 @@ class Paramreg(object):
             pca: approximate cord segmentation by an ellipse and finds it orientation using PCA's
             eigenvectors; hog: finds the orientation using the symmetry of the image; pcahog: tries method pca and if it
             fails, uses method hog. If using hog or pcahog, type should be set to 'imseg'."
+        :param jobs: Number of processes used by algo=centermass, centermassrot and columnwise, slices being distributed
+            across processes. 0 or a negative number means the number of available cores minus that number.
         """
         self.step = step
         self.type = type
@@ -93,6 +97,7 @@ class Paramreg(object):
         self.smoothWarpXY = smoothWarpXY  # only for algo=columnwise
         self.pca_eigenratio_th = pca_eigenratio_th  # only for algo=centermassrot
         self.rot_method = rot_method  # only for algo=centermassrot
+        self.jobs = jobs  # only for algo=centermass, centermassrot and columnwise
         self.rot_src = None  # this variable is used to set the angle of the cord on the src image if it is known
         self.rot_dest = None  # same as above for the destination image (e.g., if template, should be set to 0)
 
@@ -613,7 +618,7 @@ def register_slicewise(fname_src, fname_dest, paramreg=None, fname_mask='', warp
         register2d_centermassrot(
             src_input, dest_input, paramreg=paramreg, fname_warp=warp_forward_out, fname_warp_inv=warp_inverse_out,
             rot_method=rot_method, filter_size=paramreg.filter_size, path_qc=path_qc, verbose=verbose,
-            pca_eigenratio_th=float(paramreg.pca_eigenratio_th), )
+            pca_eigenratio_th=float(paramreg.pca_eigenratio_th), jobs=int(paramreg.jobs))
 
     elif paramreg.algo == 'columnwise':
         # scaling R-L, then column-wise center of mass alignment and scaling
@@ -624,6 +629,7 @@ def register_slicewise(fname_src, fname_dest, paramreg=None, fname_mask='', warp
                               verbose=verbose,
                               path_qc=path_qc,
                               smoothWarpXY=int(paramreg.smoothWarpXY),
+                              jobs=int(paramreg.jobs),
                               )
 
     # ANTs registration
@@ -656,11 +662,11 @@ def register_slicewise(fname_src, fname_dest, paramreg=None, fname_mask='', warp
 
 def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='warp_forward.nii.gz',
                              fname_warp_inv='warp_inverse.nii.gz', rot_method='pca', filter_size=0, path_qc='.',
-                             verbose=1, pca_eigenratio_th=1.6, th_max_angle=40):
+                             verbose=1, pca_eigenratio_th=1.6, th_max_angle=40, jobs=1):
     """
     Rotate the source image to match the orientation of the destination image, using the first and second eigenvector
     of the PCA. This function should be used on segmentations (not images).
-    This works for 2D and 3D images.  If 3D, it splits the image and performs the rotation slice-by-slice.
+    This works for 2D and 3D images.  If 3D, it performs the rotation slice-by-slice.
 
     :param fname_src: List: Name of moving image. If rot=0 or 1, only the first element is used (should be a
         segmentation). If rot=2 or 3, the first element is a segmentation and the second is an image.
@@ -679,143 +685,51 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
         for the PCA rotation detection method. If below this threshold, the estimation will be discarded (poorly robust)
     :param th_max_angle: threshold of the absolute value of the estimated rotation using the PCA method, above
         which the estimation will be discarded (unlikely to happen genuinely and hence considered outlier)
+    :param jobs: int: Number of processes used to estimate the rotations, slices being distributed across processes.
+        0 or a negative number means the number of available cores minus that number.
     :return:
     """
-    # TODO: no need to split the src or dest if it is the template (we know its centerline and orientation already)
+    # TODO: no need to process the src or dest if it is the template (we know its centerline and orientation already)
 
     if verbose == 2:
         import matplotlib.pyplot as plt
 
     # Get image dimensions and retrieve nz
     logger.info("\nGet image dimensions of destination image...")
-    nx, ny, nz, nt, px, py, pz, pt = image.Image(fname_dest[0]).dim
+    im_dest = image.Image(fname_dest[0])
+    nx, ny, nz, nt, px, py, pz, pt = im_dest.dim
 
     logger.info(f"  matrix size: {str(nx)} x {str(ny)} x {str(nz)}")
     logger.info(f"  voxel size: {str(px)}mm x {str(py)}mm x {str(nz)}mm")
 
-    # Split source volume along z
-    logger.info("\nSplit input segmentation...")
     im_src = image.Image(fname_src[0])
-    split_source_list = image.split_img_data(im_src, 2)
-    for im in split_source_list:
-        im.save()
-
-    # Split destination volume along z
-    logger.info("\nSplit destination segmentation...")
-    im_dest = image.Image(fname_dest[0])
-    split_dest_list = image.split_img_data(im_dest, 2)
-    for im in split_dest_list:
-        im.save()
-
-    data_src = im_src.data
-    data_dest = im_dest.data
-
     # if input data is 2D, reshape into pseudo 3D (only one slice)
-    if len(data_src.shape) == 2:
-        new_shape = list(data_src.shape)
-        new_shape.append(1)
-        new_shape = tuple(new_shape)
-        data_src = data_src.reshape(new_shape)
-        data_dest = data_dest.reshape(new_shape)
+    data_src = _as_3d(im_src.data)
+    data_dest = _as_3d(im_dest.data)
 
     # Deal with cases where both an image and segmentation are input
     if len(fname_src) > 1:
-        # Split source volume along z
-        logger.info("\nSplit input image...")
-        im_src_im = image.Image(fname_src[1])
-        split_source_list = image.split_img_data(im_src_im, 2)
-        for im in split_source_list:
-            im.save()
-
-        # Split destination volume along z
-        logger.info("\nSplit destination image...")
-        im_dest_im = image.Image(fname_dest[1])
-        split_dest_list = image.split_img_data(im_dest_im, 2)
-        for im in split_dest_list:
-            im.save()
-
-        data_src_im = im_src_im.data
-        data_dest_im = im_dest_im.data
-
-    # initialize displacement and rotation
-    coord_src = [None] * nz
-    pca_src = [None] * nz
-    coord_dest = [None] * nz
-    pca_dest = [None] * nz
-    centermass_src = np.zeros([nz, 2])
-    centermass_dest = np.zeros([nz, 2])
-    # displacement_forward = np.zeros([nz, 2])
-    # displacement_inverse = np.zeros([nz, 2])
-    angle_src_dest = np.zeros(nz)
-    z_nonzero = []
-    th_max_angle *= np.pi / 180
+        data_src_im = _as_3d(image.Image(fname_src[1]).data)
+        data_dest_im = _as_3d(image.Image(fname_dest[1]).data)
+    else:
+        data_src_im = data_dest_im = None
 
-    # Loop across slices
+    # Estimate the center of mass and cord angle of all slices at once, the slices being split into ranges of slices
+    # (slabs) when they are distributed across processes
     print()  # Add newline between last log message and the progress bar logging
-    for iz in sct_progress_bar(range(0, nz), unit='iter', unit_scale=False, desc="Estimate cord angle for each slice",
-                               ncols=100):
-        try:
-            # compute PCA and get center or mass based on segmentation
-            coord_src[iz], pca_src[iz], centermass_src[iz, :] = compute_pca(data_src[:, :, iz])
-            coord_dest[iz], pca_dest[iz], centermass_dest[iz, :] = compute_pca(data_dest[:, :, iz])
-
-            # detect rotation using the HOG method
-            if rot_method in ['hog', 'pcahog']:
-                angle_src_hog, conf_score_src = find_angle_hog(data_src_im[:, :, iz], centermass_src[iz, :],
-                                                               px, py, angle_range=th_max_angle)
-                angle_dest_hog, conf_score_dest = find_angle_hog(data_dest_im[:, :, iz], centermass_dest[iz, :],
-                                                                 px, py, angle_range=th_max_angle)
-                # In case no maxima is found (it should never happen)
-                if (angle_src_hog is None) or (angle_dest_hog is None):
-                    logger.warning(f"Slice #{str(iz)} not angle found in dest or src. It will be ignored.")
-                    continue
-                if rot_method == 'hog':
-                    angle_src = -angle_src_hog  # flip sign to be consistent with PCA output
-                    angle_dest = angle_dest_hog
-
-            # Detect rotation using the PCA or PCA-HOG method
-            if rot_method in ['pca', 'pcahog']:
-                eigenv_src = pca_src[iz].components_.T[0][0], pca_src[iz].components_.T[1][0]
-                eigenv_dest = pca_dest[iz].components_.T[0][0], pca_dest[iz].components_.T[1][0]
-                # Make sure first element is always positive (to prevent sign flipping)
-                if eigenv_src[0] <= 0:
-                    eigenv_src = tuple([i * (-1) for i in eigenv_src])
-                if eigenv_dest[0] <= 0:
-                    eigenv_dest = tuple([i * (-1) for i in eigenv_dest])
-                angle_src = angle_between(eigenv_src, [1, 0])
-                angle_dest = angle_between([1, 0], eigenv_dest)
-                # compute ratio between axis of PCA
-                pca_eigenratio_src = pca_src[iz].explained_variance_ratio_[0] / pca_src[iz].explained_variance_ratio_[1]
-                pca_eigenratio_dest = pca_dest[iz].explained_variance_ratio_[0] / pca_dest[iz].explained_variance_ratio_[1]
-                # angle is set to 0 if either ratio between axis is too low or outside angle range
-                if pca_eigenratio_src < pca_eigenratio_th or angle_src > th_max_angle or angle_src < -th_max_angle:
-                    if rot_method == 'pca':
-                        angle_src = 0
-                    elif rot_method == 'pcahog':
-                        logger.info("Switched to method 'hog' for slice: {}".format(iz))
-                        angle_src = -angle_src_hog  # flip sign to be consistent with PCA output
-                if pca_eigenratio_dest < pca_eigenratio_th or angle_dest > th_max_angle or angle_dest < -th_max_angle:
-                    if rot_method == 'pca':
-                        angle_dest = 0
-                    elif rot_method == 'pcahog':
-                        logger.info("Switched to method 'hog' for slice: {}".format(iz))
-                        angle_dest = angle_dest_hog
-
-            if not rot_method == 'none':
-                # bypass estimation is source or destination angle is known a priori
-                if paramreg.rot_src is not None:
-                    angle_src = paramreg.rot_src
-                if paramreg.rot_dest is not None:
-                    angle_dest = paramreg.rot_dest
-                # the angle between (src, dest) is the angle between (src, origin) + angle between (origin, dest)
-                angle_src_dest[iz] = angle_src + angle_dest
-
-            # append to list of z_nonzero
-            z_nonzero.append(iz)
-
-        # if one of the slice is empty, ignore it
-        except ValueError:
-            logger.warning(f"Slice #{str(iz)} is empty. It will be ignored.")
+    estimate = functools.partial(
+        _estimate_slab_rotation, rot_method=rot_method, px=px, py=py, th_max_angle=th_max_angle * np.pi / 180,
+        pca_eigenratio_th=pca_eigenratio_th, rot_src=None if paramreg is None else paramreg.rot_src,
+        rot_dest=None if paramreg is None else paramreg.rot_dest)
+    n_jobs = get_n_jobs(jobs)
+    bounds = np.linspace(0, nz, (1 if n_jobs == 1 else min(nz, 4 * n_jobs)) + 1).astype(int)
+    tasks = [(z_start, data_src[:, :, z_start:z_end], data_dest[:, :, z_start:z_end],
+              None if data_src_im is None else data_src_im[:, :, z_start:z_end],
+              None if data_dest_im is None else data_dest_im[:, :, z_start:z_end])
+             for z_start, z_end in zip(bounds[:-1], bounds[1:])]
+    results = _map_slices(estimate, tasks, jobs, desc="Estimate cord angle for each slab of slices")
+    centermass_src, centermass_dest, angle_src_dest, valid = (np.concatenate(arrays) for arrays in zip(*results))
+    z_nonzero = list(np.flatnonzero(valid))
 
     # regularize rotation
     if not filter_size == 0 and (rot_method in ['pca', 'hog', 'pcahog']):
@@ -833,16 +747,16 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
         # update variable
         angle_src_dest[z_nonzero] = angle_src_dest_regularized
 
-    warp_x = np.zeros(data_dest.shape)
-    warp_y = np.zeros(data_dest.shape)
-    warp_inv_x = np.zeros(data_src.shape)
-    warp_inv_y = np.zeros(data_src.shape)
+    # ITK warping fields, filled slice by slice
+    data_warp = np.zeros(data_dest.shape + (1, 3))
+    data_warp_inv = np.zeros(data_src.shape + (1, 3))
+
+    # get indices of x and y coordinates
+    row, col = np.indices((nx, ny))
 
     # construct 3D warping matrix
     for iz in sct_progress_bar(z_nonzero, unit='iter', unit_scale=False, desc="Build 3D deformation field",
                                ncols=100):
-        # get indices of x and y coordinates
-        row, col = np.indices((nx, ny))
         # build 2xn array of coordinates in pixel space
         coord_init_pix = np.array([row.ravel(), col.ravel(), np.array(np.ones(len(row.ravel())) * iz)]).T
         # convert coordinates to physical space
@@ -861,9 +775,11 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
         coord_inverse_phy = np.array(np.dot((coord_init_phy - np.transpose(centermass_src_phy)), R3d.T) + np.transpose(centermass_dest_phy))
         # display rotations
         if verbose == 2 and not angle_src_dest[iz] == 0 and not rot_method == 'hog':
+            coord_src, pca_src, _ = compute_pca(data_src[:, :, iz])
+            coord_dest, pca_dest, _ = compute_pca(data_dest[:, :, iz])
             # compute new coordinates
-            coord_src_rot = coord_src[iz] * R
-            coord_dest_rot = coord_dest[iz] * R.T
+            coord_src_rot = coord_src * R
+            coord_dest_rot = coord_dest * R.T
             # generate figure
             plt.figure(figsize=(9, 9))
             # plt.ion()  # enables interactive mode (allows keyboard interruption)
@@ -872,10 +788,10 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
                 plt.subplot(isub)
                 # ax = matplotlib.pyplot.axis()
                 if isub == 221:
-                    plt.scatter(coord_src[iz][:, 0], coord_src[iz][:, 1], s=5, marker='o', zorder=10, color='steelblue',
+                    plt.scatter(coord_src[:, 0], coord_src[:, 1], s=5, marker='o', zorder=10, color='steelblue',
                                 alpha=0.5)
-                    pcaaxis = pca_src[iz].components_.T
-                    pca_eigenratio = pca_src[iz].explained_variance_ratio_
+                    pcaaxis = pca_src.components_.T
+                    pca_eigenratio = pca_src.explained_variance_ratio_
                     plt.title('src')
                 elif isub == 222:
                     plt.scatter(
@@ -883,14 +799,14 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
                         [coord_src_rot[i, 1] for i in range(len(coord_src_rot))],
                         s=5, marker='o', zorder=10, color='steelblue', alpha=0.5,
                     )
-                    pcaaxis = pca_dest[iz].components_.T
-                    pca_eigenratio = pca_dest[iz].explained_variance_ratio_
+                    pcaaxis = pca_dest.components_.T
+                    pca_eigenratio = pca_dest.explained_variance_ratio_
                     plt.title('src_rot')
                 elif isub == 223:
-                    plt.scatter(coord_dest[iz][:, 0], coord_dest[iz][:, 1], s=5, marker='o', zorder=10, color='red',
+                    plt.scatter(coord_dest[:, 0], coord_dest[:, 1], s=5, marker='o', zorder=10, color='red',
                                 alpha=0.5)
-                    pcaaxis = pca_dest[iz].components_.T
-                    pca_eigenratio = pca_dest[iz].explained_variance_ratio_
+                    pcaaxis = pca_dest.components_.T
+                    pca_eigenratio = pca_dest.explained_variance_ratio_
                     plt.title('dest')
                 elif isub == 224:
                     plt.scatter(
@@ -898,8 +814,8 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
                         [coord_dest_rot[i, 1] for i in range(len(coord_dest_rot))],
                         s=5, marker='o', zorder=10, color='red', alpha=0.5,
                     )
-                    pcaaxis = pca_src[iz].components_.T
-                    pca_eigenratio = pca_src[iz].explained_variance_ratio_
+                    pcaaxis = pca_src.components_.T
+                    pca_eigenratio = pca_src.explained_variance_ratio_
                     plt.title('dest_rot')
                 plt.text(-2.5, -2, 'eigenvectors:', horizontalalignment='left', verticalalignment='bottom')
                 plt.text(-2.5, -2.8, str(pcaaxis), horizontalalignment='left', verticalalignment='bottom')
@@ -913,18 +829,96 @@ def register2d_centermassrot(fname_src, fname_dest, paramreg=None, fname_warp='w
             plt.savefig(os.path.join(path_qc, 'register2d_centermassrot_pca_z' + str(iz) + '.png'))
             plt.close()
 
-        # construct 3D warping matrix
-        warp_x[:, :, iz] = np.array([coord_forward_phy[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_y[:, :, iz] = np.array([coord_forward_phy[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_inv_x[:, :, iz] = np.array([coord_inverse_phy[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-        warp_inv_y[:, :, iz] = np.array([coord_inverse_phy[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
+        # construct 3D warping matrix (need to invert due to ITK conventions)
+        data_warp[:, :, iz, 0, :2] = -(coord_forward_phy - coord_init_phy)[:, :2].reshape((nx, ny, 2))
+        data_warp_inv[:, :, iz, 0, :2] = -(coord_inverse_phy - coord_init_phy)[:, :2].reshape((nx, ny, 2))
 
     # Generate forward warping field (defined in destination space)
-    generate_warping_field(fname_dest[0], warp_x, warp_y, fname_warp)
-    generate_warping_field(fname_src[0], warp_inv_x, warp_inv_y, fname_warp_inv)
+    save_warping_field(fname_dest[0], data_warp, fname_warp)
+    save_warping_field(fname_src[0], data_warp_inv, fname_warp_inv)
+
 
+def _estimate_slab_rotation(task, rot_method, px, py, th_max_angle, pca_eigenratio_th, rot_src, rot_dest):
+    """
+    Worker function for `register2d_centermassrot`: estimate the center of mass of each slice of a range of slices of
+    the source and destination segmentations, and the rotation between them.
+
+    :param task: tuple (z_start, src_seg, dest_seg, src_im, dest_im) of the index of the first slice and the 3D arrays
+        of the range of slices. Images are only used with the HOG method.
+    :param th_max_angle: in radians.
+    :return: tuple (centermass_src, centermass_dest, angle_src_dest, valid) of arrays of length nz. Slices that are not
+        `valid` should be ignored.
+    """
+    z_start, src_seg, dest_seg, src_im, dest_im = task
+    nz = src_seg.shape[2]
+    # compute PCA and get center or mass based on segmentation
+    centermass_src, components_src, ratio_src = compute_pca_batch(src_seg)
+    centermass_dest, components_dest, ratio_dest = compute_pca_batch(dest_seg)
+    # if one of the slice is empty, ignore it
+    valid = ~np.isnan(ratio_src[:, 0]) & ~np.isnan(ratio_dest[:, 0])
+    for iz in np.flatnonzero(~valid):
+        logger.warning(f"Slice #{z_start + iz} is empty. It will be ignored.")
 
-def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz', fname_warp_inv='warp_inverse.nii.gz', verbose=1, path_qc='.', smoothWarpXY=1):
+    angle_src_dest = np.zeros(nz)
+    if rot_method == 'none':
+        return centermass_src, centermass_dest, angle_src_dest, valid
+
+    # detect rotation using the HOG method
+    if rot_method in ['hog', 'pcahog']:
+        angle_src_hog, angle_dest_hog = np.zeros(nz), np.zeros(nz)
+        # the range of slices might only contain empty slices
+        if valid.any():
+            angle_src_hog[valid], _ = find_angles_hog(src_im[:, :, valid], centermass_src[valid], px, py,
+                                                      angle_range=th_max_angle)
+            angle_dest_hog[valid], _ = find_angles_hog(dest_im[:, :, valid], centermass_dest[valid], px, py,
+                                                       angle_range=th_max_angle)
+        if rot_method == 'hog':
+            angle_src = -angle_src_hog  # flip sign to be consistent with PCA output
+            angle_dest = angle_dest_hog
+
+    # Detect rotation using the PCA or PCA-HOG method
+    if rot_method in ['pca', 'pcahog']:
+        # first principal axis of each slice, i.e. the eigenvector with the largest eigenvalue
+        eigenv_src = components_src[:, 0, :]
+        eigenv_dest = components_dest[:, 0, :]
+        # Make sure first element is always positive (to prevent sign flipping)
+        eigenv_src = np.where(eigenv_src[:, [0]] <= 0, -eigenv_src, eigenv_src)
+        eigenv_dest = np.where(eigenv_dest[:, [0]] <= 0, -eigenv_dest, eigenv_dest)
+        # same as `angle_between(eigenv_src, [1, 0])` and `angle_between([1, 0], eigenv_dest)`
+        with np.errstate(invalid='ignore'):
+            angle_src = -np.sign(eigenv_src[:, 1]) * np.arccos(
+                np.clip(eigenv_src[:, 0] / np.linalg.norm(eigenv_src, axis=1), -1, 1))
+            angle_dest = np.sign(eigenv_dest[:, 1]) * np.arccos(
+                np.clip(eigenv_dest[:, 0] / np.linalg.norm(eigenv_dest, axis=1), -1, 1))
+        # compute ratio between axis of PCA
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pca_eigenratio_src = ratio_src[:, 0] / ratio_src[:, 1]
+            pca_eigenratio_dest = ratio_dest[:, 0] / ratio_dest[:, 1]
+        # angle is set to 0 if either ratio between axis is too low or outside angle range
+        discard_src = valid & ((pca_eigenratio_src < pca_eigenratio_th) | (np.abs(angle_src) > th_max_angle))
+        discard_dest = valid & ((pca_eigenratio_dest < pca_eigenratio_th) | (np.abs(angle_dest) > th_max_angle))
+        if rot_method == 'pca':
+            angle_src[discard_src] = 0
+            angle_dest[discard_dest] = 0
+        elif rot_method == 'pcahog':
+            for iz in np.flatnonzero(discard_src | discard_dest):
+                logger.info("Switched to method 'hog' for slice: {}".format(z_start + iz))
+            angle_src[discard_src] = -angle_src_hog[discard_src]  # flip sign to be consistent with PCA output
+            angle_dest[discard_dest] = angle_dest_hog[discard_dest]
+
+    # bypass estimation is source or destination angle is known a priori
+    if rot_src is not None:
+        angle_src = np.full(nz, rot_src)
+    if rot_dest is not None:
+        angle_dest = np.full(nz, rot_dest)
+    # the angle between (src, dest) is the angle between (src, origin) + angle between (origin, dest)
+    angle_src_dest[valid] = (angle_src + angle_dest)[valid]
+
+    return centermass_src, centermass_dest, angle_src_dest, valid
+
+
+def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz', fname_warp_inv='warp_inverse.nii.gz',
+                          verbose=1, path_qc='.', smoothWarpXY=1, jobs=1):
     """
     Column-wise non-linear registration of segmentations. Based on an idea from Allan Martin.
     - Assumes src/dest are segmentations (not necessarily binary), and already registered by center of mass
@@ -937,65 +931,43 @@ def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz
     :param fname_warp:
     :param fname_warp_inv:
     :param verbose:
+    :param jobs: int: Number of processes used to estimate the transformations, slices being distributed across
+        processes. 0 or a negative number means the number of available cores minus that number.
     :return:
     """
-
-    # initialization
-    th_nonzero = 0.5  # values below are considered zero
-
-    # for display stuff
-    if verbose == 2:
-        import matplotlib.pyplot as plt
-
     # Get image dimensions and retrieve nz
     logger.info("\nGet image dimensions of destination image...")
-    nx, ny, nz, nt, px, py, pz, pt = image.Image(fname_dest).dim
+    im_dest = image.Image(fname_dest)
+    nx, ny, nz, nt, px, py, pz, pt = im_dest.dim
 
     logger.info(f"  matrix size: {str(nx)} x {str(ny)} x {str(nz)}")
     logger.info(f"  voxel size: {str(px)}mm x {str(py)}mm x {str(nz)}mm")
 
-    # Split source volume along z
-    logger.info("\nSplit input volume...")
-    im_src = image.Image('src.nii')
-    split_source_list = image.split_img_data(im_src, 2)
-    for im in split_source_list:
-        im.save()
-
-    # Split destination volume along z
-    logger.info("\nSplit destination volume...")
-    im_dest = image.Image('dest.nii')
-    split_dest_list = image.split_img_data(im_dest, 2)
-    for im in split_dest_list:
-        im.save()
-
-    # open image
-    data_src = im_src.data
-    data_dest = im_dest.data
-
-    if len(data_src.shape) == 2:
-        # reshape 2D data into pseudo 3D (only one slice)
-        new_shape = list(data_src.shape)
-        new_shape.append(1)
-        new_shape = tuple(new_shape)
-        data_src = data_src.reshape(new_shape)
-        data_dest = data_dest.reshape(new_shape)
-
-    # initialize forward warping field (defined in destination space)
-    warp_x = np.zeros(data_dest.shape)
-    warp_y = np.zeros(data_dest.shape)
+    im_src = image.Image(fname_src)
+    # reshape 2D data into pseudo 3D (only one slice)
+    data_src = _as_3d(im_src.data)
+    data_dest = _as_3d(im_dest.data)
 
-    # initialize inverse warping field (defined in source space)
-    warp_inv_x = np.zeros(data_src.shape)
-    warp_inv_y = np.zeros(data_src.shape)
+    # initialize forward warping field (defined in destination space) and inverse warping field (defined in source
+    # space), in the ITK format
+    data_warp = np.zeros(data_dest.shape + (1, 3))
+    data_warp_inv = np.zeros(data_src.shape + (1, 3))
 
-    # Loop across slices
+    # Estimate the transformation of each slice, in pixel space
     print()  # Add newline between last log message and the progress bar logging
-    for iz in sct_progress_bar(range(0, nz), unit='iter', unit_scale=False, desc="Estimate columnwise transformation",
-                               ncols=100):
+    estimate = functools.partial(_estimate_slice_columnwise, smoothWarpXY=smoothWarpXY, verbose=verbose,
+                                 path_qc=path_qc)
+    tasks = [(iz, data_src[:, :, iz], data_dest[:, :, iz]) for iz in range(nz)]
+    results = _map_slices(estimate, tasks, jobs, desc="Estimate columnwise transformation")
+
+    # get indices of x and y coordinates
+    row, col = np.indices((nx, ny))
+    for iz, result in enumerate(results):
+        if result is None:
+            continue
+        row_scaleX, row_scaleXinv, col_scaleY, col_scaleYinv = result
         # PREPARE COORDINATES
         # ============================================================
-        # get indices of x and y coordinates
-        row, col = np.indices((nx, ny))
         # build 2xn array of coordinates in pixel space
         # ordering of indices is as follows:
         # coord_init_pix[:, 0] = 0, 0, 0, ..., 1, 1, 1..., nx, nx, nx
@@ -1003,181 +975,234 @@ def register2d_columnwise(fname_src, fname_dest, fname_warp='warp_forward.nii.gz
         coord_init_pix = np.array([row.ravel(), col.ravel(), np.array(np.ones(len(row.ravel())) * iz)]).T
         # convert coordinates to physical space
         coord_init_phy = np.array(im_src.transfo_pix2phys(coord_init_pix))
-        # get 2d data from the selected slice
-        src2d = data_src[:, :, iz]
-        dest2d = data_dest[:, :, iz]
-        # julien 20161105
-        # <<<
-        # threshold at 0.5
-        src2d[src2d < th_nonzero] = 0
-        dest2d[dest2d < th_nonzero] = 0
-        # get non-zero coordinates, and transpose to obtain nx2 dimensions
-        coord_src2d = np.array(np.where(src2d > 0)).T
-        # here we use 0.5 as threshold for non-zero value
-        # coord_src2d = np.array(np.where(src2d > th_nonzero)).T
-        # >>>
-
-        # SCALING R-L (X dimension)
+        coord_init_pix_scaleX = np.copy(coord_init_pix)
+        coord_init_pix_scaleX[:, 0] = row_scaleX.ravel()
+        coord_init_pix_scaleXinv = np.copy(coord_init_pix)
+        coord_init_pix_scaleXinv[:, 0] = row_scaleXinv.ravel()
+        coord_init_pix_scaleY = np.copy(coord_init_pix)
+        coord_init_pix_scaleY[:, 1] = col_scaleY.ravel()
+        coord_init_pix_scaleYinv = np.copy(coord_init_pix)
+        coord_init_pix_scaleYinv[:, 1] = col_scaleYinv.ravel()
+
+        # ============================================================
+        # CALCULATE TRANSFORMATIONS
         # ============================================================
-        # sum data across Y to obtain 1D signal: src_y and dest_y
-        src1d = np.sum(src2d, 1)
-        dest1d = np.sum(dest2d, 1)
+        # calculate forward transformation (in physical space)
+        coord_init_phy_scaleX = np.array(im_dest.transfo_pix2phys(coord_init_pix_scaleX))
+        coord_init_phy_scaleY = np.array(im_dest.transfo_pix2phys(coord_init_pix_scaleY))
+        # calculate inverse transformation (in physical space)
+        coord_init_phy_scaleXinv = np.array(im_src.transfo_pix2phys(coord_init_pix_scaleXinv))
+        coord_init_phy_scaleYinv = np.array(im_src.transfo_pix2phys(coord_init_pix_scaleYinv))
+        # compute displacement per pixel in destination space (for forward warping field)
+        # (need to invert due to ITK conventions)
+        data_warp[:, :, iz, 0, 0] = -(coord_init_phy_scaleXinv[:, 0] - coord_init_phy[:, 0]).reshape((nx, ny))
+        data_warp[:, :, iz, 0, 1] = -(coord_init_phy_scaleYinv[:, 1] - coord_init_phy[:, 1]).reshape((nx, ny))
+        # compute displacement per pixel in source space (for inverse warping field)
+        data_warp_inv[:, :, iz, 0, 0] = -(coord_init_phy_scaleX[:, 0] - coord_init_phy[:, 0]).reshape((nx, ny))
+        data_warp_inv[:, :, iz, 0, 1] = -(coord_init_phy_scaleY[:, 1] - coord_init_phy[:, 1]).reshape((nx, ny))
+
+    # Generate forward warping field (defined in destination space)
+    save_warping_field(fname_dest, data_warp, fname_warp)
+    # Generate inverse warping field (defined in source space)
+    save_warping_field(fname_src, data_warp_inv, fname_warp_inv)
+
+
+def _estimate_slice_columnwise(task, smoothWarpXY, verbose, path_qc):
+    """
+    Worker function for `register2d_columnwise`: estimate the R-L scaling and column-wise transformation of a slice.
+
+    :param task: tuple (iz, src2d, dest2d)
+    :return: tuple (row_scaleX, row_scaleXinv, col_scaleY, col_scaleYinv) of 2D arrays: transformed coordinates of each
+        pixel in pixel space, or None if the slice is empty.
+    """
+    iz, src2d, dest2d = task
+    nx, ny = dest2d.shape
+
+    # initialization
+    th_nonzero = 0.5  # values below are considered zero
+
+    # for display stuff
+    if verbose == 2:
+        import matplotlib.pyplot as plt
+
+    # get indices of x and y coordinates
+    row, col = np.indices((nx, ny))
+    coord_init_pix = np.array([row.ravel(), col.ravel()]).T.astype(float)
+    # julien 20161105
+    # <<<
+    # threshold at 0.5
+    src2d[src2d < th_nonzero] = 0
+    dest2d[dest2d < th_nonzero] = 0
+    # get non-zero coordinates, and transpose to obtain nx2 dimensions
+    coord_src2d = np.array(np.where(src2d > 0)).T
+    # here we use 0.5 as threshold for non-zero value
+    # coord_src2d = np.array(np.where(src2d > th_nonzero)).T
+    # >>>
+
+    # SCALING R-L (X dimension)
+    # ============================================================
+    # sum data across Y to obtain 1D signal: src_y and dest_y
+    src1d = np.sum(src2d, 1)
+    dest1d = np.sum(dest2d, 1)
+    # make sure there are non-zero data in src or dest
+    if not (np.any(src1d > th_nonzero) and np.any(dest1d > th_nonzero)):
+        return None
+    # retrieve min/max of non-zeros elements (edge of the segmentation)
+    # julien 20161105
+    # <<<
+    src1d_min, src1d_max = min(np.where(src1d != 0)[0]), max(np.where(src1d != 0)[0])
+    dest1d_min, dest1d_max = min(np.where(dest1d != 0)[0]), max(np.where(dest1d != 0)[0])
+    # for i in range(len(src1d)):
+    #     if src1d[i] > 0.5:
+    #         found index above 0.5, exit loop
+    #         break
+    # get indices (in continuous space) at half-maximum of upward and downward slope
+    # src1d_min, src1d_max = find_index_halfmax(src1d)
+    # dest1d_min, dest1d_max = find_index_halfmax(dest1d)
+    # >>>
+    # 1D matching between src_y and dest_y
+    mean_dest_x = (dest1d_max + dest1d_min) / 2
+    mean_src_x = (src1d_max + src1d_min) / 2
+    # compute x-scaling factor
+    Sx = (dest1d_max - dest1d_min + 1) / float(src1d_max - src1d_min + 1)
+    # apply transformation to coordinates
+    coord_src2d_scaleX = np.copy(coord_src2d)  # need to use np.copy to avoid copying pointer
+    coord_src2d_scaleX[:, 0] = (coord_src2d[:, 0] - mean_src_x) * Sx + mean_dest_x
+    coord_init_pix_scaleX = np.copy(coord_init_pix)
+    coord_init_pix_scaleX[:, 0] = (coord_init_pix[:, 0] - mean_src_x) * Sx + mean_dest_x
+    coord_init_pix_scaleXinv = np.copy(coord_init_pix)
+    coord_init_pix_scaleXinv[:, 0] = (coord_init_pix[:, 0] - mean_dest_x) / float(Sx) + mean_src_x
+    # apply transformation to image
+    from skimage.transform import warp
+    row_scaleXinv = np.reshape(coord_init_pix_scaleXinv[:, 0], [nx, ny])
+    src2d_scaleX = warp(src2d, np.array([row_scaleXinv, col]), order=1)
+
+    # ============================================================
+    # COLUMN-WISE REGISTRATION (Y dimension for each Xi)
+    # ============================================================
+    coord_init_pix_scaleY = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
+    coord_init_pix_scaleYinv = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
+    # coord_src2d_scaleXY = np.copy(coord_src2d_scaleX)  # need to use np.copy to avoid copying pointer
+    # loop across columns (X dimension)
+    for ix in range(nx):
+        # retrieve 1D signal along Y
+        src1d = src2d_scaleX[ix, :]
+        dest1d = dest2d[ix, :]
         # make sure there are non-zero data in src or dest
         if np.any(src1d > th_nonzero) and np.any(dest1d > th_nonzero):
             # retrieve min/max of non-zeros elements (edge of the segmentation)
-            # julien 20161105
-            # <<<
-            src1d_min, src1d_max = min(np.where(src1d != 0)[0]), max(np.where(src1d != 0)[0])
-            dest1d_min, dest1d_max = min(np.where(dest1d != 0)[0]), max(np.where(dest1d != 0)[0])
-            # for i in range(len(src1d)):
-            #     if src1d[i] > 0.5:
-            #         found index above 0.5, exit loop
-            #         break
+            # src1d_min, src1d_max = min(np.nonzero(src1d)[0]), max(np.nonzero(src1d)[0])
+            # dest1d_min, dest1d_max = min(np.nonzero(dest1d)[0]), max(np.nonzero(dest1d)[0])
+            # 1D matching between src_y and dest_y
+            # Ty = (dest1d_max + dest1d_min)/2 - (src1d_max + src1d_min)/2
+            # Sy = (dest1d_max - dest1d_min) / float(src1d_max - src1d_min)
+            # apply translation and scaling to coordinates in column
             # get indices (in continuous space) at half-maximum of upward and downward slope
             # src1d_min, src1d_max = find_index_halfmax(src1d)
             # dest1d_min, dest1d_max = find_index_halfmax(dest1d)
-            # >>>
+            src1d_min, src1d_max = np.min(np.where(src1d > th_nonzero)), np.max(np.where(src1d > th_nonzero))
+            dest1d_min, dest1d_max = np.min(np.where(dest1d > th_nonzero)), np.max(np.where(dest1d > th_nonzero))
             # 1D matching between src_y and dest_y
-            mean_dest_x = (dest1d_max + dest1d_min) / 2
-            mean_src_x = (src1d_max + src1d_min) / 2
-            # compute x-scaling factor
-            Sx = (dest1d_max - dest1d_min + 1) / float(src1d_max - src1d_min + 1)
-            # apply transformation to coordinates
-            coord_src2d_scaleX = np.copy(coord_src2d)  # need to use np.copy to avoid copying pointer
-            coord_src2d_scaleX[:, 0] = (coord_src2d[:, 0] - mean_src_x) * Sx + mean_dest_x
-            coord_init_pix_scaleX = np.copy(coord_init_pix)
-            coord_init_pix_scaleX[:, 0] = (coord_init_pix[:, 0] - mean_src_x) * Sx + mean_dest_x
-            coord_init_pix_scaleXinv = np.copy(coord_init_pix)
-            coord_init_pix_scaleXinv[:, 0] = (coord_init_pix[:, 0] - mean_dest_x) / float(Sx) + mean_src_x
-            # apply transformation to image
-            from skimage.transform import warp
-            row_scaleXinv = np.reshape(coord_init_pix_scaleXinv[:, 0], [nx, ny])
-            src2d_scaleX = warp(src2d, np.array([row_scaleXinv, col]), order=1)
-
-            # ============================================================
-            # COLUMN-WISE REGISTRATION (Y dimension for each Xi)
-            # ============================================================
-            coord_init_pix_scaleY = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
-            coord_init_pix_scaleYinv = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
-            # coord_src2d_scaleXY = np.copy(coord_src2d_scaleX)  # need to use np.copy to avoid copying pointer
-            # loop across columns (X dimension)
-            for ix in range(nx):
-                # retrieve 1D signal along Y
-                src1d = src2d_scaleX[ix, :]
-                dest1d = dest2d[ix, :]
-                # make sure there are non-zero data in src or dest
-                if np.any(src1d > th_nonzero) and np.any(dest1d > th_nonzero):
-                    # retrieve min/max of non-zeros elements (edge of the segmentation)
-                    # src1d_min, src1d_max = min(np.nonzero(src1d)[0]), max(np.nonzero(src1d)[0])
-                    # dest1d_min, dest1d_max = min(np.nonzero(dest1d)[0]), max(np.nonzero(dest1d)[0])
-                    # 1D matching between src_y and dest_y
-                    # Ty = (dest1d_max + dest1d_min)/2 - (src1d_max + src1d_min)/2
-                    # Sy = (dest1d_max - dest1d_min) / float(src1d_max - src1d_min)
-                    # apply translation and scaling to coordinates in column
-                    # get indices (in continuous space) at half-maximum of upward and downward slope
-                    # src1d_min, src1d_max = find_index_halfmax(src1d)
-                    # dest1d_min, dest1d_max = find_index_halfmax(dest1d)
-                    src1d_min, src1d_max = np.min(np.where(src1d > th_nonzero)), np.max(np.where(src1d > th_nonzero))
-                    dest1d_min, dest1d_max = np.min(np.where(dest1d > th_nonzero)), np.max(np.where(dest1d > th_nonzero))
-                    # 1D matching between src_y and dest_y
-                    mean_dest_y = (dest1d_max + dest1d_min) / 2
-                    mean_src_y = (src1d_max + src1d_min) / 2
-                    # Tx = (dest1d_max + dest1d_min)/2 - (src1d_max + src1d_min)/2
-                    Sy = (dest1d_max - dest1d_min + 1) / float(src1d_max - src1d_min + 1)
-                    # apply forward transformation (in pixel space)
-                    # below: only for debugging purpose
-                    # coord_src2d_scaleX = np.copy(coord_src2d)  # need to use np.copy to avoid copying pointer
-                    # coord_src2d_scaleX[:, 0] = (coord_src2d[:, 0] - mean_src) * Sx + mean_dest
-                    # coord_init_pix_scaleY = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
-                    # coord_init_pix_scaleY[:, 0] = (coord_init_pix[:, 0] - mean_src ) * Sx + mean_dest
-                    range_x = list(range(ix * ny, ix * ny + nx))
-                    coord_init_pix_scaleY[range_x, 1] = (coord_init_pix[range_x, 1] - mean_src_y) * Sy + mean_dest_y
-                    coord_init_pix_scaleYinv[range_x, 1] = (coord_init_pix[range_x, 1] - mean_dest_y) / float(Sy) + mean_src_y
-            # apply transformation to image
-            col_scaleYinv = np.reshape(coord_init_pix_scaleYinv[:, 1], [nx, ny])
-            src2d_scaleXY = warp(src2d, np.array([row_scaleXinv, col_scaleYinv]), order=1)
-            # regularize Y warping fields
-            from skimage.filters import gaussian
-            col_scaleY = np.reshape(coord_init_pix_scaleY[:, 1], [nx, ny])
-            col_scaleYsmooth = gaussian(col_scaleY, smoothWarpXY)
-            col_scaleYinvsmooth = gaussian(col_scaleYinv, smoothWarpXY)
-            # apply smoothed transformation to image
-            src2d_scaleXYsmooth = warp(src2d, np.array([row_scaleXinv, col_scaleYinvsmooth]), order=1)
-            # reshape warping field as 1d
-            coord_init_pix_scaleY[:, 1] = col_scaleYsmooth.ravel()
-            coord_init_pix_scaleYinv[:, 1] = col_scaleYinvsmooth.ravel()
-            # display
-            if verbose == 2:
-                # FIG 1
-                plt.figure(figsize=(15, 3))
-                # plot #1
-                ax = plt.subplot(141)
-                plt.imshow(np.swapaxes(src2d, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
-                plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src')
-                plt.xlabel('x')
-                plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
-                ax.grid(True, color='w')
-                # plot #2
-                ax = plt.subplot(142)
-                plt.imshow(np.swapaxes(src2d_scaleX, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
-                plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src_scaleX')
-                plt.xlabel('x')
-                plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
-                ax.grid(True, color='w')
-                # plot #3
-                ax = plt.subplot(143)
-                plt.imshow(np.swapaxes(src2d_scaleXY, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
-                plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src_scaleXY')
-                plt.xlabel('x')
-                plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
-                ax.grid(True, color='w')
-                # plot #4
-                ax = plt.subplot(144)
-                plt.imshow(np.swapaxes(src2d_scaleXYsmooth, 1, 0), cmap=plt.cm.gray, interpolation='none')
-                plt.hold(True)  # add other layer
-                plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
-                plt.title('src_scaleXYsmooth (s=' + str(smoothWarpXY) + ')')
-                plt.xlabel('x')
-                plt.ylabel('y')
-                plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
-                plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
-                ax.grid(True, color='w')
-                # save figure
-                plt.savefig(os.path.join(path_qc, 'register2d_columnwise_image_z' + str(iz) + '.png'))
-                plt.close()
-
-            # ============================================================
-            # CALCULATE TRANSFORMATIONS
-            # ============================================================
-            # calculate forward transformation (in physical space)
-            coord_init_phy_scaleX = np.array(im_dest.transfo_pix2phys(coord_init_pix_scaleX))
-            coord_init_phy_scaleY = np.array(im_dest.transfo_pix2phys(coord_init_pix_scaleY))
-            # calculate inverse transformation (in physical space)
-            coord_init_phy_scaleXinv = np.array(im_src.transfo_pix2phys(coord_init_pix_scaleXinv))
-            coord_init_phy_scaleYinv = np.array(im_src.transfo_pix2phys(coord_init_pix_scaleYinv))
-            # compute displacement per pixel in destination space (for forward warping field)
-            warp_x[:, :, iz] = np.array([coord_init_phy_scaleXinv[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-            warp_y[:, :, iz] = np.array([coord_init_phy_scaleYinv[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
-            # compute displacement per pixel in source space (for inverse warping field)
-            warp_inv_x[:, :, iz] = np.array([coord_init_phy_scaleX[i, 0] - coord_init_phy[i, 0] for i in range(nx * ny)]).reshape((nx, ny))
-            warp_inv_y[:, :, iz] = np.array([coord_init_phy_scaleY[i, 1] - coord_init_phy[i, 1] for i in range(nx * ny)]).reshape((nx, ny))
+            mean_dest_y = (dest1d_max + dest1d_min) / 2
+            mean_src_y = (src1d_max + src1d_min) / 2
+            # Tx = (dest1d_max + dest1d_min)/2 - (src1d_max + src1d_min)/2
+            Sy = (dest1d_max - dest1d_min + 1) / float(src1d_max - src1d_min + 1)
+            # apply forward transformation (in pixel space)
+            # below: only for debugging purpose
+            # coord_src2d_scaleX = np.copy(coord_src2d)  # need to use np.copy to avoid copying pointer
+            # coord_src2d_scaleX[:, 0] = (coord_src2d[:, 0] - mean_src) * Sx + mean_dest
+            # coord_init_pix_scaleY = np.copy(coord_init_pix)  # need to use np.copy to avoid copying pointer
+            # coord_init_pix_scaleY[:, 0] = (coord_init_pix[:, 0] - mean_src ) * Sx + mean_dest
+            range_x = list(range(ix * ny, ix * ny + nx))
+            coord_init_pix_scaleY[range_x, 1] = (coord_init_pix[range_x, 1] - mean_src_y) * Sy + mean_dest_y
+            coord_init_pix_scaleYinv[range_x, 1] = (coord_init_pix[range_x, 1] - mean_dest_y) / float(Sy) + mean_src_y
+    # apply transformation to image
+    col_scaleYinv = np.reshape(coord_init_pix_scaleYinv[:, 1], [nx, ny])
+    src2d_scaleXY = warp(src2d, np.array([row_scaleXinv, col_scaleYinv]), order=1)
+    # regularize Y warping fields
+    from skimage.filters import gaussian
+    col_scaleY = np.reshape(coord_init_pix_scaleY[:, 1], [nx, ny])
+    col_scaleYsmooth = gaussian(col_scaleY, smoothWarpXY)
+    col_scaleYinvsmooth = gaussian(col_scaleYinv, smoothWarpXY)
+    # apply smoothed transformation to image
+    src2d_scaleXYsmooth = warp(src2d, np.array([row_scaleXinv, col_scaleYinvsmooth]), order=1)
+    # reshape warping field as 1d
+    coord_init_pix_scaleY[:, 1] = col_scaleYsmooth.ravel()
+    coord_init_pix_scaleYinv[:, 1] = col_scaleYinvsmooth.ravel()
+    # display
+    if verbose == 2:
+        # FIG 1
+        plt.figure(figsize=(15, 3))
+        # plot #1
+        ax = plt.subplot(141)
+        plt.imshow(np.swapaxes(src2d, 1, 0), cmap=plt.cm.gray, interpolation='none')
+        plt.hold(True)  # add other layer
+        plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
+        plt.title('src')
+        plt.xlabel('x')
+        plt.ylabel('y')
+        plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
+        plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
+        ax.grid(True, color='w')
+        # plot #2
+        ax = plt.subplot(142)
+        plt.imshow(np.swapaxes(src2d_scaleX, 1, 0), cmap=plt.cm.gray, interpolation='none')
+        plt.hold(True)  # add other layer
+        plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
+        plt.title('src_scaleX')
+        plt.xlabel('x')
+        plt.ylabel('y')
+        plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
+        plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
+        ax.grid(True, color='w')
+        # plot #3
+        ax = plt.subplot(143)
+        plt.imshow(np.swapaxes(src2d_scaleXY, 1, 0), cmap=plt.cm.gray, interpolation='none')
+        plt.hold(True)  # add other layer
+        plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
+        plt.title('src_scaleXY')
+        plt.xlabel('x')
+        plt.ylabel('y')
+        plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
+        plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
+        ax.grid(True, color='w')
+        # plot #4
+        ax = plt.subplot(144)
+        plt.imshow(np.swapaxes(src2d_scaleXYsmooth, 1, 0), cmap=plt.cm.gray, interpolation='none')
+        plt.hold(True)  # add other layer
+        plt.imshow(np.swapaxes(dest2d, 1, 0), cmap=plt.cm.copper, interpolation='none', alpha=0.5)
+        plt.title('src_scaleXYsmooth (s=' + str(smoothWarpXY) + ')')
+        plt.xlabel('x')
+        plt.ylabel('y')
+        plt.xlim(mean_dest_x - 15, mean_dest_x + 15)
+        plt.ylim(mean_dest_y - 15, mean_dest_y + 15)
+        ax.grid(True, color='w')
+        # save figure
+        plt.savefig(os.path.join(path_qc, 'register2d_columnwise_image_z' + str(iz) + '.png'))
+        plt.close()
+
+    return (coord_init_pix_scaleX[:, 0].reshape((nx, ny)), coord_init_pix_scaleXinv[:, 0].reshape((nx, ny)),
+            coord_init_pix_scaleY[:, 1].reshape((nx, ny)), coord_init_pix_scaleYinv[:, 1].reshape((nx, ny)))
+
+
+def _as_3d(data):
+    """Reshape 2D data into pseudo 3D data (with only one slice)."""
+    return data.reshape(data.shape + (1,)) if data.ndim == 2 else data
+
+
+def _map_slices(func, tasks, jobs, desc):
+    """
+    Apply a function to the tasks of each slice, distributing the tasks across a pool of processes.
 
-    # Generate forward warping field (defined in destination space)
-    generate_warping_field(fname_dest, warp_x, warp_y, fname_warp)
-    # Generate inverse warping field (defined in source space)
-    generate_warping_field(fname_src, warp_inv_x, warp_inv_y, fname_warp_inv)
+    :param jobs: int: Number of processes. 0 or a negative number means the number of available cores minus that number.
+    :return: list of the results, in the same order as the tasks
+    """
+    n_jobs = min(get_n_jobs(jobs), max(len(tasks), 1))
+    progress = dict(total=len(tasks), unit='iter', unit_scale=False, desc=desc, ncols=100)
+    if n_jobs == 1:
+        return list(sct_progress_bar(map(func, tasks), **progress))
+    with multiprocessing.Pool(n_jobs) as pool:
+        return list(sct_progress_bar(pool.imap(func, tasks), **progress))
 
 
 def register2d(fname_src, fname_dest, fname_mask='', fname_warp='warp_forward.nii.gz',
@@ -1392,7 +1417,17 @@ def generate_warping_field(fname_dest, warp_x, warp_y, fname_warp='warping_field
     data_warp[:, :, :, 0, 0] = -warp_x  # need to invert due to ITK conventions
     data_warp[:, :, :, 0, 1] = -warp_y  # need to invert due to ITK conventions
 
-    # save warping field
+    save_warping_field(fname_dest, data_warp, fname_warp)
+
+
+def save_warping_field(fname_dest, data_warp, fname_warp='warping_field.nii.gz'):
+    """
+    Save an ITK warping field
+    :param fname_dest: image defining the space of the warping field
+    :param data_warp: array (nx, ny, nz, 1, 3) of displacements, already in ITK conventions
+    :param fname_warp:
+    :return:
+    """
     im_dest = load(fname_dest)
     hdr_dest = im_dest.header
     hdr_warp = hdr_dest.copy()
@@ -1449,6 +1484,48 @@ def compute_pca(data2d):
     return coordsrc, pca, centermass
 
 
+def compute_pca_batch(data3d):
+    """
+    Compute the PCA of the non-zero coordinates of each slice of a 3D array (same as `compute_pca` slice by slice), the
+    centers of mass and 2x2 covariance matrices of all slices being computed at once.
+
+    :param data3d: 3d array. PCA will be computed on non-zeros values of each slice along the last axis.
+    :return: centermass: (nz, 2) array: 2d coordinates of the center of mass of each slice\
+        components: (nz, 2, 2) array: principal axes of each slice (one axis per row), sorted by decreasing variance\
+        explained_variance_ratio: (nz, 2) array: percentage of variance explained by each axis.\
+        Slices with less than two non-zero values are filled with NaN.
+    """
+    nz = data3d.shape[2]
+    # round it and make it int (otherwise end up with values like 10-7)
+    x, y, iz = np.nonzero(data3d.round().astype(int))
+    count = np.bincount(iz, minlength=nz)
+    valid = count >= 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # get center of mass
+        centermass = np.stack([np.bincount(iz, weights=x, minlength=nz),
+                               np.bincount(iz, weights=y, minlength=nz)], axis=1) / count[:, np.newaxis]
+    # covariance of the centered coordinates of each slice
+    dx = x - centermass[iz, 0]
+    dy = y - centermass[iz, 1]
+    cov = np.empty((nz, 2, 2))
+    cov[:, 0, 0] = np.bincount(iz, weights=dx * dx, minlength=nz)
+    cov[:, 0, 1] = cov[:, 1, 0] = np.bincount(iz, weights=dx * dy, minlength=nz)
+    cov[:, 1, 1] = np.bincount(iz, weights=dy * dy, minlength=nz)
+    cov[~valid] = np.eye(2)
+
+    # eigenvalues are sorted in ascending order: reverse them to sort the axes by decreasing variance
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    eigenvalues = np.clip(eigenvalues[:, ::-1], 0, None)
+    components = np.swapaxes(eigenvectors[:, :, ::-1], 1, 2)
+    explained_variance_ratio = eigenvalues / eigenvalues.sum(axis=1, keepdims=True)
+
+    centermass[~valid] = np.nan
+    components[~valid] = np.nan
+    explained_variance_ratio[~valid] = np.nan
+    return centermass, components, explained_variance_ratio
+
+
 def find_index_halfmax(data1d):
     """
     Find the two indices at half maximum for a bell-type curve (non-parametric). Uses center of mass calculation.
@@ -1489,6 +1566,21 @@ def find_angle_hog(image, centermass, px, py, angle_range=10):
     :param: angle_range : float or None, in deg, the angle will be search in the range [-angle_range, angle_range], if None angle angle might be returned
     :return: angle found and confidence score
     """
+    angles, conf_scores = find_angles_hog(image[:, :, np.newaxis], [centermass], px, py, angle_range=angle_range)
+    return angles[0], conf_scores[0]
+
+
+def find_angles_hog(images, centermasses, px, py, angle_range=10):
+    """
+    Same as `find_angle_hog`, for each slice of a stack of images. The weighting masks and the gradient orientation
+    histograms of all the slices are computed at once.
+
+    :param: images : 3D numpy array (nx, ny, nz), the angle is found for each slice along the last axis
+    :param: centermasses: (nz, 2) array of the center of mass of each slice
+    :param: px, py, dimensions of the pixels in the x and y direction
+    :param: angle_range : float or None, in deg, the angle will be search in the range [-angle_range, angle_range], if None angle angle might be returned
+    :return: angles found and confidence scores, 1D arrays of length nz
+    """
 
     # param that can actually be tweeked to influence method performance :
     sigma = 10  # influence how far away pixels will vote for the orientation, if high far away pixels vote will count more, if low only closest pixels will participate
@@ -1503,44 +1595,58 @@ def find_angle_hog(image, centermass, px, py, angle_range=10):
     if angle_range is None:
         angle_range = 90
 
-    # Constructing mask based on center of mass that will influence the weighting of the orientation histogram
-    nx, ny = image.shape
-    xx, yy = np.mgrid[:nx, :ny]
-    seg_weighted_mask = np.exp(
-        -(((xx - centermass[0]) ** 2) / (2 * (sigmax ** 2)) + ((yy - centermass[1]) ** 2) / (2 * (sigmay ** 2))))
+    # Constructing masks based on the centers of mass that will influence the weighting of the orientation histograms
+    nx, ny, nz = images.shape
+    if nz == 0:
+        return np.zeros(0), np.zeros(0)
+    centermasses = np.asarray(centermasses, dtype=float).reshape(nz, 2)
+    xx = np.arange(nx)[:, np.newaxis, np.newaxis]
+    yy = np.arange(ny)[np.newaxis, :, np.newaxis]
+    seg_weighted_masks = np.exp(
+        -(((xx - centermasses[:, 0]) ** 2) / (2 * (sigmax ** 2)) + ((yy - centermasses[:, 1]) ** 2) / (2 * (sigmay ** 2))))
 
-    # Acquiring the orientation histogram :
-    grad_orient_histo = gradient_orientation_histogram(image, nb_bin=nb_bin, seg_weighted_mask=seg_weighted_mask)
+    # Acquiring the orientation histograms :
+    grad_orient_histos = gradient_orientation_histograms(images, nb_bin=nb_bin, seg_weighted_masks=seg_weighted_masks)
 
     # Bins of the histogram :
     repr_hist = np.linspace(-(np.pi - 2 * np.pi / nb_bin), (np.pi - 2 * np.pi / nb_bin), nb_bin - 1)
 
-    # Smoothing of the histogram, necessary to avoid digitization effects that will favor angles 0, 45, 90, -45, -90:
-    grad_orient_histo_smooth = circular_filter_1d(grad_orient_histo, kmedian_size, kernel='median')  # fft than square than ifft to calculate convolution
-
-    # Computing the circular autoconvolution of the histogram to obtain the axis of symmetry of the histogram :
-    grad_orient_histo_conv = circular_conv(grad_orient_histo_smooth, grad_orient_histo_smooth)
-
     # Restraining angle search to the angle range :
     index_restrain = int(np.ceil(np.true_divide(angle_range, 180) * nb_bin))
     center = (nb_bin - 1) // 2
-    grad_orient_histo_conv_restrained = grad_orient_histo_conv[center - index_restrain + 1:center + index_restrain + 1]
 
-    # Finding the symmetry axis by searching for the maximum in the autoconvolution of the histogram :
-    index_angle_found = np.argmax(grad_orient_histo_conv_restrained) + (nb_bin // 2 - index_restrain)
-    angle_found = repr_hist[index_angle_found] / 2
-    angle_found_score = np.amax(grad_orient_histo_conv_restrained)
+    angles = np.zeros(nz)
+    conf_scores = np.zeros(nz)
+    for iz, grad_orient_histo in enumerate(grad_orient_histos):
+        # Smoothing of the histogram, necessary to avoid digitization effects that will favor angles 0, 45, 90, -45, -90:
+        grad_orient_histo_smooth = circular_filter_1d(grad_orient_histo, kmedian_size, kernel='median')  # fft than square than ifft to calculate convolution
 
-    # Finding other maxima to compute confidence score
-    arg_maxs = argrelmax(grad_orient_histo_conv_restrained, order=kmedian_size, mode='wrap')[0]
+        # Computing the circular autoconvolution of the histogram to obtain the axis of symmetry of the histogram :
+        grad_orient_histo_conv = circular_conv(grad_orient_histo_smooth, grad_orient_histo_smooth)
+        grad_orient_histo_conv_restrained = grad_orient_histo_conv[center - index_restrain + 1:center + index_restrain + 1]
 
-    # Confidence score is the ratio of the 2 first maxima :
-    if len(arg_maxs) > 1:
-        conf_score = angle_found_score / grad_orient_histo_conv_restrained[arg_maxs[1]]
-    else:
-        conf_score = angle_found_score / np.mean(grad_orient_histo_conv)  # if no other maxima  in the region ratio of the maximum to the mean
+        # Finding the symmetry axis by searching for the maximum in the autoconvolution of the histogram :
+        index_angle_found = np.argmax(grad_orient_histo_conv_restrained) + (nb_bin // 2 - index_restrain)
+        angles[iz] = repr_hist[index_angle_found] / 2
+        angle_found_score = np.amax(grad_orient_histo_conv_restrained)
+
+        # Finding other maxima to compute confidence score
+        arg_maxs = argrelmax(grad_orient_histo_conv_restrained, order=kmedian_size, mode='wrap')[0]
+
+        # Confidence score is the ratio of the 2 first maxima :
+        if len(arg_maxs) > 1:
+            conf_scores[iz] = angle_found_score / grad_orient_histo_conv_restrained[arg_maxs[1]]
+        else:
+            conf_scores[iz] = angle_found_score / np.mean(grad_orient_histo_conv)  # if no other maxima  in the region ratio of the maximum to the mean
+
+    return angles, conf_scores
 
-    return angle_found, conf_score
+
+# Kernels of the x and y gradients used by `gradient_orientation_histograms`
+SOBEL_H_KERNEL = np.array([[1, 2, 1],
+                           [0, 0, 0],
+                           [-1, -2, -1]]) / 4.0
+SOBEL_V_KERNEL = SOBEL_H_KERNEL.T
 
 
 def gradient_orientation_histogram(image, nb_bin, seg_weighted_mask=None):
@@ -1551,39 +1657,50 @@ def gradient_orientation_histogram(image, nb_bin, seg_weighted_mask=None):
     :param nb_bin: the number of bins of the histogram, an int, for instance 360 for bins 1 degree large (can be more or less than 360)
     :param seg_weighted_mask: optional, mask weighting the histogram count, base on segmentation, 2D numpy array between 0 and 1
     :return grad_orient_histo: the histogram of the orientations of the image, a 1D numpy array of length nb_bin"""
+    if seg_weighted_mask is not None:
+        seg_weighted_mask = seg_weighted_mask[:, :, np.newaxis]
+    return gradient_orientation_histograms(image[:, :, np.newaxis], nb_bin, seg_weighted_masks=seg_weighted_mask)[0]
+
 
-    h_kernel = np.array([[1, 2, 1],
-                         [0, 0, 0],
-                         [-1, -2, -1]]) / 4.0
-    v_kernel = h_kernel.T
+def gradient_orientation_histograms(images, nb_bin, seg_weighted_masks=None):
+    """
+    Same as `gradient_orientation_histogram`, for each slice of a stack of images. The gradients of all the slices are
+    computed at once.
+
+    :param images: 3D numpy array (nx, ny, nz), a histogram is computed for each slice along the last axis
+    :param nb_bin: the number of bins of the histograms
+    :param seg_weighted_masks: optional, masks weighting the histogram counts, 3D numpy array with the same shape as images
+    :return grad_orient_histos: the histograms of the orientations of each slice, a (nz, nb_bin - 1) numpy array"""
 
-    # Normalization by median, to resolve scaling problems
-    median = np.median(image)
-    if median != 0:
-        image = image / median
+    # Normalization of each slice by its median, to resolve scaling problems
+    medians = np.median(images, axis=(0, 1))
+    images = images / np.where(medians != 0, medians, 1)
 
-    # x and y gradients of the image
-    gradx = convolve(image, v_kernel)
-    grady = convolve(image, h_kernel)
+    # x and y gradients of the images, slice by slice
+    gradx = convolve(images, SOBEL_V_KERNEL[:, :, np.newaxis])
+    grady = convolve(images, SOBEL_H_KERNEL[:, :, np.newaxis])
 
     # orientation gradient
     orient = np.arctan2(grady, gradx)  # results are in the range -pi pi
 
     # weight by gradient magnitude :  this step seems dumb, it alters the angles
-    grad_mag = ((np.abs(gradx.astype(object)) ** 2 + np.abs(grady.astype(object)) ** 2) ** 0.5)  # weird data type manipulation, cannot explain why it failed without it
-    if np.max(grad_mag) != 0:
-        grad_mag = grad_mag / np.max(grad_mag)  # to have map between 0 and 1 (and keep consistency with the seg_weihting map if provided)
+    grad_mag = np.sqrt(gradx ** 2 + grady ** 2)
+    # to have map between 0 and 1 (and keep consistency with the seg_weihting map if provided)
+    grad_mag_max = np.max(grad_mag, axis=(0, 1))
+    grad_mag = grad_mag / np.where(grad_mag_max != 0, grad_mag_max, 1)
 
-    if seg_weighted_mask is not None:
-        weighting_map = np.multiply(seg_weighted_mask, grad_mag)  # include weightning by segmentation
+    if seg_weighted_masks is not None:
+        weighting_map = np.multiply(seg_weighted_masks, grad_mag)  # include weightning by segmentation
     else:
         weighting_map = grad_mag
 
-    # compute histogram :
-    grad_orient_histo = np.histogram(np.concatenate(orient), bins=nb_bin - 1, range=(-(np.pi - np.pi / nb_bin), (np.pi - np.pi / nb_bin)),
-                                     weights=np.concatenate(weighting_map))
+    # compute histograms :
+    grad_orient_histos = np.zeros((images.shape[2], nb_bin - 1))
+    for iz in range(images.shape[2]):
+        grad_orient_histos[iz] = np.histogram(orient[:, :, iz], bins=nb_bin - 1, range=(-(np.pi - np.pi / nb_bin), (np.pi - np.pi / nb_bin)),
+                                              weights=weighting_map[:, :, iz])[0]
 
-    return grad_orient_histo[0].astype(float)  # return only the values of the bins, not the bins (we know them)
+    return grad_orient_histos
 
 
 def circular_conv(signal1, signal2):
@@ -14,6 +14,8 @@ import os
 import logging
 
 from spinalcordtoolbox.registration import algorithms
+from spinalcordtoolbox.registration.transforms import (use_python_transforms, load_transforms,
+                                                       compose_displacement_field)
 
 from spinalcordtoolbox.image import Image, add_suffix, generate_output_file
 from spinalcordtoolbox.utils.fs import extract_fname, rmtree, tmp_create
@@ -196,35 +198,43 @@ def register_wrapper(fname_src, fname_dest, param, paramregmulti, fname_src_seg=
     # Concatenate transformations
     printv('\nConcatenate transformations...', param.verbose)
 
-    # if a warping field needs to be inverted, remove it from warp_forward
-    warp_forward = [f for f in warp_forward if f not in warp_forward_winv]
-    dimensionality = len(Image("dest.nii").hdr.get_data_shape())
-    cmd = ['isct_ComposeMultiTransform', f"{dimensionality}", 'warp_src2dest.nii.gz', '-R', 'dest.nii']
-
-    if warp_forward_winv:
-        cmd.append('-i')
-        cmd += reversed(warp_forward_winv)
-    if warp_forward:
-        cmd += reversed(warp_forward)
-
-    status, output = run_proc(cmd, is_sct_binary=True)
-    if status != 0:
-        raise RuntimeError(f"Subprocess call {cmd} returned non-zero: {output}")
-
-    # if an inverse warping field needs to be inverted, remove it from warp_inverse_winv
-    warp_inverse = [f for f in warp_inverse if f not in warp_inverse_winv]
-    cmd = ['isct_ComposeMultiTransform', f"{dimensionality}", 'warp_dest2src.nii.gz', '-R', 'src.nii']
-    dimensionality = len(Image("dest.nii").hdr.get_data_shape())
-
-    if warp_inverse_winv:
-        cmd.append('-i')
-        cmd += reversed(warp_inverse_winv)
-    if warp_inverse:
-        cmd += reversed(warp_inverse)
-
-    status, output = run_proc(cmd, is_sct_binary=True)
-    if status != 0:
-        raise RuntimeError(f"Subprocess call {cmd} returned non-zero: {output}")
+    if use_python_transforms():
+        # Compose the transformations of all steps into a single displacement field in Python (affine transformations
+        # listed in warp_forward_winv/warp_inverse_winv are inverted)
+        compose_displacement_field(load_transforms(warp_forward, warp_forward_winv),
+                                   Image('dest.nii')).save('warp_src2dest.nii.gz', verbose=0)
+        compose_displacement_field(load_transforms(warp_inverse, warp_inverse_winv),
+                                   Image('src.nii')).save('warp_dest2src.nii.gz', verbose=0)
+    else:
+        # if a warping field needs to be inverted, remove it from warp_forward
+        warp_forward = [f for f in warp_forward if f not in warp_forward_winv]
+        dimensionality = len(Image("dest.nii").hdr.get_data_shape())
+        cmd = ['isct_ComposeMultiTransform', f"{dimensionality}", 'warp_src2dest.nii.gz', '-R', 'dest.nii']
+
+        if warp_forward_winv:
+            cmd.append('-i')
+            cmd += reversed(warp_forward_winv)
+        if warp_forward:
+            cmd += reversed(warp_forward)
+
+        status, output = run_proc(cmd, is_sct_binary=True)
+        if status != 0:
+            raise RuntimeError(f"Subprocess call {cmd} returned non-zero: {output}")
+
+        # if an inverse warping field needs to be inverted, remove it from warp_inverse_winv
+        warp_inverse = [f for f in warp_inverse if f not in warp_inverse_winv]
+        cmd = ['isct_ComposeMultiTransform', f"{dimensionality}", 'warp_dest2src.nii.gz', '-R', 'src.nii']
+        dimensionality = len(Image("dest.nii").hdr.get_data_shape())
+
+        if warp_inverse_winv:
+            cmd.append('-i')
+            cmd += reversed(warp_inverse_winv)
+        if warp_inverse:
+            cmd += reversed(warp_inverse)
+
+        status, output = run_proc(cmd, is_sct_binary=True)
+        if status != 0:
+            raise RuntimeError(f"Subprocess call {cmd} returned non-zero: {output}")
 
     # TODO: make the following code optional (or move it to sct_register_multimodal)
     # Apply warping field to src data
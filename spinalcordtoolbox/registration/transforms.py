@@ -0,0 +1,286 @@
+"""
+Composition and application of ITK transformations (displacement fields and affine transformations), without calling
+the ANTs binaries
+
+Transformations follow the ITK conventions used by `isct_antsApplyTransforms` and `isct_ComposeMultiTransform`:
+they map the physical points of the destination (fixed) space to the source (moving) space, in LPS coordinates.
+
+sct_apply_transfo and the registration of sct_register_multimodal/sct_register_to_template still call the ANTs binaries
+by default. They only use this module if the `SCT_PYTHON_TRANSFORMS` environment variable is set to `yes`, `on` or
+`true` (see `use_python_transforms`), until its results have been compared with the ones of ANTs on real data.
+
+Copyright (c) 2023 Polytechnique Montreal <www.neuro.polymtl.ca>
+License: see the file LICENSE
+"""
+
+import logging
+import os
+
+import numpy as np
+from scipy.io import loadmat
+from scipy.ndimage import map_coordinates, spline_filter
+
+from spinalcordtoolbox.image import Image, splitext
+
+logger = logging.getLogger(__name__)
+
+# NIfTI affines map voxels to RAS coordinates, whereas ITK points are in LPS coordinates
+RAS2LPS = np.diag([-1., -1., 1., 1.])
+
+# Order of the spline used by `scipy.ndimage.map_coordinates` for each interpolation method of sct_apply_transfo
+INTERP_ORDER = {'nn': 0, 'linear': 1, 'spline': 3}
+
+# ITK transformations defined by a matrix and an offset, which can be read from a text or a .mat file
+AFFINE_TRANSFORM_TYPES = ('AffineTransform', 'MatrixOffsetTransformBase')
+
+# Maximum number of voxels of the destination space transformed at once. The destination space is processed by slabs
+# of slices, to limit the memory used by the coordinates of the points.
+MAX_POINTS_PER_SLAB = 2 ** 20
+
+
+def use_python_transforms():
+    """
+    Whether transformations are composed and applied by this module rather than by the ANTs binaries. This is opt-in:
+    the `SCT_PYTHON_TRANSFORMS` environment variable has to be set to `yes`, `on` or `true` (case insensitive).
+    """
+    return os.environ.get('SCT_PYTHON_TRANSFORMS', 'no').lower() in ['yes', 'on', 'true']
+
+
+class AffineTransform:
+    """ITK affine transformation, stored as a 4x4 matrix acting on LPS points."""
+
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+
+    @classmethod
+    def from_parameters(cls, parameters, fixed_parameters, dim):
+        """
+        :param parameters: matrix (row by row) followed by the translation, as in ITK transform files.
+        :param fixed_parameters: center of rotation (can be empty).
+        :param dim: int: 2 or 3.
+        """
+        parameters = np.asarray(parameters, dtype=np.float64).ravel()
+        if len(parameters) != dim * dim + dim:
+            raise ValueError(f"Expected {dim * dim + dim} parameters for a {dim}D affine transformation, got "
+                             f"{len(parameters)}")
+        rotation = parameters[:dim * dim].reshape((dim, dim))
+        translation = parameters[dim * dim:]
+        center = np.asarray(fixed_parameters, dtype=np.float64).ravel()
+        if len(center) == 0:
+            center = np.zeros(dim)
+        matrix = np.eye(4)
+        matrix[:dim, :dim] = rotation
+        # ITK: T(p) = R (p - c) + t + c
+        matrix[:dim, 3] = translation + center - rotation @ center
+        return cls(matrix)
+
+    @classmethod
+    def load(cls, fname):
+        """Read an ITK text transform file (.txt) or an ANTs binary transform file (.mat)."""
+        if fname.endswith('.mat'):
+            content = loadmat(fname)
+            for key in content:
+                if key.startswith(AFFINE_TRANSFORM_TYPES):
+                    return cls.from_parameters(content[key], content.get('fixed', []), int(key.split('_')[-1]))
+            raise ValueError(f"{fname} does not contain an affine transformation")
+
+        fields = {}
+        with open(fname) as f:
+            for line in f:
+                if ':' in line and not line.startswith('#'):
+                    key, value = line.split(':', 1)
+                    if key.strip() in fields:
+                        raise ValueError(f"{fname} contains several transformations, which is not supported")
+                    fields[key.strip()] = value.split()
+        transform_type = fields.get('Transform', [''])[0]
+        if not transform_type.startswith(AFFINE_TRANSFORM_TYPES):
+            raise ValueError(f"Transformation '{transform_type}' of {fname} is not supported")
+        return cls.from_parameters([float(v) for v in fields['Parameters']],
+                                   [float(v) for v in fields.get('FixedParameters', [])],
+                                   int(transform_type.split('_')[-1]))
+
+    def inverse(self):
+        return AffineTransform(np.linalg.inv(self.matrix))
+
+    def transform_points(self, points):
+        """
+        :param points: (n, 3) array of LPS coordinates.
+        :return: (n, 3) array of transformed LPS coordinates.
+        """
+        return points @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+
+
+class DisplacementFieldTransform:
+    """
+    ITK displacement field, i.e. a 5D NIfTI file (nx, ny, nz, 1, 2 or 3) with a 'vector' intent, whose vectors are
+    LPS displacements. The field is only read when points are transformed for the first time.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._field = None
+        self._lps2vox = None
+
+    def _load(self):
+        if self._field is None:
+            im_field = Image(self.fname)
+            data = np.asarray(im_field.data, dtype=np.float64)
+            self._field = data.reshape(data.shape[:3] + (data.shape[-1],))
+            self._lps2vox = np.linalg.inv(RAS2LPS @ im_field.hdr.get_best_affine())
+        return self._field, self._lps2vox
+
+    def transform_points(self, points):
+        """
+        :param points: (n, 3) array of LPS coordinates.
+        :return: (n, 3) array of transformed LPS coordinates. As in ITK, the displacement is null outside the field.
+        """
+        field, lps2vox = self._load()
+        coords = (points @ lps2vox[:3, :3].T + lps2vox[:3, 3]).T
+        inside = _inside_grid(coords, field.shape[:3])
+        points_out = points.copy()
+        for i in range(min(field.shape[3], 3)):
+            points_out[inside, i] += map_coordinates(field[..., i], coords[:, inside], order=1, mode='nearest')
+        return points_out
+
+
+class CompositeTransform:
+    """Chain of transformations, the first transformation of the list being applied first to the points."""
+
+    def __init__(self, transforms):
+        self.transforms = list(transforms)
+
+    def transform_points(self, points):
+        for transform in self.transforms:
+            points = transform.transform_points(points)
+        return points
+
+
+def load_transforms(fnames, fnames_inv=()):
+    """
+    Load a list of transformations, as given to sct_apply_transfo. Displacement fields are only read when the
+    transformation is used.
+
+    :param fnames: list of displacement fields (.nii, .nii.gz) and affine transformations (.txt, .mat), in the order in
+        which they transform the source image (i.e. the last one is defined in the destination space), like the '-w'
+        option of sct_apply_transfo.
+    :param fnames_inv: affine transformations of `fnames` that should be inverted.
+    :return: CompositeTransform mapping points of the destination space to the source space.
+    """
+    transforms = []
+    for fname in reversed(fnames):
+        ext = splitext(fname)[1]
+        if ext in ['.nii', '.nii.gz']:
+            if fname in fnames_inv:
+                raise ValueError(f"Displacement field {fname} cannot be inverted, use the inverse displacement field "
+                                 f"instead")
+            transforms.append(DisplacementFieldTransform(fname))
+        elif ext in ['.txt', '.mat']:
+            transform = AffineTransform.load(fname)
+            transforms.append(transform.inverse() if fname in fnames_inv else transform)
+        else:
+            raise ValueError(f"Transformation file {fname} is not supported")
+    return CompositeTransform(transforms)
+
+
+def _inside_grid(coords, shape):
+    """Points whose continuous voxel coordinates (3, n) lie within half a voxel of the grid, as in ITK."""
+    inside = np.ones(coords.shape[1], dtype=bool)
+    for axis, size in enumerate(shape):
+        inside &= (coords[axis] >= -0.5) & (coords[axis] < size - 0.5)
+    return inside
+
+
+def _iter_slabs(shape, vox2lps):
+    """
+    Iterate over slabs of slices (along the third axis) of a grid.
+
+    :return: tuples (slab, points) of the slice of the slab, and the (n, 3) LPS coordinates of its voxels.
+    """
+    nx, ny, nz = shape
+    n_slices = max(1, MAX_POINTS_PER_SLAB // (nx * ny))
+    for z_start in range(0, nz, n_slices):
+        slab = slice(z_start, min(z_start + n_slices, nz))
+        vox = np.stack(np.meshgrid(np.arange(nx), np.arange(ny), np.arange(slab.start, slab.stop), indexing='ij'),
+                       axis=-1).reshape((-1, 3))
+        yield slab, vox @ vox2lps[:3, :3].T + vox2lps[:3, 3]
+
+
+def _grid_shape(im):
+    """Spatial shape of an image, 2D images being considered as a single slice."""
+    shape = im.data.shape[:3]
+    return shape + (1,) * (3 - len(shape))
+
+
+def compose_displacement_field(transform, im_ref):
+    """
+    Compose transformations into a single displacement field defined in the space of a reference image (same as
+    `isct_ComposeMultiTransform`).
+
+    :param transform: transformation mapping points of the reference space (see `load_transforms`).
+    :param im_ref: Image defining the space of the displacement field.
+    :return: Image of the displacement field (nx, ny, nz, 1, 3), or (nx, ny, 1, 1, 2) for a 2D reference image.
+    """
+    shape = _grid_shape(im_ref)
+    n_components = 2 if im_ref.data.ndim == 2 else 3
+    vox2lps = RAS2LPS @ im_ref.hdr.get_best_affine()
+    data_warp = np.zeros(shape + (1, n_components), dtype=np.float32)
+    for slab, points in _iter_slabs(shape, vox2lps):
+        displacement = transform.transform_points(points) - points
+        data_warp[:, :, slab, 0, :] = displacement[:, :n_components].reshape(
+            (shape[0], shape[1], slab.stop - slab.start, n_components))
+
+    hdr_warp = im_ref.hdr.copy()
+    hdr_warp.set_intent('vector', (), '')
+    hdr_warp.set_data_dtype(np.float32)
+    return Image(data_warp, hdr=hdr_warp)
+
+
+def apply_transforms(im_src, im_ref, transform, interp='spline'):
+    """
+    Resample an image in the space of a reference image (same as `isct_antsApplyTransforms`). Each voxel of the
+    reference space is mapped to the source image by the transformation, and is null outside of the source image.
+
+    :param im_src: Image to resample. For 4D images, each volume is resampled (the transformation being evaluated only
+        once for all the volumes).
+    :param im_ref: Image defining the output space.
+    :param transform: transformation mapping points of the reference space to the source space (see
+        `load_transforms`).
+    :param interp: {'nn', 'linear', 'spline'}
+    :return: Image with the grid of im_ref, and the same number of volumes as im_src. Its data type is the one of im_src,
+        except for integer images interpolated with 'linear' or 'spline', which are resampled as float32.
+    """
+    order = INTERP_ORDER[interp]
+    # spline interpolation with mirror boundaries, as the BSpline interpolator of ITK
+    mode = 'mirror' if order > 1 else 'nearest'
+
+    shape_src = _grid_shape(im_src)
+    data_src = np.asarray(im_src.data).reshape(shape_src + (-1,))
+    volumes = [data_src[..., it] for it in range(data_src.shape[3])]
+    if order > 1:
+        # the spline coefficients are computed once, rather than for each slab
+        volumes = [spline_filter(volume, order=order, mode=mode, output=np.float64) for volume in volumes]
+    lps2vox_src = np.linalg.inv(RAS2LPS @ im_src.hdr.get_best_affine())
+
+    # nearest neighbour interpolation only copies values, so integer images (e.g. labels) can keep their data type
+    dtype = data_src.dtype if order == 0 or np.issubdtype(data_src.dtype, np.floating) else np.dtype(np.float32)
+
+    shape_ref = _grid_shape(im_ref)
+    data_out = np.zeros(shape_ref + (len(volumes),), dtype=dtype)
+    for slab, points in _iter_slabs(shape_ref, RAS2LPS @ im_ref.hdr.get_best_affine()):
+        points_src = transform.transform_points(points)
+        coords = (points_src @ lps2vox_src[:3, :3].T + lps2vox_src[:3, 3]).T
+        inside = _inside_grid(coords, shape_src)
+        values = np.zeros(len(points), dtype=dtype)
+        for it, volume in enumerate(volumes):
+            values[inside] = map_coordinates(volume, coords[:, inside], order=order, mode=mode, prefilter=False,
+                                             output=np.float64)
+            data_out[:, :, slab, it] = values.reshape((shape_ref[0], shape_ref[1], slab.stop - slab.start))
+
+    # keep the spatial dimensions of the reference image, and the volumes of the source image
+    if im_src.data.ndim < 4:
+        data_out = data_out.reshape(im_ref.data.shape[:3])
+    hdr_out = im_ref.hdr.copy()
+    hdr_out.set_data_dtype(dtype)
+    if im_src.data.ndim >= 4:
+        hdr_out['pixdim'][4] = im_src.hdr['pixdim'][4]
+    return Image(data_out, hdr=hdr_out)
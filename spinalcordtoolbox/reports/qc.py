@@ -10,7 +10,8 @@ import os
 import json
 import logging
 import datetime
-from string import Template
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, List, Tuple, Union
 
 import numpy as np
@@ -23,6 +24,7 @@ from matplotlib.figure import Figure
 from matplotlib.axes import Axes
 from matplotlib.animation import FuncAnimation, PillowWriter
 import matplotlib.colors as color
+import matplotlib.image
 import matplotlib.patheffects as path_effects
 import portalocker
 
@@ -32,6 +34,20 @@ from spinalcordtoolbox.utils import list2cmdline, __version__, copy, extract_fna
 
 logger = logging.getLogger(__name__)
 
+# Append-only index of the QC entries, in the `_json` folder of the QC report
+QC_INDEX = 'qc_index.js'
+
+
+# Colormaps are built once per process, and shared by all the QC images
+@functools.lru_cache(maxsize=None)
+def _linear_colormap(colors, name=""):
+    return color.LinearSegmentedColormap.from_list(name, colors, N=256)
+
+
+@functools.lru_cache(maxsize=None)
+def _listed_colormap(colors):
+    return color.ListedColormap(colors)
+
 
 class QcImage:
     """
@@ -60,7 +76,7 @@ class QcImage:
     _ctl_colormap = ["#ff000099", '#ffff00']
 
     def __init__(self, qc_report, interpolation, action_list, process, stretch_contrast=True,
-                 stretch_contrast_method='contrast_stretching', fps=None):
+                 stretch_contrast_method='contrast_stretching', fps=None, n_threads=1):
         """
         :param qc_report: QcReport: The QC report object
         :param interpolation: str: Type of interpolation used in matplotlib
@@ -72,6 +88,10 @@ class QcImage:
         :param stretch_contrast_method: str: {'contrast_stretching', 'equalized'}: Method for stretching contrast
         :param fps: float: Number of frames per second for output gif images. It is only used for sct_fmri_moco and\
         sct_dmri_moco
+        :param n_threads: int: Number of threads used to stretch the contrast of the mosaics and, for 3D volumes, to
+                               encode the PNG images while the next figure is drawn. The GIF animations of
+                               sct_fmri_moco and sct_dmri_moco are encoded in the calling thread. With 1, everything is
+                               done in the calling thread.
         """
         self.qc_report = qc_report
         self.interpolation = interpolation
@@ -84,12 +104,15 @@ class QcImage:
                              "Try 'equalized' or 'contrast_stretching'")
         self._fps = fps
         self._centermass = None  # center of mass returned by slice.Axial.get_center()
+        self.n_threads = n_threads
+        self._executor = None
+        self._futures = []
 
     def listed_seg(self, mask, ax):
         """Create figure with red segmentation. Common scenario."""
         img = np.ma.masked_equal(mask, 0)
         ax.imshow(img,
-                  cmap=color.LinearSegmentedColormap.from_list("", self._seg_colormap),
+                  cmap=_linear_colormap(tuple(self._seg_colormap)),
                   norm=color.Normalize(vmin=0.5, vmax=1),
                   interpolation=self.interpolation,
                   aspect=float(self.aspect_mask))
@@ -103,8 +126,7 @@ class QcImage:
         color_white = color.colorConverter.to_rgba('white', alpha=0.0)
         color_blue = color.colorConverter.to_rgba('blue', alpha=0.7)
         color_cyan = color.colorConverter.to_rgba('cyan', alpha=0.8)
-        cmap = color.LinearSegmentedColormap.from_list('cmap_atlas',
-                                                       [color_white, color_blue, color_cyan], N=256)
+        cmap = _linear_colormap((color_white, color_blue, color_cyan), name='cmap_atlas')
         ax.imshow(values,
                   cmap=cmap,
                   interpolation=self.interpolation,
@@ -138,11 +160,10 @@ class QcImage:
 
     def label_vertebrae(self, mask, ax):
         """Draw vertebrae areas, then add text showing the vertebrae names"""
-        from matplotlib import colors
         img = np.rint(np.ma.masked_where(mask < 1, mask))
         labels = np.unique(img[np.where(~img.mask)]).astype(int)  # get available labels
         ax.imshow(img,
-                  cmap=colors.ListedColormap(self._labels_color[labels.min():labels.max()+1]),  # get color from min label and max label
+                  cmap=_listed_colormap(tuple(self._labels_color[labels.min():labels.max()+1])),  # get color from min label and max label
                   interpolation=self.interpolation,
                   alpha=1,
                   aspect=float(self.aspect_mask))
@@ -183,7 +204,7 @@ class QcImage:
             # ax.text(cord[1]+5,cord[0]+5, str(mask[cord]), color='lime', clip_on=True)
         img = np.rint(np.ma.masked_where(mask < 1, mask))
         ax.imshow(img,
-                  cmap=color.ListedColormap(self._color_bin_red),
+                  cmap=_listed_colormap(tuple(self._color_bin_red)),
                   norm=color.Normalize(vmin=0, vmax=1),
                   interpolation=self.interpolation,
                   alpha=1,
@@ -216,7 +237,7 @@ class QcImage:
         mask[mask < 0.05] = 0  # Apply 0.5 threshold
         img = np.ma.masked_equal(mask, 0)
         ax.imshow(img,
-                  cmap=color.LinearSegmentedColormap.from_list("", self._ctl_colormap),
+                  cmap=_linear_colormap(tuple(self._ctl_colormap)),
                   norm=color.Normalize(vmin=0, vmax=1),
                   interpolation=self.interpolation,
                   aspect=float(self.aspect_mask))
@@ -231,13 +252,39 @@ class QcImage:
         self.qc_report.make_content_path()
         logger.info('QcImage: layout with %s slice', self.qc_report.plane)
 
-        if self.process in ['sct_fmri_moco', 'sct_dmri_moco']:
-            [images_after_moco, images_before_moco], centermass = qcslice_layout(qcslice)
-            self._centermass = centermass
-            self._make_QC_image_for_4d_volumes(images_after_moco, images_before_moco)
+        if self.n_threads > 1:
+            self._executor = ThreadPoolExecutor(self.n_threads)
+        try:
+            if self.process in ['sct_fmri_moco', 'sct_dmri_moco']:
+                [images_after_moco, images_before_moco], centermass = qcslice_layout(qcslice)
+                self._centermass = centermass
+                self._make_QC_image_for_4d_volumes(images_after_moco, images_before_moco)
+            else:
+                img, *mask = qcslice_layout(qcslice)
+                self._make_QC_image_for_3d_volumes(img, mask, plane=self.qc_report.plane)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _submit(self, func, *args, **kwargs):
+        """Run `func` in the thread pool (if any), or else right away."""
+        if self._executor is None:
+            func(*args, **kwargs)
         else:
-            img, *mask = qcslice_layout(qcslice)
-            self._make_QC_image_for_3d_volumes(img, mask, plane=self.qc_report.plane)
+            self._futures.append(self._executor.submit(func, *args, **kwargs))
+
+    def _map(self, func, iterable):
+        """Apply `func` to all the items, using the thread pool (if any)."""
+        if self._executor is None:
+            return [func(item) for item in iterable]
+        return list(self._executor.map(func, iterable))
+
+    def _wait(self):
+        """Wait for the submitted tasks to finish, and raise their errors (if any)."""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
 
     def _make_QC_image_for_3d_volumes(self, img, mask, plane):
         """
@@ -285,6 +332,7 @@ class QcImage:
             action(self, mask[i], ax)
         self._save(fig, self.qc_report.abs_overlay_img_path(), dpi=self.qc_report.dpi)
 
+        self._wait()
         self.qc_report.update_description_file()
 
     def _make_QC_image_for_4d_volumes(self, images_after_moco, images_before_moco):
@@ -298,9 +346,8 @@ class QcImage:
 
         size_fig = [5, 10 * images_after_moco[0].shape[0] / images_after_moco[0].shape[1] + 0.5]
         if self._stretch_contrast:
-            for i in range(len(images_after_moco)):
-                images_after_moco[i] = self._func_stretch_contrast(images_after_moco[i])
-                images_before_moco[i] = self._func_stretch_contrast(images_before_moco[i])
+            images_after_moco = self._map(self._func_stretch_contrast, images_after_moco)
+            images_before_moco = self._map(self._func_stretch_contrast, images_before_moco)
 
         self._generate_and_save_gif(images_before_moco, images_after_moco, size_fig)
         self._generate_and_save_gif(images_before_moco, images_after_moco, size_fig, is_mask=True)
@@ -440,11 +487,17 @@ class QcImage:
         :return:
         """
         logger.debug('Save image %s', img_path)
-        fig.savefig(img_path,
-                    format=format,
-                    bbox_inches=None,
-                    transparent=True,
-                    dpi=dpi)
+        # Same as `fig.savefig(img_path, format=format, bbox_inches=None, transparent=True, dpi=dpi)`, except that only
+        # the drawing is done here: the pixels are encoded by the thread pool (if any), while the next figure is drawn.
+        fig.patch.set_facecolor('none')
+        fig.patch.set_edgecolor('none')
+        for ax in fig.axes:
+            ax.patch.set_facecolor('none')
+            ax.patch.set_edgecolor('none')
+        fig.dpi = dpi
+        fig.canvas.draw()
+        rgba = np.array(fig.canvas.buffer_rgba())
+        self._submit(matplotlib.image.imsave, img_path, rgba, format=format, origin='upper', dpi=dpi)
 
 
 class QcReport:
@@ -512,20 +565,15 @@ class QcReport:
         os.makedirs(target_img_folder, exist_ok=True)
 
     def update_description_file(self):
-        """Create the description file with a JSON structure"""
-        path_qc = self.path_qc
-        html_path = os.path.join(path_qc, 'index.html')
-        # Make sure the file exists before trying to open it in 'r+' mode
-        open(html_path, 'a').close()
-        # NB: We use 'r+' because it allows us to open an existing file for locking *without* immediately truncating the
-        # existing contents prior to opening. We can then use this file to overwrite the contents later in the function.
-        dest_file = open(html_path, 'r+', encoding="utf-8")
-        # We lock `index.html` at the start of this function so that we halt any other processes *before* they have a
-        # chance to generate or read any .json files. This ensues that the last process to write to index.html has read
-        # in all of the available .json files, preventing:
-        # https://github.com/spinalcordtoolbox/spinalcordtoolbox/pull/3701#discussion_r816300380
-        portalocker.lock(dest_file, portalocker.LOCK_EX)
+        """
+        Add the QC entry to the report.
 
+        Each entry is written to its own JSON file, and appended as a single line to the index `_json/qc_index.js`,
+        which is loaded by `index.html`. The page itself is static, so adding an entry doesn't require reading the
+        previous entries or rendering the page again (which would be O(N^2) when running many subjects in parallel).
+        """
+        path_qc = self.path_qc
+        assets_path = os.path.join(os.path.dirname(__file__), 'assets')
         output = {
             'cwd': self.cwd,
             'cmdline': "{} {}".format(self.command, self.args),
@@ -542,25 +590,28 @@ class QcReport:
             'qc': ""
         }
         logger.debug('Description file: %s', self.qc_results)
-        # results = []
         # Create path to store json files
         path_json, _ = os.path.split(self.qc_results)
-        if not os.path.exists(path_json):
-            os.makedirs(path_json, exist_ok=True)
-
-        # Create json file for specific QC entry
-        with open(self.qc_results, 'w+') as qc_file:
-            json.dump(output, qc_file, indent=1)
-
-        # Append entry to existing HTML file
-        json_data = get_json_data_from_path(path_json)
-        assets_path = os.path.join(os.path.dirname(__file__), 'assets')
-        with open(os.path.join(assets_path, 'index.html'), encoding="utf-8") as template_index:
-            template = Template(template_index.read())
-            output = template.substitute(sct_json_data=json.dumps(json_data))
-        # Empty the HTML file before writing, to make sure there's no leftover junk at the end
-        dest_file.truncate()
-        dest_file.write(output)
+        os.makedirs(path_json, exist_ok=True)
+
+        # The index is only locked while appending a line. JSON files are also written while holding the lock, so that
+        # all the JSON files found when creating the index are from reports that predate it (see below).
+        with open(os.path.join(path_json, QC_INDEX), 'a', encoding="utf-8") as index_file:
+            portalocker.lock(index_file, portalocker.LOCK_EX)
+            index_file.seek(0, os.SEEK_END)
+            if index_file.tell() == 0:
+                # New index: add the entries of a report created by a previous version of SCT (if any), and (re)write
+                # the page, which used to embed the entries.
+                for entry in get_json_data_from_path(path_json):
+                    index_file.write(format_qc_index_line(entry))
+                copy(os.path.join(assets_path, 'index.html'), os.path.join(path_qc, 'index.html'))
+
+            # Create json file for specific QC entry
+            with open(self.qc_results, 'w+') as qc_file:
+                json.dump(output, qc_file, indent=1)
+            index_file.write(format_qc_index_line(output))
+            index_file.flush()
+            portalocker.unlock(index_file)
 
         for path in ['css', 'js', 'imgs', 'fonts']:
             src_path = os.path.join(assets_path, '_assets', path)
@@ -571,15 +622,27 @@ class QcReport:
                 if not os.path.isfile(os.path.join(dest_path, file_)):
                     copy(os.path.join(src_path, file_), dest_path)
 
-        dest_file.flush()
-        portalocker.unlock(dest_file)
-        dest_file.close()
+
+def format_qc_index_line(entry):
+    """Format a QC entry as a line of the QC index (a JavaScript statement, so that the page can load it locally)"""
+    return f"sct_data.push({json.dumps(entry)});\n"
+
+
+def read_qc_index(path_qc):
+    """Read the entries of the QC index of a QC report, in the order in which they were added"""
+    prefix, suffix = format_qc_index_line(None).split('null')
+    results = []
+    with open(os.path.join(path_qc, '_json', QC_INDEX), encoding="utf-8") as index_file:
+        for line in index_file:
+            if line.startswith(prefix) and line.endswith(suffix):
+                results.append(json.loads(line[len(prefix):-len(suffix)]))
+    return results
 
 
 def get_json_data_from_path(path_json):
     """Read all json files present in the given path, and output an aggregated json structure"""
     results = []
-    for file_json in glob.iglob(os.path.join(path_json, '*.json')):
+    for file_json in sorted(glob.iglob(os.path.join(path_json, '*.json'))):
         logger.debug('Opening: ' + file_json)
         with open(file_json, 'r+') as fjson:
             results.append(json.load(fjson))
@@ -587,7 +650,7 @@ def get_json_data_from_path(path_json):
 
 
 def generate_qc(fname_in1, fname_in2=None, fname_seg=None, plane=None, args=None, path_qc=None, dataset=None,
-                subject=None, process=None, fps=None):
+                subject=None, process=None, fps=None, n_threads=1):
     """
     Generate a QC entry allowing to quickly review results. This function is the entry point and is called by SCT
     scripts (e.g. sct_propseg).
@@ -602,6 +665,8 @@ def generate_qc(fname_in1, fname_in2=None, fname_seg=None, plane=None, args=None
     :param subject: str: Subject name
     :param process: str: Name of SCT function. e.g., sct_propseg
     :param fps: float: Number of frames per second for output gif images. Used only for sct_frmi_moco and sct_dmri_moco.
+    :param n_threads: int: Number of threads used to stretch the contrast of the mosaics and to encode the PNG images
+                           (GIF animations are encoded in a single thread).
     :return: None
     """
     logger.info('\n*** Generate Quality Control (QC) html report ***')
@@ -717,6 +782,7 @@ def generate_qc(fname_in1, fname_in2=None, fname_seg=None, plane=None, args=None
         process=process,
         stretch_contrast_method='equalized',
         fps=fps,
+        n_threads=n_threads,
     ).layout(
         qcslice_layout=qcslice_layout,
         qcslice=qcslice,
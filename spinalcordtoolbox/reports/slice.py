@@ -12,10 +12,10 @@ import logging
 import math
 
 import numpy as np
-from scipy.ndimage import center_of_mass
+from scipy.ndimage import affine_transform
 from nibabel.nifti1 import Nifti1Image
 
-from spinalcordtoolbox.image import Image, split_img_data
+from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.resampling import resample_nib
 from spinalcordtoolbox.cropping import ImageCropper
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
@@ -182,6 +182,47 @@ class Slice(object):
         matrix[start_row:end_row, start_col:end_col] = patch
         return matrix
 
+    @staticmethod
+    def crop_slices(data, centers_x, centers_y, width, height):
+        """Crops all the slices of a volume at once, around their center
+
+        Same as `crop()` applied to each slice `data[i]`, except that crop areas which extend past the end of the slice
+        are shifted back inside the slice, so that all the cropped slices have the same size.
+
+        :param data: Array of shape (n_slices, nx, ny, ...) (e.g. axial slices of a 3D or 4D volume in SAL orientation)
+        :param centers_x: Centers of the crop areas in the x axis, for each slice
+        :param centers_y: Centers of the crop areas in the y axis, for each slice
+        :param width: The width from the center
+        :param height: The height from the center
+        :returns: array of shape (n_slices, 2*width, 2*height, ...)
+        """
+        n_slices, n_x, n_y = data.shape[:3]
+        width = min(width, n_x // 2)
+        height = min(height, n_y // 2)
+        start_row = np.clip(np.asarray(centers_x, dtype=int) - width, 0, n_x - width * 2)
+        start_col = np.clip(np.asarray(centers_y, dtype=int) - height, 0, n_y - height * 2)
+        rows = start_row[:, np.newaxis] + np.arange(width * 2)
+        cols = start_col[:, np.newaxis] + np.arange(height * 2)
+        return data[np.arange(n_slices)[:, np.newaxis, np.newaxis], rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+
+    @staticmethod
+    def assemble_mosaic(patches, column, matrix_sz):
+        """Places all the patches in a "big canvas" at once, row by row (same as `add_slice()` for each patch)
+
+        :param patches: array of shape (n_patches, height, width)
+        :param column: number of columns in mosaic
+        :param matrix_sz: size of the canvas
+        :return: matrix
+        """
+        n_patches, height, width = patches.shape
+        row = math.ceil(n_patches / column)
+        grid = np.zeros((row * column, height, width))
+        grid[:n_patches] = patches
+        grid = grid.reshape(row, column, height, width).transpose(0, 2, 1, 3).reshape(row * height, column * width)
+        matrix = np.zeros(matrix_sz)
+        matrix[:grid.shape[0], :grid.shape[1]] = grid
+        return matrix
+
     @staticmethod
     def inf_nan_fill(A):
         """Interpolate inf and NaN values with neighboring values in a 1D array, in-place.
@@ -224,11 +265,11 @@ class Slice(object):
         """
         logger.info('Compute center of mass at each slice')
         data = np.array(image.data)  # we cast np.array to overcome problem if inputing nii format
-        nz = image.dim[0]  # SAL orientation
-        centers_x = np.zeros(nz)
-        centers_y = np.zeros(nz)
-        for i in range(nz):
-            centers_x[i], centers_y[i] = center_of_mass(data[i, :, :])
+        # Same as `center_of_mass(data[i, :, :])`, for all the slices at once (SAL orientation). Empty slices give NaN.
+        normalizer = data.sum(axis=(1, 2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centers_x = (data.sum(axis=2) * np.arange(data.shape[1])).sum(axis=1) / normalizer
+            centers_y = (data.sum(axis=1) * np.arange(data.shape[2])).sum(axis=1) / normalizer
         Slice.inf_nan_fill(centers_x)
         Slice.inf_nan_fill(centers_y)
         return centers_x, centers_y
@@ -289,7 +330,10 @@ class Slice(object):
                 new_size = [p_resample, p_resample, image.dim[6]]
             else:
                 raise TypeError(f"Unexpected slice type: {type(self)}")
-            nii_r = resample_nib(nii, new_size=new_size, new_size_type='mm', interpolation=dict_interp[type_img])
+            if isinstance(self, Axial):
+                nii_r = self._resample_axial_planes(nii, new_size, order=1 if type_img == 'seg' else 2)
+            else:
+                nii_r = resample_nib(nii, new_size=new_size, new_size_type='mm', interpolation=dict_interp[type_img])
 
         # Otherwise, resampling to the space of the reference image
         else:
@@ -313,6 +357,52 @@ class Slice(object):
             change_orientation(image.orientation)
         return image_r
 
+    @staticmethod
+    def _resample_axial_planes(nii, new_size, order):
+        """
+        Same as `resample_nib(nii, new_size=new_size, new_size_type='mm', ...)` when the S-I axis (first axis in SAL
+        orientation) is left untouched, but for all the axial slices (and all the volumes of a 4D image) at once.
+
+        The resampling of each axis is a linear operation, so it is applied as a matrix product along the A-P and R-L
+        axes, instead of interpolating each 3D volume separately.
+
+        :param nii: nibabel image (3D or 4D) in SAL orientation
+        :param new_size: list of float: Resolution in mm of the 3 spatial axes. The resolution of the S-I axis is ignored.
+        :param order: Order of the spline interpolation (1: linear, 2: spline, as in `resample_nib()`)
+        :return: resampled nibabel image (the 4th axis of 4D images is kept as is)
+        """
+        data = np.asanyarray(nii.dataobj)
+        zooms = nii.header.get_zooms()
+        data_r = data
+        R = np.eye(4)
+        for axis in [1, 2]:
+            n_in = data.shape[axis]
+            n_out = int(np.round(n_in * float(zooms[axis]) / float(new_size[axis])))
+            if n_out == 0:
+                raise ZeroDivisionError(f"Destination size is zero for dimension {axis}. You are trying to resample to "
+                                        f"an unrealistic dimension. Check your NIFTI pixdim values to make sure they are "
+                                        f"not corrupted.")
+            R[axis, axis] = n_in / n_out
+            # Column `i` of the matrix is the interpolation of the i-th basis vector
+            matrix = np.empty((n_out, n_in))
+            for i, basis in enumerate(np.eye(n_in)):
+                matrix[:, i] = affine_transform(basis, np.array([[R[axis, axis]]]), output_shape=(n_out,),
+                                                order=order, mode='nearest')
+            data_r = np.moveaxis(np.tensordot(matrix, data_r, axes=(1, axis)), 0, axis)
+        if np.issubdtype(data.dtype, np.integer):
+            # Round half away from zero, like scipy.ndimage does for integer outputs
+            data_r = np.sign(data_r) * np.floor(np.abs(data_r) + 0.5)
+        data_r = data_r.astype(data.dtype)
+        affine = nii.affine.copy()
+        affine[3, :] = np.array([0, 0, 0, 1])
+        if nii.ndim == 4:
+            # As in `resample_nib()`, 4D volumes are stored as float64
+            data_r = data_r.astype(np.float64)
+            nii_r = Nifti1Image(data_r, np.dot(affine, R))
+            nii_r.header.set_zooms(list(nii_r.header.get_zooms()[0:3]) + [zooms[3]])
+            return nii_r
+        return Nifti1Image(data_r, np.dot(affine, R), nii.header)
+
 
 class Axial(Slice):
     """The axial representation of a slice"""
@@ -347,8 +437,33 @@ class Axial(Slice):
         :return: list of tuples, each tuple representing the center of each square of the mosaic.
         """
 
-        # Calculate number of columns to display on the report
         dim = self.get_dim(self._images[0])  # dim represents the 3rd dimension of the 3D matrix
+        size, nb_column, matrix_sz, centers_mosaic = self._mosaic_layout(dim)
+
+        # Get center of mass for each slice of the image. If the input is the cord segmentation, these coordinates are
+        # used to center the image on each panel of the mosaic.
+        centers_x, centers_y = self.get_center()
+
+        matrices = list()
+        for image in self._images:
+            # crop slices around center of mass and add slices to the matrix layout
+            # TODO: resample there after cropping based on physical dimensions
+            patches = self.crop_slices(image.data[:dim], centers_x, centers_y, size, size)
+            matrices.append(self.assemble_mosaic(patches, nb_column, matrix_sz))
+        if return_center is True:
+            return matrices, centers_mosaic
+        else:
+            return matrices
+
+    @staticmethod
+    def _mosaic_layout(dim):
+        """
+        Calculates how many squares will fit in a row based on the column and the size
+
+        :param dim: number of slices
+        :return: half size of the squares, number of columns, size of the mosaic, and center of each square
+        """
+        # Calculate number of columns to display on the report
         size = 15  # (By default, size=15 -> 30x30 squares -> 20 columns)
         nb_column = 600 // (size * 2)
 
@@ -361,44 +476,25 @@ class Axial(Slice):
         for irow in range(nb_row):
             for icol in range(nb_column):
                 centers_mosaic.append((icol * size * 2 + size, irow * size * 2 + size))
-
-        # Get center of mass for each slice of the image. If the input is the cord segmentation, these coordinates are
-        # used to center the image on each panel of the mosaic.
-        centers_x, centers_y = self.get_center()
-
-        matrices = list()
-        for image in self._images:
-            matrix = np.zeros(matrix_sz)
-            for i in range(dim):
-                x = int(centers_x[i])
-                y = int(centers_y[i])
-                # crop slice around center of mass and add slice to the matrix layout
-                # TODO: resample there after cropping based on physical dimensions
-                self.add_slice(matrix, i, nb_column, self.crop(self.get_slice(image.data, i), x, y, size, size))
-
-            matrices.append(matrix)
-        if return_center is True:
-            return matrices, centers_mosaic
-        else:
-            return matrices
+        return size, nb_column, matrix_sz, centers_mosaic
 
     def mosaics_through_time(self):
         """Obtain mosaics for each volume
 
+        The slices of all the volumes are cropped at once, around the center of mass of the segmentation.
+
         :return: list of tuples of numpy.ndarray containing the mosaics of each volumes
         """
         mosaics = list()
         self._image_seg = self._images[0].copy()  # segmentation used for cropping
+        centers_x, centers_y = self.get_center()
 
-        for i, img in enumerate(self._4d_images):
-            # The absolutepath is changed to None after change_orientation see issue #3304
-            img.absolutepath = self._absolute_paths[i]
-
-            im_t_list = (split_img_data(img, dim=3, squeeze_data=True))  # Split along T dimension
-            self._images.clear()
-            self._images = im_t_list
-            matrices, centers_mosaic = self.mosaic(return_center=True)
-            mosaics.append(matrices)
+        for img in self._4d_images:
+            dim = self.get_dim(img)
+            size, nb_column, matrix_sz, centers_mosaic = self._mosaic_layout(dim)
+            patches = self.crop_slices(img.data[:dim], centers_x, centers_y, size, size)  # (n_slices, h, w, n_t)
+            mosaics.append([self.assemble_mosaic(patches[..., it], nb_column, matrix_sz)
+                            for it in range(patches.shape[3])])
         return mosaics, centers_mosaic
 
 
@@ -481,12 +577,8 @@ class Sagittal(Slice):
         matrices = list()
         for image in self._images:
             image_cropped = cropper.crop(img_in=image)
-            matrix = np.zeros(matrix_sz)
-            for i in range(nb_slices):
-                # Fetch the sagittal slice (which has already been cropped)
-                lrslice_cropped = self.get_slice(image_cropped.data, i)
-                # Add the cropped slice to the matrix layout
-                self.add_slice(matrix, i, nb_column, lrslice_cropped)
-            matrices.append(matrix)
+            # Add the sagittal slices (which have already been cropped) to the matrix layout
+            lrslices_cropped = np.moveaxis(image_cropped.data, 2, 0)[:nb_slices]
+            matrices.append(self.assemble_mosaic(lrslices_cropped, nb_column, matrix_sz))
 
         return matrices
@@ -11,11 +11,11 @@ import itertools
 from typing import Sequence
 
 import numpy as np
-from skimage.feature import graycomatrix, graycoprops
 
 from spinalcordtoolbox.image import Image, add_suffix, zeros_like, concat_data
+from spinalcordtoolbox.texture import glcm_texture
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, ActionCreateFolder, display_viewer_syntax
-from spinalcordtoolbox.utils.sys import init_sct, printv, sct_progress_bar, set_loglevel
+from spinalcordtoolbox.utils.sys import init_sct, printv, set_loglevel
 from spinalcordtoolbox.utils.fs import tmp_create, extract_fname, copy, rmtree
 
 
@@ -88,6 +88,15 @@ def get_parser():
         type=int,
         choices=(0, 1),
         default=int(Param().rm_tmp))
+    optional.add_argument(
+        "-jobs", "-j",
+        metavar=Metavar.int,
+        type=int,
+        default=Param().n_jobs,
+        help="Number of processes used to compute the texture, slices being distributed across processes. "
+             "Either an integer greater than or equal to one, or 0 or a negative integer specifying the number of "
+             "available cores minus that number. For example '-jobs -1' will use all the available cores minus one, "
+             "and '-jobs 0' will use all available cores.")
     optional.add_argument(
         '-v',
         metavar=Metavar.int,
@@ -233,34 +242,14 @@ class ExtractGLCM:
             dct_metric[m] = im_2save
             # dct_metric[m] = Image(self.fname_metric_lst[m])
 
-        with sct_progress_bar() as pbar:
-            for im_z, seg_z, zz in zip(self.dct_im_seg['im'], self.dct_im_seg['seg'], range(len(self.dct_im_seg['im']))):
-                for xx in range(im_z.shape[0]):
-                    for yy in range(im_z.shape[1]):
-                        if not seg_z[xx, yy]:
-                            continue
-                        if xx < offset or yy < offset:
-                            continue
-                        if xx > (im_z.shape[0] - offset - 1) or yy > (im_z.shape[1] - offset - 1):
-                            continue  # to check if the whole glcm_window is in the axial_slice
-                        if False in np.unique(seg_z[xx - offset: xx + offset + 1, yy - offset: yy + offset + 1]):
-                            continue  # to check if the whole glcm_window is in the mask of the axial_slice
-
-                        glcm_window = im_z[xx - offset: xx + offset + 1, yy - offset: yy + offset + 1]
-                        glcm_window = glcm_window.astype(np.uint8)
-
-                        dct_glcm = {}
-                        for a in self.param_glcm.angle.split(','):  # compute the GLCM for self.param_glcm.distance and for each self.param_glcm.angle
-                            dct_glcm[a] = graycomatrix(glcm_window,
-                                                       [self.param_glcm.distance], [np.radians(int(a))],
-                                                       symmetric=self.param_glcm.symmetric,
-                                                       normed=self.param_glcm.normed)
-
-                        for m in self.metric_lst:  # compute the GLCM property (m.split('_')[0]) of the voxel xx,yy,zz
-                            dct_metric[m].data[xx, yy, zz] = graycoprops(dct_glcm[m.split('_')[2]], m.split('_')[0])[0][0]
-
-                        pbar.set_postfix(pos="{}/{}".format(zz, len(self.dct_im_seg["im"])))
-                        pbar.update(1)
+        # compute the GLCM properties of all the voxels whose window is entirely inside the mask
+        features = list(dict.fromkeys(m.split('_')[0] for m in self.metric_lst))
+        angles = [int(a) for a in self.param_glcm.angle.split(',')]
+        texture = glcm_texture(np.stack(self.dct_im_seg['im'], axis=2), np.stack(self.dct_im_seg['seg'], axis=2),
+                               offset, angles, features, jobs=self.param.n_jobs)
+        for m in self.metric_lst:
+            feature, _, angle = m.split('_')
+            dct_metric[m].data = texture[feature, int(angle)]
 
         for m in self.metric_lst:
             fname_out = add_suffix("".join(extract_fname(self.param.fname_im)[1:]), '_' + m)
@@ -280,6 +269,7 @@ class Param:
         self.verbose = 1
         self.dim = 'ax'
         self.rm_tmp = True
+        self.n_jobs = 1
 
 
 class ParamGLCM(object):
@@ -333,6 +323,7 @@ def main(argv: Sequence[str]):
         param.dim = arguments.dim
     if arguments.r is not None:
         param.rm_tmp = bool(arguments.r)
+    param.n_jobs = arguments.jobs
 
     # create the GLCM constructor
     glcm = ExtractGLCM(param=param, param_glcm=param_glcm)
@@ -17,6 +17,7 @@ from spinalcordtoolbox.image import Image, generate_output_file
 from spinalcordtoolbox.cropping import ImageCropper
 from spinalcordtoolbox.math import dilate
 from spinalcordtoolbox.labels import cubic_to_point
+from spinalcordtoolbox.registration.transforms import use_python_transforms, load_transforms, apply_transforms
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, get_interpolation, display_viewer_syntax
 from spinalcordtoolbox.utils.sys import init_sct, run_proc, printv, set_loglevel
 from spinalcordtoolbox.utils.fs import tmp_create, rmtree, extract_fname, copy
@@ -193,23 +194,43 @@ class Transform:
         # nx, ny, nz, nt, px, py, pz, pt = get_dimension(fname_src)
         printv('  ' + str(nx) + ' x ' + str(ny) + ' x ' + str(nz) + ' x ' + str(nt), verbose)
 
-        # if 3d
+        # If requested with SCT_PYTHON_TRANSFORMS, displacement fields and affine transformations are applied in Python,
+        # without calling the ANTs binaries
+        transform = None
+        if use_python_transforms():
+            try:
+                transform = load_transforms(list_warp, self.list_warpinv)
+            except ValueError as e:
+                printv(f"\n{e}: falling back to isct_antsApplyTransforms.", verbose)
+
         if nt == 1:
-            # Apply transformation
-            printv('\nApply transformation...', verbose)
             if nz in [0, 1]:
                 dim = '2'
             else:
                 dim = '3'
-            # if labels, dilate before resampling
+        else:
+            dim = '4'
             if islabel:
-                printv("\nDilate labels before warping...")
-                path_tmp = tmp_create(basename="apply-transfo-3d-label")
-                fname_dilated_labels = os.path.join(path_tmp, "dilated_data.nii")
-                # dilate points
-                dilate(Image(fname_src), 4, 'ball').save(fname_dilated_labels)
-                fname_src = fname_dilated_labels
+                raise NotImplementedError
 
+        # if labels, dilate before resampling
+        if islabel:
+            printv("\nDilate labels before warping...")
+            path_tmp = tmp_create(basename="apply-transfo-3d-label")
+            fname_dilated_labels = os.path.join(path_tmp, "dilated_data.nii")
+            # dilate points
+            dilate(Image(fname_src), 4, 'ball').save(fname_dilated_labels)
+            fname_src = fname_dilated_labels
+
+        if transform is not None:
+            # 4D images are resampled all at once, the transformation being evaluated only once for all volumes
+            printv("\nApply transformation and resample to destination space...", verbose)
+            apply_transforms(Image(fname_src), Image(fname_dest), transform, interp=self.interp).save(fname_out)
+
+        # if 3d
+        elif nt == 1:
+            # Apply transformation
+            printv('\nApply transformation...', verbose)
             printv("\nApply transformation and resample to destination space...", verbose)
             run_proc(['isct_antsApplyTransforms',
                       '-d', dim,
@@ -220,10 +241,6 @@ class Transform:
 
         # if 4d, loop across the T dimension
         else:
-            if islabel:
-                raise NotImplementedError
-
-            dim = '4'
             path_tmp = tmp_create(basename="apply-transfo-4d")
 
             # convert to nifti into temp folder
@@ -12,6 +12,7 @@ import os
 from typing import Sequence
 
 import numpy as np
+from scipy.spatial import cKDTree
 
 from spinalcordtoolbox.image import Image, add_suffix, empty_like, change_orientation
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar
@@ -32,6 +33,7 @@ class Param:
     def __init__(self):
         self.debug = 0
         self.thinning = True
+        self.mode = '2d'
         self.verbose = 1
 
 
@@ -61,105 +63,73 @@ class Thinning:
             self.thinned_image.absolutepath = add_suffix(self.image.absolutepath, "_thinned")
 
     # ------------------------------------------------------------------------------------------------------------------
-    def get_neighbours(self, x, y, image):
+    def get_neighbours(self, image):
         """
-        Return 8-neighbours of image point P1(x,y), in a clockwise order
-        code from https://github.com/linbojin/Skeletonization-by-Zhang-Suen-Thinning-Algorithm
-        :param x:
-        :param y:
+        Return the 8-neighbours of all the points P1 of an image, in a clockwise order
+        The image is zero-padded, so points on its border have zero-valued neighbours outside of it.
         :param image:
-        :return:
+        :return: list of 8 arrays P2, P3, ..., P9, with the same shape as image
         """
-        # now = time.time()
-        x_1, y_1, x1, y1 = x - 1, y - 1, x + 1, y + 1
-        neighbours = [image[x_1][y], image[x_1][y1], image[x][y1], image[x1][y1],     # P2,P3,P4,P5
-                      image[x1][y], image[x1][y_1], image[x][y_1], image[x_1][y_1]]    # P6,P7,P8,P9
-        # t = time.time() - now
-        # printv('t neighbours: ', t)
-        return neighbours
+        padded = np.pad(image, 1)
+        nx, ny = image.shape
+        shifts = [(-1, 0), (-1, 1), (0, 1), (1, 1),     # P2,P3,P4,P5
+                  (1, 0), (1, -1), (0, -1), (-1, -1)]   # P6,P7,P8,P9
+        return [padded[1 + dx:1 + dx + nx, 1 + dy:1 + dy + ny] for dx, dy in shifts]
 
     # ------------------------------------------------------------------------------------------------------------------
     def transitions(self, neighbours):
         """
-        No. of 0,1 patterns (transitions from 0 to 1) in the ordered sequence
-        code from https://github.com/linbojin/Skeletonization-by-Zhang-Suen-Thinning-Algorithm
-        :param neighbours:
+        No. of 0,1 patterns (transitions from 0 to 1) in the ordered sequence, for all the points of an image
+        :param neighbours: list of 8 arrays P2, P3, ..., P9 (see get_neighbours)
         :return:
         """
-        # now = time.time()
         n = neighbours + neighbours[0:1]      # P2, P3, ... , P8, P9, P2
-        s = sum((n1, n2) == (0, 1) for n1, n2 in zip(n, n[1:]))  # (P2,P3), (P3,P4), ... , (P8,P9), (P9,P2)
-        # t = time.time() - now
-        # printv('t transitions sum: ', t)
-        return s
+        return sum((n1 == 0) & (n2 == 1) for n1, n2 in zip(n, n[1:]))  # (P2,P3), (P3,P4), ... , (P8,P9), (P9,P2)
 
     # ------------------------------------------------------------------------------------------------------------------
     def zhang_suen(self, image):
         """
         the Zhang-Suen Thinning Algorithm
-        code from https://github.com/linbojin/Skeletonization-by-Zhang-Suen-Thinning-Algorithm
+        Each sub-iteration evaluates the conditions on all the points of the image at once, then removes the points that
+        satisfy them, like the original algorithm.
         :param image:
         :return:
         """
-        # now = time.time()
         image_thinned = image.copy()  # deepcopy to protect the original image
-        changing1 = changing2 = 1  # the points to be removed (set as 0)
-        while changing1 or changing2:  # iterates until no further changes occur in the image
-            # Step 1
-            changing1 = []
-            max = len(image_thinned) - 1
-            pass_list = [1, max]
-            # rows, columns = image_thinned.shape  # x for rows, y for columns
-
-            # for x in range(1, rows - 1):         # No. of  rows
-            # for y in range(1, columns - 1):  # No. of columns
-            for x, y in non_zero_coord(image_thinned):
-                if x not in pass_list and y not in pass_list:
-                    # if image_thinned[x][y] == 1:  # Condition 0: Point P1 in the object regions
-                    P2, P3, P4, P5, P6, P7, P8, P9 = n = self.get_neighbours(x, y, image_thinned)
-                    if (2 <= sum(n) <= 6 and    # Condition 1: 2<= N(P1) <= 6
-                        P2 * P4 * P6 == 0 and    # Condition 3
-                        P4 * P6 * P8 == 0 and   # Condition 4
-                            self.transitions(n) == 1):    # Condition 2: S(P1)=1
-                        changing1.append((x, y))
-            for x, y in changing1:
-                image_thinned[x][y] = 0
-            # Step 2
-            changing2 = []
-
-            # for x in range(1, rows - 1):
-            # for y in range(1, columns - 1):
-            for x, y in non_zero_coord(image_thinned):
-                if x not in pass_list and y not in pass_list:
-                    # if image_thinned[x][y] == 1:  # Condition 0
-                    P2, P3, P4, P5, P6, P7, P8, P9 = n = self.get_neighbours(x, y, image_thinned)
-                    if (2 <= sum(n) <= 6 and       # Condition 1
-                        P2 * P4 * P8 == 0 and       # Condition 3
-                        P2 * P6 * P8 == 0 and  # Condition 4
-                            self.transitions(n) == 1):    # Condition 2
-                        changing2.append((x, y))
-            for x, y in changing2:
-                image_thinned[x][y] = 0
-        # t = time.time() - now
-        # printv('t thinning: ', t)
+        changing = True
+        while changing:  # iterates until no further changes occur in the image
+            changing = False
+            for step in (1, 2):
+                P2, P3, P4, P5, P6, P7, P8, P9 = n = self.get_neighbours(image_thinned)
+                n_neighbours = sum(n)
+                if step == 1:
+                    conditions_34 = (P2 * P4 * P6 == 0) & (P4 * P6 * P8 == 0)  # Conditions 3 and 4 of step 1
+                else:
+                    conditions_34 = (P2 * P4 * P8 == 0) & (P2 * P6 * P8 == 0)  # Conditions 3 and 4 of step 2
+                to_remove = ((image_thinned > 0) &                                   # Condition 0: P1 in the object
+                             (2 <= n_neighbours) & (n_neighbours <= 6) &            # Condition 1: 2<= N(P1) <= 6
+                             conditions_34 &
+                             (self.transitions(n) == 1))                           # Condition 2: S(P1)=1
+                image_thinned[to_remove] = 0
+                changing |= bool(to_remove.any())
         return image_thinned
 
 
 # ----------------------------------------------------------------------------------------------------------------------
 # HAUSDORFF'S DISTANCE -------------------------------------------------------------------------------------------------
 class HausdorffDistance:
-    def __init__(self, data1, data2, v=1):
+    def __init__(self, data1, data2, v=1, sampling=None):
         """
         the hausdorff distance between two sets is the maximum of the distances from a point in any of the sets to the nearest point in the other set
+        :param sampling: size of the pixels along each axis. If None, distances are in pixels.
         :return:
         """
-        # now = time.time()
-        printv('Computing 2D Hausdorff\'s distance ... ', v, 'normal')
+        printv(f'Computing {np.ndim(data1)}D Hausdorff\'s distance ... ', v, 'normal')
         self.data1 = bin_data(data1)
         self.data2 = bin_data(data2)
 
-        self.min_distances_1 = self.relative_hausdorff_dist(self.data1, self.data2, v)
-        self.min_distances_2 = self.relative_hausdorff_dist(self.data2, self.data1, v)
+        self.min_distances_1 = self.relative_hausdorff_dist(self.data1, self.data2, v, sampling)
+        self.min_distances_2 = self.relative_hausdorff_dist(self.data2, self.data1, v, sampling)
 
         # relatives hausdorff's distances in pixel
         self.h1 = np.max(self.min_distances_1)
@@ -167,28 +137,20 @@ class HausdorffDistance:
 
         # Hausdorff's distance in pixel
         self.H = max(self.h1, self.h2)
-        # t = time.time() - now
-        # printv('Hausdorff dist time :', t)
 
     # ------------------------------------------------------------------------------------------------------------------
-    def relative_hausdorff_dist(self, dat1, dat2, v=1):
+    def relative_hausdorff_dist(self, dat1, dat2, v=1, sampling=None):
+        """
+        Distance from each non-zero point of dat1 to the nearest non-zero point of dat2
+        :return: array with the same shape as dat1, containing the distances at the non-zero points of dat1
+        """
         h = np.zeros(dat1.shape)
-        nz_coord_1 = non_zero_coord(dat1)
-        nz_coord_2 = non_zero_coord(dat2)
-        if len(nz_coord_1) != 0 and len(nz_coord_2) != 0:
-            for x1, y1 in nz_coord_1:
-                # for x1 in range(dat1.shape[0]):
-                # for y1 in range(dat1.shape[1]):
-                # if dat1[x1, y1] == 1:
-                d_p1_dat2 = []
-                p1 = np.asarray([x1, y1])
-                for x2, y2 in nz_coord_2:
-                    # for x2 in range(dat2.shape[0]):
-                    # for y2 in range(dat2.shape[1]):
-                    # if dat2[x2, y2] == 1:
-                    p2 = np.asarray([x2, y2])
-                    d_p1_dat2.append(np.linalg.norm(p1 - p2))  # Euclidean distance between p1 and p2
-                h[x1, y1] = min(d_p1_dat2)
+        nz_coord_1 = np.nonzero(dat1)
+        nz_coord_2 = np.nonzero(dat2)
+        if len(nz_coord_1[0]) != 0 and len(nz_coord_2[0]) != 0:
+            scale = np.ones(dat1.ndim) if sampling is None else np.asarray(sampling, dtype=float)
+            tree = cKDTree(np.transpose(nz_coord_2) * scale)
+            h[nz_coord_1], _ = tree.query(np.transpose(nz_coord_1) * scale)
         else:
             printv('Warning: an image is empty', v, 'warning')
         return h
@@ -234,13 +196,15 @@ class ComputeDistances:
         if self.dim_im == 3:
             if self.im2 is None:
                 self.compute_dist_1im_3d()
+            elif self.param.mode == '3d':
+                self.compute_dist_2im_volume()
             else:
                 self.compute_dist_2im_3d()
 
-        if self.dim_im == 2 and self.distances is not None:
+        if isinstance(self.distances, HausdorffDistance):
             self.dist1_distribution = self.distances.min_distances_1[np.nonzero(self.distances.min_distances_1)]
             self.dist2_distribution = self.distances.min_distances_2[np.nonzero(self.distances.min_distances_2)]
-        if self.dim_im == 3:
+        if isinstance(self.distances, list):
             self.dist1_distribution = []
             self.dist2_distribution = []
 
@@ -285,9 +249,30 @@ class ComputeDistances:
             dat2 = bin_data(self.im2.data)
 
         self.distances = HausdorffDistance(dat1, dat2, self.param.verbose)
-        self.res = 'Hausdorff\'s distance : ' + str(self.distances.H * self.dim_pix) + ' mm\n\n' \
-                   'First relative Hausdorff\'s distance : ' + str(self.distances.h1 * self.dim_pix) + ' mm\n' \
-                   'Second relative Hausdorff\'s distance : ' + str(self.distances.h2 * self.dim_pix) + ' mm'
+        self.res = self.format_global_distances()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def compute_dist_2im_volume(self):
+        nx1, ny1, nz1, nt1, px1, py1, pz1, pt1 = self.im1.dim
+        nx2, ny2, nz2, nt2, px2, py2, pz2, pt2 = self.im2.dim
+        assert (nx1, ny1, nz1) == (nx2, ny2, nz2)
+        self.dim_pix = 1  # distances are directly computed in mm
+
+        if self.param.thinning:
+            dat1 = self.thinning1.thinned_image.data
+            dat2 = self.thinning2.thinned_image.data
+        else:
+            dat1 = bin_data(self.im1.data)
+            dat2 = bin_data(self.im2.data)
+
+        self.distances = HausdorffDistance(dat1, dat2, self.param.verbose, sampling=(px1, py1, pz1))
+        self.res = self.format_global_distances()
+
+    # ------------------------------------------------------------------------------------------------------------------
+    def format_global_distances(self):
+        return 'Hausdorff\'s distance : ' + str(self.distances.H * self.dim_pix) + ' mm\n\n' \
+               'First relative Hausdorff\'s distance : ' + str(self.distances.h1 * self.dim_pix) + ' mm\n' \
+               'Second relative Hausdorff\'s distance : ' + str(self.distances.h2 * self.dim_pix) + ' mm'
 
     # ------------------------------------------------------------------------------------------------------------------
     def compute_dist_1im_3d(self):
@@ -333,7 +318,7 @@ class ComputeDistances:
 
         data_dist = {"distances": [], "image": [], "slice": []}
 
-        if self.dim_im == 2:
+        if isinstance(self.distances, HausdorffDistance):
             data_dist["distances"].append([dist * self.dim_pix for dist in self.dist1_distribution])
             data_dist["image"].append(len(self.dist1_distribution) * [1])
             data_dist["slice"].append(len(self.dist1_distribution) * [0])
@@ -342,7 +327,7 @@ class ComputeDistances:
             data_dist["image"].append(len(self.dist2_distribution) * [2])
             data_dist["slice"].append(len(self.dist2_distribution) * [0])
 
-        if self.dim_im == 3:
+        else:
             for i in range(len(self.distances)):
                 data_dist["distances"].append([dist * self.dim_pix for dist in self.dist1_distribution[i]])
                 data_dist["image"].append(len(self.dist1_distribution[i]) * [1])
@@ -472,6 +457,13 @@ def get_parser():
         required=False,
         default=1,
         choices=(0, 1))
+    optional.add_argument(
+        "-mode",
+        help="Compute the distances between the axial slices of the two images, slice by slice (2d), or between the "
+             "two whole volumes (3d). The 3d mode requires a second image ('-d').",
+        required=False,
+        default=Param().mode,
+        choices=('2d', '3d'))
     optional.add_argument(
         "-resampling",
         type=float,
@@ -516,6 +508,9 @@ def main(argv: Sequence[str]):
             input_second_fname = arguments.d
         if arguments.thinning is not None:
             param.thinning = bool(arguments.thinning)
+        param.mode = arguments.mode
+        if param.mode == '3d' and input_second_fname == '':
+            parser.error("A second image ('-d') is mandatory with '-mode 3d'.")
         if arguments.resampling is not None:
             resample_to = arguments.resampling
         if arguments.o is not None:
@@ -28,7 +28,7 @@ import os
 from typing import Sequence
 
 from spinalcordtoolbox.moco import ParamMoco, moco_wrapper
-from spinalcordtoolbox.utils.sys import init_sct, set_loglevel
+from spinalcordtoolbox.utils.sys import init_sct, set_loglevel, get_n_jobs
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, ActionCreateFolder, list_type, display_viewer_syntax
 from spinalcordtoolbox.reports.qc import generate_qc
 
@@ -128,6 +128,18 @@ def get_parser():
         default=param_default.remove_temp_files,
         help="Remove temporary files. 0 = no, 1 = yes"
     )
+    optional.add_argument(
+        '-jobs', '-j',
+        metavar=Metavar.int,
+        type=int,
+        default=1,
+        help="Number of processes used to register the volumes, which are distributed across processes. Either an "
+             "integer greater than or equal to one, or 0 or a negative integer specifying the number of available "
+             "cores minus that number. For example '-jobs -1' will use all the available cores minus one, and "
+             "'-jobs 0' will use all available cores. The result does not depend on the number of processes. "
+             "The contrast of the images of the QC report ('-qc') is also stretched with this number of threads "
+             "(the GIF animations themselves are encoded in a single thread)."
+    )
     optional.add_argument(
         '-v',
         metavar=Metavar.int,
@@ -190,6 +202,7 @@ def main(argv: Sequence[str]):
     param.interp = arguments.x
     param.path_out = arguments.ofolder
     param.remove_temp_files = arguments.r
+    param.n_jobs = arguments.jobs
     if arguments.param is not None:
         param.update(arguments.param)
 
@@ -213,7 +226,7 @@ def main(argv: Sequence[str]):
     if path_qc is not None:
         generate_qc(fname_in1=fname_output_image, fname_in2=param.fname_data, fname_seg=qc_seg,
                     args=argv, path_qc=os.path.abspath(path_qc), fps=qc_fps, dataset=qc_dataset,
-                    subject=qc_subject, process='sct_dmri_moco')
+                    subject=qc_subject, process='sct_dmri_moco', n_threads=get_n_jobs(arguments.jobs))
 
     display_viewer_syntax([fname_output_image, param.fname_data], mode='ortho,ortho', verbose=verbose)
 
@@ -16,9 +16,11 @@ import argparse
 from typing import Sequence
 
 import numpy as np
+import pandas as pd
 
 from spinalcordtoolbox.metadata import read_label_file
-from spinalcordtoolbox.aggregate_slicewise import check_labels, extract_metric, save_as_csv, Metric, LabelStruc
+from spinalcordtoolbox.aggregate_slicewise import check_labels, extract_metric_labels, agg_metric_to_dataframe, \
+    save_as_table, Metric, LabelStruc, get_vert_level_index
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, list_type, parse_num_list, display_open
 from spinalcordtoolbox.utils.sys import init_sct, printv, __data_dir__, set_loglevel
@@ -155,7 +157,8 @@ def get_parser():
         metavar=Metavar.file,
         default=param_default.fname_output,
         help="File name of the output result file collecting the metric estimation results. Include the '.csv' "
-             "file extension in the file name. Example: extract_metric.csv"
+             "file extension in the file name (or '.parquet' to write a Parquet file, which requires the 'pyarrow' "
+             "package). Example: extract_metric.csv"
     )
     optional.add_argument(
         '-output-map',
@@ -355,9 +358,8 @@ def main(argv: Sequence[str]):
         im_label = Image(os.path.join(path_label, indiv_labels_files[i_label])).change_orientation("RPI")
         labels_tmp[i_label] = np.expand_dims(im_label.data, 3)  # TODO: generalize to 2D input label
     labels = np.concatenate(labels_tmp[:], 3)  # labels: (x,y,z,label)
-    # Load vertebral levels
-    if not levels:
-        fname_vert_level = None
+    # Load vertebral levels (the level of each slice is computed once for all labels)
+    vert_level = get_vert_level_index(fname_vert_level) if levels else None
 
     # Get dimensions of data and labels
     nx, ny, nz = data.data.shape
@@ -374,14 +376,15 @@ def main(argv: Sequence[str]):
                                      map_cluster=None)
         labels_id_user = [99]
 
-    for id_label in labels_id_user:
-        printv('Estimation for label: ' + label_struc[id_label].name, verbose)
-        agg_metric = extract_metric(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
-                                    perlevel=perlevel, fname_vert_level=fname_vert_level, method=method,
-                                    label_struc=label_struc, id_label=id_label, indiv_labels_ids=indiv_labels_ids)
-
-        save_as_csv(agg_metric, fname_output, fname_in=fname_data, append=append_csv)
-        append_csv = True  # when looping across labels, need to append results in the same file
+    printv('Estimation for labels: ' + ', '.join(label_struc[id_label].name for id_label in labels_id_user), verbose)
+    agg_metrics = extract_metric_labels(data, labels=labels, slices=slices, levels=levels, perslice=perslice,
+                                        perlevel=perlevel, fname_vert_level=vert_level, method=method,
+                                        label_struc=label_struc, id_labels=labels_id_user,
+                                        indiv_labels_ids=indiv_labels_ids)
+    # Write the results of all labels at once
+    table = pd.concat([agg_metric_to_dataframe(agg_metrics[id_label], fname_in=fname_data)
+                       for id_label in labels_id_user], ignore_index=True)
+    save_as_table(table, fname_output, append=append_csv)
     display_open(fname_output)
 
 
@@ -10,7 +10,7 @@ import os
 from typing import Sequence
 
 from spinalcordtoolbox.moco import ParamMoco, moco_wrapper
-from spinalcordtoolbox.utils.sys import init_sct, set_loglevel
+from spinalcordtoolbox.utils.sys import init_sct, set_loglevel, get_n_jobs
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, ActionCreateFolder, display_viewer_syntax, list_type
 from spinalcordtoolbox.reports.qc import generate_qc
 
@@ -102,6 +102,18 @@ def get_parser():
         default=1,
         help="Remove temporary files. 0 = no, 1 = yes"
     )
+    optional.add_argument(
+        '-jobs', '-j',
+        metavar=Metavar.int,
+        type=int,
+        default=1,
+        help="Number of processes used to register the volumes, which are distributed across processes. Either an "
+             "integer greater than or equal to one, or 0 or a negative integer specifying the number of available "
+             "cores minus that number. For example '-jobs -1' will use all the available cores minus one, and "
+             "'-jobs 0' will use all available cores. The result does not depend on the number of processes. "
+             "The contrast of the images of the QC report ('-qc') is also stretched with this number of threads "
+             "(the GIF animations themselves are encoded in a single thread)."
+    )
     optional.add_argument(
         '-v',
         metavar=Metavar.int,
@@ -159,6 +171,7 @@ def main(argv: Sequence[str]):
     param.path_out = arguments.ofolder
     param.remove_temp_files = arguments.r
     param.interp = arguments.x
+    param.n_jobs = arguments.jobs
     if arguments.g is not None:
         param.group_size = arguments.g
     if arguments.m is not None:
@@ -186,7 +199,7 @@ def main(argv: Sequence[str]):
     if path_qc is not None:
         generate_qc(fname_in1=fname_output_image, fname_in2=param.fname_data, fname_seg=qc_seg,
                     args=argv, path_qc=os.path.abspath(path_qc), fps=qc_fps, dataset=qc_dataset,
-                    subject=qc_subject, process='sct_fmri_moco')
+                    subject=qc_subject, process='sct_fmri_moco', n_threads=get_n_jobs(arguments.jobs))
 
     display_viewer_syntax([fname_output_image, param.fname_data], mode='ortho,ortho', verbose=verbose)
 
@@ -23,7 +23,8 @@ from spinalcordtoolbox.math import dilate
 from spinalcordtoolbox.labels import create_labels_along_segmentation
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, ActionCreateFolder, display_viewer_syntax
 from spinalcordtoolbox.utils.sys import init_sct, printv, __data_dir__, set_loglevel
-from spinalcordtoolbox.utils.fs import tmp_create, cache_signature, cache_valid, cache_save, copy, extract_fname, rmtree
+from spinalcordtoolbox.utils.fs import tmp_create, extract_fname, rmtree
+from spinalcordtoolbox.straightening import STRAIGHTENING_OUTPUTS, STRAIGHTENING_CACHE_HELP, get_straightening_cache, get_straightening_cache_key
 from spinalcordtoolbox.math import threshold, laplacian
 
 from spinalcordtoolbox.scripts import sct_straighten_spinalcord, sct_apply_transfo, sct_resample
@@ -231,6 +232,14 @@ def get_parser():
              '  - size_RL [mm]: RL window size for disc search\n'
              '  - size_IS [mm]: IS window size for disc search\n',
     )
+    optional.add_argument(
+        '-cache',
+        metavar=Metavar.int,
+        type=int,
+        choices=[0, 1],
+        default=1,
+        help=STRAIGHTENING_CACHE_HELP
+    )
     optional.add_argument(
         '-r',
         metavar=Metavar.int,
@@ -304,20 +313,13 @@ def main(argv: Sequence[str]):
 
     # Straighten spinal cord
     printv('\nStraighten spinal cord...', verbose)
-    # check if warp_curve2straight and warp_straight2curve already exist (i.e. no need to do it another time)
-    cache_sig = cache_signature(
+    # check if the straightening was already computed from the same inputs (i.e. no need to do it another time)
+    straightening_cache = get_straightening_cache(enabled=bool(arguments.cache))
+    cache_key = get_straightening_cache_key(
         input_files=[fname_in, fname_seg],
     )
-    if (cache_valid(os.path.join(curdir, "straightening.cache"), cache_sig)
-            and os.path.isfile(os.path.join(curdir, "warp_curve2straight.nii.gz"))
-            and os.path.isfile(os.path.join(curdir, "warp_straight2curve.nii.gz"))
-            and os.path.isfile(os.path.join(curdir, "straight_ref.nii.gz"))):
-        # if they exist, copy them into current folder
+    if straightening_cache.get(cache_key, STRAIGHTENING_OUTPUTS, '.'):
         printv('Reusing existing warping field which seems to be valid', verbose, 'warning')
-        copy(os.path.join(curdir, "straightening.cache"), 'straightening.cache')
-        copy(os.path.join(curdir, "warp_curve2straight.nii.gz"), 'warp_curve2straight.nii.gz')
-        copy(os.path.join(curdir, "warp_straight2curve.nii.gz"), 'warp_straight2curve.nii.gz')
-        copy(os.path.join(curdir, "straight_ref.nii.gz"), 'straight_ref.nii.gz')
         # apply straightening
         sct_apply_transfo.main(['-i', 'data.nii', '-w', 'warp_curve2straight.nii.gz', '-d', 'straight_ref.nii.gz', '-o', 'data_straight.nii', '-v', '0'])
     else:
@@ -327,7 +329,7 @@ def main(argv: Sequence[str]):
             '-r', str(remove_temp_files),
             '-v', '0',
         ])
-        cache_save("straightening.cache", cache_sig)
+        straightening_cache.put(cache_key, STRAIGHTENING_OUTPUTS)
 
     # resample to 0.5mm isotropic to match template resolution
     printv('\nResample to 0.5mm isotropic...', verbose)
@@ -472,7 +474,6 @@ def main(argv: Sequence[str]):
     generate_output_file(os.path.join(path_tmp, "segmentation_labeled.nii"), fname_seg_labeled)
     generate_output_file(os.path.join(path_tmp, "segmentation_labeled_disc.nii"), os.path.join(path_output, file_seg + '_labeled_discs' + ext_seg))
     # copy straightening files in case subsequent SCT functions need them
-    generate_output_file(os.path.join(path_tmp, "straightening.cache"), os.path.join(path_output, "straightening.cache"), verbose=verbose)
     generate_output_file(os.path.join(path_tmp, "warp_curve2straight.nii.gz"), os.path.join(path_output, "warp_curve2straight.nii.gz"), verbose=verbose)
     generate_output_file(os.path.join(path_tmp, "warp_straight2curve.nii.gz"), os.path.join(path_output, "warp_straight2curve.nii.gz"), verbose=verbose)
     generate_output_file(os.path.join(path_tmp, "straight_ref.nii.gz"), os.path.join(path_output, "straight_ref.nii.gz"), verbose=verbose)
@@ -19,8 +19,8 @@ import pandas as pd
 import numpy as np
 from matplotlib.ticker import MaxNLocator
 
-from spinalcordtoolbox.aggregate_slicewise import aggregate_per_slice_or_level, save_as_csv, func_wa, func_std, \
-    func_sum, merge_dict, normalize_csa
+from spinalcordtoolbox.aggregate_slicewise import aggregate_per_slice_or_level, save_as_table, func_wa, func_std, \
+    func_sum, merge_dict, normalize_csa, get_vert_level_index
 from spinalcordtoolbox.process_seg import compute_shape
 from spinalcordtoolbox.scripts import sct_maths
 from spinalcordtoolbox.csa_pmj import get_slices_for_pmj_distance
@@ -111,7 +111,8 @@ def get_parser():
         '-o',
         metavar=Metavar.file,
         default='csa.csv',
-        help="Output file name (add extension)."
+        help="Output file name (add extension). Use the '.parquet' extension to write a Parquet file instead of a csv "
+             "file (requires the 'pyarrow' package)."
     )
     optional.add_argument(
         '-append',
@@ -188,6 +189,27 @@ def get_parser():
         default=30,
         help="Degree of smoothing for centerline fitting. Only use with -centerline-algo {bspline, linear}."
     )
+    optional.add_argument(
+        '-shape-method',
+        choices=['regionprops', 'moments'],
+        default='regionprops',
+        help="Method used to compute the shape metrics of each slice.\n"
+             "  - regionprops: Each slice is corrected for the centerline angle, upsampled, then analyzed using "
+             "skimage's regionprops.\n"
+             "  - moments: Metrics are computed for all slices at once from the moments of the (weighted) mask. "
+             "Much faster on long segmentations (e.g. whole spine), with results that agree with 'regionprops' "
+             "within a few percent."
+    )
+    optional.add_argument(
+        '-jobs', '-j',
+        metavar=Metavar.int,
+        type=int,
+        default=1,
+        help="Number of processes used to compute the shape metrics, axial slices being distributed across "
+             "processes. Either an integer greater than or equal to one, or 0 or a negative integer specifying the "
+             "number of available cores minus that number. For example '-jobs -1' will use all the available cores "
+             "minus one, and '-jobs 0' will use all available cores."
+    )
     optional.add_argument(
         '-pmj',
         metavar=Metavar.file,
@@ -418,7 +440,9 @@ def main(argv: Sequence[str]):
                                          angle_correction=angle_correction,
                                          param_centerline=param_centerline,
                                          verbose=verbose,
-                                         remove_temp_files=arguments.r)
+                                         remove_temp_files=arguments.r,
+                                         method=arguments.shape_method,
+                                         jobs=arguments.jobs)
     if normalize_pam50:
         fname_vert_level_PAM50 = os.path.join(__data_dir__, 'PAM50', 'template', 'PAM50_levels.nii.gz')
         metrics_PAM50_space = interpolate_metrics(metrics, fname_vert_level_PAM50, fname_vert_level)
@@ -444,20 +468,22 @@ def main(argv: Sequence[str]):
     else:
         length_from_pmj = None
     # Aggregate metrics
+    # Compute the vertebral level of each slice once for all metrics
+    vert_level = get_vert_level_index(fname_vert_level) if fname_vert_level is not None else None
     for key in sct_progress_bar(metrics, unit='iter', unit_scale=False, desc="Aggregating metrics", ncols=80):
         if key == 'length':
             # For computing cord length, slice-wise length needs to be summed across slices
             metrics_agg[key] = aggregate_per_slice_or_level(metrics[key], slices=slices,
                                                             levels=levels,
                                                             distance_pmj=distance_pmj, perslice=perslice,
-                                                            perlevel=perlevel, fname_vert_level=fname_vert_level,
+                                                            perlevel=perlevel, fname_vert_level=vert_level,
                                                             group_funcs=(('SUM', func_sum),), length_pmj=length_from_pmj)
         else:
             # For other metrics, we compute the average and standard deviation across slices
             metrics_agg[key] = aggregate_per_slice_or_level(metrics[key], slices=slices,
                                                             levels=levels,
                                                             distance_pmj=distance_pmj, perslice=perslice,
-                                                            perlevel=perlevel, fname_vert_level=fname_vert_level,
+                                                            perlevel=perlevel, fname_vert_level=vert_level,
                                                             group_funcs=group_funcs, length_pmj=length_from_pmj)
     metrics_agg_merged = merge_dict(metrics_agg)
     # Normalize CSA values (MEAN(area))
@@ -476,7 +502,7 @@ def main(argv: Sequence[str]):
         for line in metrics_agg_merged.values():
             line['MEAN(area)'] = normalize_csa(line['MEAN(area)'], data_predictors, data_subject)
 
-    save_as_csv(metrics_agg_merged, file_out, fname_in=fname_segmentation, append=append)
+    save_as_table(metrics_agg_merged, file_out, fname_in=fname_segmentation, append=append)
     # QC report (only for PMJ-based CSA)
     if path_qc is not None:
         if fname_pmj is not None:
@@ -219,7 +219,10 @@ def get_parser():
               f"    * pca: approximate cord segmentation by an ellipse and finds it orientation using PCA's "
               f"eigenvectors\n"
               f"    * hog: finds the orientation using the symmetry of the image\n"
-              f"    * pcahog: tries method pca and if it fails, uses method hog.\n")
+              f"    * pcahog: tries method pca and if it fails, uses method hog.\n"
+              f"  - jobs: <int> Number of processes used by algo=centermass, centermassrot and columnwise, slices being "
+              f"distributed across processes. 0 or a negative number means the number of available cores minus that "
+              f"number. Default={DEFAULT_PARAMREGMULTI.steps['1'].jobs}.\n")
     )
     optional.add_argument(
         '-identity',
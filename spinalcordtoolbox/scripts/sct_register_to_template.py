@@ -26,10 +26,10 @@ from spinalcordtoolbox.metadata import get_file_label
 from spinalcordtoolbox.image import Image, add_suffix, generate_output_file
 from spinalcordtoolbox.centerline.core import ParamCenterline
 from spinalcordtoolbox.reports.qc import generate_qc
+from spinalcordtoolbox.straightening import STRAIGHTENING_CACHE_HELP
 from spinalcordtoolbox.resampling import resample_file
 from spinalcordtoolbox.math import dilate, binarize
-from spinalcordtoolbox.utils.fs import (copy, extract_fname, check_file_exist, rmtree,
-                                        cache_save, cache_signature, cache_valid, tmp_create)
+from spinalcordtoolbox.utils.fs import copy, extract_fname, check_file_exist, rmtree, tmp_create
 from spinalcordtoolbox.utils.shell import (SCTArgumentParser, ActionCreateFolder, Metavar, list_type,
                                            printv, display_viewer_syntax)
 from spinalcordtoolbox.utils.sys import set_loglevel, init_sct, run_proc
@@ -269,6 +269,14 @@ def get_parser():
         metavar=Metavar.str,
         help="If provided, this string will be mentioned in the QC report as the subject the process was run on."
     )
+    optional.add_argument(
+        '-cache',
+        metavar=Metavar.int,
+        type=int,
+        choices=[0, 1],
+        default=1,
+        help=STRAIGHTENING_CACHE_HELP
+    )
     optional.add_argument(
         '-r',
         metavar=Metavar.int,
@@ -518,11 +526,9 @@ def main(argv: Sequence[str]):
         # straighten segmentation
         printv('\nStraighten the spinal cord using centerline/segmentation...', verbose)
 
-        # check if warp_curve2straight and warp_straight2curve already exist (i.e. no need to do it another time)
-        fn_warp_curve2straight = os.path.join(curdir, "warp_curve2straight.nii.gz")
-        fn_warp_straight2curve = os.path.join(curdir, "warp_straight2curve.nii.gz")
-        fn_straight_ref = os.path.join(curdir, "straight_ref.nii.gz")
-
+        from spinalcordtoolbox.straightening import (SpinalCordStraightener, STRAIGHTENING_OUTPUTS,
+                                                     get_straightening_cache, get_straightening_cache_key)
+        # check if the straightening was already computed from the same inputs (i.e. no need to do it another time)
         cache_input_files = [ftmp_seg]
         if level_alignment:
             cache_input_files += [
@@ -530,18 +536,13 @@ def main(argv: Sequence[str]):
                 ftmp_label,
                 ftmp_template_label,
             ]
-        cache_sig = cache_signature(
+        straightening_cache = get_straightening_cache(enabled=bool(arguments.cache))
+        cache_key = get_straightening_cache_key(
             input_files=cache_input_files,
+            input_params={f"param_centerline.{k}": v for k, v in vars(param_centerline).items()},
         )
-        if (cache_valid(os.path.join(curdir, "straightening.cache"), cache_sig)
-                and os.path.isfile(fn_warp_curve2straight)
-                and os.path.isfile(fn_warp_straight2curve)
-                and os.path.isfile(fn_straight_ref)):
+        if straightening_cache.get(cache_key, STRAIGHTENING_OUTPUTS, '.'):
             printv('Reusing existing warping field which seems to be valid', verbose, 'warning')
-            copy(os.path.join(curdir, "straightening.cache"), 'straightening.cache')
-            copy(fn_warp_curve2straight, 'warp_curve2straight.nii.gz')
-            copy(fn_warp_straight2curve, 'warp_straight2curve.nii.gz')
-            copy(fn_straight_ref, 'straight_ref.nii.gz')
             # apply straightening
             sct_apply_transfo.main(argv=[
                 '-i', ftmp_seg,
@@ -551,7 +552,6 @@ def main(argv: Sequence[str]):
                 '-v', '0',
             ])
         else:
-            from spinalcordtoolbox.straightening import SpinalCordStraightener
             sc_straight = SpinalCordStraightener(ftmp_seg, ftmp_seg)
             sc_straight.param_centerline = param_centerline
             sc_straight.output_filename = add_suffix(ftmp_seg, '_straight')
@@ -567,7 +567,7 @@ def main(argv: Sequence[str]):
                 sc_straight.discs_ref_filename = ftmp_template_label
 
             sc_straight.straighten()
-            cache_save("straightening.cache", cache_sig)
+            straightening_cache.put(cache_key, STRAIGHTENING_OUTPUTS)
 
         # N.B. DO NOT UPDATE VARIABLE ftmp_seg BECAUSE TEMPORARY USED LATER
         # re-define warping field using non-cropped space (to avoid issue #367)
@@ -812,7 +812,6 @@ def main(argv: Sequence[str]):
     generate_output_file(os.path.join(path_tmp, "anat2template.nii.gz"), fname_anat2template, verbose=verbose)
     if ref == 'template':
         # copy straightening files in case subsequent SCT functions need them
-        generate_output_file(os.path.join(path_tmp, "straightening.cache"), os.path.join(path_output, "straightening.cache"), verbose=verbose)
         generate_output_file(os.path.join(path_tmp, "warp_curve2straight.nii.gz"), os.path.join(path_output, "warp_curve2straight.nii.gz"), verbose=verbose)
         generate_output_file(os.path.join(path_tmp, "warp_straight2curve.nii.gz"), os.path.join(path_output, "warp_straight2curve.nii.gz"), verbose=verbose)
         generate_output_file(os.path.join(path_tmp, "straight_ref.nii.gz"), os.path.join(path_output, "straight_ref.nii.gz"), verbose=verbose)
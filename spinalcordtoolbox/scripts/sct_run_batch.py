@@ -10,6 +10,7 @@
 
 import os
 import sys
+import csv
 import pathlib
 from getpass import getpass
 import multiprocessing
@@ -22,6 +23,7 @@ import functools
 import json
 import tempfile
 import warnings
+import statistics
 import shutil
 from typing import Sequence
 from types import SimpleNamespace
@@ -31,11 +33,24 @@ import yaml
 import psutil
 
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, display_open
-from spinalcordtoolbox.utils.sys import send_email, init_sct, __get_commit, __get_git_origin, __version__, __sct_dir__, set_loglevel
+from spinalcordtoolbox.utils.sys import (send_email, init_sct, __get_commit, __get_git_origin, __version__, __sct_dir__,
+                                         set_loglevel, get_n_jobs)
 from spinalcordtoolbox.utils.fs import Tee
 
 from stat import S_IEXEC
 
+# Machine-readable record of the processing of each subject (one row per subject and per run), in the log folder. The
+# durations of the previous runs are used to process the longest subjects first.
+TIMING_FILE = 'sct_run_batch_timing.csv'
+TIMING_COLUMNS = ['subject', 'start', 'end', 'duration_s', 'returncode', 'itk_threads']
+
+# State of the batch shared by the worker processes (see `run_scheduled()`): number of subjects started so far, number
+# of subjects running, and number of ITK threads used by the running subjects. The three values share the same
+# (reentrant) lock.
+_n_started = None
+_n_running = None
+_threads_in_use = None
+
 
 def get_parser():
     parser = SCTArgumentParser(
@@ -86,6 +101,12 @@ def get_parser():
                         'This argument enables thread-based parallelism, while \'-jobs\' enables process-based '
                         'parallelism. You may need to tweak both to find a balance that works best for your system.',
                         metavar=Metavar.int)
+    parser.add_argument('-rebalance-itk-threads', type=int, default=1, choices=(0, 1),
+                        help='Whether to give more ITK threads to the last subjects, once there are fewer subjects left '
+                        'than \'-jobs\'. The threads which are not used by the running subjects (out of \'-jobs\' x '
+                        '\'-itk-threads\') are then split between the subjects that can still start, so that cores do '
+                        'not sit idle at the end of the batch.',
+                        metavar=Metavar.int)
     parser.add_argument('-path-data', help='Setting for environment variable: PATH_DATA\n'
                         'Path containing subject directories in a consistent format')
     parser.add_argument('-subject-prefix', default='sub-',
@@ -240,6 +261,112 @@ def _filter_directories(dir_list, include=None, include_list=None, exclude=None,
     return dir_list
 
 
+def _read_timings(fname_timing):
+    """
+    Read the duration (in seconds) of the latest run of each subject, from a timing file written by a previous batch.
+
+    :param fname_timing: path to the timing file (it may not exist)
+    :return: dict {subject directory: duration}
+    """
+    durations = {}
+    if os.path.isfile(fname_timing):
+        with open(fname_timing, newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    durations[row['subject']] = float(row['duration_s'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+    return durations
+
+
+def _get_input_size(path_subject):
+    """Total size (in bytes) of the files of a subject directory"""
+    size = 0
+    for root, _, files in os.walk(path_subject):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                continue
+    return size
+
+
+def _estimate_costs(subject_dirs, path_data, durations):
+    """
+    Estimate the processing cost of each subject, in seconds: the duration of its previous run if there is one, or else
+    the size of its input files, converted to seconds using the median rate of the subjects that were already processed.
+    (Without any previous run, the cost is just the size of the input files.)
+
+    :param subject_dirs: list of subject directories, relative to `path_data`
+    :param path_data: path of the dataset
+    :param durations: dict {subject directory: duration of the previous run}, see `_read_timings()`
+    :return: dict {subject directory: cost}
+    """
+    sizes = {subj_dir: _get_input_size(os.path.join(path_data, subj_dir)) for subj_dir in subject_dirs}
+    rates = [durations[subj_dir] / sizes[subj_dir] for subj_dir in subject_dirs
+             if subj_dir in durations and sizes[subj_dir] > 0]
+    seconds_per_byte = statistics.median(rates) if rates else 1
+    return {subj_dir: durations.get(subj_dir, sizes[subj_dir] * seconds_per_byte) for subj_dir in subject_dirs}
+
+
+def _get_itk_threads(n_started, n_running, threads_in_use, n_subjects, jobs, itk_threads):
+    """
+    Number of ITK threads for the next subject: the threads that are not used by the running subjects (out of
+    `jobs` x `itk_threads`) are split between this subject and the subjects that can still start on the idle workers,
+    so that the last subjects get more threads as the pool drains, without exceeding the total number of threads.
+
+    :param n_started: number of subjects started before this one
+    :param n_running: number of subjects currently running
+    :param threads_in_use: number of ITK threads used by the running subjects
+    :param n_subjects: total number of subjects
+    :param jobs: number of worker processes
+    :param itk_threads: number of ITK threads per subject requested by the user
+    :return: int
+    """
+    n_parallel = max(1, min(jobs - n_running, n_subjects - n_started))
+    return max(itk_threads, (jobs * itk_threads - threads_in_use) // n_parallel)
+
+
+def _init_worker(n_started, n_running, threads_in_use):
+    """Initializer of the worker processes (the shared values have to be passed at creation to be shared)"""
+    global _n_started, _n_running, _threads_in_use
+    _n_started, _n_running, _threads_in_use = n_started, n_running, threads_in_use
+
+
+def run_scheduled(subj_dir, n_subjects, jobs, itk_threads, rebalance_itk_threads=True, **kwargs):
+    """
+    Job function for mapping with multiprocessing: run a single subject, with a number of ITK threads that depends on
+    the number of subjects left and on the threads used by the other subjects (see `_get_itk_threads()`), and time it.
+
+    :param subj_dir: subject directory
+    :param n_subjects: total number of subjects
+    :param jobs: number of worker processes
+    :param itk_threads: number of ITK threads per subject requested by the user
+    :param rebalance_itk_threads: if False, always use `itk_threads`
+    :param kwargs: other arguments of `run_single()`
+    :return: subject directory, result of `run_single()`, start and end datetimes, number of ITK threads
+    """
+    rebalance_itk_threads = rebalance_itk_threads and _n_started is not None
+    if rebalance_itk_threads:
+        with _n_started.get_lock():
+            itk_threads = _get_itk_threads(_n_started.value, _n_running.value, _threads_in_use.value, n_subjects, jobs,
+                                           itk_threads)
+            _n_started.value += 1
+            _n_running.value += 1
+            _threads_in_use.value += itk_threads
+    try:
+        start = datetime.datetime.now()
+        res = run_single(subj_dir, itk_threads=itk_threads, **kwargs)
+        end = datetime.datetime.now()
+    finally:
+        if rebalance_itk_threads:
+            # release the threads for the subjects that start after this one
+            with _n_started.get_lock():
+                _n_running.value -= 1
+                _threads_in_use.value -= itk_threads
+    return subj_dir, res, start, end, itk_threads
+
+
 def run_single(subj_dir, script, script_args, path_segmanual, path_data, path_data_processed, path_results, path_log,
                path_qc, itk_threads, continue_on_error=False):
     """
@@ -511,22 +638,33 @@ def main(argv: Sequence[str]):
                                        exclude=arguments.exclude, exclude_list=arguments.exclude_list)
 
     # Determine the number of jobs we can run simultaneously
-    if arguments.jobs < 1:
-        jobs = multiprocessing.cpu_count() + arguments.jobs
-    else:
-        jobs = arguments.jobs
+    jobs = get_n_jobs(arguments.jobs)
+
+    # Process the longest subjects first, so that they don't end up queued behind short ones at the end of the batch
+    fname_timing = os.path.join(path_log, TIMING_FILE)
+    costs = _estimate_costs(subject_dirs, path_data, _read_timings(fname_timing))
+    subject_dirs_scheduled = sorted(subject_dirs, key=lambda subj_dir: costs[subj_dir], reverse=True)
 
     print("RUNNING")
     print("-------")
     print("Processing {} subjects in parallel. (Worker processes used: {}).".format(len(subject_dirs), jobs))
+    print("Subjects are processed from the longest to the shortest (estimated from the previous runs in {}, or "
+          "from the size of the input files).".format(fname_timing))
 
     # Run the jobs, recording start and end times
     start = datetime.datetime.now()
 
     # Trap errors to send an email if a script fails.
     try:
-        with multiprocessing.Pool(jobs) as p:
-            run_single_dir = functools.partial(run_single,
+        lock = multiprocessing.RLock()
+        batch_state = [multiprocessing.Value('i', 0, lock=lock) for _ in range(3)]
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=batch_state) as p, \
+                open(fname_timing, 'a', newline='') as f_timing:
+            run_single_dir = functools.partial(run_scheduled,
+                                               n_subjects=len(subject_dirs),
+                                               jobs=jobs,
+                                               itk_threads=arguments.itk_threads,
+                                               rebalance_itk_threads=bool(arguments.rebalance_itk_threads),
                                                script=script,
                                                script_args=arguments.script_args,
                                                path_segmanual=path_segmanual,
@@ -535,9 +673,20 @@ def main(argv: Sequence[str]):
                                                path_results=path_results,
                                                path_log=path_log,
                                                path_qc=path_qc,
-                                               itk_threads=arguments.itk_threads,
                                                continue_on_error=arguments.continue_on_error)
-            results = list(p.imap(run_single_dir, subject_dirs))
+            timing_writer = csv.writer(f_timing)
+            if f_timing.tell() == 0:
+                timing_writer.writerow(TIMING_COLUMNS)
+            # Subjects are dispatched one at a time to the first idle worker
+            results_subject = {}
+            runs = p.imap_unordered(run_single_dir, subject_dirs_scheduled)
+            for subj_dir, res, start_subject, end_subject, itk_threads in runs:
+                results_subject[subj_dir] = res
+                timing_writer.writerow([subj_dir, start_subject.isoformat(), end_subject.isoformat(),
+                                        round((end_subject - start_subject).total_seconds(), 3), res.returncode,
+                                        itk_threads])
+                f_timing.flush()
+        results = [results_subject[subj_dir] for subj_dir in subject_dirs]
     except Exception as e:
         if do_email:
             message = ('Oh no there has been the following error in your pipeline:\n\n'
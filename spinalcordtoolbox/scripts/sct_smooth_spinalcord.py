@@ -18,8 +18,8 @@ import numpy as np
 from spinalcordtoolbox.image import Image, generate_output_file, convert, add_suffix
 from spinalcordtoolbox.utils.shell import SCTArgumentParser, Metavar, list_type, display_viewer_syntax
 from spinalcordtoolbox.utils.sys import init_sct, printv, set_loglevel
-from spinalcordtoolbox.utils.fs import tmp_create, cache_save, cache_signature, cache_valid, copy, \
-    extract_fname, rmtree
+from spinalcordtoolbox.utils.fs import tmp_create, copy, extract_fname, rmtree
+from spinalcordtoolbox.straightening import STRAIGHTENING_OUTPUTS, STRAIGHTENING_CACHE_HELP, get_straightening_cache, get_straightening_cache_key
 from spinalcordtoolbox.math import smooth
 
 from spinalcordtoolbox.scripts import sct_apply_transfo, sct_straighten_spinalcord
@@ -96,6 +96,14 @@ def get_parser():
         "-o",
         metavar=Metavar.file,
         help="Output filename. Example: smooth_sc.nii.gz. By default, the suffix '_smooth' will be added to the input file name."),
+    optional.add_argument(
+        '-cache',
+        metavar=Metavar.int,
+        type=int,
+        choices=[0, 1],
+        default=1,
+        help=STRAIGHTENING_CACHE_HELP
+    )
     optional.add_argument(
         '-r',
         type=int,
@@ -197,20 +205,11 @@ def main(argv: Sequence[str]):
     # Straighten the spinal cord
     # straighten segmentation
     printv('\nStraighten the spinal cord using centerline/segmentation...', verbose)
-    cache_sig = cache_signature(input_files=[fname_anat_rpi, fname_centerline_rpi],
-                                input_params={"x": "spline"})
-    cachefile = os.path.join(curdir, "straightening.cache")
-    if (
-        cache_valid(cachefile, cache_sig)
-        and os.path.isfile(os.path.join(curdir, 'warp_curve2straight.nii.gz'))
-        and os.path.isfile(os.path.join(curdir, 'warp_straight2curve.nii.gz'))
-        and os.path.isfile(os.path.join(curdir, 'straight_ref.nii.gz'))
-    ):
-        # if they exist, copy them into current folder
+    straightening_cache = get_straightening_cache(enabled=bool(arguments.cache))
+    cache_key = get_straightening_cache_key(input_files=[fname_anat_rpi, fname_centerline_rpi],
+                                            input_params={"x": "spline", "algo_fitting": param.algo_fitting})
+    if straightening_cache.get(cache_key, STRAIGHTENING_OUTPUTS, '.'):
         printv('Reusing existing warping field which seems to be valid', verbose, 'warning')
-        copy(os.path.join(curdir, 'warp_curve2straight.nii.gz'), 'warp_curve2straight.nii.gz')
-        copy(os.path.join(curdir, 'warp_straight2curve.nii.gz'), 'warp_straight2curve.nii.gz')
-        copy(os.path.join(curdir, 'straight_ref.nii.gz'), 'straight_ref.nii.gz')
         # apply straightening
         sct_apply_transfo.main(['-i', fname_anat_rpi, '-w', 'warp_curve2straight.nii.gz', '-d', 'straight_ref.nii.gz', '-o', 'anat_rpi_straight.nii', '-x', 'spline', '-v', '0'])
     else:
@@ -222,11 +221,7 @@ def main(argv: Sequence[str]):
             '-param', 'algo_fitting=' + param.algo_fitting,
             '-v', '0',
         ])
-        cache_save(cachefile, cache_sig)
-        # move warping fields and straight reference file from the tmpdir to the localdir (to use caching next time)
-        copy('straight_ref.nii.gz', os.path.join(curdir, 'straight_ref.nii.gz'))
-        copy('warp_curve2straight.nii.gz', os.path.join(curdir, 'warp_curve2straight.nii.gz'))
-        copy('warp_straight2curve.nii.gz', os.path.join(curdir, 'warp_straight2curve.nii.gz'))
+        straightening_cache.put(cache_key, STRAIGHTENING_OUTPUTS)
 
     # Smooth the straightened image along z
     printv('\nSmooth the straightened image...')
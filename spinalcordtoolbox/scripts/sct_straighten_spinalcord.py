@@ -141,8 +141,20 @@ def get_parser():
              "  - threshold_distance: Float [0, inf) Threshold at which voxels are not considered into displacement. "
              "Increase this threshold if the image is blackout around the spinal cord too much. Default=10\n"
              "  - accuracy_results: {0, 1} Disable/Enable computation of accuracy results after straightening. Default=0\n"
-             "  - template_orientation: {0, 1} Disable/Enable orientation of the straight image to be the same as the template. Default=0",
+             "  - template_orientation: {0, 1} Disable/Enable orientation of the straight image to be the same as the template. Default=0\n"
+             "  - max_memory: Float (0, inf) Upper bound of the memory used to compute each warping field, in MB. "
+             "Larger values process more slices at once. Default=2048",
         required=False)
+    optional.add_argument(
+        '-jobs', '-j',
+        metavar=Metavar.int,
+        type=int,
+        default=1,
+        help="Number of processes used to compute the warping fields, slabs of slices being distributed across "
+             "processes. Either an integer greater than or equal to one, or 0 or a negative integer specifying the "
+             "number of available cores minus that number. For example '-jobs -1' will use all the available cores "
+             "minus one, and '-jobs 0' will use all available cores."
+    )
 
     optional.add_argument(
         "-x",
@@ -227,6 +239,7 @@ def main(argv: Sequence[str]):
     sc_straight.path_output = arguments.ofolder
     path_qc = arguments.qc
     sc_straight.verbose = verbose
+    sc_straight.n_jobs = arguments.jobs
 
     # if arguments.cpu_nb is not None:
     #     sc_straight.cpu_number = arguments.cpu-nb)
@@ -257,6 +270,8 @@ def main(argv: Sequence[str]):
                 sc_straight.accuracy_results = int(param_split[1])
             if param_split[0] == 'template_orientation':
                 sc_straight.template_orientation = int(param_split[1])
+            if param_split[0] == 'max_memory':
+                sc_straight.max_memory = float(param_split[1])
 
     fname_straight = sc_straight.straighten()
 
@@ -5,26 +5,206 @@ Copyright (c) 2019 Polytechnique Montreal <www.neuro.polymtl.ca>
 License: see the file LICENSE
 """
 
-# TODO: only input Image instead of file names
-
 import os
 import time
 import logging
 import bisect
+import multiprocessing
 
 import numpy as np
-from nibabel import Nifti1Image, save
 
 from spinalcordtoolbox.types import Centerline
-from spinalcordtoolbox.image import Image, spatial_crop, generate_output_file, pad_image
+from spinalcordtoolbox.image import Image, spatial_crop, generate_output_file, pad_image, change_orientation, check_sform
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline
-from spinalcordtoolbox.utils.sys import sct_progress_bar
-from spinalcordtoolbox.utils.fs import tmp_create, rmtree, copy, mv, extract_fname
+from spinalcordtoolbox.utils.sys import sct_progress_bar, get_n_jobs, __version__
+from spinalcordtoolbox.resampling import resample_nib
+from spinalcordtoolbox.utils.fs import tmp_create, rmtree, copy, extract_fname, cache_key, FileCache
 
-from spinalcordtoolbox.scripts import sct_apply_transfo, sct_resample, sct_image
+from spinalcordtoolbox.scripts import sct_apply_transfo
 
 logger = logging.getLogger(__name__)
 
+# Rough upper bound of the memory needed per voxel by the intermediate arrays used to compute the warping fields
+# (physical coordinates, nearest centerline points, rotation matrices, displacements), in bytes.
+BYTES_PER_VOXEL = 512
+
+# Outputs of the straightening that are shared across runs by the straightening cache
+STRAIGHTENING_OUTPUTS = ["warp_curve2straight.nii.gz", "warp_straight2curve.nii.gz", "straight_ref.nii.gz"]
+
+# Help of the `-cache` option of the scripts which reuse the straightening (see `get_straightening_cache`)
+STRAIGHTENING_CACHE_HELP = (
+    f"Whether to reuse and store the straightening (warping fields and straight reference) in the cache shared across "
+    f"runs. 0 = no, 1 = yes. The cache folder is '~/.cache/spinalcordtoolbox' (or the 'SCT_CACHE_DIR' environment "
+    f"variable), and holds up to {FileCache.DEFAULT_MAX_SIZE} MB of files (or the 'SCT_CACHE_SIZE' environment "
+    f"variable, in MB), the least recently used ones being removed first. To disable the cache for all scripts, set "
+    f"'SCT_CACHE_SIZE=0'."
+)
+
+# Parameters of the slab function, set once per worker process by `_init_warp_worker`
+_warp_worker_params = None
+
+
+def get_straightening_cache(enabled=True):
+    """
+    Return the cache in which the straightening outputs (STRAIGHTENING_OUTPUTS) are shared across runs.
+
+    :param enabled: If False, return a disabled cache, i.e. which neither reuses nor stores outputs (e.g. `-cache 0`).
+    """
+    return FileCache('straightening', max_size=None if enabled else 0)
+
+
+def get_straightening_cache_key(input_files, input_params={}):
+    """
+    Return the key of the straightening outputs computed from `input_files` with `input_params` in the straightening
+    cache. The version of SCT is part of the key, so that outputs of older versions are never reused.
+    """
+    return cache_key(input_files, dict(input_params, sct_version=__version__))
+
+
+def _get_physical_coordinates(affine, shape_xy, z_start, z_end):
+    """Return the physical coordinates (N x 3) of the voxels of slices [z_start, z_end), in C order."""
+    indexes = np.indices((shape_xy[0], shape_xy[1], z_end - z_start)).reshape(3, -1).T
+    indexes[:, 2] += z_start
+    return indexes @ affine[:3, :3].T + affine[:3, 3]
+
+
+def warp_curved2straight_slab(z_start, z_end, shape_xy, affine_straight, centerline, centerline_straight,
+                              lookup_straight2curved, threshold_distance):
+    """
+    Compute the curved->straight warping field over slices [z_start, z_end) of the straight space.
+
+    :param shape_xy: (nx, ny) of the straight space
+    :param affine_straight: voxel-to-physical affine of the straight space
+    :param centerline: Centerline of the curved space
+    :param centerline_straight: Centerline of the straight space
+    :param lookup_straight2curved: index of the curved centerline point matching each straight centerline point
+    :param threshold_distance: voxels further than this distance (in mm) from their nearest plane are not warped
+    :return: float32 array of shape (nx, ny, z_end - z_start, 3)
+    """
+    physical_coordinates_straight = _get_physical_coordinates(affine_straight, shape_xy, z_start, z_end)
+    nearest_indexes_straight = centerline_straight.find_nearest_indexes(physical_coordinates_straight)
+    distances_straight = centerline_straight.get_distances_from_planes(physical_coordinates_straight,
+                                                                       nearest_indexes_straight)
+    lookup = lookup_straight2curved[nearest_indexes_straight]
+    indexes_out_distance_straight = np.logical_or(
+        np.logical_or(distances_straight > threshold_distance,
+                      distances_straight < -threshold_distance), lookup == 0)
+    projected_points_straight = centerline_straight.get_projected_coordinates_on_planes(
+        physical_coordinates_straight, nearest_indexes_straight)
+    coord_in_planes_straight = centerline_straight.get_in_plans_coordinates(projected_points_straight,
+                                                                            nearest_indexes_straight)
+
+    coord_straight2curved = centerline.get_inverse_plans_coordinates(coord_in_planes_straight, lookup)
+    displacements_straight = coord_straight2curved - physical_coordinates_straight
+    # Invert Z coordinate as ITK & ANTs physical coordinate system is LPS- (RAI+)
+    # while ours is LPI-
+    # Refs: https://sourceforge.net/p/advants/discussion/840261/thread/2a1e9307/#fb5a
+    #  https://www.slicer.org/wiki/Coordinate_systems
+    displacements_straight[:, 2] = -displacements_straight[:, 2]
+    displacements_straight[indexes_out_distance_straight] = [100000.0, 100000.0, 100000.0]
+
+    return (-displacements_straight).astype(np.float32).reshape(shape_xy[0], shape_xy[1], z_end - z_start, 3)
+
+
+def warp_straight2curved_slab(z_start, z_end, shape_xy, affine_curved, centerline, centerline_straight,
+                              lookup_curved2straight, threshold_distance):
+    """
+    Compute the straight->curved warping field over slices [z_start, z_end) of the (padded) curved space.
+
+    :param shape_xy: (nx, ny) of the curved space
+    :param affine_curved: voxel-to-physical affine of the curved space
+    :param centerline: Centerline of the curved space
+    :param centerline_straight: Centerline of the straight space
+    :param lookup_curved2straight: index of the straight centerline point matching each curved centerline point
+    :param threshold_distance: voxels further than this distance (in mm) from their nearest plane are not warped
+    :return: float32 array of shape (nx, ny, z_end - z_start, 3)
+    """
+    physical_coordinates = _get_physical_coordinates(affine_curved, shape_xy, z_start, z_end)
+    nearest_indexes_curved = centerline.find_nearest_indexes(physical_coordinates)
+    distances_curved = centerline.get_distances_from_planes(physical_coordinates, nearest_indexes_curved)
+    lookup = lookup_curved2straight[nearest_indexes_curved]
+    indexes_out_distance_curved = np.logical_or(
+        np.logical_or(distances_curved > threshold_distance,
+                      distances_curved < -threshold_distance), lookup == 0)
+    projected_points_curved = centerline.get_projected_coordinates_on_planes(physical_coordinates,
+                                                                             nearest_indexes_curved)
+    coord_in_planes_curved = centerline.get_in_plans_coordinates(projected_points_curved, nearest_indexes_curved)
+
+    coord_curved2straight = centerline_straight.points[lookup]
+    coord_curved2straight[:, 0:2] += coord_in_planes_curved[:, 0:2]
+    coord_curved2straight[:, 2] += distances_curved
+
+    displacements_curved = coord_curved2straight - physical_coordinates
+    # Invert Z coordinate (see warp_curved2straight_slab)
+    displacements_curved[:, 2] = -displacements_curved[:, 2]
+    displacements_curved[indexes_out_distance_curved] = [100000.0, 100000.0, 100000.0]
+
+    return (-displacements_curved).astype(np.float32).reshape(shape_xy[0], shape_xy[1], z_end - z_start, 3)
+
+
+def _init_warp_worker(slab_function, params):
+    """Store the (large) parameters of the slab function once per worker process, instead of once per slab."""
+    global _warp_worker_params
+    _warp_worker_params = (slab_function, params)
+
+
+def _compute_warp_slab(bounds):
+    """Worker function: compute the warping field over slices [z_start, z_end)."""
+    slab_function, params = _warp_worker_params
+    return bounds, slab_function(*bounds, **params)
+
+
+def compute_warping_field(slab_function, shape, params, n_jobs=1, max_memory=None, fname_memmap=None):
+    """
+    Compute a warping field slab by slab, along the z axis.
+
+    The slabs are sized so that the intermediate arrays of all the processes fit within `max_memory`. If the warping
+    field itself is larger than `max_memory` and `fname_memmap` is provided, it is written to a memory-mapped file
+    instead of being kept in RAM.
+
+    :param slab_function: `warp_curved2straight_slab` or `warp_straight2curved_slab`
+    :param shape: (nx, ny, nz) of the space in which the warping field is defined
+    :param params: dict of keyword arguments of `slab_function`, besides the slab bounds and `shape_xy`
+    :param n_jobs: Number of processes (see `utils.sys.get_n_jobs`). With more than one process, slabs are distributed
+        across a process pool.
+    :param max_memory: Upper bound of the memory used to compute the warping field, in MB. None: no bound.
+    :param fname_memmap: File used to store the warping field if it doesn't fit within `max_memory`.
+    :return: float32 array (or numpy.memmap) of shape (nx, ny, nz, 1, 3)
+    """
+    nx, ny, nz = shape
+    n_jobs = get_n_jobs(n_jobs)
+    params = dict(params, shape_xy=(nx, ny))
+
+    shape_warp = (nx, ny, nz, 1, 3)
+    size_warp = nx * ny * nz * 3 * np.dtype(np.float32).itemsize
+    if max_memory is not None and fname_memmap is not None and size_warp > max_memory * 1024 ** 2:
+        logger.info('Warping field does not fit in memory, writing it to: {}'.format(fname_memmap))
+        data_warp = np.memmap(fname_memmap, dtype=np.float32, mode='w+', shape=shape_warp)
+    else:
+        data_warp = np.zeros(shape_warp, dtype=np.float32)
+
+    if max_memory is None:
+        slab_size = int(np.ceil(nz / n_jobs))
+    else:
+        slab_size = int(max_memory * 1024 ** 2 // (n_jobs * nx * ny * BYTES_PER_VOXEL))
+    slab_size = min(max(1, slab_size), nz)
+    slabs = [(z_start, min(z_start + slab_size, nz)) for z_start in range(0, nz, slab_size)]
+
+    with sct_progress_bar(total=nz, unit='slice') as pbar:
+        if n_jobs == 1 or len(slabs) == 1:
+            results = ((bounds, slab_function(*bounds, **params)) for bounds in slabs)
+            for (z_start, z_end), slab in results:
+                data_warp[:, :, z_start:z_end, 0, :] = slab
+                pbar.update(z_end - z_start)
+        else:
+            with multiprocessing.Pool(min(n_jobs, len(slabs)), initializer=_init_warp_worker,
+                                      initargs=(slab_function, params)) as pool:
+                for (z_start, z_end), slab in pool.imap_unordered(_compute_warp_slab, slabs):
+                    data_warp[:, :, z_start:z_end, 0, :] = slab
+                    pbar.update(z_end - z_start)
+
+    return data_warp
+
 
 class SpinalCordStraightener(object):
     def __init__(self, input_filename, centerline_filename, debug=0, param_centerline=ParamCenterline(),
@@ -54,6 +234,7 @@ class SpinalCordStraightener(object):
         self.max_distance_straightening = 0.0
         self.elapsed_time = 0.0
         self.elapsed_time_accuracy = 0.0
+        self.number_of_points = 0  # number of points of the fitted centerline, set by compute_warping_fields()
 
         # Outputs
         self.curved2straight = True
@@ -62,6 +243,10 @@ class SpinalCordStraightener(object):
 
         self.template_orientation = 0
 
+        # Computation of the warping fields
+        self.n_jobs = 1  # number of processes (see utils.sys.get_n_jobs)
+        self.max_memory = 2048  # upper bound of the memory used to compute each warping field, in MB (None: no bound)
+
     def straighten(self):
         """
         Straighten spinal cord. Steps: (everything is done in physical space)
@@ -87,7 +272,7 @@ class SpinalCordStraightener(object):
             Both centerline have the same lenght. Therefore, we can map centerline point via their position along the curve.
             If we use the same number of points uniformely along the spinal cord (1000 for example), the correspondance is straight-forward.
 
-        :return:
+        :return: filename of the straightened input image
         """
         # Initialization
         fname_anat = self.input_filename
@@ -104,25 +289,136 @@ class SpinalCordStraightener(object):
 
         path_tmp = tmp_create(basename="straighten-spinalcord")
 
-        # Copying input data to tmp folder
-        logger.info('Copy files to tmp folder...')
-        Image(fname_anat, check_sform=True).save(os.path.join(path_tmp, "data.nii"))
-        Image(fname_centerline, check_sform=True).save(os.path.join(path_tmp, "centerline.nii.gz"))
-
+        # Load input data. The input image itself is only read by sct_apply_transfo, so only its header is checked here.
+        check_sform(fname_anat)
+        image_centerline = Image(fname_centerline, check_sform=True)
+        image_centerline_ref, image_discs_input, image_discs_ref = None, None, None
         if self.use_straight_reference:
-            Image(self.centerline_reference_filename, check_sform=True).save(os.path.join(path_tmp, "centerline_ref.nii.gz"))
+            image_centerline_ref = Image(self.centerline_reference_filename, check_sform=True)
         if self.discs_input_filename != '':
-            Image(self.discs_input_filename, check_sform=True).save(os.path.join(path_tmp, "labels_input.nii.gz"))
+            image_discs_input = Image(self.discs_input_filename, check_sform=True)
         if self.discs_ref_filename != '':
-            Image(self.discs_ref_filename, check_sform=True).save(os.path.join(path_tmp, "labels_ref.nii.gz"))
+            image_discs_ref = Image(self.discs_ref_filename, check_sform=True)
+
+        warp_curve2straight, warp_straight2curve, image_ref = self.compute_warping_fields(
+            image_centerline, image_centerline_ref, image_discs_input, image_discs_ref, path_tmp=path_tmp)
+
+        # Write warping fields (final outputs) and the reference of the straight space (needed by sct_apply_transfo)
+        fname_warp_curve2straight = os.path.join(self.path_output, "warp_curve2straight.nii.gz")
+        fname_warp_straight2curve = os.path.join(self.path_output, "warp_straight2curve.nii.gz")
+        if self.curved2straight:
+            warp_curve2straight.save(fname_warp_curve2straight, verbose=verbose)
+            logger.info('Warping field generated: {}'.format(fname_warp_curve2straight))
+        if self.straight2curved:
+            warp_straight2curve.save(fname_warp_straight2curve, verbose=verbose)
+            logger.info('Warping field generated: {}'.format(fname_warp_straight2curve))
+        fname_ref = os.path.join(path_tmp, "straight_ref_space.nii")
+        image_ref.save(fname_ref, verbose=verbose)
 
-        # go to tmp folder
-        curdir = os.getcwd()
-        os.chdir(path_tmp)
+        if self.curved2straight:
+            logger.info('Apply transformation to input image...')
+            sct_apply_transfo.main(['-i', fname_anat,
+                                    '-d', fname_ref,
+                                    '-w', fname_warp_curve2straight,
+                                    '-o', os.path.join(path_tmp, 'tmp.anat_rigid_warp.nii.gz'),
+                                    '-x', 'spline',
+                                    '-v', '0'])
+
+        if self.accuracy_results:
+            time_accuracy_results = time.time()
+            # compute the error between the straightened centerline/segmentation and the central vertical line.
+            # Ideally, the error should be zero.
+            # Apply deformation to input image
+            logger.info('Apply transformation to centerline image...')
+            sct_apply_transfo.main(['-i', fname_centerline,
+                                    '-d', fname_ref,
+                                    '-w', fname_warp_curve2straight,
+                                    '-o', os.path.join(path_tmp, 'tmp.centerline_straight.nii.gz'),
+                                    '-x', 'nn',
+                                    '-v', '0'])
+            file_centerline_straight = Image(os.path.join(path_tmp, 'tmp.centerline_straight.nii.gz'), verbose=verbose)
+            nx, ny, nz, nt, px, py, pz, pt = file_centerline_straight.dim
+            coordinates_centerline = file_centerline_straight.getNonZeroCoordinates(sorting='z')
+            mean_coord = []
+            for z in range(coordinates_centerline[0].z, coordinates_centerline[-1].z):
+                temp_mean = [coord.value for coord in coordinates_centerline if coord.z == z]
+                if temp_mean:
+                    mean_value = np.mean(temp_mean)
+                    mean_coord.append(
+                        np.mean([[coord.x * coord.value / mean_value, coord.y * coord.value / mean_value]
+                                 for coord in coordinates_centerline if coord.z == z], axis=0))
+
+            # compute error between the straightened centerline and the straight line.
+            x0 = file_centerline_straight.data.shape[0] / 2.0
+            y0 = file_centerline_straight.data.shape[1] / 2.0
+            count_mean = 0
+            if self.number_of_points >= 10:
+                mean_c = mean_coord[2:-2]  # we don't include the four extrema because there are usually messy.
+            else:
+                mean_c = mean_coord
+            for coord_z in mean_c:
+                if not np.isnan(np.sum(coord_z)):
+                    dist = ((x0 - coord_z[0]) * px) ** 2 + ((y0 - coord_z[1]) * py) ** 2
+                    self.mse_straightening += dist
+                    dist = np.sqrt(dist)
+                    if dist > self.max_distance_straightening:
+                        self.max_distance_straightening = dist
+                    count_mean += 1
+            self.mse_straightening = np.sqrt(self.mse_straightening / float(count_mean))
+
+            self.elapsed_time_accuracy = time.time() - time_accuracy_results
+
+        # Generate output file (in current folder)
+        logger.info('Generate output files...')
+        # create ref_straight.nii.gz file that can be used by other SCT functions that need a straight reference space
+        if self.curved2straight:
+            copy(os.path.join(path_tmp, "tmp.anat_rigid_warp.nii.gz"),
+                 os.path.join(self.path_output, "straight_ref.nii.gz"))
+            # move straightened input file
+            if fname_output == '':
+                fname_straight = generate_output_file(os.path.join(path_tmp, "tmp.anat_rigid_warp.nii.gz"),
+                                                      os.path.join(self.path_output,
+                                                                   file_anat + "_straight" + ext_anat), verbose)
+            else:
+                fname_straight = generate_output_file(os.path.join(path_tmp, "tmp.anat_rigid_warp.nii.gz"),
+                                                      os.path.join(self.path_output, fname_output),
+                                                      verbose)  # straightened anatomic
+
+        # Remove temporary files
+        if remove_temp_files:
+            logger.info('Remove temporary files...')
+            rmtree(path_tmp)
+
+        if self.accuracy_results:
+            logger.info('Maximum x-y error: {} mm'.format(self.max_distance_straightening))
+            logger.info('Accuracy of straightening (MSE): {} mm'.format(self.mse_straightening))
+
+        # display elapsed time
+        self.elapsed_time = int(np.round(time.time() - start_time))
+
+        return fname_straight
+
+    def compute_warping_fields(self, image_centerline, image_centerline_ref=None, image_discs_input=None,
+                               image_discs_ref=None, path_tmp=None):
+        """
+        Compute the curved->straight and straight->curved warping fields, in memory (steps 1 to 6 of straighten()).
+
+        Only the warping fields enabled by `self.curved2straight` and `self.straight2curved` are computed.
+
+        :param image_centerline: Image of the centerline (or segmentation) of the spinal cord.
+        :param image_centerline_ref: Image of the centerline of the destination space. Required if
+            `self.use_straight_reference` is True, ignored otherwise.
+        :param image_discs_input: Image of the intervertebral discs labels of the input space. Optional.
+        :param image_discs_ref: Image of the intervertebral discs labels of the destination space. Optional.
+        :param path_tmp: Folder in which the warping fields are memory-mapped if they do not fit within
+            `self.max_memory`, and debug outputs are written. If None, nothing is written to disk.
+        :return: warp_curve2straight, warp_straight2curve, image_straight: warping fields (None if disabled), and
+            centerline in the straight space, to be used as the destination of warp_curve2straight
+        """
+        verbose = self.verbose
 
         # Change orientation of the input centerline into RPI
-        image_centerline = Image("centerline.nii.gz").change_orientation("RPI").save("centerline_rpi.nii.gz",
-                                                                                     mutable=True)
+        image_centerline = change_orientation(image_centerline, "RPI")
 
         # Get dimension
         nx, ny, nz, nt, px, py, pz, pt = image_centerline.dim
@@ -133,29 +429,19 @@ class SpinalCordStraightener(object):
             intermediate_resampling = False
 
         if intermediate_resampling:
-            mv('centerline_rpi.nii.gz', 'centerline_rpi_native.nii.gz')
-            pz_native = pz
-            # TODO: remove system call
-            sct_resample.main([
-                '-i', 'centerline_rpi_native.nii.gz',
-                '-mm', str(px_r) + 'x' + str(py_r) + 'x' + str(pz_r),
-                '-o', 'centerline_rpi.nii.gz',
-                '-v', '0',
-            ])
-            image_centerline = Image('centerline_rpi.nii.gz')
+            image_centerline = resample_nib(image_centerline, new_size=[px_r, py_r, pz_r], new_size_type='mm',
+                                            interpolation='linear')
             nx, ny, nz, nt, px, py, pz, pt = image_centerline.dim
 
         if np.min(image_centerline.data) < 0 or np.max(image_centerline.data) > 1:
-            image_centerline.data[image_centerline.data < 0] = 0
-            image_centerline.data[image_centerline.data > 1] = 1
-            image_centerline.save()
+            image_centerline.data = np.clip(image_centerline.data, 0, 1)
 
         # 2. extract bspline fitting of the centerline, and its derivatives
-        img_ctl = Image('centerline_rpi.nii.gz')
-        _, arr_ctl_phys, arr_ctl_der_phys, _ = get_centerline(img_ctl, self.param_centerline,
+        _, arr_ctl_phys, arr_ctl_der_phys, _ = get_centerline(image_centerline, self.param_centerline,
                                                               verbose=verbose, space="phys")
         centerline = Centerline(*arr_ctl_phys, *arr_ctl_der_phys)
         number_of_points = centerline.number_of_points
+        self.number_of_points = number_of_points
 
         # ==========================================================================================
         logger.info('Create the straight space and the safe zone')
@@ -213,13 +499,10 @@ class SpinalCordStraightener(object):
         # ==========================================================================================
         # TODO: maybe this if case is not needed?
         if self.use_straight_reference:
-            image_centerline_pad = Image('centerline_rpi.nii.gz')
+            image_centerline_pad = image_centerline
             nx, ny, nz, nt, px, py, pz, pt = image_centerline_pad.dim
 
-            fname_ref = 'centerline_ref_rpi.nii.gz'
-            image_centerline_straight = Image('centerline_ref.nii.gz') \
-                .change_orientation("RPI") \
-                .save(fname_ref, mutable=True)
+            image_centerline_straight = change_orientation(image_centerline_ref, "RPI")
             _, arr_ctl_phys, arr_ctl_der_phys, _ = get_centerline(image_centerline_straight, self.param_centerline,
                                                                   verbose=verbose, space="phys")
             centerline_straight = Centerline(*arr_ctl_phys, *arr_ctl_der_phys)
@@ -231,8 +514,8 @@ class SpinalCordStraightener(object):
             hdr_warp_s = image_centerline_straight.hdr.copy()
             hdr_warp_s.set_data_dtype('float32')
 
-            if self.discs_input_filename != "" and self.discs_ref_filename != "":
-                discs_input_image = Image('labels_input.nii.gz')
+            if image_discs_input is not None and image_discs_ref is not None:
+                discs_input_image = image_discs_input
                 coord = discs_input_image.getNonZeroCoordinates(sorting='z', reverse_coord=True)
                 coord_physical = []
                 for c in coord:
@@ -240,9 +523,11 @@ class SpinalCordStraightener(object):
                     c_p.append(c.value)
                     coord_physical.append(c_p)
                 centerline.compute_vertebral_distribution(coord_physical)
-                centerline.save_centerline(image=discs_input_image, fname_output='discs_input_image.nii.gz')
+                if path_tmp is not None:
+                    centerline.save_centerline(image=discs_input_image,
+                                               fname_output=os.path.join(path_tmp, 'discs_input_image.nii.gz'))
 
-                discs_ref_image = Image('labels_ref.nii.gz')
+                discs_ref_image = image_discs_ref
                 coord = discs_ref_image.getNonZeroCoordinates(sorting='z', reverse_coord=True)
                 coord_physical = []
                 for c in coord:
@@ -250,7 +535,9 @@ class SpinalCordStraightener(object):
                     c_p.append(c.value)
                     coord_physical.append(c_p)
                 centerline_straight.compute_vertebral_distribution(coord_physical)
-                centerline_straight.save_centerline(image=discs_ref_image, fname_output='discs_ref_image.nii.gz')
+                if path_tmp is not None:
+                    centerline_straight.save_centerline(image=discs_ref_image,
+                                                        fname_output=os.path.join(path_tmp, 'discs_ref_image.nii.gz'))
 
         else:
             logger.info('Pad input volume to account for spinal cord length...')
@@ -258,44 +545,11 @@ class SpinalCordStraightener(object):
             start_point, end_point = bound_straight[0], bound_straight[1]
             offset_z = 0
 
-            # if the destination image is resampled, we still create the straight reference space with the native
-            # resolution.
-            # TODO: Maybe this if case is not needed?
+            # if the destination image is resampled, add a few slices to account for the lower resolution.
+            # Note: the straight reference space used to be computed at the native resolution, but it was overwritten by
+            # the resampled one before being used.
             if intermediate_resampling:
-                padding_z = int(np.ceil(1.5 * ((length_centerline - size_z_centerline) / 2.0) / pz_native))
-                sct_image.main([
-                    '-i', 'centerline_rpi_native.nii.gz',
-                    '-o', 'tmp.centerline_pad_native.nii.gz',
-                    '-pad', '0,0,' + str(padding_z),
-                    '-v', '0',
-                ])
-                image_centerline_pad = Image('centerline_rpi_native.nii.gz')
-                nx, ny, nz, nt, px, py, pz, pt = image_centerline_pad.dim
-                start_point_coord_native = image_centerline_pad.transfo_phys2pix([[0, 0, start_point]])[0]
-                end_point_coord_native = image_centerline_pad.transfo_phys2pix([[0, 0, end_point]])[0]
-                straight_size_x = int(self.xy_size / px)
-                straight_size_y = int(self.xy_size / py)
-                warp_space_x = [int(np.round(nx / 2)) - straight_size_x, int(np.round(nx / 2)) + straight_size_x]
-                warp_space_y = [int(np.round(ny / 2)) - straight_size_y, int(np.round(ny / 2)) + straight_size_y]
-                if warp_space_x[0] < 0:
-                    warp_space_x[1] += warp_space_x[0] - 2
-                    warp_space_x[0] = 0
-                if warp_space_y[0] < 0:
-                    warp_space_y[1] += warp_space_y[0] - 2
-                    warp_space_y[0] = 0
-
-                spec = dict((
-                    (0, warp_space_x),
-                    (1, warp_space_y),
-                    (2, (0, end_point_coord_native[2] - start_point_coord_native[2])),
-                ))
-                spatial_crop(Image("tmp.centerline_pad_native.nii.gz"), spec).save(
-                    "tmp.centerline_pad_crop_native.nii.gz")
-
-                fname_ref = 'tmp.centerline_pad_crop_native.nii.gz'
                 offset_z = 4
-            else:
-                fname_ref = 'tmp.centerline_pad_crop.nii.gz'
 
             nx, ny, nz, nt, px, py, pz, pt = image_centerline.dim
             padding_z = int(np.ceil(1.5 * ((length_centerline - size_z_centerline) / 2.0) / pz)) + offset_z
@@ -360,7 +614,7 @@ class SpinalCordStraightener(object):
             time_centerlines = time.time() - time_centerlines
             logger.info('Time to generate centerline: {} ms'.format(np.round(time_centerlines * 1000.0)))
 
-        if verbose == 2:
+        if verbose == 2 and path_tmp is not None:
             # TODO: use OO
             import matplotlib.pyplot as plt
             from datetime import datetime
@@ -375,11 +629,11 @@ class SpinalCordStraightener(object):
             plt.plot(range_points, dist_curved)
             plt.plot(range_points, dist_straight)
             plt.grid(True)
-            plt.savefig('fig_straighten_' + datetime.now().strftime("%y%m%d%H%M%S%f") + '.png')
+            plt.savefig(os.path.join(path_tmp, 'fig_straighten_' + datetime.now().strftime("%y%m%d%H%M%S%f") + '.png'))
             plt.close()
 
         lookup_curved2straight = list(range(centerline.number_of_points))
-        if self.discs_input_filename != "":
+        if image_discs_input is not None:
             # create look-up table curved to straight
             for index in range(centerline.number_of_points):
                 disc_label = centerline.l_points[index]
@@ -404,7 +658,7 @@ class SpinalCordStraightener(object):
         lookup_curved2straight = np.array(lookup_curved2straight)
 
         lookup_straight2curved = list(range(centerline_straight.number_of_points))
-        if self.discs_input_filename != "":
+        if image_discs_input is not None:
             for index in range(centerline_straight.number_of_points):
                 disc_label = centerline_straight.l_points[index]
                 relative_position = centerline_straight.dist_points_rel[index]
@@ -425,70 +679,29 @@ class SpinalCordStraightener(object):
                 break
         lookup_straight2curved = np.array(lookup_straight2curved)
 
-        # Create volumes containing curved and straight warping fields
-        data_warp_curved2straight = np.zeros((nx_s, ny_s, nz_s, 1, 3))
-        data_warp_straight2curved = np.zeros((nx, ny, nz, 1, 3))
-
         # 5. compute transformations
-        # Curved and straight images and the same dimensions, so we compute both warping fields at the same time.
-        # b. determine which plane of spinal cord centreline it is included
-
+        # For each voxel, determine the plane of the spinal cord centerline it is included in, and find the
+        # corresponding position in the other space. Warping fields are computed slab by slab to bound memory usage.
+        if path_tmp is not None:
+            fname_memmap_curved2straight = os.path.join(path_tmp, 'warp_curve2straight.dat')
+            fname_memmap_straight2curved = os.path.join(path_tmp, 'warp_straight2curve.dat')
+        else:
+            fname_memmap_curved2straight, fname_memmap_straight2curved = None, None
+        warp_params = dict(centerline=centerline, centerline_straight=centerline_straight,
+                           threshold_distance=self.threshold_distance)
         if self.curved2straight:
-            for u in sct_progress_bar(range(nz_s)):
-                x_s, y_s, z_s = np.mgrid[0:nx_s, 0:ny_s, u:u + 1]
-                indexes_straight = np.array(list(zip(x_s.ravel(), y_s.ravel(), z_s.ravel())))
-                physical_coordinates_straight = image_centerline_straight.transfo_pix2phys(indexes_straight)
-                nearest_indexes_straight = centerline_straight.find_nearest_indexes(physical_coordinates_straight)
-                distances_straight = centerline_straight.get_distances_from_planes(physical_coordinates_straight,
-                                                                                   nearest_indexes_straight)
-                lookup = lookup_straight2curved[nearest_indexes_straight]
-                indexes_out_distance_straight = np.logical_or(
-                    np.logical_or(distances_straight > self.threshold_distance,
-                                  distances_straight < -self.threshold_distance), lookup == 0)
-                projected_points_straight = centerline_straight.get_projected_coordinates_on_planes(
-                    physical_coordinates_straight, nearest_indexes_straight)
-                coord_in_planes_straight = centerline_straight.get_in_plans_coordinates(projected_points_straight,
-                                                                                        nearest_indexes_straight)
-
-                coord_straight2curved = centerline.get_inverse_plans_coordinates(coord_in_planes_straight, lookup)
-                displacements_straight = coord_straight2curved - physical_coordinates_straight
-                # Invert Z coordinate as ITK & ANTs physical coordinate system is LPS- (RAI+)
-                # while ours is LPI-
-                # Refs: https://sourceforge.net/p/advants/discussion/840261/thread/2a1e9307/#fb5a
-                #  https://www.slicer.org/wiki/Coordinate_systems
-                displacements_straight[:, 2] = -displacements_straight[:, 2]
-                displacements_straight[indexes_out_distance_straight] = [100000.0, 100000.0, 100000.0]
-
-                data_warp_curved2straight[indexes_straight[:, 0], indexes_straight[:, 1], indexes_straight[:, 2], 0, :]\
-                    = -displacements_straight
+            data_warp_curved2straight = compute_warping_field(
+                warp_curved2straight_slab, (nx_s, ny_s, nz_s),
+                dict(warp_params, affine_straight=image_centerline_straight.hdr.get_best_affine(),
+                     lookup_straight2curved=lookup_straight2curved),
+                n_jobs=self.n_jobs, max_memory=self.max_memory, fname_memmap=fname_memmap_curved2straight)
 
         if self.straight2curved:
-            for u in sct_progress_bar(range(nz)):
-                x, y, z = np.mgrid[0:nx, 0:ny, u:u + 1]
-                indexes = np.array(list(zip(x.ravel(), y.ravel(), z.ravel())))
-                physical_coordinates = image_centerline_pad.transfo_pix2phys(indexes)
-                nearest_indexes_curved = centerline.find_nearest_indexes(physical_coordinates)
-                distances_curved = centerline.get_distances_from_planes(physical_coordinates,
-                                                                        nearest_indexes_curved)
-                lookup = lookup_curved2straight[nearest_indexes_curved]
-                indexes_out_distance_curved = np.logical_or(
-                    np.logical_or(distances_curved > self.threshold_distance,
-                                  distances_curved < -self.threshold_distance), lookup == 0)
-                projected_points_curved = centerline.get_projected_coordinates_on_planes(physical_coordinates,
-                                                                                         nearest_indexes_curved)
-                coord_in_planes_curved = centerline.get_in_plans_coordinates(projected_points_curved,
-                                                                             nearest_indexes_curved)
-
-                coord_curved2straight = centerline_straight.points[lookup]
-                coord_curved2straight[:, 0:2] += coord_in_planes_curved[:, 0:2]
-                coord_curved2straight[:, 2] += distances_curved
-
-                displacements_curved = coord_curved2straight - physical_coordinates
-
-                displacements_curved[:, 2] = -displacements_curved[:, 2]
-                displacements_curved[indexes_out_distance_curved] = [100000.0, 100000.0, 100000.0]
-
-                data_warp_straight2curved[indexes[:, 0], indexes[:, 1], indexes[:, 2], 0, :] = -displacements_curved
+            data_warp_straight2curved = compute_warping_field(
+                warp_straight2curved_slab, (nx, ny, nz),
+                dict(warp_params, affine_curved=image_centerline_pad.hdr.get_best_affine(),
+                     lookup_curved2straight=lookup_curved2straight),
+                n_jobs=self.n_jobs, max_memory=self.max_memory, fname_memmap=fname_memmap_straight2curved)
 
         # Creation of the safe zone based on pre-calculated safe boundaries
         coord_bound_curved_inf, coord_bound_curved_sup = image_centerline_pad.transfo_phys2pix(
@@ -502,111 +715,15 @@ class SpinalCordStraightener(object):
             data_warp_straight2curved[:, :, 0:coord_bound_curved_inf[0][2], 0, :] = 100000.0
             data_warp_straight2curved[:, :, coord_bound_curved_sup[0][2]:, 0, :] = 100000.0
 
-        # Generate warp files as a warping fields
+        # 6. Generate warping fields
         hdr_warp_s.set_intent('vector', (), '')
         hdr_warp_s.set_data_dtype('float32')
         hdr_warp.set_intent('vector', (), '')
         hdr_warp.set_data_dtype('float32')
+        warp_curve2straight, warp_straight2curve = None, None
         if self.curved2straight:
-            img = Nifti1Image(data_warp_curved2straight, None, hdr_warp_s)
-            save(img, 'tmp.curve2straight.nii.gz')
-            logger.info('Warping field generated: tmp.curve2straight.nii.gz')
-
-        if self.straight2curved:
-            img = Nifti1Image(data_warp_straight2curved, None, hdr_warp)
-            save(img, 'tmp.straight2curve.nii.gz')
-            logger.info('Warping field generated: tmp.straight2curve.nii.gz')
-
-        image_centerline_straight.save(fname_ref)
-        if self.curved2straight:
-            logger.info('Apply transformation to input image...')
-            sct_apply_transfo.main(['-i', 'data.nii',
-                                    '-d', fname_ref,
-                                    '-w', 'tmp.curve2straight.nii.gz',
-                                    '-o', 'tmp.anat_rigid_warp.nii.gz',
-                                    '-x', 'spline',
-                                    '-v', '0'])
-
-        if self.accuracy_results:
-            time_accuracy_results = time.time()
-            # compute the error between the straightened centerline/segmentation and the central vertical line.
-            # Ideally, the error should be zero.
-            # Apply deformation to input image
-            logger.info('Apply transformation to centerline image...')
-            sct_apply_transfo.main(['-i', 'centerline.nii.gz',
-                                    '-d', fname_ref,
-                                    '-w', 'tmp.curve2straight.nii.gz',
-                                    '-o', 'tmp.centerline_straight.nii.gz',
-                                    '-x', 'nn',
-                                    '-v', '0'])
-            file_centerline_straight = Image('tmp.centerline_straight.nii.gz', verbose=verbose)
-            nx, ny, nz, nt, px, py, pz, pt = file_centerline_straight.dim
-            coordinates_centerline = file_centerline_straight.getNonZeroCoordinates(sorting='z')
-            mean_coord = []
-            for z in range(coordinates_centerline[0].z, coordinates_centerline[-1].z):
-                temp_mean = [coord.value for coord in coordinates_centerline if coord.z == z]
-                if temp_mean:
-                    mean_value = np.mean(temp_mean)
-                    mean_coord.append(
-                        np.mean([[coord.x * coord.value / mean_value, coord.y * coord.value / mean_value]
-                                 for coord in coordinates_centerline if coord.z == z], axis=0))
-
-            # compute error between the straightened centerline and the straight line.
-            x0 = file_centerline_straight.data.shape[0] / 2.0
-            y0 = file_centerline_straight.data.shape[1] / 2.0
-            count_mean = 0
-            if number_of_points >= 10:
-                mean_c = mean_coord[2:-2]  # we don't include the four extrema because there are usually messy.
-            else:
-                mean_c = mean_coord
-            for coord_z in mean_c:
-                if not np.isnan(np.sum(coord_z)):
-                    dist = ((x0 - coord_z[0]) * px) ** 2 + ((y0 - coord_z[1]) * py) ** 2
-                    self.mse_straightening += dist
-                    dist = np.sqrt(dist)
-                    if dist > self.max_distance_straightening:
-                        self.max_distance_straightening = dist
-                    count_mean += 1
-            self.mse_straightening = np.sqrt(self.mse_straightening / float(count_mean))
-
-            self.elapsed_time_accuracy = time.time() - time_accuracy_results
-
-        os.chdir(curdir)
-
-        # Generate output file (in current folder)
-        # TODO: do not uncompress the warping field, it is too time consuming!
-        logger.info('Generate output files...')
-        if self.curved2straight:
-            generate_output_file(os.path.join(path_tmp, "tmp.curve2straight.nii.gz"),
-                                 os.path.join(self.path_output, "warp_curve2straight.nii.gz"), verbose)
+            warp_curve2straight = Image(data_warp_curved2straight, hdr=hdr_warp_s)
         if self.straight2curved:
-            generate_output_file(os.path.join(path_tmp, "tmp.straight2curve.nii.gz"),
-                                 os.path.join(self.path_output, "warp_straight2curve.nii.gz"), verbose)
-
-        # create ref_straight.nii.gz file that can be used by other SCT functions that need a straight reference space
-        if self.curved2straight:
-            copy(os.path.join(path_tmp, "tmp.anat_rigid_warp.nii.gz"),
-                 os.path.join(self.path_output, "straight_ref.nii.gz"))
-            # move straightened input file
-            if fname_output == '':
-                fname_straight = generate_output_file(os.path.join(path_tmp, "tmp.anat_rigid_warp.nii.gz"),
-                                                      os.path.join(self.path_output,
-                                                                   file_anat + "_straight" + ext_anat), verbose)
-            else:
-                fname_straight = generate_output_file(os.path.join(path_tmp, "tmp.anat_rigid_warp.nii.gz"),
-                                                      os.path.join(self.path_output, fname_output),
-                                                      verbose)  # straightened anatomic
-
-        # Remove temporary files
-        if remove_temp_files:
-            logger.info('Remove temporary files...')
-            rmtree(path_tmp)
+            warp_straight2curve = Image(data_warp_straight2curved, hdr=hdr_warp)
 
-        if self.accuracy_results:
-            logger.info('Maximum x-y error: {} mm'.format(self.max_distance_straightening))
-            logger.info('Accuracy of straightening (MSE): {} mm'.format(self.mse_straightening))
-
-        # display elapsed time
-        self.elapsed_time = int(np.round(time.time() - start_time))
-
-        return fname_straight
+        return warp_curve2straight, warp_straight2curve, image_centerline_straight
@@ -11,6 +11,54 @@ import numpy as np
 logger = logging.getLogger(__name__)
 
 
+class VertLevelIndex:
+    """
+    Vertebral level of each slice of a vertebral labeling image, computed once so that slice -> level and
+    level -> slices lookups don't have to scan the image again.
+
+    The level of a slice is the average of the non-null and finite values of the slice, rounded to the closest integer.
+    Important: This class assumes that the 3rd dimension is Z.
+    """
+    def __init__(self, im_vertlevel):
+        """
+        :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
+        """
+        data = im_vertlevel.data
+        if data.ndim > 3:
+            data = np.moveaxis(data, 2, -1)
+        data = data.reshape(-1, data.shape[-1])
+        mask = (data != 0) & np.isfinite(data)
+        counts = mask.sum(axis=0)
+        sums = np.where(mask, data, 0).sum(axis=0, dtype=np.float64)
+        # average non-null values and round to closest
+        self.levels = np.zeros(data.shape[-1], dtype=int)
+        self.levels[counts > 0] = np.round(sums[counts > 0] / counts[counts > 0])
+        self.is_empty = counts == 0
+        self._slices = {}
+        for iz in np.flatnonzero(~self.is_empty):
+            self._slices.setdefault(int(self.levels[iz]), []).append(int(iz))
+
+    @property
+    def n_slices(self):
+        return len(self.levels)
+
+    def get_slices(self, level):
+        """
+        :param level: int: vertebral level
+        :return: list of int: slices of this vertebral level
+        """
+        return list(self._slices.get(level, []))
+
+    def get_level(self, idx_slice):
+        """
+        :param idx_slice: int: slice (z)
+        :return: int: vertebral level. If no level is found (only zeros on this slice), return None.
+        """
+        if self.is_empty[idx_slice]:
+            return None
+        return int(self.levels[idx_slice])
+
+
 def get_slices_from_vertebral_levels(im_vertlevel, level):
     """
     Find the slices of the corresponding vertebral level.
@@ -19,27 +67,13 @@ def get_slices_from_vertebral_levels(im_vertlevel, level):
     :param level: int: vertebral level
     :return: list of int: slices
     """
-    data_vertlevel = im_vertlevel.data
-    slices = []
-    # loop across z
-    for iz in range(data_vertlevel.shape[-1]):
-        # fetch non-null and finite values
-        data_vertlevel_nonzero = data_vertlevel[..., iz].flatten()[np.nonzero(data_vertlevel[..., iz].flatten())]
-        data_vertlevel_nonzero_finite = [i for i in data_vertlevel_nonzero if np.isfinite(i)]
-        # avoid empty slice
-        if not data_vertlevel_nonzero_finite == []:
-            # average non-null values and round to closest
-            average_value = int(np.round(np.mean(data_vertlevel_nonzero_finite)))
-            # if that matches the desired level, append it to slice list
-            if average_value == level:
-                slices.append(iz)
-    return slices
+    return VertLevelIndex(im_vertlevel).get_slices(level)
 
 
 def get_vertebral_level_from_slice(im_vertlevel, idx_slice):
     """
     Find the vertebral level of the corresponding slice.
-    Important: This function assumes that the 3rd dimension is Z.
+    Important: This function assumes that the 3rd dimension is Z. To look up many slices, use VertLevelIndex.
     :param im_vertlevel: image object of vertebral labeling (e.g., label/template/PAM50_levels.nii.gz)
     :param idx_slice: int: slice (z)
     :return: int: vertebral level. If no level is found (only zeros on this slice), return None.
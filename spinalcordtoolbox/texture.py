@@ -0,0 +1,169 @@
+"""
+Gray level co-occurrence matrix (GLCM) texture features, computed in a sliding window (used by sct_analyze_texture)
+
+Copyright (c) 2023 Polytechnique Montreal <www.neuro.polymtl.ca>
+License: see the file LICENSE
+"""
+
+import math
+import functools
+import multiprocessing
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from spinalcordtoolbox.utils import sct_progress_bar, get_n_jobs
+
+# Properties of `skimage.feature.graycoprops`
+GLCM_FEATURES = ('contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM', 'mean', 'variance',
+                 'std', 'entropy')
+
+
+def glcm_offset(distance, angle):
+    """
+    Row and column offsets between the two pixels of a co-occurrence, rounded like `skimage.feature.graycomatrix`.
+
+    :param distance: int: Distance between the pixels, in pixels.
+    :param angle: Angle of the offset, in degrees.
+    :return: tuple (row offset, column offset)
+    """
+    def round_half_away(value):
+        # Not `round()`: adding 0.5 first makes e.g. sin(30°) = 0.49999999999999994 round to 1, as skimage does
+        return math.floor(value + 0.5) if value >= 0 else math.ceil(value - 0.5)
+
+    angle = np.radians(angle)
+    return round_half_away(math.sin(angle) * distance), round_half_away(math.cos(angle) * distance)
+
+
+def _glcm_properties(a, b, features):
+    """
+    Compute GLCM properties from the pairs of gray levels of several windows at once.
+
+    The symmetric and normalized GLCM of a window is the histogram of the pairs (a, b) and (b, a), so the properties
+    of `skimage.feature.graycoprops` can be computed as averages over these pairs, without building the 256x256
+    matrices.
+
+    :param a: ndarray (n_windows, n_pairs): gray level of the first pixel of each pair.
+    :param b: ndarray (n_windows, n_pairs): gray level of the second pixel of each pair.
+    :param features: list of properties (see `GLCM_FEATURES`).
+    :return: dict {feature: ndarray (n_windows,)}
+    """
+    diff = (a - b).astype(np.float64)
+    levels = np.concatenate([a, b], axis=1).astype(np.float64)
+    mean = levels.mean(axis=1)
+    variance = np.mean((levels - mean[:, np.newaxis]) ** 2, axis=1)
+    if {'ASM', 'energy', 'entropy'} & set(features):
+        # Number of occurrences of each (non-zero) GLCM entry, counted once per occurrence, i.e. each entry of the
+        # symmetric GLCM with count `n` appears `n` times in `counts`
+        entries = np.concatenate([a * 256 + b, b * 256 + a], axis=1)
+        keys = entries + (np.arange(len(entries)) * 256 ** 2)[:, np.newaxis]
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        proba = counts[inverse].reshape(entries.shape) / entries.shape[1]
+
+    results = {}
+    for feature in features:
+        if feature == 'contrast':
+            results[feature] = np.mean(diff ** 2, axis=1)
+        elif feature == 'dissimilarity':
+            results[feature] = np.mean(np.abs(diff), axis=1)
+        elif feature == 'homogeneity':
+            results[feature] = np.mean(1 / (1 + diff ** 2), axis=1)
+        elif feature == 'ASM':
+            results[feature] = np.mean(proba, axis=1)
+        elif feature == 'energy':
+            results[feature] = np.sqrt(np.mean(proba, axis=1))
+        elif feature == 'entropy':
+            results[feature] = -np.mean(np.log(proba), axis=1)
+        elif feature == 'mean':
+            results[feature] = mean
+        elif feature == 'variance':
+            results[feature] = variance
+        elif feature == 'std':
+            results[feature] = np.sqrt(variance)
+        elif feature == 'correlation':
+            std = np.sqrt(variance)
+            cov = np.mean((a - mean[:, np.newaxis]) * (b - mean[:, np.newaxis]), axis=1)
+            # Same special case as skimage: constant windows have a correlation of 1
+            results[feature] = np.ones_like(mean)
+            mask = std >= 1e-15
+            results[feature][mask] = cov[mask] / (std[mask] * std[mask])
+        else:
+            raise ValueError(f'{feature} is an invalid property')
+    return results
+
+
+def glcm_texture_slice(im_slice, seg_slice, distance, angles, features):
+    """
+    Compute GLCM texture features in a window of (2 * distance + 1)^2 pixels centered on each pixel of a 2D slice.
+
+    Features are only computed for pixels whose whole window lies inside the slice and inside the mask, and are zero
+    elsewhere. For each of these pixels, the result is the same as calling `skimage.feature.graycomatrix` on the
+    window (cast to uint8) with `symmetric=True, normed=True`, then `skimage.feature.graycoprops`, but all the windows
+    of the slice are processed at once.
+
+    :param im_slice: 2D ndarray: image.
+    :param seg_slice: 2D ndarray: mask.
+    :param distance: int: Distance between the pixels of a co-occurrence, in pixels.
+    :param angles: list of int: Angles of the co-occurrences, in degrees.
+    :param features: list of properties (see `GLCM_FEATURES`).
+    :return: dict {(feature, angle): 2D ndarray float64}
+    """
+    for feature in features:
+        if feature not in GLCM_FEATURES:
+            raise ValueError(f'{feature} is an invalid property')
+    distance = int(distance)
+    size = 2 * distance + 1
+    results = {(feature, angle): np.zeros(im_slice.shape) for feature in features for angle in angles}
+    if im_slice.shape[0] < size or im_slice.shape[1] < size:
+        return results
+
+    # Pixels whose window is entirely inside the mask, indexed by the top-left corner of their window
+    valid = sliding_window_view(seg_slice != 0, (size, size)).all(axis=(2, 3))
+    x, y = np.nonzero(valid)
+    if not len(x):
+        return results
+    windows = sliding_window_view(im_slice.astype(np.uint8), (size, size))[x, y].astype(np.int64)
+
+    for angle in angles:
+        d_row, d_col = glcm_offset(distance, angle)
+        rows = slice(max(0, -d_row), min(size, size - d_row))
+        cols = slice(max(0, -d_col), min(size, size - d_col))
+        rows_offset = slice(rows.start + d_row, rows.stop + d_row)
+        cols_offset = slice(cols.start + d_col, cols.stop + d_col)
+        a = windows[:, rows, cols].reshape(len(windows), -1)
+        b = windows[:, rows_offset, cols_offset].reshape(len(windows), -1)
+        for feature, values in _glcm_properties(a, b, features).items():
+            results[feature, angle][x + distance, y + distance] = values
+    return results
+
+
+def _glcm_texture_task(task, distance, angles, features):
+    """Worker function: compute the GLCM texture features of one slice."""
+    return glcm_texture_slice(*task, distance, angles, features)
+
+
+def glcm_texture(im_data, seg_data, distance, angles, features, jobs=1):
+    """
+    Compute GLCM texture features for each 2D slice along the last axis of a volume (see `glcm_texture_slice`).
+
+    :param im_data: 3D ndarray: image.
+    :param seg_data: 3D ndarray: mask.
+    :param distance: int: Distance between the pixels of a co-occurrence, in pixels.
+    :param angles: list of int: Angles of the co-occurrences, in degrees.
+    :param features: list of properties (see `GLCM_FEATURES`).
+    :param jobs: int: Number of processes used to compute the features, slices being distributed across processes.
+        0 or a negative number means the number of available cores minus that number.
+    :return: dict {(feature, angle): 3D ndarray float64}
+    """
+    tasks = [(im_data[:, :, iz], seg_data[:, :, iz]) for iz in range(im_data.shape[2])]
+    compute = functools.partial(_glcm_texture_task, distance=distance, angles=angles, features=features)
+    n_jobs = min(get_n_jobs(jobs), max(len(tasks), 1))
+    progress = dict(total=len(tasks), unit='slice', desc="Compute texture metrics", ncols=80)
+    if n_jobs == 1:
+        results = list(sct_progress_bar(map(compute, tasks), **progress))
+    else:
+        with multiprocessing.Pool(n_jobs) as pool:
+            results = list(sct_progress_bar(pool.imap(compute, tasks), **progress))
+    if not results:
+        return {(feature, angle): np.zeros(im_data.shape) for feature in features for angle in angles}
+    return {key: np.stack([result[key] for result in results], axis=2) for key in results[0]}
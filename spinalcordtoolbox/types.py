@@ -185,10 +185,10 @@ class Centerline:
                  fname=None):
         # initialization of variables
         self.length = 0.0
-        self.progressive_length = [0.0]
-        self.progressive_length_inverse = [0.0]
-        self.incremental_length = [0.0]
-        self.incremental_length_inverse = [0.0]
+        self.progressive_length = np.zeros(1)
+        self.progressive_length_inverse = np.zeros(1)
+        self.incremental_length = np.zeros(1)
+        self.incremental_length_inverse = np.zeros(1)
 
         # variables used for vertebral distribution
         self.first_label, self.last_label = None, None
@@ -223,12 +223,9 @@ class Centerline:
 
         # computation of centerline features, based on points and derivatives
         self.compute_length()
-        self.coordinate_system = [self.compute_coordinate_system(index) for index in range(0, self.number_of_points)]
-        self.plans_parameters = [self.get_plan_parameters(index) for index in range(0, self.number_of_points)]
-
-        self.matrices = stack([item[4] for item in self.coordinate_system])
-        self.inverse_matrices = stack([item[5] for item in self.coordinate_system])
-        self.offset_plans = array([item[3] for item in self.plans_parameters])
+        self.matrices, self.inverse_matrices = self.compute_coordinate_systems()
+        # offset 'd' of the parametric equation of each plane (see get_plan_parameters)
+        self.offset_plans = -einsum('ij,ij->i', self.derivatives, self.points)
 
         # initialization of KDTree for enabling computation of nearest points in centerline
         self.tree_points = cKDTree(self.points)
@@ -237,19 +234,20 @@ class Centerline:
             self.compute_vertebral_distribution(discs_levels=self.discs_levels, label_reference=self.label_reference)
 
     def compute_length(self):
-        for i in range(0, self.number_of_points - 1):
-            distance = np.sqrt((self.points[i][0] - self.points[i + 1][0]) ** 2 +
-                               (self.points[i][1] - self.points[i + 1][1]) ** 2 +
-                               (self.points[i][2] - self.points[i + 1][2]) ** 2)
-            self.length += distance
-            self.progressive_length.append(distance)
-            self.incremental_length.append(self.incremental_length[-1] + distance)
-        for i in range(self.number_of_points - 1, 0, -1):
-            distance = np.sqrt((self.points[i][0] - self.points[i - 1][0]) ** 2 +
-                               (self.points[i][1] - self.points[i - 1][1]) ** 2 +
-                               (self.points[i][2] - self.points[i - 1][2]) ** 2)
-            self.progressive_length_inverse.append(distance)
-            self.incremental_length_inverse.append(self.incremental_length_inverse[-1] + distance)
+        """
+        Compute the distances between consecutive points of the centerline, from the first point to the last one
+        (`progressive_length`) and from the last point to the first one (`progressive_length_inverse`), as well as their
+        cumulative sums (`incremental_length` and `incremental_length_inverse`). All of them start with a 0.
+        """
+        if self.number_of_points > 1:
+            distances = norm(np.diff(self.points, axis=0), axis=1)
+        else:
+            distances = np.zeros(0)
+        self.length = float(np.sum(distances))
+        self.progressive_length = np.concatenate([[0.0], distances])
+        self.incremental_length = np.concatenate([[0.0], np.cumsum(distances)])
+        self.progressive_length_inverse = np.concatenate([[0.0], distances[::-1]])
+        self.incremental_length_inverse = np.concatenate([[0.0], np.cumsum(distances[::-1])])
 
     def find_nearest_index(self, coord):
         """
@@ -320,6 +318,28 @@ class Centerline:
 
         return origin, x_prime_axis, y_prime_axis, z_prime_axis, matrix_base, inverse_matrix
 
+    def compute_coordinate_systems(self):
+        """
+        This function computes the coordinate reference systems of all the points of the centerline at once. See
+        compute_coordinate_system() for the definition of the axes.
+
+        :return: matrices, inverse_matrices: arrays of shape (number_of_points, 3, 3), where the columns of each matrix
+            are the X, Y and Z axes of the corresponding plane.
+        """
+        z_prime_axis = self.derivatives.astype(np.float64)
+        z_prime_axis /= norm(z_prime_axis, axis=1, keepdims=True)
+        # y_axis - dot(y_axis, z_prime_axis) * z_prime_axis, with y_axis = [0, 1, 0]
+        y_prime_axis = -z_prime_axis[:, [1]] * z_prime_axis
+        y_prime_axis[:, 1] += 1
+        y_prime_axis /= norm(y_prime_axis, axis=1, keepdims=True)
+        x_prime_axis = cross(y_prime_axis, z_prime_axis)
+        x_prime_axis /= norm(x_prime_axis, axis=1, keepdims=True)
+
+        matrices = stack([x_prime_axis, y_prime_axis, z_prime_axis], axis=2)
+        inverse_matrices = inv(matrices)
+
+        return matrices, inverse_matrices
+
     def get_projected_coordinates_on_planes(self, coordinates, indexes):
         return coordinates - multiply(tile(einsum('ij,ij->i', coordinates - self.points[indexes], self.derivatives[indexes]), (3, 1)).transpose(), self.derivatives[indexes])
 
@@ -391,8 +411,7 @@ class Centerline:
         index_disc_inv.sort(key=itemgetter(0))
 
         progress_length = zeros(self.number_of_points)
-        for i in range(self.number_of_points - 1):
-            progress_length[i + 1] = progress_length[i] + self.progressive_length[i]
+        progress_length[1:] = np.cumsum(self.progressive_length[:self.number_of_points - 1])
 
         self.label_reference = label_reference
         if self.label_reference not in self.index_disc:
@@ -178,6 +178,17 @@ def cache_signature(input_files=[], input_params={}):
       signature in the cache file, so as to also verify them prior
       to taking a shortcut.
 
+    """
+    return "# Cache file generated by SCT\nDEPENDENCIES_SIG={}\n".format(cache_key(input_files, input_params)).encode()
+
+
+def cache_key(input_files=[], input_params={}):
+    """
+    Hash the contents of input files and the values of input parameters, e.g. to identify an entry of a FileCache.
+
+    :param input_files: paths of input files (that can influence output)
+    :param input_params: input parameters (that can influence output)
+    :return: str: hexadecimal digest
     """
     import hashlib
     h = hashlib.md5()
@@ -191,7 +202,7 @@ def cache_signature(input_files=[], input_params={}):
         h.update(str(type(v)).encode('utf-8'))
         h.update(str(v).encode('utf-8'))
 
-    return "# Cache file generated by SCT\nDEPENDENCIES_SIG={}\n".format(h.hexdigest()).encode()
+    return h.hexdigest()
 
 
 def cache_valid(cachefile, sig_expected):
@@ -216,6 +227,119 @@ def cache_save(cachefile, sig):
         f.write(sig)
 
 
+def get_cache_dir():
+    """
+    Return the folder where data shared across runs (e.g. straightening warping fields) is cached.
+
+    It can be set with the `SCT_CACHE_DIR` environment variable, and defaults to `$XDG_CACHE_HOME/spinalcordtoolbox`
+    (i.e. `~/.cache/spinalcordtoolbox`).
+    """
+    if os.environ.get('SCT_CACHE_DIR'):
+        return os.path.abspath(os.path.expanduser(os.environ['SCT_CACHE_DIR']))
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'spinalcordtoolbox')
+
+
+class FileCache:
+    """
+    Content-addressed cache of files, shared across runs and working directories.
+
+    Each entry is a folder `<path>/<key>` holding the files produced from some inputs, `key` being typically computed
+    with cache_key(). Entries are stored atomically, so that concurrent runs never read a partially written entry.
+    Once the total size of the cache exceeds `max_size`, the least recently used entries are evicted.
+    """
+    DEFAULT_MAX_SIZE = 2048  # MB
+
+    def __init__(self, name, path=None, max_size=None):
+        """
+        :param name: Name of the cache, i.e. subfolder of `path`.
+        :param path: Parent folder of the cache. Default: get_cache_dir().
+        :param max_size: Maximum size of the cache, in MB. Defaults to the `SCT_CACHE_SIZE` environment variable, or
+            to `DEFAULT_MAX_SIZE`. 0 disables the cache.
+        """
+        self.path = os.path.join(path if path is not None else get_cache_dir(), name)
+        if max_size is None:
+            max_size = float(os.environ.get('SCT_CACHE_SIZE', self.DEFAULT_MAX_SIZE))
+        self.max_size = max_size
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key, filenames, folder):
+        """
+        Copy the files of an entry into `folder`.
+
+        :param key: Key of the entry.
+        :param filenames: Names of the files of the entry.
+        :param folder: Destination folder.
+        :return: True if the entry was found (cache hit), False otherwise.
+        """
+        if not self.enabled:
+            return False
+        path_entry = os.path.join(self.path, key)
+        try:
+            for filename in filenames:
+                shutil.copyfile(os.path.join(path_entry, filename), os.path.join(folder, filename))
+            # Mark the entry as recently used
+            os.utime(path_entry)
+        except FileNotFoundError:
+            # Missing entry, or entry evicted by a concurrent run
+            return False
+        logger.info(f"Reusing cached files from: {path_entry}")
+        return True
+
+    def put(self, key, fnames):
+        """
+        Store files as an entry of the cache, then evict the least recently used entries if the cache is too large.
+
+        :param key: Key of the entry.
+        :param fnames: Paths of the files to store.
+        """
+        if not self.enabled:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        path_entry = os.path.join(self.path, key)
+        # Write the entry in a hidden folder first, so that it only appears once complete
+        path_tmp = tempfile.mkdtemp(prefix=f".{key}_", dir=self.path)
+        for fname in fnames:
+            shutil.copyfile(fname, os.path.join(path_tmp, os.path.basename(fname)))
+        try:
+            os.rename(path_tmp, path_entry)
+            logger.info(f"Cached files in: {path_entry}")
+        except OSError:
+            # The same entry was stored by a concurrent run
+            shutil.rmtree(path_tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the size of the cache is below `max_size`.
+
+        :param keep: Key of an entry that should not be evicted (e.g. the one that was just stored).
+        """
+        entries = []
+        for entry in os.scandir(self.path):
+            # Skip entries being written
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.name))
+            except FileNotFoundError:
+                # Entry evicted by a concurrent run
+                continue
+        size_total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if size_total <= self.max_size * 1024 ** 2:
+                break
+            if name == keep:
+                continue
+            logger.info(f"Evicting cache entry: {os.path.join(self.path, name)}")
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            size_total -= size
+
+
 def mv(src, dst, verbose=1):
     """Move a file from src to dst (adding a logging message)."""
     printv("mv %s %s" % (src, dst), verbose=verbose, type="code")
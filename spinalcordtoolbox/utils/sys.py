@@ -20,6 +20,7 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import inspect
+import multiprocessing
 
 import tqdm
 
@@ -286,6 +287,19 @@ def sct_progress_bar(*args, **kwargs):
     return tqdm.tqdm(*args, **kwargs)
 
 
+def get_n_jobs(jobs):
+    """
+    Convert a `-jobs` argument into a number of worker processes.
+
+    :param jobs: Either an integer greater than or equal to one specifying the number of processes, or 0 or a negative
+        integer specifying the number of available cores minus that number (e.g. -1 = all cores but one).
+    :return: int: number of processes (at least 1)
+    """
+    if jobs < 1:
+        return max(1, multiprocessing.cpu_count() + jobs)
+    return jobs
+
+
 def _which_sct_binaries():
     """
     :return name of the sct binaries to use on this platform
@@ -9,6 +9,7 @@ import pandas as pd
 
 from spinalcordtoolbox import __version__
 from spinalcordtoolbox import aggregate_slicewise
+from spinalcordtoolbox import template
 from spinalcordtoolbox.process_seg import Metric
 from spinalcordtoolbox.image import Image
 
@@ -179,6 +180,31 @@ def test_aggregate_slices_pmj(dummy_metrics):
     assert agg_metric[(2, 3, 4, 5)] == {'VertLevel': None, 'DistancePMJ': 64, 'WA()': 45.25}
 
 
+@pytest.mark.parametrize('perslice,perlevel', [(False, False), (True, False), (False, True)])
+def test_aggregate_groupby(dummy_vert_level, perslice, perlevel):
+    """Test that 1d metrics aggregated with a groupby give the same results as the loop across slice groups"""
+    data = np.array([29., np.nan, 39., 41., np.inf, 51., 59., 62., 70.])
+    funcs = [aggregate_slicewise.func_wa, aggregate_slicewise.func_std, aggregate_slicewise.func_sum,
+             aggregate_slicewise.func_max]
+    kwargs = dict(slices=[1, 2, 3, 4, 5, 6], levels=[2, 3, 4], perslice=perslice, perlevel=perlevel,
+                  fname_vert_level=dummy_vert_level)
+    agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(
+        Metric(data=data, label='area'), group_funcs=[(func.__name__, func) for func in funcs], **kwargs)
+    # Wrapping the functions makes aggregate_per_slice_or_level() loop across the slice groups instead
+    agg_metric_loop = aggregate_slicewise.aggregate_per_slice_or_level(
+        Metric(data=data, label='area'), group_funcs=[(func.__name__, lambda d, m, c, f=func: f(d, m, c))
+                                                      for func in funcs], **kwargs)
+    assert agg_metric.keys() == agg_metric_loop.keys()
+    for slicegroup in agg_metric:
+        assert agg_metric[slicegroup].keys() == agg_metric_loop[slicegroup].keys()
+        for key, value in agg_metric_loop[slicegroup].items():
+            assert agg_metric[slicegroup][key] == (value if value is None or isinstance(value, tuple)
+                                                   else pytest.approx(value))
+    if perslice:
+        # Slice 1 only has a nonfinite value
+        assert agg_metric[(1,)]['func_wa(area)'] is None
+
+
 def test_extract_metric(dummy_data_and_labels):
     """Test different estimation methods."""
     # Weighted average
@@ -228,6 +254,25 @@ def test_extract_metric(dummy_data_and_labels):
     assert agg_metric[list(agg_metric)[0]]['MAP()'] == pytest.approx(20.0, rel=0.01)
 
 
+@pytest.mark.parametrize('method', ['ml', 'map'])
+@pytest.mark.parametrize('perslice', [True, False])
+def test_extract_metric_labels(dummy_data_and_labels, method, perslice):
+    """Test that estimating all labels at once gives the same results as estimating each label separately."""
+    data, labels, label_struc = dummy_data_and_labels
+    id_labels = [2, 0, 1, 99]
+    agg_metrics = aggregate_slicewise.extract_metric_labels(data, labels=labels, label_struc=label_struc,
+                                                            id_labels=id_labels, indiv_labels_ids=[0, 1, 2],
+                                                            perslice=perslice, method=method)
+    assert list(agg_metrics) == id_labels
+    for id_label in id_labels:
+        agg_metric = aggregate_slicewise.extract_metric(data, labels=labels, label_struc=label_struc,
+                                                        id_label=id_label, indiv_labels_ids=[0, 1, 2],
+                                                        perslice=perslice, method=method)
+        assert list(agg_metrics[id_label]) == list(agg_metric)
+        for slicegroup, values in agg_metric.items():
+            assert agg_metrics[id_label][slicegroup] == pytest.approx(values)
+
+
 def test_extract_metric_2d(dummy_data_and_labels_2d):
     """Test different estimation methods with 2D input array"""
     agg_metric = aggregate_slicewise.extract_metric(dummy_data_and_labels_2d[0], labels=dummy_data_and_labels_2d[1],
@@ -372,6 +417,65 @@ def test_save_as_csv_extract_metric(tmp_path, dummy_data_and_labels):
         assert next(spamreader)[1:-1] == [__version__, '', '0:4', '', '', 'label_0', '2.5', '38.0']
 
 
+def test_agg_metric_to_dataframe(tmp_path, dummy_metrics):
+    """Test conversion of the metric structure to a table, and writing of several tables at once"""
+    agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(dummy_metrics['with float'], slices=[3, 4, 5],
+                                                                  perslice=True,
+                                                                  group_funcs=(('WA', aggregate_slicewise.func_wa),))
+    table = aggregate_slicewise.agg_metric_to_dataframe(agg_metric, fname_in='FakeFile.txt')
+    assert list(table.columns) == aggregate_slicewise.TABLE_COLUMNS + ['WA()']
+    assert list(table['Slice (I->S)']) == ['3', '4', '5']
+    assert list(table['WA()']) == [agg_metric[(iz,)]['WA()'] for iz in [3, 4, 5]]
+    # Writing the concatenated tables gives the same file as appending them one by one
+    path_table, path_append = str(tmp_path / 'table.csv'), str(tmp_path / 'append.csv')
+    aggregate_slicewise.save_as_csv(pd.concat([table, table], ignore_index=True), path_table)
+    aggregate_slicewise.save_as_csv(table, path_append)
+    aggregate_slicewise.save_as_csv(table, path_append, append=True)
+    with open(path_table, 'r') as f_table, open(path_append, 'r') as f_append:
+        assert f_table.read() == f_append.read()
+
+
+def test_save_as_parquet(tmp_path, dummy_metrics):
+    """Test writing of output metric Parquet file"""
+    pytest.importorskip("pyarrow")
+    path_out = str(tmp_path / 'tmp_file_out.parquet')
+    agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(dummy_metrics['with float'], slices=[3, 4],
+                                                                  perslice=False,
+                                                                  group_funcs=(('WA', aggregate_slicewise.func_wa),
+                                                                               ('STD', aggregate_slicewise.func_std)))
+    aggregate_slicewise.save_as_table(agg_metric, path_out, fname_in='FakeFile.txt')
+    aggregate_slicewise.save_as_table(agg_metric, path_out, append=True)
+    table = pd.read_parquet(path_out)
+    assert list(table['Filename']) == ['FakeFile.txt', None]
+    assert list(table['Slice (I->S)']) == ['3:4', '3:4']
+    assert list(table['WA()']) == [45.5, 45.5]
+
+
+def test_vert_level_index(dummy_metrics, dummy_vert_level):
+    """Test the slice -> level and level -> slices lookups of VertLevelIndex."""
+    im_vert_level = Image(dummy_vert_level).change_orientation('RPI')
+    data = np.array(im_vert_level.data)
+    data[:, :, -1] = 0  # empty slice
+    data[0, 0, 0] = np.nan  # non-finite values are ignored
+    data[3, 4, 3], data[5, 4, 3] = 4, 3  # the level of a slice is the rounded average of its values (3.33)
+    im_vert_level.data = data
+    vert_level_index = template.VertLevelIndex(im_vert_level)
+    assert vert_level_index.n_slices == 9
+    expected_slices = {0: [], 1: [], 2: [0, 1], 3: [2, 3], 4: [4, 5], 5: [6, 7], 6: []}
+    for level, slices in expected_slices.items():
+        assert vert_level_index.get_slices(level) == slices
+        assert template.get_slices_from_vertebral_levels(im_vert_level, level) == slices
+    expected_levels = [2, 2, 3, 3, 4, 4, 5, 5, None]
+    assert [vert_level_index.get_level(iz) for iz in range(9)] == expected_levels
+    # get_vertebral_level_from_slice doesn't ignore non-finite values
+    assert [template.get_vertebral_level_from_slice(im_vert_level, iz) for iz in range(1, 9)] == expected_levels[1:]
+    # A VertLevelIndex can be passed instead of the vertebral level image
+    agg_metric = aggregate_slicewise.aggregate_per_slice_or_level(dummy_metrics['with float'], levels=[2, 3],
+                                                                  perlevel=True, fname_vert_level=vert_level_index,
+                                                                  group_funcs=(('WA', aggregate_slicewise.func_wa),))
+    assert agg_metric[(0, 1)]['VertLevel'] == (2,)
+
+
 def test_dimension_mismatch_between_metric_and_vertfile(dummy_metrics, dummy_vert_level):
     """Test that an exception is raised only for mismatched metric and -vertfile images."""
     for metric in dummy_metrics:
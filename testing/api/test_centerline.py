@@ -10,6 +10,7 @@ import nibabel as nib
 from spinalcordtoolbox.centerline.curve_fitting import bspline
 from spinalcordtoolbox.centerline.core import ParamCenterline, get_centerline, find_and_sort_coord
 from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.types import Centerline
 from spinalcordtoolbox.utils import sct_test_path, init_sct, set_loglevel
 
 # Set logger to "DEBUG"
@@ -226,3 +227,24 @@ def test_get_centerline_optic(params):
         im, ParamCenterline(algo_fitting='optic', contrast=params['contrast'], minmax=False), verbose=VERBOSE)
     # Compare with ground truth centerline
     assert np.all(im_centerline.data == Image(params['fname_centerline-optic']).data)
+
+
+def test_centerline_geometry():
+    """Test the lengths and the coordinate systems of the planes of types.Centerline against a per-point computation"""
+    z = np.linspace(0, 100, 200)
+    x, y = 10 * np.sin(z / 30), 5 * np.cos(z / 40)
+    deriv = [np.gradient(a) for a in (x, y, z)]
+    centerline = Centerline(x, y, z, *deriv)
+
+    distances = [np.linalg.norm(centerline.points[i + 1] - centerline.points[i]) for i in range(len(z) - 1)]
+    assert centerline.length == pytest.approx(sum(distances))
+    np.testing.assert_allclose(centerline.progressive_length, [0.0] + distances)
+    np.testing.assert_allclose(centerline.incremental_length, np.cumsum([0.0] + distances))
+    np.testing.assert_allclose(centerline.progressive_length_inverse, [0.0] + distances[::-1])
+    np.testing.assert_allclose(centerline.incremental_length_inverse, np.cumsum([0.0] + distances[::-1]))
+
+    for index in [0, 57, 199]:
+        matrix_base, inverse_matrix = centerline.compute_coordinate_system(index)[4:]
+        np.testing.assert_allclose(centerline.matrices[index], matrix_base, atol=1e-12)
+        np.testing.assert_allclose(centerline.inverse_matrices[index], inverse_matrix, atol=1e-12)
+        assert centerline.offset_plans[index] == pytest.approx(centerline.get_plan_parameters(index)[3])
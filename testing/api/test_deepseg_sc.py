@@ -3,6 +3,7 @@
 import pytest
 import numpy as np
 import nibabel as nib
+from scipy import ndimage
 
 from spinalcordtoolbox.image import Image
 import spinalcordtoolbox.deepseg_.sc as deepseg_sc
@@ -36,6 +37,45 @@ def test_deep_segmentation_spinalcord(params):
     assert np.all(im_seg.data == Image(params['fname_seg_manual']).data)
 
 
+def test_heatmap_batch(monkeypatch):
+    """Predicting the blocks of several slices at once gives the same heatmap as re-centering the block on each slice."""
+    # Synthetic cord drifting in the axial plane, and missing on 2 slices so that the tracking is lost
+    nx, ny, nz = 70, 64, 30
+    xx, yy = np.mgrid[:nx, :ny]
+    data = np.random.default_rng(0).normal(10, 2, (nx, ny, nz))
+    for iz in range(nz):
+        if iz not in [12, 13]:
+            data[:, :, iz][(xx - 25 - iz / 2) ** 2 + (yy - 30 + iz / 3) ** 2 <= 64] = 100
+    nii = nib.nifti1.Nifti1Image(data, np.eye(4))
+    im = Image(data, hdr=nii.header, dim=nii.header.get_data_shape())
+
+    # Like the convolutions of the real model, the "CNN" has a receptive field padded with zeros at the border of the
+    # block, so that its prediction depends on where the block is cropped
+    n_calls = []
+
+    def fake_onnx_inference(model, data):
+        n_calls.append(len(data))
+        context = ndimage.uniform_filter(data, size=(1, 15, 15, 1), mode='constant')
+        return [1 / (1 + np.exp(-10 * (data + context - 1)))]
+    monkeypatch.setattr(deepseg_sc, 'onnx_inference', fake_onnx_inference)
+
+    heatmaps = {}
+    for n_slices_batch in [1, 4, 8]:
+        n_calls.clear()
+        im_heatmap, z_max = deepseg_sc.heatmap(im.copy(), 'fake.onnx', patch_shape=(32, 32), mean_train=50,
+                                               std_train=40, brain_bool=False, n_slices_batch=n_slices_batch)
+        heatmaps[n_slices_batch] = (im_heatmap.data, len(n_calls))
+        assert z_max is None
+    data_single, n_calls_single = heatmaps[1]
+    assert np.all(data_single[:, :, [12, 13]] == 0) and np.all(data_single.max(axis=(0, 1))[:12] > 0)
+    # one call per slice, and one more on slice 12 where the block is predicted before the tracking is lost
+    assert n_calls_single == nz + 1
+    for n_slices_batch in [4, 8]:
+        data_batch, n_calls_batch = heatmaps[n_slices_batch]
+        np.testing.assert_array_equal(data_batch, data_single)
+        assert n_calls_batch < n_calls_single
+
+
 def test_intensity_normalization():
     data_in = np.random.rand(10, 10)
     min_out, max_out = 0, 255
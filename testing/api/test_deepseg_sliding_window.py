@@ -0,0 +1,50 @@
+# pytest unit tests for spinalcordtoolbox.deepseg_.sliding_window
+
+import pytest
+import numpy as np
+
+import spinalcordtoolbox.deepseg_.sliding_window as sliding_window
+
+
+@pytest.fixture
+def identity_model(monkeypatch):
+    """Replace the ONNX model by an identity, and record the shape of every batch fed to it."""
+    batch_shapes = []
+
+    def fake_onnx_inference(model_path, input_data):
+        batch_shapes.append(input_data.shape)
+        return [input_data.copy()]
+
+    monkeypatch.setattr(sliding_window, 'onnx_inference', fake_onnx_inference)
+    return batch_shapes
+
+
+@pytest.mark.parametrize('n_z,overlap,expected', [
+    (100, 0.0, [0, 48, 96]),
+    (96, 0.0, [0, 48]),
+    (30, 0.0, [0]),
+    (100, 0.5, [0, 24, 48, 72]),
+])
+def test_get_window_starts(n_z, overlap, expected):
+    assert sliding_window.get_window_starts(n_z, 48, overlap) == expected
+
+
+@pytest.mark.parametrize('overlap', [0.0, 0.25, 0.5])
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_sliding_window_inference_identity(identity_model, overlap, batch_size):
+    data = np.random.rand(8, 8, 101).astype(np.float32)
+    pred = sliding_window.sliding_window_inference('model.onnx', data, patch_size_z=48, overlap=overlap,
+                                                   batch_size=batch_size)
+    assert pred.shape == data.shape
+    assert np.allclose(pred, data, atol=1e-6)
+    assert all(shape[0] <= batch_size and shape[1:] == (1, 8, 8, 48) for shape in identity_model)
+
+
+def test_sliding_window_inference_skip_empty(identity_model):
+    data = np.random.rand(8, 8, 96).astype(np.float32)
+    data[:, :, 48:] = 0
+    pred = sliding_window.sliding_window_inference('model.onnx', data, patch_size_z=48, normalize=lambda x: x + 1)
+    # Only the first window is predicted, the empty one is left at zero
+    assert len(identity_model) == 1
+    assert np.allclose(pred[:, :, :48], data[:, :, :48] + 1)
+    assert not np.any(pred[:, :, 48:])
@@ -680,7 +680,7 @@ def test_splitext():
     assert msct_image.splitext('image.tar.gz') == ('image', '.tar.gz')
 
 
-def test_tolerance_of_affine_mismatch_check():
+def test_tolerance_of_affine_mismatch_check(tmp_path):
     """Verify that affine mismatch error is thrown only for mismatches above a certain tolerance."""
     # ERROR NOT EXPECTED (Affine matrices have slight differences, but are close enough to be equivalent)
     # NB: Specific values taken from anonymized data from https://github.com/spinalcordtoolbox/spinalcordtoolbox/issues/3251
@@ -714,3 +714,13 @@ def test_tolerance_of_affine_mismatch_check():
     with pytest.raises(ValueError) as e:
         msct_image.Image(param=[1, 1, 1], hdr=header_e2, check_sform=True)
     assert "Image sform does not match qform" in str(e.value)
+
+    # The same check is done when only reading the header of a file
+    for header, mismatch in [(header_e3, False), (header_e2, True)]:
+        fname = str(tmp_path / 'im.nii.gz')
+        nibabel.save(nibabel.Nifti1Image(np.zeros((1, 1, 1)), None, header=header), fname)
+        if mismatch:
+            with pytest.raises(ValueError, match="Image sform does not match qform"):
+                msct_image.check_sform(fname)
+        else:
+            msct_image.check_sform(fname)
@@ -0,0 +1,113 @@
+# pytest unit tests for spinalcordtoolbox.moco
+
+import csv
+import os
+
+import pytest
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox import moco
+from spinalcordtoolbox.image import Image, concat_data
+from spinalcordtoolbox.scripts.sct_image import multicomponent_split
+
+
+def _moco_apply(path, data, n_jobs):
+    """Run moco() with todo='apply' on 4D data, with a warping field translating each volume by `it` mm along x."""
+    os.makedirs(path)
+    fname_data, fname_target = os.path.join(path, 'data.nii'), os.path.join(path, 'target.nii')
+    nib.save(nib.Nifti1Image(data, np.eye(4)), fname_data)
+    nib.save(nib.Nifti1Image(data[..., 0], np.eye(4)), fname_target)
+    folder_mat = os.path.join(path, 'mat')
+    os.makedirs(folder_mat)
+    for it in range(data.shape[3]):
+        # ITK displacement (LPS) mapping the points of the target to the volume: +it mm along R (i.e. along x)
+        warp = np.zeros(data.shape[:3] + (1, 3), dtype=np.float32)
+        warp[..., 0] = -it
+        img = nib.Nifti1Image(warp, np.eye(4))
+        img.header.set_intent('vector', (), '')
+        nib.save(img, os.path.join(folder_mat, f"mat.Z0000T{it:04d}Warp.nii.gz"))
+
+    param = moco.ParamMoco()
+    param.file_data, param.file_target, param.mat_moco = fname_data, fname_target, folder_mat
+    param.todo, param.suffix_mat, param.interp, param.verbose, param.n_jobs = 'apply', 'Warp.nii.gz', 'linear', 0, n_jobs
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        _, im_moco = moco.moco(param)
+    finally:
+        os.chdir(cwd)
+    return im_moco.data
+
+
+def test_moco_parallel(tmp_path, monkeypatch):
+    """Volumes registered by several processes give the same result as when registered one after the other."""
+    # the warping fields are applied by sct_apply_transfo, in Python rather than with isct_antsApplyTransforms
+    monkeypatch.setenv('SCT_PYTHON_TRANSFORMS', 'yes')
+    data = np.random.default_rng(0).normal(size=(12, 14, 6, 5)).astype(np.float32)
+    data_moco = _moco_apply(str(tmp_path / 'serial'), data, n_jobs=1)
+    assert data_moco.shape == data.shape
+    np.testing.assert_array_equal(_moco_apply(str(tmp_path / 'parallel'), data, n_jobs=2), data_moco)
+    # Each volume is translated by its warping field, and temporary volumes are removed
+    for it in range(data.shape[3]):
+        np.testing.assert_allclose(data_moco[:data.shape[0] - it, :, :, it], data[it:, :, :, it], atol=1e-5)
+    assert sorted(os.listdir(tmp_path / 'parallel')) == ['data.nii', 'data_moco.nii', 'mat', 'target.nii', 'target.nii.gz']
+
+
+def test_save_moco_params(tmp_path):
+    """The motion parameters saved from the translations array match the ones of the former per-file implementation."""
+    nz, nt = 6, 5
+    translations = np.random.default_rng(0).normal(size=(nz, nt, 2)).astype(np.float32)
+    fnames_warp = []
+    for it in range(nt):
+        # same translation for all voxels of a slice, and no translation along Z
+        warp = np.zeros((4, 3, nz, 1, 3), dtype=np.float32)
+        warp[..., :2] = translations[np.newaxis, np.newaxis, :, it, np.newaxis, :]
+        img = nib.Nifti1Image(warp, np.diag([0.8, 0.8, 5, 1]))
+        img.header.set_intent('vector', (), '')
+        fnames_warp.append(str(tmp_path / f"mat.Z0000T{it:04d}Warp.nii.gz"))
+        nib.save(img, fnames_warp[-1])
+
+    translations_loaded, im_warp = moco.load_moco_translations(fnames_warp)
+    np.testing.assert_array_equal(translations_loaded, translations)
+    fnames_out = [str(tmp_path / fname) for fname in ['x.nii.gz', 'y.nii.gz', 'params.tsv']]
+    moco.save_moco_params(translations_loaded, im_warp, *fnames_out)
+
+    # Former implementation: split each warping field into X/Y files, then concatenate them along T
+    files_warp_X, files_warp_Y, moco_param = [], [], []
+    for fname_warp in fnames_warp:
+        im_warp = Image(fname_warp)
+        im_warp.data = np.expand_dims(np.expand_dims(im_warp.data[0, 0, :, :, :], axis=0), axis=0)
+        im_warp_XYZ = multicomponent_split(im_warp)
+        files_warp_X.append(fname_warp + '_crop_X.nii.gz')
+        im_warp_XYZ[0].save(files_warp_X[-1])
+        files_warp_Y.append(fname_warp + '_crop_Y.nii.gz')
+        im_warp_XYZ[1].save(files_warp_Y[-1])
+        moco_param.append([np.mean(np.ravel(im_warp_XYZ[0].data)), np.mean(np.ravel(im_warp_XYZ[1].data))])
+    for fname_out, files_warp in zip(fnames_out, [files_warp_X, files_warp_Y]):
+        im_ref = concat_data([Image(fname) for fname in files_warp], dim=3)
+        im_out = Image(fname_out)
+        assert im_out.data.shape == im_ref.data.shape == (1, 1, nz, nt)
+        assert im_out.data.dtype == im_ref.data.dtype
+        np.testing.assert_array_equal(im_out.data, im_ref.data)
+        np.testing.assert_array_equal(im_out.hdr.get_best_affine(), im_ref.hdr.get_best_affine())
+    with open(fnames_out[2]) as f:
+        rows = list(csv.reader(f, delimiter='\t'))
+    assert rows[0] == ['X', 'Y']
+    np.testing.assert_allclose(np.array(rows[1:], dtype=float), np.array(moco_param, dtype=float), rtol=1e-6)
+
+
+@pytest.mark.parametrize('itk_threads, expected', [(None, 2), ('1', 1), ('8', 2)])
+def test_init_moco_worker_itk_threads(tmp_path, monkeypatch, itk_threads, expected):
+    """The cores are shared between the processes, without raising a number of ITK threads set by the user."""
+    fname_data = str(tmp_path / 'data.nii')
+    nib.save(nib.Nifti1Image(np.zeros((4, 4, 3, 2), dtype=np.float32), np.eye(4)), fname_data)
+    monkeypatch.setattr(moco.multiprocessing, 'cpu_count', lambda: 4)
+    if itk_threads is None:
+        monkeypatch.delenv('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', raising=False)
+    else:
+        monkeypatch.setenv('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', itk_threads)
+    monkeypatch.setattr(moco, '_moco_worker_data', None)
+    moco._init_moco_worker(2, fname_data)
+    assert os.environ['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'] == str(expected)
+    assert moco._moco_worker_data.shape == (4, 4, 3, 2)
@@ -225,12 +225,14 @@ im_segs = [
     ]
 
 
+@pytest.mark.parametrize('method', ['regionprops', 'moments'])
 @pytest.mark.parametrize('im_seg,expected,params', im_segs)
-def test_compute_shape(im_seg, expected, params):
+def test_compute_shape(im_seg, expected, params, method):
     metrics, fit_results = process_seg.compute_shape(im_seg,
                                                      angle_correction=params['angle_corr'],
                                                      param_centerline=ParamCenterline(),
-                                                     verbose=VERBOSE)
+                                                     verbose=VERBOSE,
+                                                     method=method)
     for key in expected.keys():
         # fetch obtained_value
         if 'slice' in params:
@@ -249,3 +251,41 @@ def test_compute_shape(im_seg, expected, params):
         else:
             expected_value = pytest.approx(expected[key], rel=0.05)
         assert obtained_value == expected_value
+
+
+def test_compute_shape_moments_matches_regionprops():
+    """Check that the 'moments' method agrees slice by slice with the 'regionprops' method."""
+    im_seg = dummy_segmentation(size_arr=(64, 64, 50), shape='ellipse', radius_RL=13.0, radius_AP=5.0,
+                                angle_RL=-10.0, angle_AP=15.0, debug=DEBUG)
+    metrics_ref, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE,
+                                               method='regionprops')
+    metrics, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE,
+                                           method='moments')
+    for key in ['area', 'diameter_AP', 'diameter_RL', 'eccentricity', 'solidity', 'angle_AP', 'angle_RL', 'length']:
+        assert metrics[key].data == pytest.approx(metrics_ref[key].data, rel=0.05, nan_ok=True)
+
+
+def test_properties2d_moments_two_objects():
+    """Check that both methods measure a slice with two objects the same way, i.e. as a single object."""
+    image = np.zeros((40, 40))
+    image[5:12, 8:15] = 1
+    image[22:30, 18:26] = 1
+    properties_ref = process_seg._properties2d(image, [0.5, 0.5])
+    properties = process_seg._properties2d_moments(image[:, :, np.newaxis], [0.5, 0.5])
+    # The slice isn't rejected: the area is the one of both objects
+    assert properties_ref['area'] == properties['area'][0] == pytest.approx(0.25 * (7 * 7 + 8 * 8))
+    for key in ['diameter_AP', 'diameter_RL', 'eccentricity', 'orientation', 'solidity']:
+        assert properties[key][0] == pytest.approx(properties_ref[key], rel=0.05)
+
+
+@pytest.mark.parametrize('method', ['regionprops', 'moments'])
+def test_compute_shape_jobs(method):
+    """Check that distributing the slices across processes doesn't change the results."""
+    im_seg = dummy_segmentation(size_arr=(64, 64, 50), shape='ellipse', radius_RL=13.0, radius_AP=5.0,
+                                angle_RL=-10.0, angle_AP=15.0, zeroslice=[10], debug=DEBUG)
+    metrics_ref, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE,
+                                               method=method)
+    metrics, _ = process_seg.compute_shape(im_seg, param_centerline=ParamCenterline(), verbose=VERBOSE,
+                                           method=method, jobs=3)
+    for key in metrics_ref:
+        np.testing.assert_array_equal(metrics[key].data, metrics_ref[key].data)
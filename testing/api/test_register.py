@@ -5,11 +5,14 @@ import os
 
 import pytest
 import numpy as np
+import nibabel as nib
 
 from spinalcordtoolbox.scripts.sct_register_to_template import Param
 from spinalcordtoolbox.registration.core import register
 from spinalcordtoolbox.registration.algorithms import (Paramreg, register_step_ants_registration, register_step_label,
-                                                       register_step_ants_slice_regularized_registration)
+                                                       register_step_ants_slice_regularized_registration,
+                                                       register2d_centermassrot, register2d_columnwise,
+                                                       compute_pca, compute_pca_batch, find_angle_hog, find_angles_hog)
 from spinalcordtoolbox.utils import sct_test_path
 
 logger = logging.getLogger(__name__)
@@ -241,18 +244,100 @@ def test_register_step2(step2_data):
     warp_forward_out, warp_inverse_out = register(src=src, dest=dest, step=step, param=cli_params)
 
 
-@pytest.mark.skip(reason="TODO")
-def test_register2d_centermassrot():
-    """
-    """
-    raise NotImplementedError()
-
-
-@pytest.mark.skip(reason="TODO")
-def test_register2d_columnwise():
-    """
-    """
-    raise NotImplementedError()
+def _save_volume(fname, data):
+    """Save data with 1mm isotropic voxels."""
+    nib.save(nib.Nifti1Image(data.astype(np.float32), np.eye(4)), fname)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_register2d_centermassrot(tmp_path, jobs):
+    """The warping field translates the center of mass of each slice, and empty slices are ignored."""
+    src, dest = np.zeros((2, 30, 30, 4))
+    src[8:17, 10:20, :3] = 1
+    dest[13:22, 10:20, :3] = 1
+    fname_src, fname_dest = str(tmp_path / 'src.nii'), str(tmp_path / 'dest.nii')
+    _save_volume(fname_src, src)
+    _save_volume(fname_dest, dest)
+    fname_warp, fname_warp_inv = str(tmp_path / 'warp.nii.gz'), str(tmp_path / 'warp_inv.nii.gz')
+    register2d_centermassrot([fname_src], [fname_dest], paramreg=Paramreg(), fname_warp=fname_warp,
+                             fname_warp_inv=fname_warp_inv, rot_method='none', verbose=0, jobs=jobs)
+    warp = nib.load(fname_warp).get_fdata()
+    assert warp.shape == (30, 30, 4, 1, 3)
+    # ITK convention: the displacement (src - dest = -5mm along x) is inverted
+    np.testing.assert_allclose(warp[:, :, :3, 0, 0], 5, atol=1e-5)
+    np.testing.assert_allclose(warp[:, :, :3, 0, 1:], 0, atol=1e-5)
+    np.testing.assert_array_equal(warp[:, :, 3], 0)
+    np.testing.assert_allclose(nib.load(fname_warp_inv).get_fdata()[:, :, :3, 0, 0], -5, atol=1e-5)
+
+
+def test_compute_pca_batch():
+    """The PCA of each slice is the same as when computed slice by slice, and empty slices are NaN."""
+    rng = np.random.default_rng(0)
+    xx, yy = np.mgrid[:30, :26]
+    seg = np.zeros((30, 26, 4))
+    for iz, angle in enumerate([0.3, -0.2, 0.6]):
+        u = (xx - 15) * np.cos(angle) + (yy - 12) * np.sin(angle)
+        v = -(xx - 15) * np.sin(angle) + (yy - 12) * np.cos(angle)
+        seg[:, :, iz] = (u / 9) ** 2 + (v / 4) ** 2 <= 1
+    im = 100 * seg + rng.normal(0, 5, seg.shape)
+
+    centermass, components, ratio = compute_pca_batch(seg)
+    for iz in range(3):
+        _, pca, centermass_iz = compute_pca(seg[:, :, iz])
+        np.testing.assert_array_equal(centermass[iz], centermass_iz)
+        # Principal axes are defined up to their sign
+        np.testing.assert_allclose(np.abs(components[iz]), np.abs(pca.components_), atol=1e-10)
+        np.testing.assert_allclose(ratio[iz], pca.explained_variance_ratio_, atol=1e-10)
+    assert np.isnan(centermass[3]).all() and np.isnan(ratio[3]).all()
+
+    # Angles and confidence scores given by the per-slice implementation of find_angle_hog (before it was batched)
+    angles, conf_scores = find_angles_hog(im[:, :, :3], centermass[:3], 0.5, 0.5, angle_range=40)
+    np.testing.assert_allclose(np.degrees(angles), [-22, 0, -33.5], atol=1e-10)
+    np.testing.assert_allclose(conf_scores, [1.0, 2.5466374959529805, 1.1594706286696934], rtol=1e-6)
+    angle, conf_score = find_angle_hog(im[:, :, 2], centermass[2], 0.5, 0.5, angle_range=40)
+    assert angle == pytest.approx(np.radians(-33.5)) and conf_score == pytest.approx(1.1594706286696934)
+
+
+@pytest.mark.parametrize('rot_method', ['hog', 'pcahog'])
+def test_register2d_centermassrot_empty_slices(tmp_path, rot_method):
+    """Slabs which only contain empty slices are skipped when estimating the rotation with several processes."""
+    src, dest = np.zeros((2, 30, 30, 8))
+    src[8:17, 10:20, 2:5] = 1
+    dest[13:22, 10:20, 2:5] = 1
+    fname_src, fname_dest = str(tmp_path / 'src.nii'), str(tmp_path / 'dest.nii')
+    _save_volume(fname_src, src)
+    _save_volume(fname_dest, dest)
+    fname_warp = str(tmp_path / 'warp.nii.gz')
+    register2d_centermassrot([fname_src, fname_src], [fname_dest, fname_dest], paramreg=Paramreg(),
+                             fname_warp=fname_warp, fname_warp_inv=str(tmp_path / 'warp_inv.nii.gz'),
+                             rot_method=rot_method, verbose=0, jobs=2)
+    warp = nib.load(fname_warp).get_fdata()
+    assert np.any(warp[:, :, 2:5])
+    np.testing.assert_array_equal(warp[:, :, 5:], 0)
+
+
+def test_register2d_columnwise(tmp_path):
+    """The warping fields don't depend on the number of processes, and are null between identical images."""
+    src = np.zeros((30, 30, 3))
+    src[8:17, 10:20] = 1
+    src[10:15, 8:22, 1] = 1
+    fname_src, fname_dest = str(tmp_path / 'src.nii'), str(tmp_path / 'dest.nii')
+    _save_volume(fname_src, src)
+    _save_volume(fname_dest, np.roll(src, 2, axis=0))
+    warps = []
+    for jobs in [1, 2]:
+        fname_warp = str(tmp_path / f'warp_{jobs}.nii.gz')
+        register2d_columnwise(fname_src, fname_dest, fname_warp=fname_warp,
+                              fname_warp_inv=str(tmp_path / f'warp_inv_{jobs}.nii.gz'), verbose=0, jobs=jobs)
+        warps.append(nib.load(fname_warp).get_fdata())
+    np.testing.assert_array_equal(warps[0], warps[1])
+    assert np.any(warps[0][:, :, :, 0, 0])
+
+    fname_warp = str(tmp_path / 'warp_identity.nii.gz')
+    register2d_columnwise(fname_src, fname_src, fname_warp=fname_warp,
+                          fname_warp_inv=str(tmp_path / 'warp_inv_identity.nii.gz'), verbose=0)
+    # The smoothing of the warping field only changes its borders
+    np.testing.assert_allclose(nib.load(fname_warp).get_fdata()[5:-5, 5:-5], 0, atol=1e-5)
 
 
 @pytest.mark.skip(reason="TODO")
@@ -1,13 +1,17 @@
 # pytest unit tests for spinalcordtoolbox.reports
 
 import os
+import json
 import logging
 
 import pytest
 import numpy as np
+import skimage.io
+from nibabel.nifti1 import Nifti1Image
 
 from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.reports.slice import Sagittal
+from spinalcordtoolbox.resampling import resample_nib
 from spinalcordtoolbox.utils import sct_test_path
 import spinalcordtoolbox.reports.qc as qc
 import spinalcordtoolbox.reports.slice as qcslice
@@ -119,3 +123,74 @@ def test_propseg(t2_image, t2_seg_image, tmp_path):
     assert os.path.isfile(qc_report.abs_background_img_path())
     assert os.path.isfile(qc_report.abs_overlay_img_path())
     assert os.path.isfile(qc_report.qc_results)
+
+
+def test_propseg_n_threads(t2_image, t2_seg_image, tmp_path):
+    """Images encoded by the thread pool are the same as the ones encoded in the calling thread"""
+    images = []
+    for n_threads in [1, 3]:
+        qc_report = qc.QcReport(t2_image.absolutepath, 'sct_propseg', ['-a'], 'Axial', str(tmp_path / str(n_threads)))
+        qc.QcImage(
+            qc_report=qc_report,
+            interpolation='none',
+            action_list=[qc.QcImage.listed_seg],
+            process=qc_report.command,
+            n_threads=n_threads,
+        ).layout(
+            qcslice_layout=lambda qcslice: qcslice.mosaic(),
+            qcslice=qcslice.Axial([t2_image.copy(), t2_seg_image.copy()]),
+        )
+        images.append([skimage.io.imread(path)
+                       for path in [qc_report.abs_background_img_path(), qc_report.abs_overlay_img_path()]])
+    for image, image_threads in zip(*images):
+        np.testing.assert_array_equal(image, image_threads)
+
+
+def test_qc_index(tmp_path):
+    """QC entries are appended to the index, including the ones of a report created by a previous version of SCT"""
+    path_qc = str(tmp_path)
+    os.makedirs(os.path.join(path_qc, '_json'))
+    legacy_entry = {'command': 'sct_propseg', 'moddate': '2020-01-01 00:00:00'}
+    with open(os.path.join(path_qc, '_json', 'qc_2020_01_01_000000.000000.json'), 'w') as f:
+        json.dump(legacy_entry, f)
+
+    qc_reports = [qc.QcReport(sct_test_path('t2', 't2.nii.gz'), command, ['-a'], 'Axial', path_qc)
+                  for command in ['sct_deepseg_sc', 'sct_label_vertebrae']]
+    for qc_report in qc_reports:
+        qc_report.update_description_file()
+
+    entries = qc.read_qc_index(path_qc)
+    assert [entry['command'] for entry in entries] == ['sct_propseg', 'sct_deepseg_sc', 'sct_label_vertebrae']
+    assert entries[0] == legacy_entry
+    assert entries[1:] == qc.get_json_data_from_path(os.path.join(path_qc, '_json'))[1:]
+    assert os.path.isfile(os.path.join(path_qc, 'index.html'))
+
+
+def test_crop_slices_and_assemble_mosaic():
+    """Vectorized cropping and assembly of the mosaic give the same result as cropping and adding slices one by one"""
+    rng = np.random.default_rng(0)
+    data = rng.random((25, 40, 45))
+    centers_x, centers_y = rng.uniform(0, 25, 25), rng.uniform(0, 30, 25)
+    patches = qcslice.Slice.crop_slices(data, centers_x, centers_y, 10, 10)
+    matrix_sz = (60, 200)
+    matrix = np.zeros(matrix_sz)
+    for i in range(len(data)):
+        qcslice.Slice.add_slice(matrix, i, 10, qcslice.Slice.crop(data[i], int(centers_x[i]), int(centers_y[i]), 10, 10))
+    np.testing.assert_array_equal(qcslice.Slice.assemble_mosaic(patches, 10, matrix_sz), matrix)
+
+
+@pytest.mark.parametrize('shape,dtype,order,interpolation', [
+    ((20, 37, 41), np.float32, 2, 'spline'),
+    ((20, 37, 41, 5), np.float32, 2, 'spline'),
+    ((20, 37, 41), np.uint8, 1, 'linear'),  # binary segmentation
+])
+def test_resample_axial_planes(shape, dtype, order, interpolation):
+    """Resampling all the axial slices at once gives the same result as resample_nib()"""
+    data = (np.random.default_rng(0).random(shape) * (2 if dtype == np.uint8 else 100)).astype(dtype)
+    nii = Nifti1Image(data, np.array([[0, 0, -0.7, 10], [0, -0.9, 0, 5], [1.3, 0, 0, -3], [0, 0, 0, 1]]))
+    new_size = [nii.header.get_zooms()[0], 0.6, 0.6]
+    nii_r = resample_nib(nii, new_size=new_size, new_size_type='mm', interpolation=interpolation)
+    nii_r_axial = qcslice.Slice._resample_axial_planes(nii, new_size, order)
+    np.testing.assert_allclose(np.asanyarray(nii_r_axial.dataobj), np.asanyarray(nii_r.dataobj), atol=1e-4)
+    np.testing.assert_allclose(nii_r_axial.affine, nii_r.affine)
+    assert nii_r_axial.header.get_zooms() == nii_r.header.get_zooms()
@@ -1,6 +1,12 @@
 # pytest unit tests for spinalcordtoolbox.straightening
 
-from spinalcordtoolbox.straightening import SpinalCordStraightener
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox.straightening import (SpinalCordStraightener, compute_warping_field, warp_curved2straight_slab,
+                                             warp_straight2curved_slab)
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.types import Centerline
 from spinalcordtoolbox.utils import sct_test_path
 
 VERBOSE = 0  # Set to 2 to save images, 0 otherwise
@@ -15,3 +21,52 @@ def test_straighten(tmp_path):
     sc_straight.straighten()
     assert sc_straight.mse_straightening < 0.8
     assert sc_straight.max_distance_straightening < 1.2
+
+
+def test_compute_warping_field_slabs(tmp_path):
+    """Test that computing the warping fields by slabs, in a pool, or in a memmap gives the same result"""
+    n_points = 200
+    z = np.linspace(0, 30, n_points)
+    x, y = 3 * np.sin(z / 10) + 15, 2 * np.cos(z / 15) + 15
+    centerline = Centerline(x, y, z, np.gradient(x), np.gradient(y), np.gradient(z))
+    z_straight = np.linspace(-2, 32, n_points)
+    centerline_straight = Centerline(np.full(n_points, 15.0), np.full(n_points, 15.0), z_straight,
+                                     np.zeros(n_points), np.zeros(n_points), np.ones(n_points))
+    lookup = np.arange(n_points)
+    affine = np.diag([0.8, 0.8, 1.0, 1.0])
+    shape = (36, 36, 30)
+    for slab_function, params in [
+            (warp_curved2straight_slab, dict(affine_straight=affine, lookup_straight2curved=lookup)),
+            (warp_straight2curved_slab, dict(affine_curved=affine, lookup_curved2straight=lookup))]:
+        params = dict(params, centerline=centerline, centerline_straight=centerline_straight, threshold_distance=10)
+        data_warp = compute_warping_field(slab_function, shape, params)
+        assert data_warp.shape == shape + (1, 3)
+        # 0.25 MB: slabs of a single slice, and a warping field that does not fit in memory
+        data_warp_slabs = compute_warping_field(slab_function, shape, params, n_jobs=2, max_memory=0.25,
+                                                fname_memmap=str(tmp_path / 'warp.dat'))
+        assert isinstance(data_warp_slabs, np.memmap)
+        np.testing.assert_array_equal(data_warp, data_warp_slabs)
+
+
+def test_compute_warping_fields_in_memory():
+    """Test that warping fields can be computed from Image objects, without writing anything to disk"""
+    data = np.zeros((40, 40, 60), dtype=np.uint8)
+    for z in range(5, 55):
+        x, y = int(round(20 + 6 * np.sin(z / 12))), int(round(20 + 3 * np.cos(z / 15)))
+        data[x - 2:x + 3, y - 2:y + 3, z] = 1
+    affine = np.diag([0.8, 0.8, 1.0, 1.0])
+    hdr = nib.Nifti1Header()
+    hdr.set_qform(affine, 1)
+    hdr.set_sform(affine, 1)
+    im_seg = Image(data, hdr=hdr)
+
+    sc_straight = SpinalCordStraightener(None, None)
+    sc_straight.verbose = VERBOSE
+    warp_curve2straight, warp_straight2curve, im_straight = sc_straight.compute_warping_fields(im_seg)
+    assert warp_curve2straight.data.shape == im_straight.data.shape + (1, 3)
+    # The curved space is padded along z to account for the length of the spinal cord
+    assert warp_straight2curve.data.shape[:2] == data.shape[:2]
+    assert warp_straight2curve.data.shape[2] > data.shape[2]
+    assert warp_straight2curve.hdr.get_intent()[0] == 'vector'
+    # Input image is left untouched
+    assert np.array_equal(im_seg.data, data)
@@ -0,0 +1,65 @@
+# pytest unit tests for spinalcordtoolbox.texture
+
+import pytest
+import numpy as np
+from skimage.feature import graycomatrix, graycoprops
+
+from spinalcordtoolbox.texture import glcm_offset, glcm_texture_slice, glcm_texture, GLCM_FEATURES
+
+
+def test_glcm_offset():
+    """Offsets are rounded like skimage, e.g. sin(30°) = 0.49999999999999994 is rounded to 1."""
+    assert glcm_offset(1, 0) == (0, 1)
+    assert glcm_offset(1, 30) == (1, 1)
+    assert glcm_offset(1, 90) == (1, 0)
+    assert glcm_offset(3, 30) == (1, 3)
+    assert glcm_offset(2, 135) == (1, -1)
+
+
+@pytest.mark.parametrize('distance', [1, 2])
+def test_glcm_texture_slice(distance):
+    """The features of each voxel match the GLCM of its window computed with skimage."""
+    rng = np.random.default_rng(0)
+    im = rng.integers(0, 6, (16, 14)) * rng.choice([1, 40], (16, 14)).astype(np.float64)
+    im[2:7, 2:8] = 7  # constant region, to check the special case of the correlation
+    seg = np.zeros(im.shape)
+    seg[1:15, 1:13] = 1
+    seg[9, 6] = 0
+    angles = [0, 30, 45, 90, 135]
+    texture = glcm_texture_slice(im, seg, distance, angles, GLCM_FEATURES)
+
+    n_valid = 0
+    for x in range(im.shape[0]):
+        for y in range(im.shape[1]):
+            window = np.s_[x - distance:x + distance + 1, y - distance:y + distance + 1]
+            inside_slice = distance <= x < im.shape[0] - distance and distance <= y < im.shape[1] - distance
+            if not inside_slice or not seg[window].all():
+                for key in texture:
+                    assert texture[key][x, y] == 0
+                continue
+            n_valid += 1
+            for angle in angles:
+                glcm = graycomatrix(im[window].astype(np.uint8), [distance], [np.radians(angle)], symmetric=True,
+                                    normed=True)
+                for feature in GLCM_FEATURES:
+                    np.testing.assert_allclose(texture[feature, angle][x, y], graycoprops(glcm, feature)[0][0],
+                                               rtol=1e-10, atol=1e-12)
+    assert n_valid > 0
+
+
+def test_glcm_texture_invalid_feature():
+    with pytest.raises(ValueError):
+        glcm_texture_slice(np.zeros((5, 5)), np.ones((5, 5)), 1, [0], ['contrast', 'foo'])
+
+
+def test_glcm_texture_jobs():
+    """Slices are processed independently, whatever the number of processes."""
+    rng = np.random.default_rng(0)
+    im = rng.integers(0, 50, (12, 10, 3)).astype(np.float64)
+    seg = np.ones(im.shape)
+    texture = glcm_texture(im, seg, 1, [0, 90], ['contrast', 'energy'], jobs=2)
+    assert texture['contrast', 0].shape == im.shape
+    for iz in range(im.shape[2]):
+        texture_slice = glcm_texture_slice(im[:, :, iz], seg[:, :, iz], 1, [0, 90], ['contrast', 'energy'])
+        for key in texture_slice:
+            np.testing.assert_array_equal(texture[key][:, :, iz], texture_slice[key])
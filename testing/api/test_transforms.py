@@ -0,0 +1,254 @@
+# pytest unit tests for spinalcordtoolbox.registration.transforms
+
+import os
+import shutil
+
+import pytest
+import numpy as np
+import nibabel as nib
+from scipy.io import savemat
+
+from spinalcordtoolbox.image import Image
+from spinalcordtoolbox.registration.transforms import (AffineTransform, load_transforms, compose_displacement_field,
+                                                       apply_transforms)
+from spinalcordtoolbox.scripts import sct_apply_transfo
+from spinalcordtoolbox.utils.shell import get_interpolation
+from spinalcordtoolbox.utils.sys import run_proc, __bin_dir__
+
+# The comparisons with ANTs need its binaries, which are installed with SCT
+requires_ants = pytest.mark.skipif(
+    not all(shutil.which(os.path.join(__bin_dir__, name)) for name in ['isct_ComposeMultiTransform',
+                                                                       'isct_antsApplyTransforms']),
+    reason="ANTs binaries are not installed")
+
+# Voxel to RAS affine of the test images: 0.5mm in-plane, 2mm slices, LPI orientation with an offset
+AFFINE = np.array([[-0.5, 0, 0, 4], [0, -0.5, 0, 6], [0, 0, 2, -10], [0, 0, 0, 1]])
+
+
+def _save_field(fname, displacement, shape=(20, 22, 8)):
+    """Save a constant ITK displacement field (LPS vector) on the grid of the test images."""
+    data = np.zeros(shape + (1, 3), dtype=np.float32)
+    data[..., 0, :] = displacement
+    img = nib.Nifti1Image(data, AFFINE)
+    img.header.set_intent('vector', (), '')
+    nib.save(img, fname)
+    return fname
+
+
+def _save_affine_txt(fname, matrix, translation, center):
+    with open(fname, 'w') as f:
+        f.write("#Insight Transform File V1.0\n#Transform 0\nTransform: AffineTransform_double_3_3\n")
+        f.write("Parameters: " + " ".join(str(v) for v in list(np.ravel(matrix)) + list(translation)) + "\n")
+        f.write("FixedParameters: " + " ".join(str(v) for v in center) + "\n")
+    return fname
+
+
+def test_affine_transform(tmp_path):
+    """ITK affine transformations map p to R (p - c) + t + c, and are read the same from .txt and .mat files."""
+    angle = 0.3
+    matrix = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1.1]])
+    translation, center = np.array([1, -2, 0.5]), np.array([3, 4, -5])
+    fname_txt = _save_affine_txt(str(tmp_path / 'affine.txt'), matrix, translation, center)
+    fname_mat = str(tmp_path / 'affine.mat')
+    savemat(fname_mat, {'AffineTransform_double_3_3': np.concatenate([matrix.ravel(), translation])[:, np.newaxis],
+                        'fixed': center[:, np.newaxis]})
+
+    points = np.random.default_rng(0).normal(size=(10, 3)) * 10
+    expected = (points - center) @ matrix.T + translation + center
+    for fname in [fname_txt, fname_mat]:
+        transform = AffineTransform.load(fname)
+        np.testing.assert_allclose(transform.transform_points(points), expected)
+        np.testing.assert_allclose(transform.inverse().transform_points(expected), points)
+
+
+def test_unsupported_transform(tmp_path):
+    fname = str(tmp_path / 'euler.txt')
+    with open(fname, 'w') as f:
+        f.write("#Insight Transform File V1.0\n#Transform 0\nTransform: Euler3DTransform_double_3_3\n"
+                "Parameters: 0 0 0 0 0 0\nFixedParameters: 0 0 0 0\n")
+    with pytest.raises(ValueError):
+        load_transforms([fname])
+    with pytest.raises(ValueError):
+        load_transforms([_save_field(str(tmp_path / 'warp.nii.gz'), [1, 0, 0])],
+                        fnames_inv=[str(tmp_path / 'warp.nii.gz')])
+
+
+def test_compose_displacement_field(tmp_path):
+    """The composition of displacement fields and affine transformations is evaluated on the reference grid."""
+    fname_warp1 = _save_field(str(tmp_path / 'warp1.nii.gz'), [1, 0.5, 0])
+    fname_warp2 = _save_field(str(tmp_path / 'warp2.nii.gz'), [0, 0, -2])
+    fname_affine = _save_affine_txt(str(tmp_path / 'affine.txt'), np.eye(3), [0.25, 0, 0], [0, 0, 0])
+    im_ref = Image(np.zeros((20, 22, 8), dtype=np.float32), hdr=nib.Nifti1Image(np.zeros((20, 22, 8)), AFFINE).header)
+
+    # The affine transformation is inverted, and the fields are chained
+    transform = load_transforms([fname_warp1, fname_affine, fname_warp2], fnames_inv=[fname_affine])
+    im_warp = compose_displacement_field(transform, im_ref)
+    assert im_warp.data.shape == (20, 22, 8, 1, 3)
+    assert im_warp.hdr.get_intent()[0] == 'vector'
+    # Points which stay inside the fields are translated by the sum of the transformations
+    assert np.allclose(im_warp.data[2:-2, 2:-2, 2:-2, 0], [0.75, 0.5, -2], atol=1e-6)
+    # Points of the last slices are moved outside of the first field, whose displacement is then null
+    assert np.allclose(im_warp.data[2:-2, 2:-2, 0, 0], [-0.25, 0, -2], atol=1e-6)
+
+    # Applying the composed field is the same as applying the chain of transformations
+    rng = np.random.default_rng(0)
+    im_src = Image(rng.normal(size=(20, 22, 8)).astype(np.float32), hdr=im_ref.hdr)
+    fname_composed = str(tmp_path / 'warp_composed.nii.gz')
+    im_warp.save(fname_composed)
+    for interp in ['nn', 'linear', 'spline']:
+        data_chain = apply_transforms(im_src, im_ref, transform, interp=interp).data
+        data_composed = apply_transforms(im_src, im_ref, load_transforms([fname_composed]), interp=interp).data
+        np.testing.assert_allclose(data_chain, data_composed, atol=1e-5)
+
+
+def test_apply_transforms(tmp_path):
+    """Volumes are shifted by the displacement, are null outside of the source image, and 4D images are supported."""
+    shape = (20, 22, 8)
+    hdr = nib.Nifti1Image(np.zeros(shape), AFFINE).header
+    im_ref = Image(np.zeros(shape, dtype=np.float32), hdr=hdr)
+    data = np.random.default_rng(0).normal(size=shape + (3,)).astype(np.float32)
+    im_src = Image(data, hdr=nib.Nifti1Image(data, AFFINE).header)
+    # 1mm along L is 2 voxels along x (LPI orientation), 2mm along S is 1 voxel along z
+    transform = load_transforms([_save_field(str(tmp_path / 'warp.nii.gz'), [1, 0, 2])])
+
+    for interp in ['nn', 'linear', 'spline']:
+        im_out = apply_transforms(im_src, im_ref, transform, interp=interp)
+        assert im_out.data.shape == shape + (3,)
+        assert im_out.data.dtype == np.float32
+        np.testing.assert_allclose(im_out.data[:-2, :, :-1], data[2:, :, 1:], atol=1e-5)
+        np.testing.assert_array_equal(im_out.data[-2:], 0)
+        np.testing.assert_array_equal(im_out.data[:, :, -1], 0)
+
+    # 3D images keep the shape of the reference image
+    im_out = apply_transforms(Image(data[..., 0], hdr=hdr), im_ref, transform, interp='linear')
+    np.testing.assert_allclose(im_out.data, apply_transforms(im_src, im_ref, transform, interp='linear').data[..., 0])
+
+    # Integer images keep their data type with nearest neighbour interpolation, and are interpolated as float32 otherwise
+    labels = np.random.default_rng(1).integers(0, 5, size=shape).astype(np.uint8)
+    im_labels = Image(labels, hdr=nib.Nifti1Image(labels, AFFINE).header)
+    im_out = apply_transforms(im_labels, im_ref, transform, interp='nn')
+    assert im_out.data.dtype == np.uint8 and im_out.hdr.get_data_dtype() == np.uint8
+    np.testing.assert_array_equal(im_out.data[:-2, :, :-1], labels[2:, :, 1:])
+    assert apply_transforms(im_labels, im_ref, transform, interp='linear').data.dtype == np.float32
+
+
+def test_displacement_field_transform_lazy(tmp_path):
+    """Displacement fields are only read when points are transformed for the first time."""
+    fname_warp = str(tmp_path / 'warp.nii.gz')
+    transform = load_transforms([fname_warp])
+    _save_field(fname_warp, [1, 2, 3])
+    points = np.array([[-4., -6., -4.], [100., 0., 0.]])
+    # The second point is outside the field, and isn't displaced
+    np.testing.assert_allclose(transform.transform_points(points), [[-3., -4., -1.], [100., 0., 0.]], atol=1e-6)
+
+
+def _oblique_affine(angle, zooms, orientation, origin):
+    """Voxel to RAS affine with anisotropic voxels, flipped axes and a rotation around the S axis."""
+    rotation = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    affine = np.eye(4)
+    affine[:3, :3] = rotation @ np.diag(orientation) @ np.diag(zooms)
+    affine[:3, 3] = origin
+    return affine
+
+
+@pytest.fixture(scope='module')
+def ants_transforms(tmp_path_factory):
+    """
+    Source and destination images on different oblique grids (the destination only partially overlapping the source),
+    and an affine transformation and a displacement field (smaller than the destination) to compare with ANTs.
+    """
+    path = tmp_path_factory.mktemp('ants_transforms')
+
+    # Smooth source image, in LPI orientation so that LPS and RAS coordinates differ
+    xx, yy, zz = np.mgrid[:24, :22, :12]
+    data_src = (100 + 40 * np.sin(xx / 3) * np.cos(yy / 4) + 20 * np.cos(zz / 2)).astype(np.float32)
+    nib.save(nib.Nifti1Image(data_src, _oblique_affine(0.2, [0.8, 0.9, 2.5], [-1, -1, 1], [10, 12, -15])),
+             str(path / 'src.nii.gz'))
+    nib.save(nib.Nifti1Image(np.zeros((20, 18, 10), dtype=np.float32),
+                             _oblique_affine(-0.3, [1, 1.1, 2], [1, -1, 1], [-4, 8, -14])),
+             str(path / 'dest.nii.gz'))
+
+    # ITK affine transformation with a center of rotation
+    angle = 0.1
+    matrix = np.array([[np.cos(angle), -np.sin(angle), 0.05], [np.sin(angle), np.cos(angle), 0], [0, 0.02, 1.05]])
+    _save_affine_txt(str(path / 'affine.txt'), matrix, [1.5, -2, 0.5], [2, -3, 1])
+
+    # Smooth displacement field (LPS vectors)
+    xx, yy, zz = np.mgrid[:14, :12, :8]
+    warp = np.zeros((14, 12, 8, 1, 3), dtype=np.float32)
+    warp[..., 0, 0] = 2 * np.sin(yy / 4)
+    warp[..., 0, 1] = -1.5 * np.cos(xx / 5)
+    warp[..., 0, 2] = 0.2 + 0.5 * np.sin(zz / 3)
+    img_warp = nib.Nifti1Image(warp, _oblique_affine(0, [1.2, 1.2, 2.2], [-1, -1, 1], [6, 10, -12]))
+    img_warp.header.set_intent('vector', (), '')
+    nib.save(img_warp, str(path / 'warp.nii.gz'))
+    return path
+
+
+@requires_ants
+@pytest.mark.parametrize('fnames_inv', [[], ['affine.txt']])
+def test_compose_displacement_field_ants(ants_transforms, fnames_inv):
+    """The composed displacement field is the same as the one of isct_ComposeMultiTransform."""
+    path = ants_transforms
+    fnames = ['affine.txt', 'warp.nii.gz']
+    # Same arguments as sct_concat_transfo: reversed transformations, '-i' before the inverted affine transformations
+    args = []
+    for fname in reversed(fnames):
+        args += ['-i', fname] if fname in fnames_inv else [fname]
+    run_proc(['isct_ComposeMultiTransform', '3', 'warp_ants.nii.gz', '-R', 'dest.nii.gz'] + args, verbose=0,
+             cwd=str(path), is_sct_binary=True)
+
+    transform = load_transforms([str(path / fname) for fname in fnames], [str(path / fname) for fname in fnames_inv])
+    data_warp = compose_displacement_field(transform, Image(str(path / 'dest.nii.gz'))).data
+    data_ants = Image(str(path / 'warp_ants.nii.gz')).data
+    assert data_warp.shape == data_ants.shape
+    np.testing.assert_allclose(data_warp, data_ants, atol=1e-3)
+
+
+@requires_ants
+@pytest.mark.parametrize('interp', ['nn', 'linear', 'spline'])
+def test_apply_transforms_ants(ants_transforms, interp):
+    """The resampled image is the same as with isct_antsApplyTransforms, including outside of the source image."""
+    path = ants_transforms
+    fnames = ['affine.txt', 'warp.nii.gz']
+    # Same arguments as sct_apply_transfo: reversed transformations
+    fname_ants = f'src_reg_ants_{interp}.nii.gz'
+    run_proc(['isct_antsApplyTransforms', '-d', '3', '-i', 'src.nii.gz', '-o', fname_ants, '-t'] + fnames[::-1] +
+             ['-r', 'dest.nii.gz'] + get_interpolation('isct_antsApplyTransforms', interp),
+             verbose=0, cwd=str(path), is_sct_binary=True)
+
+    data_out = apply_transforms(Image(str(path / 'src.nii.gz')), Image(str(path / 'dest.nii.gz')),
+                                load_transforms([str(path / fname) for fname in fnames]), interp=interp).data
+    data_ants = Image(str(path / fname_ants)).data
+    assert data_out.shape == data_ants.shape
+    # Part of the destination image is mapped outside of the source image, where the output is null
+    outside = data_ants == 0
+    assert 0 < np.count_nonzero(outside) < outside.size
+    # Points which lie exactly on the border of the source image (or halfway between voxels with 'nn') can be rounded
+    # differently
+    assert np.mean((data_out == 0) == outside) > 0.99
+    assert np.mean(np.isclose(data_out, data_ants, rtol=1e-3, atol=1e-2)) > 0.99
+    inside = (data_out != 0) & ~outside
+    if interp != 'nn':
+        np.testing.assert_allclose(data_out[inside], data_ants[inside], rtol=1e-3, atol=1e-2)
+
+
+@pytest.mark.parametrize('python_transforms', ['no', 'yes'])
+def test_sct_apply_transfo_python_transforms(ants_transforms, monkeypatch, python_transforms):
+    """sct_apply_transfo only applies the transformations in Python if requested with SCT_PYTHON_TRANSFORMS."""
+    path = ants_transforms
+    monkeypatch.setenv('SCT_PYTHON_TRANSFORMS', python_transforms)
+    cmds = []
+
+    def fake_run_proc(cmd, *args, **kwargs):
+        # stand-in for isct_antsApplyTransforms, only writing an output image
+        cmds.append(cmd[0])
+        Image(str(path / 'dest.nii.gz')).save(cmd[cmd.index('-o') + 1])
+        return 0, ''
+    monkeypatch.setattr(sct_apply_transfo, 'run_proc', fake_run_proc)
+
+    fname_out = str(path / f'src_reg_{python_transforms}.nii.gz')
+    sct_apply_transfo.main(['-i', str(path / 'src.nii.gz'), '-d', str(path / 'dest.nii.gz'), '-w',
+                            str(path / 'affine.txt'), str(path / 'warp.nii.gz'), '-o', fname_out, '-v', '0'])
+    assert cmds == ([] if python_transforms == 'yes' else ['isct_antsApplyTransforms'])
+    assert os.path.isfile(fname_out)
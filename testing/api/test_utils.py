@@ -86,3 +86,37 @@ def test_display_viewer_syntax(temporary_viewers):
             assert cmd_opts == ("-g test_img.nii.gz "
                                 "-o test_img_2.nii.gz test_img_3.nii.gz "
                                 "-s test_seg.nii.gz")
+
+
+def test_file_cache(tmp_path):
+    """Test storing, retrieving and evicting entries of a FileCache."""
+    fnames = []
+    for i in range(3):
+        fname = tmp_path / f"file{i}.bin"
+        fname.write_bytes(bytes([i]) * 400 * 1024)
+        fnames.append(str(fname))
+    keys = [utils.cache_key([fname], {'param': 1}) for fname in fnames]
+    assert len(set(keys)) == 3
+    assert utils.cache_key([fnames[0]], {'param': 2}) != keys[0]
+
+    # Room for 2 entries
+    cache = utils.FileCache('test', path=str(tmp_path / 'cache'), max_size=1)
+    path_out = tmp_path / 'out'
+    path_out.mkdir()
+    assert not cache.get(keys[0], ['file0.bin'], str(path_out))
+    cache.put(keys[0], [fnames[0]])
+    cache.put(keys[1], [fnames[1]])
+    assert cache.get(keys[0], ['file0.bin'], str(path_out))
+    assert (path_out / 'file0.bin').read_bytes() == bytes([0]) * 400 * 1024
+    # Make sure that the access to entry 0 is more recent than the creation of entry 1
+    os.utime(os.path.join(cache.path, keys[1]), (0, 0))
+    cache.put(keys[2], [fnames[2]])
+    assert cache.get(keys[0], ['file0.bin'], str(path_out))
+    assert not cache.get(keys[1], ['file1.bin'], str(path_out))
+    assert cache.get(keys[2], ['file2.bin'], str(path_out))
+
+    # A size of 0 disables the cache
+    cache = utils.FileCache('disabled', path=str(tmp_path / 'cache'), max_size=0)
+    cache.put(keys[0], [fnames[0]])
+    assert not cache.get(keys[0], ['file0.bin'], str(path_out))
+    assert not os.path.exists(cache.path)
@@ -3,6 +3,10 @@
 import pytest
 import logging
 
+import numpy as np
+import nibabel as nib
+
+from spinalcordtoolbox.image import Image
 from spinalcordtoolbox.scripts import sct_compute_hausdorff_distance
 
 logger = logging.getLogger(__name__)
@@ -22,3 +26,42 @@ def test_sct_compute_hausdorff_distance_null_values():
                 hausdorff_distance_lst.append(float(line.split(': ')[1].split(' -')[0]))
 
     assert max(hausdorff_distance_lst) <= 1.0
+
+
+def test_hausdorff_distance_brute_force():
+    """Compare the distances with the distances between all the pairs of points."""
+    rng = np.random.default_rng(0)
+    data1, data2 = rng.random((2, 20, 15)) < 0.1
+    distances = sct_compute_hausdorff_distance.HausdorffDistance(data1, data2, v=0, sampling=(0.5, 2))
+    points1, points2 = np.argwhere(data1) * (0.5, 2), np.argwhere(data2) * (0.5, 2)
+    pairwise = np.linalg.norm(points1[:, np.newaxis] - points2[np.newaxis], axis=-1)
+    np.testing.assert_allclose(distances.min_distances_1[data1], pairwise.min(axis=1))
+    np.testing.assert_allclose(distances.min_distances_2[data2], pairwise.min(axis=0))
+    assert distances.H == pytest.approx(max(pairwise.min(axis=0).max(), pairwise.min(axis=1).max()))
+
+
+def test_zhang_suen_thinning(tmp_path):
+    """A filled rectangle is thinned to a one pixel wide line."""
+    data = np.zeros((15, 30), dtype=np.uint8)
+    data[4:11, 5:25] = 1
+    nib.save(nib.Nifti1Image(data, np.eye(4)), str(tmp_path / 'im.nii.gz'))
+    thinned = sct_compute_hausdorff_distance.Thinning(Image(str(tmp_path / 'im.nii.gz')), v=0).thinned_image.data
+    assert thinned.sum() > 0
+    assert np.all(thinned.sum(axis=0) <= 1)
+    assert np.all(thinned <= data)
+
+
+def test_sct_compute_hausdorff_distance_3d(tmp_path):
+    """Run the CLI script in 3D mode, with a second image shifted by one slice."""
+    data = np.zeros((20, 20, 6), dtype=np.uint8)
+    data[5:15, 6:14, 1:4] = 1
+    affine = np.diag([0.5, 0.5, 2, 1])
+    nib.save(nib.Nifti1Image(data, affine), str(tmp_path / 'im1.nii.gz'))
+    nib.save(nib.Nifti1Image(np.roll(data, 1, axis=2), affine), str(tmp_path / 'im2.nii.gz'))
+    fname_out = str(tmp_path / 'hausdorff_distance.txt')
+    sct_compute_hausdorff_distance.main(argv=['-i', str(tmp_path / 'im1.nii.gz'), '-d', str(tmp_path / 'im2.nii.gz'),
+                                              '-thinning', '0', '-resampling', '0.5', '-mode', '3d', '-o', fname_out])
+    with open(fname_out, 'r') as f:
+        hausdorff_distance = float(f.readline().split(': ')[1].split(' mm')[0])
+    # The first and last slices of each image have no counterpart in the same slice of the other image
+    assert hausdorff_distance == pytest.approx(2)
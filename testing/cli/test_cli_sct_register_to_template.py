@@ -78,7 +78,7 @@ def test_sct_register_to_template_dice_coefficient_against_groundtruth(fname_gt,
                                   + remaining_args)
 
     # Straightening files are only generated for `-ref template`. They should *not* exist for `-ref subject`.
-    for file in ["straightening.cache", "straight_ref.nii.gz",
+    for file in ["straight_ref.nii.gz",
                  "warp_straight2curve.nii.gz", "warp_curve2straight.nii.gz"]:
         assert os.path.isfile(tmp_path/file) == (False if 'subject' in remaining_args else True)
 
@@ -18,11 +18,21 @@ def test_sct_smooth_spinalcord_check_output_files(tmp_path):
                                      '-o', fname_out])
     assert os.path.isfile(fname_out)
 
-    # Currently, 3 of SCT's CLI scripts output "straightening cache files" to the working directory. There's no way
-    # to output these files into a temp directory, because `sct_smooth_spinalcord` has no `-ofolder` option.
-    # So, for now we have to explicitly remove the files as to not pollute the working directory.
-    straightening_cache_files = ['straightening.cache', 'straight_ref.nii.gz',
-                                 'warp_straight2curve.nii.gz', 'warp_curve2straight.nii.gz']
-    for f in straightening_cache_files:
-        assert os.path.isfile(f)
-        os.unlink(f)
+    # Straightening files are shared through the straightening cache, instead of polluting the working directory
+    for f in ['straightening.cache', 'straight_ref.nii.gz', 'warp_straight2curve.nii.gz', 'warp_curve2straight.nii.gz']:
+        assert not os.path.isfile(f)
+
+
+@pytest.mark.sct_testing
+@pytest.mark.usefixtures("run_in_sct_testing_data_dir")
+@pytest.mark.parametrize('cache', [0, 1])
+def test_sct_smooth_spinalcord_cache(tmp_path, cache):
+    """Ensure that the straightening is only stored in the straightening cache with `-cache 1`."""
+    path_cache = os.path.join(os.environ['SCT_CACHE_DIR'], 'straightening')
+    entries = set(os.listdir(path_cache)) if os.path.isdir(path_cache) else set()
+    # `-algo-fitting polyfit` so that the straightening isn't already cached by the other tests
+    sct_smooth_spinalcord.main(argv=['-i', 't2/t2.nii.gz', '-s', 't2/t2_seg-manual.nii.gz', '-smooth', '0,0,5',
+                                     '-algo-fitting', 'polyfit', '-cache', str(cache),
+                                     '-o', os.path.join(str(tmp_path), "test_smooth.nii.gz")])
+    entries_new = (set(os.listdir(path_cache)) if os.path.isdir(path_cache) else set()) - entries
+    assert len(entries_new) == cache
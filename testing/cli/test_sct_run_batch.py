@@ -1,8 +1,10 @@
 # pytest unit tests for sct_run_batch
 
+import csv
 import glob
 import os
 import json
+import random
 
 import pytest
 from stat import S_IEXEC
@@ -192,3 +194,75 @@ def test_separate_sessions(tmp_path, dummy_script):
     for sub, ses in sub_ses_pairs:
         file_log = glob.glob(os.path.join(out, 'log', f'*sub-{sub}_ses-{ses}.log'))[0]
         assert os.path.join(f'sub-{sub}', f'ses-{ses}') in open(file_log, "r").read()
+
+
+def test_estimate_costs(tmp_path):
+    """
+    Test that subjects are ranked by the duration of their previous run, or else by the size of their input files.
+    """
+    for sub, size in [('sub-01', 10), ('sub-02', 1000), ('sub-03', 100), ('sub-04', 400)]:
+        (tmp_path / sub / 'anat').mkdir(parents=True)
+        (tmp_path / sub / 'anat' / 'image.nii.gz').write_bytes(b'0' * size)
+    subject_dirs = ['sub-01', 'sub-02', 'sub-03', 'sub-04']
+    # Without any previous run: only the size matters
+    costs = sct_run_batch._estimate_costs(subject_dirs, str(tmp_path), {})
+    assert sorted(subject_dirs, key=costs.get, reverse=True) == ['sub-02', 'sub-04', 'sub-03', 'sub-01']
+    # With previous runs: sub-01 was very long, and sub-04 is estimated from the rate of the others (1 s/byte)
+    costs = sct_run_batch._estimate_costs(subject_dirs, str(tmp_path), {'sub-01': 5000, 'sub-02': 1000, 'sub-03': 100})
+    assert costs['sub-04'] == 400
+    assert sorted(subject_dirs, key=costs.get, reverse=True) == ['sub-01', 'sub-02', 'sub-04', 'sub-03']
+
+
+def test_get_itk_threads():
+    """
+    Test that the last subjects get the threads of the workers that became idle, without exceeding the total number of
+    threads while other subjects are still running.
+    """
+    def get_itk_threads(n_started, n_running, threads_in_use):
+        return sct_run_batch._get_itk_threads(n_started, n_running, threads_in_use, n_subjects=10, jobs=4,
+                                              itk_threads=2)
+
+    # At the start of the batch, the workers share the threads
+    assert [get_itk_threads(n, n, 2 * n) for n in range(4)] == [2, 2, 2, 2]
+    # 8th subject: 3 subjects running with 2 threads each, 3 subjects left for the idle worker
+    assert get_itk_threads(7, 3, 6) == 2
+    # 9th subject: 2 subjects running, the 2 idle workers share the 4 free threads
+    assert get_itk_threads(8, 2, 4) == 2
+    # 10th subject: a single subject is still running, the last subject gets the other threads
+    assert get_itk_threads(9, 1, 2) == 6
+    # Only the free threads are given, even if a single subject is left
+    assert get_itk_threads(9, 3, 6) == 2
+
+
+def test_itk_threads_not_oversubscribed():
+    """
+    Test that simulated batches never use more threads than requested, whatever the order in which subjects finish.
+    """
+    rng = random.Random(0)
+    jobs, itk_threads, n_subjects = 4, 2, 20
+    for _ in range(50):
+        running = []
+        for n_started in range(n_subjects):
+            if len(running) == jobs:
+                running.pop(rng.randrange(jobs))
+            running.append(sct_run_batch._get_itk_threads(n_started, len(running), sum(running), n_subjects, jobs,
+                                                          itk_threads))
+            assert sum(running) <= jobs * itk_threads
+
+
+def test_timing_file(tmp_path, dummy_script):
+    """
+    Test that the processing of each subject is recorded in the timing file, which is appended at each run.
+    """
+    data = tmp_path / 'data'
+    out = tmp_path / 'out'
+    for sub in ['01', '02', '03']:
+        (data / f'sub-{sub}' / 'anat').mkdir(parents=True)
+    for _ in range(2):
+        sct_run_batch.main(['-path-data', str(data), '-path-out', str(out), '-script', dummy_script, '-jobs', '2'])
+    with open(os.path.join(out, 'log', sct_run_batch.TIMING_FILE), newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row['subject'] for row in rows) == ['sub-01', 'sub-01', 'sub-02', 'sub-02', 'sub-03', 'sub-03']
+    assert all(row['returncode'] == '0' and float(row['duration_s']) >= 0 for row in rows)
+    assert set(sct_run_batch._read_timings(os.path.join(out, 'log', sct_run_batch.TIMING_FILE))) == \
+        {'sub-01', 'sub-02', 'sub-03'}
@@ -43,6 +43,19 @@ def run_in_sct_testing_data_dir():
     os.chdir(cwd)
 
 
+@pytest.fixture(scope="session", autouse=True)
+def isolated_cache_dir(tmp_path_factory):
+    """Use a temporary cache folder (see `utils.fs.get_cache_dir`), so that tests never reuse the outputs of previous
+    runs, nor fill the user's cache."""
+    cache_dir = os.environ.get('SCT_CACHE_DIR')
+    os.environ['SCT_CACHE_DIR'] = str(tmp_path_factory.mktemp('sct_cache'))
+    yield
+    if cache_dir is None:
+        del os.environ['SCT_CACHE_DIR']
+    else:
+        os.environ['SCT_CACHE_DIR'] = cache_dir
+
+
 @pytest.fixture(scope="session", autouse=True)
 def test_data_integrity(request):
     files_checksums = dict()